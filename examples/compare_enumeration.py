@@ -9,6 +9,7 @@ from synth.syntax import (
     CFG,
     DSL,
     hs_enumerate_prob_grammar,
+    chs_enumerate_prob_grammar,
     bs_enumerate_prob_grammar,
     bps_enumerate_prob_grammar,
     ProgramEnumerator,
@@ -24,6 +25,7 @@ SEARCH_ALGOS = {
     "bee_search": bs_enumerate_prob_grammar,
     "beap_search": bps_enumerate_prob_grammar,
     "heap_search": hs_enumerate_prob_grammar,
+    "compiled_heap_search": chs_enumerate_prob_grammar,
     "cd4": lambda x: cd(x, k=4),
     "cd12": lambda x: cd(x, k=12),
     "cd100": lambda x: cd(x, k=100),
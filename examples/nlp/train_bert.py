@@ -61,7 +61,7 @@ class MyPredictor(nn.Module):
     def __init__(self, size: int) -> None:
         super().__init__()
         self.primitive_layer = PrimitivePredictorLayer(size, dsl, 0.2)
-        self.encoder = NLPEncoder()
+        self.encoder = NLPEncoder(cache="bert_cache")
         input_size = self.encoder.embedding_size
         self.rnn = nn.LSTM(input_size, size, 1, batch_first=True)
 
@@ -73,7 +73,7 @@ class MyPredictor(nn.Module):
         )
 
     def forward(self, x: List[Task[NLP]]) -> Tensor:
-        xx = [self.encoder.encode(task) for task in x]
+        xx = self.encoder.encode_batch(x)
         xxx = torch.stack(xx).squeeze(1)
         y0, _ = self.rnn(xxx)
         y = y0.data[:, -1, :]
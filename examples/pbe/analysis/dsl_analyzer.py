@@ -32,6 +32,7 @@ from synth.nn import (
     abstractions,
 )
 from synth.pbe import IOEncoder
+from examples.pbe.model_loader import GRAMMAR_INDEX, load_checkpoint
 
 MAX_TESTS = 400000
 
@@ -229,7 +230,12 @@ def produce_pcfgs(
             return self.bigram_layer(self.end(y))
 
     predictor = MyPredictor(hidden_size)
-    predictor.load_state_dict(torch.load(model_file))
+    # Older checkpoints do not have a grammar index, it is then computed from cfgs
+    state = load_checkpoint(model_file, device)
+    missing, unexpected = predictor.load_state_dict(state, strict=False)
+    assert not unexpected and set(missing) <= {
+        GRAMMAR_INDEX
+    }, f"Incompatible checkpoint, missing: {missing} unexpected: {unexpected}"
     predictor = predictor.to(device)
     predictor.eval()
 
@@ -16,7 +16,7 @@ from synth.syntax import (
     DFTA,
     UnknownType,
 )
-from synth.filter import DFTAFilter, LocalStatelessFilter, Filter
+from synth.filter import DFTAFilter, EquivalenceFilter, Filter
 from synth.syntax.grammars.grammar import DerivableProgram
 
 uk = UnknownType()
@@ -27,9 +27,7 @@ class FiltersBuilder:
         self, dfta: DFTA[Tuple[Type, DerivableProgram], DerivableProgram]
     ) -> None:
         self.dfta = dfta
-        self.equal_parameters_reject: Set[
-            Tuple[DerivableProgram, Tuple[Tuple[int, int], ...]]
-        ] = set()
+        self.equivalence = EquivalenceFilter()
         self.stats = {
             "dfta.size.initial": self.dfta.size(),
             "dfta.size.final": self.dfta.size(),
@@ -84,25 +82,13 @@ class FiltersBuilder:
             del self.dfta.rules[state]
         return True
 
-    def __program_to_stateless_constraint(self, program: Program) -> bool:
-        if program.depth() == 2 and isinstance(program, Function):
-            diff = []
-            for i, arg in enumerate(program.arguments):
-                if not isinstance(arg, Variable):
-                    return False
-                if i != arg.variable:
-                    diff.append((min(i, arg.variable), max(i, arg.variable)))
-            self.equal_parameters_reject.add((program.function, tuple(diff)))
-            return True
-        return False
-
-    def forbid_program(self, program: Program) -> bool:
+    def forbid_program(self, program: Program, representative: Program) -> bool:
         self.stats["constraints.total"] += 1
-        if program.depth() > 3 or not isinstance(program, Function):
+        if not isinstance(program, Function):
             return False
-        out = self.__simple_constraint(
-            program
-        ) or self.__program_to_stateless_constraint(program)
+        out = (
+            program.depth() <= 3 and self.__simple_constraint(program)
+        ) or self.equivalence.forbid_program(program, representative)
         if out:
             self.stats["constraints.successes"] += 1
         return out
@@ -119,7 +105,7 @@ class FiltersBuilder:
         eq_class = [p for p in programs if p != representative]
         added = 0
         for p in eq_class:
-            added += self.forbid_program(p)
+            added += self.forbid_program(p, representative)
         return added
 
     def compress(self):
@@ -140,27 +126,10 @@ class FiltersBuilder:
             r[(Constant(cst_type), tuple())] = dst
         x = DFTAFilter(DFTA(r, set()))
 
-        if len(self.equal_parameters_reject) == 0:
+        if len(self.equivalence.forbidden) == 0:
             return x
-
-        # Local Stateless Part
-        def make_equal_filter(to_look):
-            return lambda *args: all(args[i] == args[j] for i, j in to_look)
-
-        def make_or(f, g):
-            return lambda *args: g(*args) or f(*args)
-
-        should_reject = {}
-        for p, to_look in self.equal_parameters_reject:
-            f = make_equal_filter(to_look)
-            key = p.primitive
-            if key in should_reject:
-                old = should_reject[key]
-                should_reject[key] = make_or(old, f)
-            else:
-                should_reject[key] = f
-        filter = LocalStatelessFilter(should_reject)
-        return filter.intersection(x)
+        # Equivalence Part
+        return x.intersection(self.equivalence)
 
     def to_code(self, commented: bool = False) -> str:
         states = list(set(self.dfta.rules.values()))
@@ -178,8 +147,8 @@ class FiltersBuilder:
             return f"(__types[{type2index[x[0]]}], __primitives[{prim2index[x[1]]}])"
 
         out = ""
-        out += "from synth.syntax import Type, Primitive, Variable, Constant, Program, auto_type, UnknownType, DFTA\n"
-        out += "from synth.filter import DFTAFilter, Filter, LocalStatelessFilter\n"
+        out += "from synth.syntax import Type, Primitive, Variable, Constant, Program, Function, auto_type, UnknownType, DFTA\n"
+        out += "from synth.filter import DFTAFilter, Filter, EquivalenceFilter\n"
         out += "from typing import Set\n\n"
         # DFTA PART
         out += "__types = [" + ",".join(map(type_to_code, types_list)) + "]\n"
@@ -209,23 +178,14 @@ class FiltersBuilder:
                 out += f"#\t{state} -> {dst}\n"
 
         out += "}\n\n"
-        # LOCAL STATELESS PART
-        if len(self.equal_parameters_reject) > 0:
-            out += "__should_reject = {\n"
-            # build dict
-            should_reject = {}
-            for p, to_look in self.equal_parameters_reject:
-                key = p.primitive
-                code = f"all(args[i] == args[j] for i,j in {to_look})"
-                if key in should_reject:
-                    old = should_reject[key]
-                    should_reject[key] = old + " or " + code
-                else:
-                    should_reject[key] = code
-            # print it
-            for p, code in should_reject.items():
-                out += f'\t"{p}": lambda *args: {code},\n'
-            out += "}\n\n"
+        # EQUIVALENCE PART
+        if len(self.equivalence.forbidden) > 0:
+            out += "__forbidden = [\n"
+            for p in self.equivalence.forbidden:
+                out += f"\t{program_to_code(p)},\n"
+                if commented:
+                    out += f"#\t{p}\n"
+            out += "]\n\n"
         # GETTER FUNCTION
         out += "def get_filter(type_request: Type, constant_types: Set[Type]) -> Filter[Program]:\n"
         out += "\timport copy\n"
@@ -235,8 +195,10 @@ class FiltersBuilder:
         out += "\tfor cst_type in constant_types:\n"
         out += f"\t\tr[(Constant(cst_type), tuple())] = __states[{state2index[(uk, Variable(0, uk))]}]\n"
         out += "\tx: Filter[Program] = DFTAFilter(DFTA(r, set()))\n"
-        if len(self.equal_parameters_reject) > 0:
-            out += "\ty = LocalStatelessFilter(__should_reject)\n"
+        if len(self.equivalence.forbidden) > 0:
+            out += "\ty = EquivalenceFilter()\n"
+            out += "\tfor p in __forbidden:\n"
+            out += "\t\ty.forbid_program(p)\n"
             out += "\tx = x.intersection(y)\n"
         out += "\treturn x\n"
         return out
@@ -315,6 +277,12 @@ def derivable_program_to_code(
     assert False, "not implemented"
 
 
+def program_to_code(program: Program) -> str:
+    if isinstance(program, Function):
+        return f"Function({program_to_code(program.function)}, [{', '.join(map(program_to_code, program.arguments))}])"
+    return derivable_program_to_code(program)  # type: ignore
+
+
 if __name__ == "__main__":
     import argparse
     import json
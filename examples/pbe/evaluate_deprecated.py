@@ -14,6 +14,7 @@ from dsl_loader import add_dsl_choice_arg, load_DSL
 from model_loader import (
     add_model_choice_arg,
     instantiate_predictor,
+    load_checkpoint,
 )
 
 
@@ -236,8 +237,9 @@ def produce_pcfgs(
         for cfg in cfgs
     ]
 
-    predictor = instantiate_predictor(parameters, cfgs, lexicon)
-    predictor.load_state_dict(torch.load(model_file, map_location=device))
+    predictor = instantiate_predictor(
+        parameters, cfgs, lexicon, load_checkpoint(model_file, device)
+    )
     predictor = predictor.to(device)
     predictor.eval()
 
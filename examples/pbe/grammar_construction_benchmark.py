@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from dsl_loader import add_dsl_choice_arg, load_DSL
+
+from synth.syntax import CFG, auto_type
+
+
+parser = argparse.ArgumentParser(description="Measure the time to build CFGs")
+add_dsl_choice_arg(parser)
+parser.add_argument(
+    "-t",
+    "--type-requests",
+    nargs="+",
+    type=str,
+    default=["int list -> int list", "int -> int list -> int"],
+    help="type requests of the grammars (default: 'int list -> int list' 'int -> int list -> int')",
+)
+parser.add_argument(
+    "--depths",
+    nargs="+",
+    type=int,
+    default=[3, 4, 5, 6],
+    help="maximum depths of the grammars (default: 3 4 5 6)",
+)
+parser.add_argument(
+    "-n", "--repeat", type=int, default=3, help="number of runs (default: 3)"
+)
+
+parameters = parser.parse_args()
+dsl_name: str = parameters.dsl
+type_requests = [auto_type(t) for t in parameters.type_requests]
+depths: list = parameters.depths
+repeat: int = parameters.repeat
+
+dsl = load_DSL(dsl_name).dsl
+print(f"{dsl_name}: {len(dsl.list_primitives)} primitives")
+for depth in depths:
+    for type_request in type_requests:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cfg = CFG.depth_constraint(dsl, type_request, depth)
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"depth={depth} type={type_request} non-terminals={len(cfg.rules)} time={best * 1000:.1f}ms"
+        )
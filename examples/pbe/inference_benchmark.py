@@ -0,0 +1,94 @@
+import argparse
+import time
+from typing import List
+
+import torch
+import torch.nn as nn
+
+from dataset_loader import add_dataset_choice_arg, load_dataset
+from dsl_loader import add_dsl_choice_arg, load_DSL
+from model_loader import (
+    add_model_choice_arg,
+    instantiate_predictor,
+    load_checkpoint,
+    InferencePredictor,
+)
+
+from synth import PBE, Task
+from synth.syntax import CFG
+
+
+parser = argparse.ArgumentParser(
+    description="Measure the CPU latency of the prediction of grammars"
+)
+add_dsl_choice_arg(parser)
+add_dataset_choice_arg(parser)
+add_model_choice_arg(parser)
+parser.add_argument(
+    "-m", "--model", default="", type=str, help="model file (default: random weights)"
+)
+parser.add_argument(
+    "--batch-sizes",
+    nargs="+",
+    type=int,
+    default=[1, 16],
+    help="batch sizes (default: 1 16)",
+)
+parser.add_argument(
+    "-n", "--tasks", type=int, default=64, help="number of tasks (default: 64)"
+)
+parser.add_argument(
+    "--threads", type=int, default=1, help="number of threads (default: 1)"
+)
+
+parameters = parser.parse_args()
+parameters.cpu = True
+dsl_name: str = parameters.dsl
+torch.set_num_threads(parameters.threads)
+
+dsl_module = load_DSL(dsl_name)
+dataset = load_dataset(dsl_name, parameters.dataset)
+tasks: List[Task[PBE]] = dataset.tasks[: parameters.tasks]
+cfgs = [
+    CFG.depth_constraint(
+        dsl_module.dsl,
+        t,
+        parameters.max_depth,
+        constant_types=getattr(dsl_module, "constant_types", set()),
+        min_variable_depth=0,
+        n_gram=parameters.ngram,
+    )
+    for t in dataset.type_requests()
+]
+predictor = instantiate_predictor(
+    parameters,
+    cfgs,
+    dsl_module.lexicon,
+    load_checkpoint(parameters.model) if parameters.model else None,
+)
+predictor.eval()
+
+models: List[nn.Module] = [
+    predictor,
+    InferencePredictor(predictor, quantize=False, script=True),
+    InferencePredictor(predictor, quantize=True, script=False),
+    InferencePredictor(predictor, quantize=True, script=True),
+]
+names = ["eager fp32", "torchscript fp32", "eager int8", "torchscript int8"]
+
+print(f"{len(tasks)} tasks, {parameters.threads} thread(s)")
+with torch.no_grad():
+    for batch_size in parameters.batch_sizes:
+        batches = [tasks[i : i + batch_size] for i in range(0, len(tasks), batch_size)]
+        # Tasks are encoded beforehand to only measure the network
+        encoded = [predictor.packer.encode(batch) for batch in batches]
+        reference = torch.cat([predictor(batch) for batch in encoded])
+        for name, model in zip(names, models):
+            model(encoded[0])
+            start = time.perf_counter()
+            outputs = torch.cat([model(batch) for batch in encoded])
+            elapsed = time.perf_counter() - start
+            error = (outputs - reference).abs().max().item()
+            print(
+                f"batch size={batch_size} {name}: {elapsed * 1000 / len(tasks):.2f}ms/task max error={error:.2e}"
+            )
@@ -8,12 +8,13 @@ from dsl_loader import add_dsl_choice_arg, load_DSL
 from model_loader import (
     add_model_choice_arg,
     instantiate_predictor,
+    load_checkpoint,
 )
 
 
 from synth.nn import print_model_summary
 from synth.syntax import CFG, UCFG
-from synth.filter import add_dfta_constraints
+from synth.filter import add_ucfg_constraints
 from synth.pbe.io_encoder import IOEncoder
 
 
@@ -61,18 +62,15 @@ cfgs = [
     for t in all_type_requests
 ]
 cfgs = [
-    UCFG.from_DFTA_with_ngrams(
-        add_dfta_constraints(cfg, constraints, progress=False), 2
-    )
-    if constrained
-    else cfg
+    add_ucfg_constraints(cfg, constraints, progress=False) if constrained else cfg
     for cfg in cfgs
 ]
 
 writer = SummaryWriter(comment=f"model_vizualizer_{model_file}")
 # Load Model ==============================================================
-predictor = instantiate_predictor(parameters, cfgs, lexicon)
-predictor.load_state_dict(torch.load(model_file, map_location=device))
+predictor = instantiate_predictor(
+    parameters, cfgs, lexicon, load_checkpoint(model_file, device)
+)
 predictor = predictor.to(device)
 predictor.eval()
 print_model_summary(predictor)
@@ -1,5 +1,5 @@
 from argparse import ArgumentParser, Namespace
-from typing import List, Union
+from typing import Any, Dict, List, Mapping, Optional, Union
 
 import torch
 from torch import Tensor
@@ -12,9 +12,10 @@ from synth.nn import (
     UGrammarPredictorLayer,
     abstractions,
     Task2Tensor,
+    optimize_for_cpu_inference,
 )
 from synth.pbe import IOEncoder
-from synth.syntax import UCFG, TTCFG
+from synth.syntax import UCFG, TTCFG, Type
 from synth.syntax.grammars.cfg import CFG
 
 
@@ -23,11 +24,12 @@ class MyPredictor(nn.Module):
         self,
         size: int,
         constrained: bool,
-        cfgs: Union[List[TTCFG], List[UCFG]],
+        cfgs: Union[List[TTCFG], List[UCFG], Mapping[Type, Union[TTCFG, UCFG]]],
         variable_probability: float,
         encoding_dimension: int,
         device: str,
         lexicon,
+        index: Optional[Dict[str, Any]] = None,
     ) -> None:
         super().__init__()
         layer = UGrammarPredictorLayer if constrained else DetGrammarPredictorLayer
@@ -41,6 +43,7 @@ class MyPredictor(nn.Module):
             cfgs,
             abstraction,
             variable_probability,
+            index,
         )
         encoder = IOEncoder(encoding_dimension, lexicon)
         self.packer = Task2Tensor(
@@ -54,16 +57,80 @@ class MyPredictor(nn.Module):
             nn.ReLU(),
         )
 
-    def forward(self, x: List[Task[PBE]]) -> Tensor:
+    def forward(self, x: Union[List[Task[PBE]], List[Tensor]]) -> Tensor:
         seq: PackedSequence = self.packer(x)
         _, (y, _) = self.rnn(seq)
         y: Tensor = y.squeeze(0)
         return self.bigram_layer(self.end(y))
 
 
+class _PredictorHead(nn.Module):
+    """
+    The part of MyPredictor after the encoding of tasks, which can be compiled with TorchScript.
+    """
+
+    def __init__(self, rnn: nn.LSTM, end: nn.Module, output: nn.Linear) -> None:
+        super().__init__()
+        self.rnn = rnn
+        self.end = end
+        self.output = output
+
+    def forward(self, seq: PackedSequence) -> Tensor:
+        _, (y, _) = self.rnn(seq)
+        return self.output(self.end(y.squeeze(0)))
+
+
+class InferencePredictor(nn.Module):
+    """
+    MyPredictor for CPU inference: tasks are encoded in Python, the rest of the network is optionally quantized and compiled.
+    """
+
+    def __init__(
+        self, predictor: MyPredictor, quantize: bool = True, script: bool = True
+    ) -> None:
+        super().__init__()
+        self.packer = predictor.packer
+        self.bigram_layer = predictor.bigram_layer
+        self.head = optimize_for_cpu_inference(
+            _PredictorHead(
+                predictor.rnn, predictor.end, predictor.bigram_layer.log_probs_predictor
+            ),
+            quantize,
+            script,
+        )
+
+    def forward(self, x: Union[List[Task[PBE]], List[Tensor]]) -> Tensor:
+        out: Tensor = self.head(self.packer(x))
+        return out
+
+
+# Key of the index of the grammar predictor layer in the state dict of MyPredictor
+GRAMMAR_INDEX = "bigram_layer._extra_state"
+
+
+def load_checkpoint(model_file: str, device: str = "cpu") -> Dict[str, Any]:
+    """
+    Loads the state dict saved in model_file, its tensors are memory mapped.
+    """
+    # The grammar index holds primitives which are not plain tensors
+    state: Dict[str, Any] = torch.load(
+        model_file, map_location=device, mmap=True, weights_only=False
+    )
+    return state
+
+
 def instantiate_predictor(
-    parameters: Namespace, cfgs: Union[List[CFG], List[UCFG]], lexicon: List
+    parameters: Namespace,
+    cfgs: Union[List[CFG], List[UCFG], Mapping[Type, Union[CFG, UCFG]]],
+    lexicon: List,
+    state: Optional[Dict[str, Any]] = None,
 ) -> MyPredictor:
+    """
+    Creates the predictor and loads state if given.
+
+    cfgs can be a lazy mapping from type requests to grammars, see LazyRules, if state contains the index of the grammar predictor layer.
+    Then grammars are only built for the type requests the predictor is queried for.
+    """
     variable_probability: float = parameters.var_prob
     encoding_dimension: int = parameters.encoding_dimension
     hidden_size: int = parameters.hidden_size
@@ -71,7 +138,7 @@ def instantiate_predictor(
     constrained: bool = parameters.constrained
     device = "cuda" if not cpu_only and torch.cuda.is_available() else "cpu"
 
-    return MyPredictor(
+    predictor = MyPredictor(
         hidden_size,
         constrained,
         cfgs,
@@ -79,7 +146,15 @@ def instantiate_predictor(
         encoding_dimension,
         device,
         lexicon,
-    ).to(device)
+        None if state is None else state.get(GRAMMAR_INDEX),
+    )
+    if state is not None:
+        # Older checkpoints do not have a grammar index, it is then computed from cfgs
+        missing, unexpected = predictor.load_state_dict(state, strict=False)
+        assert not unexpected and set(missing) <= {
+            GRAMMAR_INDEX
+        }, f"Incompatible checkpoint, missing: {missing} unexpected: {unexpected}"
+    return predictor.to(device)
 
 
 def add_model_choice_arg(parser: ArgumentParser) -> None:
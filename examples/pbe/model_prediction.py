@@ -1,5 +1,4 @@
 import argparse
-import atexit
 import os
 import sys
 from typing import List, Optional, Set, Tuple, Union
@@ -13,13 +12,17 @@ from dsl_loader import add_dsl_choice_arg, load_DSL
 from model_loader import (
     add_model_choice_arg,
     instantiate_predictor,
+    load_checkpoint,
+    GRAMMAR_INDEX,
+    InferencePredictor,
 )
 
 
 from synth import Dataset, PBE
-from synth.filter import add_dfta_constraints
-from synth.syntax import CFG, UCFG, ProbDetGrammar, ProbUGrammar, DSL, Type
-from synth.utils import load_object, save_object
+from synth.filter import add_ucfg_constraints
+from synth.syntax import CFG, UCFG, DSL, Type
+from synth.syntax.grammars import LazyRules
+from synth.utils import ObjectStore
 
 
 parser = argparse.ArgumentParser(
@@ -43,6 +46,24 @@ g.add_argument(
     default=16,
     help="batch size to compute PCFGs (default: 16)",
 )
+g.add_argument(
+    "--quantize",
+    action="store_true",
+    default=False,
+    help="quantize the linear and LSTM layers to int8, for CPU inference",
+)
+g.add_argument(
+    "--script",
+    action="store_true",
+    default=False,
+    help="compile the model with TorchScript, for CPU inference",
+)
+g.add_argument(
+    "--threads",
+    type=int,
+    default=0,
+    help="number of threads used by torch (default: 0 for torch's default)",
+)
 
 
 parameters = parser.parse_args()
@@ -50,6 +71,9 @@ dsl_name: str = parameters.dsl
 dataset_file: str = parameters.dataset
 model_file: str = parameters.model
 batch_size: int = parameters.batch_size
+quantize: bool = parameters.quantize
+script: bool = parameters.script
+threads: int = parameters.threads
 constrained: bool = parameters.constrained
 max_depth: int = parameters.max_depth
 ngram: int = parameters.ngram
@@ -118,7 +142,11 @@ def produce_pcfgs(
     lexicon: List[int],
     constraints: List[str],
     constant_types: Set[Type],
-) -> Union[List[ProbDetGrammar], List[ProbUGrammar]]:
+) -> ObjectStore:
+    """
+    Predicts the PCFGs of the tasks and streams them to a store where the i-th PCFG is the one of the i-th task.
+    Resumes from the PCFGs already in the store.
+    """
     # ================================
     # Load already done PCFGs
     # ================================
@@ -129,22 +157,22 @@ def produce_pcfgs(
         else (len(model_file) - model_file[::-1].index(os.path.sep))
     )
     model_name = model_file[start_index : model_file.index(".", start_index)]
-    file = os.path.join(dir, f"pcfgs_{dataset_name}_{model_name}.pickle")
-    pcfgs: Union[List[ProbDetGrammar], List[ProbUGrammar]] = []
+    file = os.path.join(dir, f"pcfgs_{dataset_name}_{model_name}.store")
+    done = 0
     if os.path.exists(file):
-        pcfgs = load_object(file)
+        with ObjectStore(file) as store:
+            done = len(store)
     tasks = full_dataset.tasks
     tasks = [
         t
         for t in tasks
         if supported_type_requests is None or t.type_request in supported_type_requests
     ]
-    done = len(pcfgs)
     # ================================
     # Skip if possible
     # ================================
     if done >= len(tasks):
-        return pcfgs
+        return ObjectStore(file)
 
     # Get device
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -157,61 +185,59 @@ def produce_pcfgs(
         full_dataset.type_requests() if support is None else supported_type_requests
     )
 
-    cfgs = [
-        CFG.depth_constraint(
+    def build_grammar(type_request: Type) -> Optional[Union[CFG, UCFG]]:
+        if type_request not in all_type_requests:
+            return None
+        cfg = CFG.depth_constraint(
             dsl,
-            t,
+            type_request,
             max_depth,
             constant_types=constant_types,
             min_variable_depth=0,
             n_gram=ngram,
         )
-        for t in all_type_requests
-    ]
-    cfgs = [
-        UCFG.from_DFTA_with_ngrams(
-            add_dfta_constraints(cfg, constraints, progress=False), ngram
+        return (
+            add_ucfg_constraints(cfg, constraints, progress=False)
+            if constrained
+            else cfg
         )
-        if constrained
-        else cfg
-        for cfg in cfgs
-    ]
 
-    predictor = instantiate_predictor(parameters, cfgs, lexicon)
-    predictor.load_state_dict(torch.load(model_file, map_location=device))
+    # Grammars are only built for the type requests of the tasks
+    cfgs = LazyRules(build_grammar)
+    state = load_checkpoint(model_file, device)
+    if GRAMMAR_INDEX not in state:
+        # Older checkpoints do not have a grammar index, it is computed from all grammars
+        for t in all_type_requests:
+            cfgs[t]
+    predictor = instantiate_predictor(parameters, cfgs, lexicon, state)
     predictor = predictor.to(device)
     predictor.eval()
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if device == "cpu" and (quantize or script):
+        predictor = InferencePredictor(predictor, quantize, script)
 
     # ================================
     # Predict PCFG
     # ================================
-    def save_pcfgs() -> None:
-        print("Saving PCFGs...", end="")
-        save_object(file, pcfgs)
-        print("done!")
-
-    atexit.register(save_pcfgs)
-
-    pbar = tqdm.tqdm(total=len(tasks) - done, desc="PCFG prediction")
-    while done < len(tasks):
-        end = min(len(tasks), done + batch_size)
-        batch = tasks[done:end]
-        pbar.update(end - done)
-        done = end
-        batch_outputs = predictor(batch)
-
-        for task, tensor in zip(batch, batch_outputs):
-            obj = predictor.bigram_layer.tensor2log_prob_grammar(
-                tensor, task.type_request
-            )
-            pcfgs.append(
-                obj.to_prob_u_grammar() if constrained else obj.to_prob_det_grammar()
-            )
-    pbar.close()
-    save_pcfgs()
-    atexit.unregister(save_pcfgs)
-
-    return pcfgs
+    # Grammars are written once in the store, PCFGs only refer to them
+    grammars = [cfgs[t] for t in {task.type_request for task in tasks[done:]}]
+    shared = grammars + [grammar.rules for grammar in grammars]
+    with ObjectStore(file, write=True, shared=shared) as store:
+        pbar = tqdm.tqdm(total=len(tasks) - done, desc="PCFG prediction")
+        while done < len(tasks):
+            end = min(len(tasks), done + batch_size)
+            batch = tasks[done:end]
+            batch_outputs = predictor(batch)
+            for pcfg in predictor.bigram_layer.tensor2prob_grammars(
+                batch_outputs, [task.type_request for task in batch]
+            ):
+                store.append(pcfg)
+            pbar.update(end - done)
+            done = end
+        pbar.close()
+
+    return ObjectStore(file)
 
 
 # Main ====================================================================
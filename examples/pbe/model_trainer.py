@@ -7,6 +7,7 @@ import tqdm
 
 import torch
 from torch import Tensor
+from torch.utils.data import DataLoader, Subset
 from torch.utils.tensorboard import SummaryWriter
 
 import numpy as np
@@ -20,10 +21,11 @@ from model_loader import (
 
 
 from synth import Dataset, PBE, Task
-from synth.nn import print_model_summary
+from synth.nn import print_model_summary, BucketBatchSampler
+from synth.pbe import EncodedIODataset
 from synth.syntax import CFG, UCFG
 from synth.utils import chrono
-from synth.filter import add_dfta_constraints
+from synth.filter import add_ucfg_constraints
 
 DREAMCODER = "dreamcoder"
 REGEXP = "regexp"
@@ -92,6 +94,38 @@ g.add_argument(
     default=1e-4,
     help="weight decay (default: 1e-4)",
 )
+g.add_argument(
+    "-a",
+    "--accumulate",
+    type=int,
+    default=1,
+    help="number of batches whose gradients are accumulated before each optimisation step, the effective batch size is multiplied by it (default: 1)",
+)
+g.add_argument(
+    "--bf16",
+    action="store_true",
+    default=False,
+    help="compute the forward pass with bfloat16 autocast",
+)
+g.add_argument(
+    "--stats-every",
+    type=int,
+    default=1,
+    help="produce stats every N batches (default: 1)",
+)
+g.add_argument(
+    "--bucket",
+    action="store_true",
+    default=False,
+    help="group tasks with similar numbers of examples in the same batches",
+)
+g.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=0,
+    help="number of processes loading batches (default: 0)",
+)
 g.add_argument("-s", "--seed", type=int, default=0, help="seed (default: 0)")
 
 parameters = parser.parse_args()
@@ -110,6 +144,12 @@ no_stats: bool = parameters.no_stats
 constrained: bool = parameters.constrained
 max_depth: int = parameters.max_depth
 ngram: int = parameters.ngram
+workers: int = parameters.workers
+bucket: bool = parameters.bucket
+encoding_dimension: int = parameters.encoding_dimension
+accumulate: int = parameters.accumulate
+bf16: bool = parameters.bf16
+stats_every: int = parameters.stats_every
 
 random.seed(seed)
 torch.manual_seed(seed)
@@ -171,11 +211,9 @@ cfgs = [
     for t in all_type_requests
 ]
 type2cfg = {
-    cfg.type_request: UCFG.from_DFTA_with_ngrams(
-        add_dfta_constraints(cfg, constraints, progress=False), ngram
+    cfg.type_request: (
+        add_ucfg_constraints(cfg, constraints, progress=False) if constrained else cfg
     )
-    if constrained
-    else cfg
     for cfg in cfgs
 }
 cfgs = list(type2cfg.values())
@@ -185,87 +223,119 @@ print(f"Lexicon: [{min(lexicon)};{max(lexicon)}]")
 
 predictor = instantiate_predictor(parameters, cfgs, lexicon)
 print_model_summary(predictor)
+# Encode the targets of the training programs once, batches then reuse them
+for task in tqdm.tqdm(full_dataset, desc="encoding targets"):
+    if task.solution is not None:
+        predictor.bigram_layer.encode_indices(task.solution, task.type_request)
 optim = torch.optim.AdamW(predictor.parameters(), lr, weight_decay=weight_decay)
 scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optim, "min")
-dataset_index = 0
-
-
-@chrono.clock(prefix="train.do_batch")
-def get_batch_of_tasks() -> List[Task[PBE]]:
-    global dataset_index
-    batch = full_dataset[dataset_index : dataset_index + batch_size]
-    dataset_index += batch_size
-    copy = []
-    for task in batch:
-        if task.solution is not None:
-            copy.append(task)
-    return copy
+# Encode the IOs of the dataset once, they are cached next to the dataset file
+encoded_ios = EncodedIODataset.cache(
+    predictor.packer.encoder,
+    full_dataset,
+    f"{os.path.splitext(dataset_file)[0]}_ios_{encoding_dimension}",
+)
+train_indices = [i for i, task in enumerate(full_dataset) if task.solution is not None]
+if bucket:
+    examples = np.diff(encoded_ios.offsets)
+    batching = dict(
+        batch_sampler=BucketBatchSampler(
+            [examples[i] for i in train_indices], batch_size, shuffle=not no_shuffle
+        )
+    )
+else:
+    batching = dict(batch_size=batch_size, shuffle=not no_shuffle)
+loader = DataLoader(
+    Subset(encoded_ios, train_indices),
+    num_workers=workers,
+    pin_memory=device == "cuda",
+    collate_fn=EncodedIODataset.collate,
+    **batching,
+)
 
 
-def do_batch(iter_number: int) -> None:
-    batch = get_batch_of_tasks()
+def do_batch(iter_number: int, indices: List[int], batch_ios: List[Tensor]) -> float:
+    """
+    Accumulates the gradients of the batch and returns its loss.
+    """
+    batch = [full_dataset[i] for i in indices]
     batch_programs = [task.solution for task in batch]
     batch_tr = [task.type_request for task in batch]
+    with chrono.clock("train.forward"):
+        with torch.autocast(device, dtype=torch.bfloat16, enabled=bf16):
+            batch_outputs: Tensor = predictor(batch_ios)
+        batch_outputs = batch_outputs.float()
+    with chrono.clock("train.loss"):
+        loss = predictor.bigram_layer.loss_mse(batch_programs, batch_tr, batch_outputs)
+    with chrono.clock("train.backward"):
+        (loss / accumulate).backward()
     # Logging
-    if all([p is not None for p in batch_programs]):
-        writer.add_scalar(
-            "program/depth", np.mean([p.depth() for p in batch_programs]), iter_number
-        )
-        mean_length = np.mean([p.size() for p in batch_programs])
-        writer.add_scalar("program/length", mean_length, iter_number)
-    with chrono.clock("train.do_batch.inference"):
-        batch_outputs: Tensor = predictor(batch)
-
-    # Gradient descent
-    with chrono.clock("train.do_batch.loss"):
-        optim.zero_grad()
-        with chrono.clock("train.do_batch.loss.compute"):
-            loss = predictor.bigram_layer.loss_mse(
-                batch_programs, batch_tr, batch_outputs
+    value = loss.item()
+    writer.add_scalar("train/loss", value, iter_number)
+    if not no_stats and iter_number % stats_every == 0:
+        with chrono.clock("train.stats"):
+            writer.add_scalar(
+                "program/depth",
+                np.mean([p.depth() for p in batch_programs]),
+                iter_number,
             )
-        with chrono.clock("train.do_batch.loss.backprop"):
-            loss.backward()
-            optim.step()
-            # Should be called on val_loss but we don't have one here
-            scheduler.step(loss.item())
-    # Logging
-    writer.add_scalar("train/loss", loss.item(), iter_number)
-    if not no_stats:
-        with chrono.clock("train.do_batch.stats"):
+            mean_length = np.mean([p.size() for p in batch_programs])
+            writer.add_scalar("program/length", mean_length, iter_number)
             with torch.no_grad():
-                batch_logprobs = torch.stack(
-                    [
-                        predictor.bigram_layer.tensor2log_prob_grammar(
-                            batch_outputs[i], task.type_request
-                        ).log_probability(task.solution)
-                        for i, task in enumerate(batch)
-                    ]
+                batch_logprobs = predictor.bigram_layer.log_probabilities_batch(
+                    batch_programs, batch_tr, batch_outputs.detach()
                 )
                 writer.add_scalar(
                     "train/program_probability",
                     torch.mean(torch.exp(batch_logprobs)),
                     iter_number,
                 )
+    return value
+
+
+def do_step(losses: List[float]) -> None:
+    with chrono.clock("train.step"):
+        if len(losses) < accumulate:
+            # Backward passes are scaled by 1 / accumulate, rescale a trailing partial group to its real size
+            for param in predictor.parameters():
+                if param.grad is not None:
+                    param.grad.mul_(accumulate / len(losses))
+        optim.step()
+        optim.zero_grad()
+        # Should be called on val_loss but we don't have one here
+        scheduler.step(np.mean(losses))
 
 
 def do_epoch(j: int) -> int:
-    global dataset_index
-    dataset_index = 0
-    if not no_shuffle:
-        random.shuffle(full_dataset.tasks)
-    nb_batch_per_epoch = int(np.ceil(len(full_dataset) / batch_size))
     i = j
-    for _ in tqdm.trange(nb_batch_per_epoch, desc="batchs"):
-        do_batch(i)
+    losses: List[float] = []
+    batches = iter(loader)
+    pbar = tqdm.tqdm(total=len(loader), desc="batchs")
+    while True:
+        with chrono.clock("train.data"):
+            item = next(batches, None)
+        if item is None:
+            break
+        indices, batch_ios = item
+        losses.append(do_batch(i, indices, batch_ios))
+        if len(losses) == accumulate:
+            do_step(losses)
+            losses = []
         i += 1
+        pbar.update(1)
+    pbar.close()
+    if losses:
+        do_step(losses)
     return i
 
 
 def train() -> None:
     j = 0
+    optim.zero_grad()
     for ep in tqdm.trange(epochs, desc="epochs"):
         j = do_epoch(j)
         torch.save(predictor.state_dict(), f"{output_file}_epoch{ep}.tmp")
+    print(chrono.summary(lambda t: f"{t:.2f}s", "train"))
 
 
 train()
@@ -0,0 +1,84 @@
+import argparse
+import time
+from typing import Callable, List
+
+import torch
+from torch import Tensor
+from torch.nn.utils.rnn import PackedSequence, pack_sequence
+
+from synth.nn import AutoPack, BucketBatchSampler
+
+
+parser = argparse.ArgumentParser(
+    description="Measure the throughput of packing batches of sequences"
+)
+parser.add_argument(
+    "--batch-sizes",
+    nargs="+",
+    type=int,
+    default=[8, 16, 32, 64, 128],
+    help="batch sizes (default: 8 16 32 64 128)",
+)
+parser.add_argument(
+    "-n",
+    "--sequences",
+    type=int,
+    default=4096,
+    help="number of sequences (default: 4096)",
+)
+parser.add_argument(
+    "--min-length", type=int, default=64, help="minimum sequence length (default: 64)"
+)
+parser.add_argument(
+    "--max-length",
+    type=int,
+    default=2048,
+    help="maximum sequence length (default: 2048)",
+)
+parser.add_argument(
+    "--size", type=int, default=64, help="size of each element (default: 64)"
+)
+parser.add_argument(
+    "--lstm", action="store_true", default=False, help="also run an LSTM on the batches"
+)
+
+parameters = parser.parse_args()
+sequences: List[Tensor] = [
+    torch.randn((length, parameters.size))
+    for length in torch.randint(
+        parameters.min_length, parameters.max_length + 1, (parameters.sequences,)
+    ).tolist()
+]
+lengths = [t.shape[0] for t in sequences]
+lstm = torch.nn.LSTM(parameters.size, parameters.size, 1)
+
+
+def throughput(
+    pack: Callable[[List[Tensor]], PackedSequence], batches: List[List[int]]
+) -> float:
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            packed = pack([sequences[i] for i in batch])
+            if parameters.lstm:
+                lstm(packed)
+    return len(sequences) / (time.perf_counter() - start)
+
+
+autopack = AutoPack()
+methods = {
+    "pad then pack": lambda x: pack_sequence(x, enforce_sorted=False),
+    "autopack": autopack,
+}
+print(
+    f"{parameters.sequences} sequences of length in [{parameters.min_length};{parameters.max_length}]"
+)
+for batch_size in parameters.batch_sizes:
+    order = torch.randperm(len(sequences)).tolist()
+    shuffled = [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+    bucketed = list(BucketBatchSampler(lengths, batch_size))
+    for name, pack in methods.items():
+        for batching, batches in [("shuffled", shuffled), ("bucketed", bucketed)]:
+            print(
+                f"batch size={batch_size} {name} {batching}: {throughput(pack, batches):.0f} sequences/s"
+            )
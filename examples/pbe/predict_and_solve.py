@@ -0,0 +1,398 @@
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import tqdm
+
+import torch
+
+from dataset_loader import add_dataset_choice_arg, load_dataset
+from dsl_loader import add_dsl_choice_arg, load_DSL
+from model_loader import (
+    add_model_choice_arg,
+    instantiate_predictor,
+    load_checkpoint,
+    GRAMMAR_INDEX,
+)
+from solver_loader import (
+    add_solver_choice_arg,
+    load_enumerate,
+    load_filter_funs,
+    setup_filters,
+    solve_task,
+    SOLVERS,
+)
+
+
+from synth import Dataset, PBE, Task
+from synth.filter import add_ucfg_constraints
+from synth.syntax import CFG, UCFG, Type
+from synth.syntax.grammars import LazyRules
+from synth.utils import ObjectStore
+
+
+parser = argparse.ArgumentParser(
+    description="Predict grammars and solve tasks at the same time, tasks are searched as soon as their grammar is predicted"
+)
+add_dsl_choice_arg(parser)
+add_dataset_choice_arg(parser)
+parser.add_argument("-m", "--model", default="", type=str, help="model file")
+add_model_choice_arg(parser)
+parser.add_argument(
+    "--support",
+    type=str,
+    default=None,
+    help="train dataset to get the set of supported type requests",
+)
+add_solver_choice_arg(parser)
+parser.add_argument(
+    "-o", "--output", type=str, default="./", help="output folder (default: './')"
+)
+g = parser.add_argument_group("pipeline parameters")
+g.add_argument(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=16,
+    help="batch size to compute PCFGs (default: 16)",
+)
+g.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=max(1, mp.cpu_count() - 1),
+    help="number of solver processes (default: number of CPUs - 1)",
+)
+g.add_argument(
+    "-q",
+    "--queue-size",
+    type=int,
+    default=0,
+    help="maximum number of predicted tasks waiting for a solver (default: 0 for twice the number of workers)",
+)
+g.add_argument(
+    "--threads",
+    type=int,
+    default=0,
+    help="number of threads used by torch (default: 0 for torch's default)",
+)
+
+parameters = parser.parse_args()
+dsl_name: str = parameters.dsl
+dataset_file: str = parameters.dataset
+model_file: str = parameters.model
+batch_size: int = parameters.batch_size
+workers: int = parameters.workers
+queue_size: int = parameters.queue_size or 2 * workers
+threads: int = parameters.threads
+constrained: bool = parameters.constrained
+max_depth: int = parameters.max_depth
+ngram: int = parameters.ngram
+search_algo: str = parameters.search
+solver_name: str = parameters.solver
+output_folder: str = parameters.output
+task_timeout: float = parameters.timeout
+pruning: List[str] = parameters.pruning or []
+filter_files: List[str] = parameters.filter or []
+support: Optional[str] = (
+    None if not parameters.support else parameters.support.format(dsl_name=dsl_name)
+)
+
+if not os.path.exists(model_file) or not os.path.isfile(model_file):
+    print("Model must be a valid model file!", file=sys.stderr)
+    sys.exit(1)
+elif not os.path.exists(dataset_file) or not os.path.isfile(dataset_file):
+    print("Dataset must be a valid dataset file!", file=sys.stderr)
+    sys.exit(1)
+elif support is not None and (
+    not os.path.exists(support) or not os.path.isfile(support)
+):
+    print("Support dataset must be a valid dataset file!", file=sys.stderr)
+    sys.exit(1)
+
+custom_enumerate = load_enumerate(search_algo, constrained)
+if custom_enumerate is None:
+    txt = "det-CFG" if not constrained else "UCFG"
+    print(
+        f"search algorithm {search_algo} does not support enumeration for {txt}!",
+        file=sys.stderr,
+    )
+    sys.exit(1)
+
+dataset_name = os.path.splitext(os.path.basename(dataset_file))[0]
+model_name = os.path.splitext(os.path.basename(model_file))[0]
+
+supported_type_requests = Dataset.load(support).type_requests() if support else None
+
+
+# Solvers =================================================================
+
+
+def solver_worker(
+    worker: int,
+    store_file: str,
+    tasks: "mp.Queue[Optional[Tuple[int, Task[PBE]]]]",
+    results: "mp.Queue[Tuple[int, List[Any]]]",
+    current: Any,
+) -> None:
+    """
+    Solves the tasks of the queue with the PCFG of the same index in the store until it receives None.
+    current[worker] is the index of the task being solved, -1 if there is none.
+    """
+    dsl_module = load_DSL(dsl_name)
+    dsl, evaluator = dsl_module.dsl, dsl_module.evaluator
+    constraints = getattr(dsl_module, "constraints", [])
+    constant_types = getattr(dsl_module, "constant_types", set())
+    filter_funs = load_filter_funs(filter_files)
+    solver = SOLVERS[solver_name](evaluator=evaluator)
+    stats_name = solver.available_stats()
+    # The producer appends PCFGs to the store before queuing their tasks
+    with ObjectStore(store_file) as store:
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            index, task = item
+            current[worker] = index
+            if index >= len(store):
+                store.refresh()
+            filter = setup_filters(
+                task,
+                dsl,
+                evaluator,
+                constraints,
+                constant_types,
+                pruning,
+                filter_funs,
+            )
+            solved, solution = solve_task(
+                task, store[index], solver, custom_enumerate, filter, task_timeout
+            )
+            results.put(
+                (
+                    index,
+                    [solved, solution] + [solver.get_stats(n) for n in stats_name],
+                )
+            )
+            current[worker] = -1
+            solver.reset_stats()
+            evaluator.clear_cache()
+
+
+def save(trace: List, file: str) -> None:
+    with open(file, "w") as fd:
+        writer = csv.writer(fd)
+        writer.writerows(trace)
+
+
+# Main ====================================================================
+
+if __name__ == "__main__":
+    dsl_module = load_DSL(dsl_name)
+    dsl, lexicon = dsl_module.dsl, dsl_module.lexicon
+    constant_types = getattr(dsl_module, "constant_types", set())
+    constraints = getattr(dsl_module, "constraints", []) if constrained else []
+    full_dataset = load_dataset(dsl_name, dataset_file)
+    tasks = [
+        t
+        for t in full_dataset.tasks
+        if supported_type_requests is None or t.type_request in supported_type_requests
+    ]
+
+    # Resume from the PCFGs and results already computed
+    store_file = os.path.join(
+        os.path.realpath(os.path.dirname(model_file)),
+        f"pcfgs_{dataset_name}_{model_name}.store",
+    )
+    done = 0
+    if os.path.exists(store_file):
+        with ObjectStore(store_file) as store:
+            done = len(store)
+    solver = SOLVERS[solver_name](evaluator=dsl_module.evaluator)
+    file = os.path.join(
+        output_folder,
+        f"{dataset_name}_{search_algo}_{model_name}_{solver.full_name()}{'_'.join(pruning)}.csv",
+    )
+    trace: List[Any] = []
+    if os.path.exists(file):
+        with open(file, "r") as fd:
+            trace = [tuple(row) for row in csv.reader(fd)]
+    if len(trace) == 0:
+        trace.append(["solved", "solution"] + solver.available_stats())
+    start = len(trace) - 1
+
+    # Start solvers before torch may initialise CUDA
+    ctx = mp.get_context()
+    # Bounding the queue makes prediction wait for solvers, so at most queue_size PCFGs are pending
+    task_queue: "mp.Queue[Optional[Tuple[int, Task[PBE]]]]" = ctx.Queue(queue_size)
+    result_queue: "mp.Queue[Tuple[int, List[Any]]]" = ctx.Queue()
+    # Solvers open the store for reading so it must exist
+    with ObjectStore(store_file, write=True):
+        pass
+    # Index of the task each worker is solving, -1 if none, to know which task was lost when a worker dies
+    current = ctx.Array("i", [-1] * workers)
+
+    def start_worker(worker: int) -> mp.Process:
+        process = ctx.Process(
+            target=solver_worker,
+            args=(worker, store_file, task_queue, result_queue, current),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    processes = [start_worker(worker) for worker in range(workers)]
+
+    begin = time.perf_counter()
+    first_solution: Optional[float] = None
+    solved = 0
+    pending: Dict[int, List[Any]] = {}
+    pbar = tqdm.tqdm(total=len(tasks) - start, desc="Tasks", smoothing=0)
+    unsolved = [False, None] + [None] * len(solver.available_stats())
+
+    def record(index: int, row: List[Any]) -> None:
+        """
+        Adds the result of a task to the trace once the results of all previous tasks are known.
+        """
+        global first_solution, solved
+        # The result of a task lost by a dead worker may still arrive
+        if index < len(trace) - 1 or index in pending:
+            return
+        pending[index] = row
+        if row[0]:
+            solved += 1
+            if first_solution is None:
+                first_solution = time.perf_counter() - begin
+        while len(trace) - 1 in pending:
+            trace.append(pending.pop(len(trace) - 1))
+            pbar.update(1)
+            if len(trace) % 10 == 0:
+                save(trace, file)
+        pbar.set_postfix_str(f"Solved {solved}/{len(trace) - 1 - start}")
+
+    def replace_dead_workers() -> None:
+        """
+        Restarts the workers that died while solving a task, which is recorded as unsolved.
+        Workers that died otherwise, for instance while starting, are not restarted.
+        """
+        for worker, process in enumerate(processes):
+            index = current[worker]
+            if process.is_alive() or index < 0:
+                continue
+            current[worker] = -1
+            print(
+                f"Worker died with exit code {process.exitcode} while solving task {index}",
+                file=sys.stderr,
+            )
+            record(index, unsolved)
+            processes[worker] = start_worker(worker)
+
+    def collect(timeout: float = 0) -> None:
+        """
+        Adds the results received, waiting at most timeout for the first one, to the trace in the order of tasks.
+        """
+        try:
+            item = (
+                result_queue.get(timeout=timeout)
+                if timeout > 0
+                else result_queue.get_nowait()
+            )
+            while True:
+                record(*item)
+                item = result_queue.get_nowait()
+        except queue.Empty:
+            pass
+        replace_dead_workers()
+
+    def submit(index: int) -> None:
+        while True:
+            try:
+                task_queue.put((index, tasks[index]), timeout=0.1)
+                return
+            except queue.Full:
+                collect()
+
+    try:
+        # Tasks whose PCFG was already predicted are sent first
+        for index in range(start, min(done, len(tasks))):
+            submit(index)
+        if done < len(tasks):
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            all_type_requests = (
+                full_dataset.type_requests()
+                if support is None
+                else supported_type_requests
+            )
+
+            def build_grammar(type_request: Type) -> Optional[Union[CFG, UCFG]]:
+                if type_request not in all_type_requests:
+                    return None
+                cfg = CFG.depth_constraint(
+                    dsl,
+                    type_request,
+                    max_depth,
+                    constant_types=constant_types,
+                    min_variable_depth=0,
+                    n_gram=ngram,
+                )
+                return (
+                    add_ucfg_constraints(cfg, constraints, progress=False)
+                    if constrained
+                    else cfg
+                )
+
+            cfgs = LazyRules(build_grammar)
+            state = load_checkpoint(model_file, device)
+            if GRAMMAR_INDEX not in state:
+                # Older checkpoints do not have a grammar index, it is computed from all grammars
+                for t in all_type_requests:
+                    cfgs[t]
+            predictor = instantiate_predictor(parameters, cfgs, lexicon, state)
+            predictor.eval()
+            if threads > 0:
+                torch.set_num_threads(threads)
+            grammars = [cfgs[t] for t in {task.type_request for task in tasks[done:]}]
+            shared = grammars + [grammar.rules for grammar in grammars]
+            with ObjectStore(store_file, write=True, shared=shared) as store:
+                with torch.no_grad():
+                    while done < len(tasks):
+                        end = min(len(tasks), done + batch_size)
+                        batch = tasks[done:end]
+                        batch_outputs = predictor(batch)
+                        for pcfg in predictor.bigram_layer.tensor2prob_grammars(
+                            batch_outputs, [task.type_request for task in batch]
+                        ):
+                            store.append(pcfg)
+                            if done >= start:
+                                submit(done)
+                            done += 1
+                        collect()
+        for _ in processes:
+            task_queue.put(None)
+        while len(trace) - 1 < len(tasks):
+            collect(1)
+            if not any(process.is_alive() for process in processes):
+                collect()
+                # No worker is left to solve the tasks whose result is missing
+                for index in range(len(trace) - 1, len(tasks)):
+                    record(index, unsolved)
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pbar.close()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        save(trace, file)
+    total = time.perf_counter() - begin
+    print(
+        f"Solved {solved}/{len(trace) - 1 - start} tasks in {total:.2f}s, first solution after {first_solution or float('nan'):.2f}s"
+    )
+    print("csv file was saved as:", file)
@@ -10,62 +10,31 @@ from dsl_loader import add_dsl_choice_arg, load_DSL
 
 
 from synth import Dataset, PBE
-from synth.filter.filter import Filter
 from synth.semantic.evaluator import DSLEvaluator
 from synth.specification import PBEWithConstants
 from synth.syntax import (
     ProbDetGrammar,
     ProbUGrammar,
     DSL,
-    hs_enumerate_prob_grammar,
-    bs_enumerate_prob_grammar,
-    bps_enumerate_prob_grammar,
-    hs_enumerate_prob_u_grammar,
-    hs_enumerate_bucket_prob_grammar,
-    hs_enumerate_bucket_prob_u_grammar,
-    cd_enumerate_prob_grammar,
     ProgramEnumerator,
     Type,
     CFG,
 )
-from synth.filter import DFTAFilter, ObsEqFilter
-from synth.filter.constraints import add_dfta_constraints
-from synth.syntax.program import Program
-from synth.task import Task
-from synth.utils import load_object
-from synth.utils.import_utils import import_file_function
-from synth.pbe.solvers import (
-    NaivePBESolver,
-    PBESolver,
-    CutoffPBESolver,
-    RestartPBESolver,
+from synth.utils import load_object, ObjectStore
+from synth.pbe.solvers import PBESolver
+from solver_loader import (
+    add_solver_choice_arg,
+    load_enumerate,
+    load_filter_funs,
+    setup_filters,
+    solve_task,
+    SOLVERS,
 )
 
 
 import argparse
 
 
-SOLVERS = {solver.name(): solver for solver in [NaivePBESolver, CutoffPBESolver]}
-base_solvers = {x: y for x, y in SOLVERS.items()}
-for meta_solver in [RestartPBESolver]:
-    for name, solver in base_solvers.items():
-        SOLVERS[f"{meta_solver.name()}.{name}"] = lambda *args, **kwargs: meta_solver(
-            *args, solver_builder=solver, **kwargs
-        )
-
-SEARCH_ALGOS = {
-    "cd_search": (lambda x: cd_enumerate_prob_grammar(x, 20), None),
-    "beap_search": (bps_enumerate_prob_grammar, None),
-    "heap_search": (hs_enumerate_prob_grammar, hs_enumerate_prob_u_grammar),
-    "bucket_search": (
-        lambda x: hs_enumerate_bucket_prob_grammar(x, 3),
-        lambda x: hs_enumerate_bucket_prob_u_grammar(x, 3),
-    ),
-    "bee_search": (bs_enumerate_prob_grammar, None),
-}
-
-PRUNING = {"dfta", "obs-eq"}
-
 parser = argparse.ArgumentParser(
     description="Solve program synthesis tasks", fromfile_prefix_chars="@"
 )
@@ -74,19 +43,6 @@ add_dataset_choice_arg(parser)
 parser.add_argument(
     "--pcfg", type=str, default=None, help="files containing the predicted PCFGs"
 )
-parser.add_argument(
-    "-s",
-    "--search",
-    choices=SEARCH_ALGOS.keys(),
-    default=list(SEARCH_ALGOS.keys())[0],
-    help=f"enumeration algorithm (default: {list(SEARCH_ALGOS.keys())[0]})",
-)
-parser.add_argument(
-    "--solver",
-    choices=list(SOLVERS.keys()),
-    default="naive",
-    help=f"used solver (default: naive)",
-)
 parser.add_argument(
     "-o", "--output", type=str, default="./", help="output folder (default: './')"
 )
@@ -102,23 +58,7 @@ parser.add_argument(
     default=None,
     help="train dataset to get the set of supported type requests",
 )
-parser.add_argument(
-    "-t", "--timeout", type=float, default=300, help="task timeout in s (default: 300)"
-)
-
-parser.add_argument(
-    "-p",
-    "--pruning",
-    nargs="*",
-    choices=list(x for x in PRUNING),
-    help="runtime pruning",
-)
-parser.add_argument(
-    "--filter",
-    nargs="*",
-    type=str,
-    help="load the given files and call their get_filter functions to get a Filter[Program]",
-)
+add_solver_choice_arg(parser)
 
 parameters = parser.parse_args()
 dsl_name: str = parameters.dsl
@@ -144,8 +84,7 @@ elif support is not None and (
     print("Support dataset must be a valid dataset file!", file=sys.stderr)
     sys.exit(1)
 
-det_search, u_search = SEARCH_ALGOS[search_algo]
-custom_enumerate = u_search if constrained else det_search
+custom_enumerate = load_enumerate(search_algo, constrained)
 if custom_enumerate is None:
     txt = "det-CFG" if not constrained else "UCFG"
     print(
@@ -166,11 +105,7 @@ supported_type_requests = Dataset.load(support).type_requests() if support else
 # ================================
 # Load dftas files
 # ================================
-filter_pot_funs = [
-    import_file_function(file[:-3].replace("/", "."), ["get_filter"])()
-    for file in filter_files
-]
-filter_funs = [x.get_filter for x in filter_pot_funs if x is not None]
+filter_funs = load_filter_funs(filter_files)
 
 # ================================
 # Load constants specific to dataset
@@ -206,34 +141,10 @@ def save(trace: Iterable, file: str) -> None:
 
 
 # Enumeration methods =====================================================
-def setup_filters(
-    task: Task[PBE], constant_types: Set[Type]
-) -> Optional[Filter[Program]]:
-    out = None
-    # Dynamic DFTA filters
-    filters = [f(task.type_request, constant_types) for f in filter_funs]
-    for filter in filters:
-        out = filter if out is None else out.intersection(filter)
-    if "dfta" in pruning:
-        base_grammar = CFG.infinite(
-            dsl, task.type_request, constant_types=constant_types
-        )
-        filter = DFTAFilter(
-            add_dfta_constraints(base_grammar, constraints, progress=False)
-        )
-        out = filter if out is None else out.intersection(filter)
-    if "obs-eq" in pruning:
-        filter = ObsEqFilter(
-            solver.evaluator, [ex.inputs for ex in task.specification.examples]
-        )
-        out = filter if out is None else out.intersection(filter)
-    return out
-
-
 def enumerative_search(
     dataset: Dataset[PBE],
     evaluator: DSLEvaluator,
-    pcfgs: Union[List[ProbDetGrammar], List[ProbUGrammar]],
+    pcfgs: Union[List[ProbDetGrammar], List[ProbUGrammar], ObjectStore],
     trace: List[Tuple[bool, float]],
     solver: PBESolver,
     custom_enumerate: Callable[
@@ -255,26 +166,31 @@ def enumerative_search(
     stats_name = solver.available_stats()
     if start == 0:
         trace.append(["solved", "solution"] + stats_name)
-    for task, pcfg in zip(tasks[start:], pcfgs[start:]):
+    for index in range(start, min(len(tasks), len(pcfgs))):
+        task, pcfg = tasks[index], pcfgs[index]
         if task.metadata.get("name", None) is not None:
             pbar.set_description_str(task.metadata["name"])
         total += 1
-        task_solved = False
-        solution = None
-        if isinstance(task.specification, PBEWithConstants):
-            pcfg = pcfg.instantiate_constants(task.specification.constants)
         try:
-            enumerator = custom_enumerate(pcfg)
-            enumerator.filter = setup_filters(task, constant_types)
-            sol_generator = solver.solve(task, enumerator, timeout=task_timeout)
-            solution = next(sol_generator)
-            sol_generator.send(True)
-            task_solved = True
-            solved += 1
+            task_solved, solution = solve_task(
+                task,
+                pcfg,
+                solver,
+                custom_enumerate,
+                setup_filters(
+                    task,
+                    dsl,
+                    evaluator,
+                    constraints,
+                    constant_types,
+                    pruning,
+                    filter_funs,
+                ),
+                task_timeout,
+            )
         except KeyboardInterrupt:
             break
-        except StopIteration:
-            pass
+        solved += task_solved
         out = [task_solved, solution] + [solver.get_stats(name) for name in stats_name]
         solver.reset_stats()
         trace.append(out)
@@ -292,9 +208,12 @@ def enumerative_search(
 
 def load_pcfgs(
     pcfg_file: Optional[str],
-) -> Union[List[ProbDetGrammar], List[ProbUGrammar]]:
+) -> Union[List[ProbDetGrammar], List[ProbUGrammar], ObjectStore]:
     if pcfg_file is not None:
-        return load_object(pcfg_file)
+        # PCFGs are read one at a time from stores, older files are pickled lists
+        if pcfg_file.endswith(".pickle"):
+            return load_object(pcfg_file)
+        return ObjectStore(pcfg_file)
     pcfgs = []
     for task in full_dataset:
         constant_types = set()
@@ -316,8 +235,8 @@ if __name__ == "__main__":
     if pcfg_file is None:
         model_name = "uniform"
     else:
-        model_name = os.path.split(pcfg_file)[1][
-            len(f"pcfgs_{dataset_name}_") : -len(".pickle")
+        model_name = os.path.splitext(os.path.split(pcfg_file)[1])[0][
+            len(f"pcfgs_{dataset_name}_") :
         ]
     pruning_suffix = "_".join(pruning)
     file = os.path.join(
@@ -0,0 +1,172 @@
+from argparse import ArgumentParser
+from typing import Callable, List, Optional, Set, Tuple, Union
+
+from synth import PBE, Task
+from synth.filter import DFTAFilter, ObsEqFilter, Filter
+from synth.filter.constraints import add_dfta_constraints
+from synth.semantic.evaluator import DSLEvaluator
+from synth.specification import PBEWithConstants
+from synth.syntax import (
+    ProbDetGrammar,
+    ProbUGrammar,
+    DSL,
+    hs_enumerate_prob_grammar,
+    chs_enumerate_prob_grammar,
+    bs_enumerate_prob_grammar,
+    bps_enumerate_prob_grammar,
+    hs_enumerate_prob_u_grammar,
+    hs_enumerate_bucket_prob_grammar,
+    hs_enumerate_bucket_prob_u_grammar,
+    cd_enumerate_prob_grammar,
+    ProgramEnumerator,
+    Type,
+    CFG,
+)
+from synth.syntax.program import Program
+from synth.utils.import_utils import import_file_function
+from synth.pbe.solvers import (
+    NaivePBESolver,
+    PBESolver,
+    CutoffPBESolver,
+    RestartPBESolver,
+)
+
+
+SOLVERS = {solver.name(): solver for solver in [NaivePBESolver, CutoffPBESolver]}
+base_solvers = {x: y for x, y in SOLVERS.items()}
+for meta_solver in [RestartPBESolver]:
+    for name, solver in base_solvers.items():
+        SOLVERS[f"{meta_solver.name()}.{name}"] = lambda *args, **kwargs: meta_solver(
+            *args, solver_builder=solver, **kwargs
+        )
+
+SEARCH_ALGOS = {
+    "cd_search": (lambda x: cd_enumerate_prob_grammar(x, 20), None),
+    "beap_search": (bps_enumerate_prob_grammar, None),
+    "heap_search": (hs_enumerate_prob_grammar, hs_enumerate_prob_u_grammar),
+    "compiled_heap_search": (chs_enumerate_prob_grammar, None),
+    "bucket_search": (
+        lambda x: hs_enumerate_bucket_prob_grammar(x, 3),
+        lambda x: hs_enumerate_bucket_prob_u_grammar(x, 3),
+    ),
+    "bee_search": (bs_enumerate_prob_grammar, None),
+}
+
+PRUNING = {"dfta", "obs-eq"}
+
+
+def add_solver_choice_arg(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "-s",
+        "--search",
+        choices=SEARCH_ALGOS.keys(),
+        default=list(SEARCH_ALGOS.keys())[0],
+        help=f"enumeration algorithm (default: {list(SEARCH_ALGOS.keys())[0]})",
+    )
+    parser.add_argument(
+        "--solver",
+        choices=list(SOLVERS.keys()),
+        default="naive",
+        help=f"used solver (default: naive)",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=300,
+        help="task timeout in s (default: 300)",
+    )
+    parser.add_argument(
+        "-p",
+        "--pruning",
+        nargs="*",
+        choices=list(x for x in PRUNING),
+        help="runtime pruning",
+    )
+    parser.add_argument(
+        "--filter",
+        nargs="*",
+        type=str,
+        help="load the given files and call their get_filter functions to get a Filter[Program]",
+    )
+
+
+def load_enumerate(
+    search_algo: str, constrained: bool
+) -> Optional[Callable[[Union[ProbDetGrammar, ProbUGrammar]], ProgramEnumerator]]:
+    """
+    Returns the function building the enumerator of search_algo or None if it does not support the kind of grammars.
+    """
+    det_search, u_search = SEARCH_ALGOS[search_algo]
+    return u_search if constrained else det_search
+
+
+def load_filter_funs(filter_files: List[str]) -> List[Callable]:
+    """
+    Returns the get_filter functions of the given files.
+    """
+    filter_pot_funs = [
+        import_file_function(file[:-3].replace("/", "."), ["get_filter"])()
+        for file in filter_files
+    ]
+    return [x.get_filter for x in filter_pot_funs if x is not None]
+
+
+def setup_filters(
+    task: Task[PBE],
+    dsl: DSL,
+    evaluator: DSLEvaluator,
+    constraints: List[str],
+    constant_types: Set[Type],
+    pruning: List[str],
+    filter_funs: List[Callable],
+) -> Optional[Filter[Program]]:
+    out = None
+    # Dynamic DFTA filters
+    filters = [f(task.type_request, constant_types) for f in filter_funs]
+    for filter in filters:
+        out = filter if out is None else out.intersection(filter)
+    if "dfta" in pruning:
+        base_grammar = CFG.infinite(
+            dsl, task.type_request, constant_types=constant_types
+        )
+        filter = DFTAFilter(
+            add_dfta_constraints(base_grammar, constraints, progress=False)
+        )
+        out = filter if out is None else out.intersection(filter)
+    if "obs-eq" in pruning:
+        filter = ObsEqFilter(
+            evaluator, [ex.inputs for ex in task.specification.examples]
+        )
+        out = filter if out is None else out.intersection(filter)
+    return out
+
+
+def solve_task(
+    task: Task[PBE],
+    pcfg: Union[ProbDetGrammar, ProbUGrammar],
+    solver: PBESolver,
+    custom_enumerate: Callable[
+        [Union[ProbDetGrammar, ProbUGrammar]], ProgramEnumerator
+    ],
+    filter: Optional[Filter[Program]],
+    timeout: float,
+) -> Tuple[bool, Optional[Program]]:
+    """
+    Searches a solution to task in pcfg and returns whether one was found and the solution.
+    """
+    if isinstance(task.specification, PBEWithConstants):
+        pcfg = pcfg.instantiate_constants(task.specification.constants)
+    enumerator = custom_enumerate(pcfg)
+    enumerator.filter = filter
+    sol_generator = solver.solve(task, enumerator, timeout=timeout)
+    try:
+        solution = next(sol_generator)
+    except StopIteration:
+        return False, None
+    # The search stops once the solution is accepted
+    try:
+        sol_generator.send(True)
+    except StopIteration:
+        pass
+    return True, solution
@@ -6,10 +6,15 @@ from synth.filter.filter import Filter, UnionFilter, IntersectionFilter
 from synth.filter.dfta_filter import DFTAFilter
 from synth.filter.obs_eq_filter import ObsEqFilter
 from synth.filter.local_stateless_filter import LocalStatelessFilter
+from synth.filter.equivalence_filter import EquivalenceFilter
 from synth.filter.syntactic_filter import (
     UseAllVariablesFilter,
     FunctionFilter,
     SyntacticFilter,
     SetFilter,
 )
-from synth.filter.constraints import add_constraints, add_dfta_constraints
+from synth.filter.constraints import (
+    add_constraints,
+    add_dfta_constraints,
+    add_ucfg_constraints,
+)
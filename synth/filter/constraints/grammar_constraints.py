@@ -0,0 +1,305 @@
+from itertools import product
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List as TList,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import tqdm
+from synth.filter.constraints.parsing import (
+    Token,
+    TokenAllow,
+    TokenAnything,
+    TokenAtLeast,
+    TokenAtMost,
+    TokenFunction,
+    TokenForceSubtree,
+    TokenForbidSubtree,
+    parse_specification,
+)
+from synth.syntax.grammars.det_grammar import DerivableProgram
+from synth.syntax.grammars.cfg import CFG, CFGState, CFGNonTerminal
+from synth.syntax.grammars.u_cfg import UCFG
+from synth.syntax.type_system import Type
+
+# An obligation is a hashable compiled token that a subtree must satisfy:
+# - (__ALLOW__, letters)
+# - (__FUNCTION__, letters, (arg obligation or None, ...))
+# - (__AT_MOST__ | __EXACTLY__ | __AT_LEAST__, letters, count)
+Obligation = Tuple
+Obligations = FrozenSet[Obligation]
+ProductNonTerminal = Tuple[Type, Tuple[CFGState, Obligations]]
+
+__ALLOW__ = 0
+__FUNCTION__ = 1
+__AT_MOST__ = 2
+__EXACTLY__ = 3
+__AT_LEAST__ = 4
+
+__NO_OBLIGATIONS__: Obligations = frozenset()
+
+
+def __compile__(token: Token) -> Optional[Obligation]:
+    """
+    Compile a parsed token into an obligation, None means the token accepts anything.
+    """
+    if isinstance(token, TokenAnything):
+        return None
+    elif isinstance(token, TokenAllow):
+        return (__ALLOW__, frozenset(token.allowed))
+    elif isinstance(token, TokenFunction):
+        return (
+            __FUNCTION__,
+            frozenset(token.function.allowed),
+            tuple(__compile__(arg) for arg in token.args),
+        )
+    elif isinstance(token, TokenAtMost):
+        return (__AT_MOST__, frozenset(token.to_count), token.count)
+    elif isinstance(token, TokenAtLeast):
+        return (__AT_LEAST__, frozenset(token.to_count), token.count)
+    elif isinstance(token, TokenForbidSubtree):
+        return (__AT_MOST__, frozenset(token.forbidden), 0)
+    elif isinstance(token, TokenForceSubtree):
+        return (__AT_LEAST__, frozenset(token.forced), 1)
+    assert False, f"Not implemented token: {token}({type(token)})"
+
+
+def __max_count__(
+    grammar: CFG,
+    S: CFGNonTerminal,
+    letters: FrozenSet[DerivableProgram],
+    memo: Dict[Tuple[CFGNonTerminal, FrozenSet[DerivableProgram]], float],
+) -> float:
+    """
+    Upper bound on the number of occurrences of letters in a program derived from S.
+    """
+    key = (S, letters)
+    if key in memo:
+        return memo[key]
+    # Recursive non terminals are unbounded
+    memo[key] = float("inf")
+    best = 0.0
+    for P, (args, _) in grammar.rules[S].items():
+        local = float(P in letters)
+        for arg in args:
+            local += __max_count__(grammar, (arg[0], (arg[1], None)), letters, memo)
+        best = max(best, local)
+    memo[key] = best
+    return best
+
+
+def __split_count__(
+    kind: int,
+    letters: FrozenSet[DerivableProgram],
+    target: int,
+    caps: TList[float],
+) -> TList[TList[Optional[Obligation]]]:
+    """
+    Partition a counting obligation among the children.
+    Each alternative describes disjoint sets of programs so that the product grammar stays unambiguous.
+    """
+    if len(caps) == 0:
+        ok = (
+            target == 0
+            if kind == __EXACTLY__
+            else (target >= 0 if kind == __AT_MOST__ else target <= 0)
+        )
+        return [[]] if ok else []
+    if kind != __AT_LEAST__ and target < 0:
+        return []
+    first_cap = caps[0]
+    if kind == __AT_LEAST__ and target <= 0:
+        return [[None] * len(caps)]
+    if kind == __AT_MOST__ and target >= sum(caps):
+        return [[None] * len(caps)]
+    if kind != __AT_MOST__ and target > sum(caps):
+        return []
+    if len(caps) == 1:
+        if kind == __EXACTLY__ and target == 0 and first_cap == 0:
+            return [[None]]
+        return [[(kind, letters, target)]]
+    out: TList[TList[Optional[Obligation]]] = []
+    upper = min(target, first_cap)
+    if kind == __AT_LEAST__:
+        upper = min(target - 1, first_cap)
+    for c in range(int(upper) + 1):
+        first: Optional[Obligation] = (
+            None if c == 0 and first_cap == 0 else (__EXACTLY__, letters, c)
+        )
+        for rest in __split_count__(kind, letters, target - c, caps[1:]):
+            out.append([first] + rest)
+    if kind == __AT_LEAST__ and first_cap >= target:
+        out.append([(__AT_LEAST__, letters, target)] + [None] * (len(caps) - 1))
+    return out
+
+
+def __expand__(
+    obligation: Obligation,
+    P: DerivableProgram,
+    caps: TList[Dict[FrozenSet[DerivableProgram], float]],
+) -> TList[TList[Optional[Obligation]]]:
+    """
+    Return the alternatives of obligations for the children when deriving P.
+    An empty list means that P violates the obligation.
+    """
+    kind, letters = obligation[0], obligation[1]
+    nargs = len(caps)
+    if kind == __ALLOW__:
+        return [[None] * nargs] if P in letters else []
+    elif kind == __FUNCTION__:
+        if P not in letters:
+            return []
+        args = list(obligation[2][:nargs])
+        return [args + [None] * (nargs - len(args))]
+    target = obligation[2] - int(P in letters)
+    return __split_count__(kind, letters, target, [cap[letters] for cap in caps])
+
+
+def __product_rules__(
+    grammar: CFG,
+    root: Obligations,
+    local_constraints: TList[Obligation],
+) -> Tuple[
+    Set[ProductNonTerminal],
+    Dict[ProductNonTerminal, Dict[DerivableProgram, TList[TList[ProductNonTerminal]]]],
+]:
+    memo: Dict[Tuple[CFGNonTerminal, FrozenSet[DerivableProgram]], float] = {}
+
+    def cfg_nt(S: ProductNonTerminal) -> CFGNonTerminal:
+        return (S[0], (S[1][0], None))
+
+    def caps_for(
+        args: TList[Tuple[Type, CFGState]], all_letters: Iterable
+    ) -> TList[Dict[FrozenSet[DerivableProgram], float]]:
+        return [
+            {
+                letters: __max_count__(grammar, (arg[0], (arg[1], None)), letters, memo)
+                for letters in all_letters
+            }
+            for arg in args
+        ]
+
+    start: ProductNonTerminal = (grammar.start[0], (grammar.start[1][0], root))
+    rules: Dict[
+        ProductNonTerminal, Dict[DerivableProgram, TList[TList[ProductNonTerminal]]]
+    ] = {}
+    stack = [start]
+    # Only non terminals reachable from the start are built
+    while stack:
+        S = stack.pop()
+        if S in rules:
+            continue
+        rules[S] = {}
+        for P, (args, _) in grammar.rules[cfg_nt(S)].items():
+            obligations = list(S[1][1]) + [o for o in local_constraints if P in o[1]]
+            counted = [o[1] for o in obligations if o[0] >= __AT_MOST__]
+            caps = caps_for(args, counted)
+            alternatives = [__expand__(o, P, caps) for o in obligations]
+            if any(len(alts) == 0 for alts in alternatives):
+                continue
+            derivations: TList[TList[ProductNonTerminal]] = []
+            for combination in product(*alternatives):
+                children: TList[Set[Obligation]] = [set() for _ in args]
+                for per_child in combination:
+                    for child, o in zip(children, per_child):
+                        if o is not None:
+                            child.add(o)
+                new_args = [
+                    (arg[0], (arg[1], frozenset(child)))
+                    for arg, child in zip(args, children)
+                ]
+                derivations.append(new_args)
+                for new_S in new_args:
+                    if new_S not in rules:
+                        stack.append(new_S)
+            rules[S][P] = derivations
+    # Remove non productive non terminals
+    productive: Set[ProductNonTerminal] = set()
+    changed = True
+    while changed:
+        changed = False
+        for S, dicP in rules.items():
+            if S in productive:
+                continue
+            if any(
+                all(arg in productive for arg in derivation)
+                for derivations in dicP.values()
+                for derivation in derivations
+            ):
+                productive.add(S)
+                changed = True
+    out: Dict[
+        ProductNonTerminal, Dict[DerivableProgram, TList[TList[ProductNonTerminal]]]
+    ] = {}
+    for S in productive:
+        out[S] = {}
+        for P, derivations in rules[S].items():
+            kept = [
+                derivation
+                for derivation in derivations
+                if all(arg in productive for arg in derivation)
+            ]
+            if kept:
+                out[S][P] = kept
+    return {start}, out
+
+
+def add_ucfg_constraints(
+    current_grammar: CFG,
+    constraints: Iterable[str],
+    sketch: Optional[str] = None,
+    progress: bool = True,
+) -> UCFG[Tuple[CFGState, Obligations]]:
+    """
+    Add constraints to the specified grammar and directly produce the constrained UCFG.
+
+    Contrary to add_dfta_constraints, the product is built symbolically on demand:
+    only non terminals reachable from the start are built and counting constraints
+    are kept as counters inside the non terminals.
+    The n-gram and depth information of the CFG are kept in the non terminals.
+
+    If sketch is True the constraints are for sketches otherwise they are pattern like.
+    If progress is set to True use a tqdm progress bar.
+    """
+    assert isinstance(current_grammar, CFG)
+    local_constraints: TList[Obligation] = []
+    constraints = list(constraints)
+    pbar = None
+    if progress:
+        pbar = tqdm.tqdm(
+            total=len(constraints) + int(sketch is not None) + 1,
+            desc="constraints",
+            smoothing=1,
+        )
+    for constraint in constraints:
+        token = parse_specification(constraint, current_grammar)
+        if pbar:
+            pbar.update(1)
+        # Skip empty allow since it means the primitive was not recognized
+        if isinstance(token, TokenAnything) or (
+            isinstance(token, TokenFunction) and len(token.function.allowed) == 0
+        ):
+            continue
+        assert isinstance(
+            token, TokenFunction
+        ), f"Unsupported topmost token for local constraint"
+        local_constraints.append(__compile__(token))  # type: ignore
+    root = __NO_OBLIGATIONS__
+    if sketch is not None:
+        compiled = __compile__(parse_specification(sketch, current_grammar))
+        if compiled is not None:
+            root = frozenset([compiled])
+        if pbar:
+            pbar.update(1)
+    starts, rules = __product_rules__(current_grammar, root, local_constraints)
+    if pbar:
+        pbar.update(1)
+        pbar.close()
+    if len(rules) == 0:
+        # No program satisfies the constraints
+        rules = {S: {} for S in starts}
+    return UCFG(starts, rules, clean=False)
@@ -1,4 +1,4 @@
-from typing import Dict, Generic, TypeVar, Optional
+from typing import Dict, Generic, Iterable, List, TypeVar, Optional
 
 from synth.filter.filter import Filter
 from synth.syntax.automata.tree_automaton import DFTA
@@ -7,6 +7,8 @@ from synth.syntax.program import Function, Program, Lambda
 
 V = TypeVar("V")
 
+__MISSING__ = object()
+
 
 class DFTAFilter(Filter, Generic[V]):
     """
@@ -15,36 +17,125 @@ class DFTAFilter(Filter, Generic[V]):
     If accepting_dfta then rejects programs that are not in the language of the DFTA.
     If not accepting_dfta, rejects programs that are in the language of the DFTA.
 
+    The states of (sub)programs are memoised in a cache of at most 2 * cache_size elements:
+    when the current generation is full, it becomes the old one and the previous old one is dropped.
     """
 
+    stateless = True
+
     def __init__(
-        self, dfta: DFTA[V, DerivableProgram], accepting_dfta: bool = True
+        self,
+        dfta: DFTA[V, DerivableProgram],
+        accepting_dfta: bool = True,
+        cache_size: int = 1000000,
     ) -> None:
         self.dfta = dfta
-        self._cache: Dict[Program, V] = {}
         self.accepting_dfta = accepting_dfta
+        self.cache_size = cache_size
+        self._cache: Dict[Program, Optional[V]] = {}
+        self._old_cache: Dict[Program, Optional[V]] = {}
+        # Statistics
+        self.accepted = 0
+        self.rejected = 0
 
-    def _get_prog_state(self, prog: Program) -> Optional[V]:
-        state = self._cache.get(prog, None)
-        if state is not None:
-            return state
+    def __lookup__(self, prog: Program) -> Optional[V]:
+        state = self._cache.get(prog, __MISSING__)
+        if state is __MISSING__:
+            state = self._old_cache.get(prog, __MISSING__)
+            if state is not __MISSING__:
+                self.__store__(prog, state)  # type: ignore
+        return state  # type: ignore
+
+    def __store__(self, prog: Program, state: Optional[V]) -> None:
+        if len(self._cache) >= self.cache_size:
+            self._old_cache = self._cache
+            self._cache = {}
+        self._cache[prog] = state
+
+    def __read__(self, prog: Program, args: tuple) -> Optional[V]:
         if isinstance(prog, Function):
-            fun = prog.function
-            args = tuple(self._get_prog_state(arg) for arg in prog.arguments)
-            state = self.dfta.read(fun, args)  # type: ignore
-            if state is not None:
-                self._cache[prog] = state
-            return state
+            return self.dfta.read(prog.function, args)  # type: ignore
         elif isinstance(prog, Lambda):
             assert False, "Not implemented"
-        else:
-            state = self.dfta.read(prog, ())  # type: ignore
-            if state is not None:
-                self._cache[prog] = state
+        return self.dfta.read(prog, ())  # type: ignore
+
+    def _get_prog_state(self, prog: Program) -> Optional[V]:
+        state = self.__lookup__(prog)
+        if state is not __MISSING__:
             return state
+        args = ()
+        if isinstance(prog, Function):
+            args = tuple(self._get_prog_state(arg) for arg in prog.arguments)
+        state = None if None in args else self.__read__(prog, args)
+        self.__store__(prog, state)
+        return state
 
     def accept(self, obj: Program) -> bool:
-        return (self._get_prog_state(obj) is not None) == self.accepting_dfta
+        out = (self._get_prog_state(obj) is not None) == self.accepting_dfta
+        if out:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        return out
+
+    def accept_batch(self, objs: Iterable[Program]) -> List[bool]:
+        """
+        Compute the states of all programs level by level, sharing common subtrees.
+        """
+        programs = list(objs)
+        states: Dict[Program, Optional[V]] = {}
+        # Group the subprograms whose state is unknown by height
+        heights: Dict[Program, int] = {}
+        levels: List[List[Program]] = []
+        for root in programs:
+            stack = [root]
+            while stack:
+                prog = stack[-1]
+                if prog in heights or prog in states:
+                    stack.pop()
+                    continue
+                state = self.__lookup__(prog)
+                if state is not __MISSING__:
+                    states[prog] = state
+                    stack.pop()
+                    continue
+                args = prog.arguments if isinstance(prog, Function) else []
+                pending = [
+                    arg for arg in args if arg not in heights and arg not in states
+                ]
+                if pending:
+                    stack += pending
+                    continue
+                stack.pop()
+                height = 1 + max((heights.get(arg, 0) for arg in args), default=0)
+                heights[prog] = height
+                while len(levels) < height:
+                    levels.append([])
+                levels[height - 1].append(prog)
+        # Lowest levels first so that the states of arguments are always known
+        for level in levels:
+            for prog in level:
+                args = ()
+                if isinstance(prog, Function):
+                    args = tuple(states[arg] for arg in prog.arguments)
+                state = None if None in args else self.__read__(prog, args)
+                states[prog] = state
+                self.__store__(prog, state)
+        out = [(states[prog] is not None) == self.accepting_dfta for prog in programs]
+        accepted = sum(out)
+        self.accepted += accepted
+        self.rejected += len(out) - accepted
+        return out
+
+    @property
+    def rejection_rate(self) -> float:
+        total = self.accepted + self.rejected
+        return self.rejected / total if total > 0 else 0
+
+    def reset_stats(self) -> None:
+        self.accepted = 0
+        self.rejected = 0
 
     def reset_cache(self) -> None:
         self._cache.clear()
+        self._old_cache.clear()
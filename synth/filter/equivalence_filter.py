@@ -0,0 +1,231 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from synth.filter.filter import Filter
+from synth.syntax.program import Function, Primitive, Program, Variable
+
+Path = Tuple[int, ...]
+Letter = Tuple[str, int]
+Equalities = Tuple[Tuple[Path, ...], ...]
+
+
+def __letter__(program: Program) -> Letter:
+    # Names are used instead of primitives so that instantiated polymorphic primitives match
+    if isinstance(program, Function):
+        return (str(program.function), len(program.arguments))
+    return (str(program), 0)
+
+
+def __at__(program: Program, path: Path) -> Optional[Program]:
+    for i in path:
+        if not isinstance(program, Function) or i >= len(program.arguments):
+            return None
+        program = program.arguments[i]
+    return program
+
+
+def __variables_count__(program: Program) -> Dict[int, int]:
+    count: Dict[int, int] = defaultdict(int)
+    for p in program.depth_first_iter():
+        if isinstance(p, Variable):
+            count[p.variable] += 1
+    return count
+
+
+@dataclass
+class _ShapeNode:
+    # path -> letter at this path -> shapes having this letter at this path
+    children: Dict[Path, Dict[Letter, "_ShapeNode"]] = field(default_factory=dict)
+    # Equalities to check for the shapes that have no other letter
+    equalities: List[Equalities] = field(default_factory=list)
+
+
+class EquivalenceFilter(Filter[Program]):
+    """
+    Rejects programs that are an instance of a program known to be equivalent to a smaller one.
+
+    Each forbidden program is compiled into an argument-shape check stored in a dispatch table indexed by the name of its root primitive:
+    shapes are indexed by the letters at their non variable positions, in a trie which is followed with the letters of the program,
+    and the arguments bound to the same variable must be equal.
+    Commutative primitives only accept their arguments in non decreasing order of their string representation.
+    """
+
+    stateless = True
+
+    def __init__(self) -> None:
+        # P -> trie of the shapes of the forbidden programs rooted in P
+        self._table: Dict[str, _ShapeNode] = {}
+        # P -> pairs of commutative argument indices
+        self._commutatives: Dict[str, List[Tuple[int, int]]] = {}
+        self.forbidden: List[Program] = []
+        self.stats = {
+            "constraints.total": 0,
+            "constraints.successes": 0,
+        }
+
+    def accept(self, program: Program) -> bool:
+        if not isinstance(program, Function):
+            return True
+        P = str(program.function)
+        args = program.arguments
+        for x, y in self._commutatives.get(P, []):
+            if str(args[x]) > str(args[y]):
+                return False
+        root = self._table.get(P)
+        if root is None:
+            return True
+        letters: Dict[Path, Optional[Letter]] = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for equalities in node.equalities:
+                if all(
+                    len(set(__at__(program, path) for path in group)) == 1
+                    for group in equalities
+                ):
+                    return False
+            for path, children in node.children.items():
+                if path not in letters:
+                    sub = __at__(program, path)
+                    letters[path] = None if sub is None else __letter__(sub)
+                child = children.get(letters[path])  # type: ignore
+                if child is not None:
+                    stack.append(child)
+        return True
+
+    def add_commutativity_constraint(self, program: Program) -> bool:
+        """
+        Add a program of the form (f x1 x0) meaning that f is commutative in its arguments 0 and 1.
+        """
+        self.stats["constraints.total"] += 1
+        if not isinstance(program, Function) or not all(
+            isinstance(arg, Variable) for arg in program.arguments
+        ):
+            return False
+        swapped = [
+            i
+            for i, arg in enumerate(program.arguments)
+            if arg.variable != i  # type: ignore
+        ]
+        if len(swapped) != 2:
+            return False
+        pairs = self._commutatives.setdefault(str(program.function), [])
+        pairs.append((min(swapped), max(swapped)))
+        self.stats["constraints.successes"] += 1
+        return True
+
+    def forbid_program(
+        self, program: Program, representative: Optional[Program] = None
+    ) -> bool:
+        """
+        Forbid all instances of program, program must be equivalent to representative.
+        The constraint is only added if every instance of representative is strictly smaller than the same instance of program.
+        If representative is None, program is forbidden without any check.
+        """
+        self.stats["constraints.total"] += 1
+        if not isinstance(program, Function):
+            return False
+        if representative is not None:
+            if program.size() <= representative.size():
+                return False
+            count = __variables_count__(program)
+            for var, n in __variables_count__(representative).items():
+                if count.get(var, 0) < n:
+                    return False
+        positions: List[Path] = []
+        letters: List[Letter] = []
+        variables: Dict[int, List[Path]] = defaultdict(list)
+        stack: List[Tuple[Program, Path]] = [
+            (arg, (i,)) for i, arg in enumerate(program.arguments)
+        ]
+        while stack:
+            sub, path = stack.pop()
+            if isinstance(sub, Variable):
+                variables[sub.variable].append(path)
+                continue
+            positions.append(path)
+            letters.append(__letter__(sub))
+            if isinstance(sub, Function):
+                stack += [(arg, path + (i,)) for i, arg in enumerate(sub.arguments)]
+        equalities = tuple(
+            tuple(paths) for paths in variables.values() if len(paths) > 1
+        )
+        # A path comes after its prefixes so the letters are followed from the root of the program
+        node = self._table.setdefault(str(program.function), _ShapeNode())
+        for i in sorted(range(len(positions)), key=lambda i: positions[i]):
+            node = node.children.setdefault(positions[i], {}).setdefault(
+                letters[i], _ShapeNode()
+            )
+        node.equalities.append(equalities)
+        self.forbidden.append(program)
+        self.stats["constraints.successes"] += 1
+        return True
+
+    def add_equivalence_class(self, programs: Iterable[Program]) -> int:
+        """
+        Forbid all programs of the class but the smallest one.
+        Returns the number of constraints added.
+        """
+        programs = list(programs)
+        representative = min(programs, key=lambda p: (p.size(), p.depth()))
+        return sum(
+            self.forbid_program(p, representative)
+            for p in programs
+            if p != representative
+        )
+
+    def to_constraints(self) -> List[str]:
+        """
+        Emits the forbidden programs that can be expressed as constraints for add_dfta_constraints or add_ucfg_constraints.
+        Only programs with exactly one argument that is not a variable, being a primitive or a primitive applied to distinct variables, can be expressed.
+        Commutativity can not be expressed.
+        """
+        forbidden: Dict[Tuple[Primitive, int, int], List[str]] = defaultdict(list)
+        for program in self.forbidden:
+            assert isinstance(program, Function)
+            if not isinstance(program.function, Primitive):
+                continue
+            non_variables = [
+                i
+                for i, arg in enumerate(program.arguments)
+                if not isinstance(arg, Variable)
+            ]
+            if len(non_variables) != 1:
+                continue
+            arg = program.arguments[non_variables[0]]
+            head = arg.function if isinstance(arg, Function) else arg
+            if not isinstance(head, Primitive):
+                continue
+            all_vars = [
+                p.variable
+                for p in program.depth_first_iter()
+                if isinstance(p, Variable)
+            ]
+            if len(set(all_vars)) != len(all_vars):
+                continue
+            if isinstance(arg, Function) and not all(
+                isinstance(x, Variable) for x in arg.arguments
+            ):
+                continue
+            key = (program.function, len(program.arguments), non_variables[0])
+            forbidden[key].append(head.primitive)
+        out = []
+        for (P, nargs, index), heads in forbidden.items():
+            args = ["_"] * nargs
+            args[index] = "^" + ",".join(sorted(set(heads)))
+            out.append(f"({P.primitive} {' '.join(args)})")
+        return out
+
+    @classmethod
+    def from_equivalence_classes(
+        cls,
+        commutatives: Iterable[Program],
+        eq_classes: Iterable[Iterable[Program]],
+    ) -> "EquivalenceFilter":
+        filter = cls()
+        for program in commutatives:
+            filter.add_commutativity_constraint(program)
+        for eq_class in eq_classes:
+            filter.add_equivalence_class(eq_class)
+        return filter
@@ -1,11 +1,17 @@
 from abc import ABC, abstractmethod
-from typing import Generic, TypeVar
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Generic, Iterable, List, Tuple, TypeVar
 
 
 T = TypeVar("T")
 
 
 class Filter(ABC, Generic[T]):
+    # A stateless filter gives the same answer for an object whatever objects it saw before,
+    # only stateless filters may be reordered inside a composite filter.
+    stateless: bool = False
+
     @abstractmethod
     def accept(self, obj: T) -> bool:
         """
@@ -19,16 +25,21 @@ class Filter(ABC, Generic[T]):
         """
         return not self.accept(obj)
 
+    def accept_batch(self, objs: Iterable[T]) -> List[bool]:
+        """
+        Accepts objects that should be kept, for each object of the batch.
+        Filters that can share work between objects should override this method.
+        """
+        return [self.accept(obj) for obj in objs]
+
     def __and__(self, other: "Filter[T]") -> "IntersectionFilter[T]":
         return self.intersection(other)
 
     def intersection(self, other: "Filter[T]") -> "IntersectionFilter[T]":
-        if isinstance(other, IntersectionFilter):
-            return other.intersection(self)
-        elif isinstance(self, IntersectionFilter):
-            if isinstance(other, IntersectionFilter):
-                return IntersectionFilter(*self.filters, *other.filters)
-            return IntersectionFilter(*self.filters, other)
+        if isinstance(self, IntersectionFilter):
+            return self.extend(other)  # type: ignore
+        elif isinstance(other, IntersectionFilter):
+            return other.extend(self)  # type: ignore
         else:
             return IntersectionFilter(self, other)
 
@@ -36,12 +47,10 @@ class Filter(ABC, Generic[T]):
         return self.union(other)
 
     def union(self, other: "Filter[T]") -> "UnionFilter[T]":
-        if isinstance(other, UnionFilter):
-            return other.union(self)
-        elif isinstance(self, UnionFilter):
-            if isinstance(other, UnionFilter):
-                return UnionFilter(*self.filters, *other.filters)
-            return UnionFilter(*self.filters, other)
+        if isinstance(self, UnionFilter):
+            return self.extend(other)  # type: ignore
+        elif isinstance(other, UnionFilter):
+            return other.extend(self)  # type: ignore
         else:
             return UnionFilter(self, other)
 
@@ -56,6 +65,10 @@ class NegFilter(Filter, Generic[T]):
     def __init__(self, filter: Filter[T]) -> None:
         self.filter = filter
 
+    @property
+    def stateless(self) -> bool:  # type: ignore
+        return self.filter.stateless
+
     def accept(self, obj: T) -> bool:
         return not self.filter.accept(obj)
 
@@ -63,17 +76,155 @@ class NegFilter(Filter, Generic[T]):
         return self.filter
 
 
-class UnionFilter(Filter, Generic[T]):
-    def __init__(self, *filters: Filter[T]) -> None:
-        self.filters = list(filters)
+@dataclass
+class FilterStats:
+    """
+    Runtime statistics of a filter inside a composite filter.
+    A decision is a call that determines the outcome of the composite filter alone:
+    a rejection for an intersection, an acceptance for an union.
+    """
 
-    def accept(self, obj: T) -> bool:
-        return any(p.accept(obj) for p in self.filters)
+    calls: int = field(default=0)
+    decisions: int = field(default=0)
+    time: float = field(default=0)
 
+    @property
+    def mean_time(self) -> float:
+        return self.time / self.calls if self.calls > 0 else 0
 
-class IntersectionFilter(Filter, Generic[T]):
-    def __init__(self, *filters: Filter[T]) -> None:
+    @property
+    def decision_rate(self) -> float:
+        return self.decisions / self.calls if self.calls > 0 else 0
+
+    def expected_cost(self) -> float:
+        """
+        Expected time spent in this filter per decision taken.
+        Filters sorted by increasing expected cost minimise the expected time of the composite filter.
+        """
+        if self.calls == 0:
+            return 0
+        if self.decisions == 0:
+            return float("inf")
+        return self.time / self.decisions
+
+
+class CompositeFilter(Filter, Generic[T]):
+    """
+    Filter made of several filters that are called until one of them decides.
+
+    The cost and the decision rate of each filter are profiled at runtime,
+    if adaptive then every reorder_every calls the stateless filters are reordered to minimise the expected cost.
+    Filters that are not stateless keep their relative order and always run after the stateless ones,
+    so that they only see objects that the stateless filters did not decide.
+    """
+
+    def __init__(
+        self, *filters: Filter[T], adaptive: bool = True, reorder_every: int = 1000
+    ) -> None:
         self.filters = list(filters)
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+        self._stats = [FilterStats() for _ in self.filters]
+        self._calls = 0
+        if adaptive:
+            self.reorder()
+
+    @property
+    def stateless(self) -> bool:  # type: ignore
+        return all(filter.stateless for filter in self.filters)
+
+    def extend(self, other: Filter[T]) -> "CompositeFilter[T]":
+        """
+        Returns a composite filter of the same kind and settings with the filters of other added at the end.
+        """
+        filters = other.filters if isinstance(other, type(self)) else [other]
+        return type(self)(
+            *self.filters,
+            *filters,
+            adaptive=self.adaptive,
+            reorder_every=self.reorder_every,
+        )
+
+    @abstractmethod
+    def _decides_(self, accepted: bool) -> bool:
+        """
+        Returns True iff this answer of a filter is the answer of the composite filter.
+        """
+        pass
 
     def accept(self, obj: T) -> bool:
-        return all(p.accept(obj) for p in self.filters)
+        self._calls += 1
+        if self.adaptive and self._calls % self.reorder_every == 0:
+            self.reorder()
+        for filter, stats in zip(self.filters, self._stats):
+            start = perf_counter()
+            accepted = filter.accept(obj)
+            stats.time += perf_counter() - start
+            stats.calls += 1
+            if self._decides_(accepted):
+                stats.decisions += 1
+                return accepted
+        return not self._decides_(True)
+
+    def accept_batch(self, objs: Iterable[T]) -> List[bool]:
+        objs = list(objs)
+        self._calls += len(objs)
+        if self.adaptive and self._calls >= self.reorder_every:
+            self.reorder()
+        default = not self._decides_(True)
+        out = [default] * len(objs)
+        # Only undecided objects are given to the next filter
+        undecided = list(range(len(objs)))
+        for filter, stats in zip(self.filters, self._stats):
+            if not undecided:
+                break
+            start = perf_counter()
+            answers = filter.accept_batch([objs[i] for i in undecided])
+            stats.time += perf_counter() - start
+            stats.calls += len(undecided)
+            next_undecided = []
+            for i, accepted in zip(undecided, answers):
+                if self._decides_(accepted):
+                    stats.decisions += 1
+                    out[i] = accepted
+                else:
+                    next_undecided.append(i)
+            undecided = next_undecided
+        return out
+
+    def reorder(self) -> None:
+        """
+        Sort the stateless filters by increasing expected cost per decision, the others are moved after them.
+        """
+        self._calls = 0
+        # sorted is stable so the filters that are not stateless keep their order
+        order = sorted(
+            range(len(self.filters)),
+            key=lambda i: (
+                (0, self._stats[i].expected_cost())
+                if self.filters[i].stateless
+                else (1, 0)
+            ),
+        )
+        self.filters = [self.filters[i] for i in order]
+        self._stats = [self._stats[i] for i in order]
+
+    def get_stats(self) -> List[Tuple[Filter[T], FilterStats]]:
+        """
+        Returns the statistics of each filter in the current order.
+        """
+        return list(zip(self.filters, self._stats))
+
+    def reset_stats(self) -> None:
+        self._stats = [FilterStats() for _ in self.filters]
+        self._calls = 0
+
+
+class UnionFilter(CompositeFilter, Generic[T]):
+    def _decides_(self, accepted: bool) -> bool:
+        return accepted
+
+
+class IntersectionFilter(CompositeFilter, Generic[T]):
+    def _decides_(self, accepted: bool) -> bool:
+        return not accepted
@@ -1,39 +1,126 @@
-from collections import defaultdict
-from typing import Any, Dict, List, Tuple
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, Iterable, List, Optional
 
 from synth.filter.filter import Filter
-from synth.semantic.evaluator import Evaluator
+from synth.semantic.evaluator import Evaluator, __tuplify__
 from synth.syntax.program import Program
-from synth.syntax.type_system import Type
+
+
+def __canonical__(value: Any) -> bytes:
+    """
+    Serialisation such that values that compare equal have the same serialisation:
+    numbers are serialised by value (1, 1.0 and True are equal), lists and tuples alike,
+    the elements of sets and dictionaries are sorted.
+    """
+    if value is None:
+        return b"N"
+    if isinstance(value, (bool, int)) or (
+        isinstance(value, float) and value.is_integer()
+    ):
+        return b"i%d;" % int(value)
+    if isinstance(value, float):
+        return b"f" + repr(value).encode() + b";"
+    if isinstance(value, str):
+        data = value.encode()
+        return b"s%d:" % len(data) + data
+    if isinstance(value, (list, tuple)):
+        return b"l%d:" % len(value) + b"".join(__canonical__(x) for x in value)
+    if isinstance(value, (set, frozenset)):
+        return b"S%d:" % len(value) + b"".join(sorted(__canonical__(x) for x in value))
+    if isinstance(value, dict):
+        return b"d%d:" % len(value) + b"".join(
+            sorted(__canonical__(k) + __canonical__(v) for k, v in value.items())
+        )
+    data = (type(value).__qualname__ + repr(value)).encode()
+    return b"r%d:" % len(data) + data
 
 
 class ObsEqFilter(Filter):
-    def __init__(self, evaluator: Evaluator, inputs_list: List[List[Any]]) -> None:
+    """
+    Rejects programs that are observationally equivalent to a program seen before,
+    that is programs of the same type with the same outputs on all inputs.
+
+    Outputs are not stored: only a 128 bits digest of their canonical serialisation is kept.
+    If confirm_collisions then when a digest is found the original program is evaluated again to check that the outputs are indeed equal.
+    If max_size is set, at most max_size digests are kept, the oldest being forgotten first.
+    """
+
+    def __init__(
+        self,
+        evaluator: Evaluator,
+        inputs_list: List[List[Any]],
+        max_size: Optional[int] = None,
+        confirm_collisions: bool = False,
+    ) -> None:
         self.evaluator = evaluator
         self.inputs_list = inputs_list
-        self._cache: Dict[Type, Dict[Tuple[Any, ...], Program]] = defaultdict(dict)
+        self.max_size = max_size
+        self.confirm_collisions = confirm_collisions
+        self._cache: "OrderedDict[bytes, Program]" = OrderedDict()
 
-    def _eval(self, prog: Program) -> bool:
-        """
-        Returns True iff the prog is unique wrt to outputs
-        """
-        outputs = None
+    def __outputs__(self, prog: Program) -> Optional[List[Any]]:
+        outputs = []
         for inputs in self.inputs_list:
             out = self.evaluator.eval(prog, inputs)
             if out is None:
-                return False
-            elif isinstance(out, List):
-                out = tuple(out)
-            outputs = (outputs, out)
-        original = self._cache[prog.type].get(outputs)  # type: ignore
-        if original is not None and hash(original) != hash(prog):
+                return None
+            outputs.append(out)
+        return outputs
+
+    def __digest__(self, prog: Program, outputs: List[Any]) -> bytes:
+        h = blake2b(__canonical__(str(prog.type)), digest_size=16)
+        h.update(__canonical__(outputs))
+        return h.digest()
+
+    def __check__(self, prog: Program, outputs: Optional[List[Any]]) -> bool:
+        """
+        Returns True iff the prog is unique wrt to outputs
+        """
+        if outputs is None:
             return False
-        else:
-            self._cache[prog.type][outputs] = prog  # type: ignore
+        key = self.__digest__(prog, outputs)
+        original = self._cache.get(key)
+        if original is None:
+            if self.max_size is not None and len(self._cache) >= self.max_size:
+                self._cache.popitem(last=False)
+            self._cache[key] = prog
+            return True
+        if hash(original) == hash(prog):
             return True
+        if self.confirm_collisions and __tuplify__(
+            self.__outputs__(original)
+        ) != __tuplify__(outputs):
+            return True
+        return False
+
+    def _eval(self, prog: Program) -> bool:
+        """
+        Returns True iff the prog is unique wrt to outputs
+        """
+        return self.__check__(prog, self.__outputs__(prog))
 
     def accept(self, obj: Program) -> bool:
         return self._eval(obj)
 
+    def accept_batch(self, objs: Iterable[Program]) -> List[bool]:
+        programs = list(objs)
+        # Evaluate input by input so that the evaluator works on one cache at a time
+        all_outputs: List[Optional[List[Any]]] = [[] for _ in programs]
+        for inputs in self.inputs_list:
+            for i, prog in enumerate(programs):
+                outputs = all_outputs[i]
+                if outputs is None:
+                    continue
+                out = self.evaluator.eval(prog, inputs)
+                if out is None:
+                    all_outputs[i] = None
+                else:
+                    outputs.append(out)
+        return [
+            self.__check__(prog, outputs)
+            for prog, outputs in zip(programs, all_outputs)
+        ]
+
     def reset_cache(self) -> None:
         self._cache.clear()
@@ -9,6 +9,8 @@ SyntacticFilter = Filter[Tuple[Type, Program]]
 
 
 class UseAllVariablesFilter(SyntacticFilter):
+    stateless = True
+
     def __init__(self) -> None:
         super().__init__()
         self._cached_variables_set: Dict[Type, Set[int]] = {}
@@ -29,6 +31,8 @@ class UseAllVariablesFilter(SyntacticFilter):
 
 
 class FunctionFilter(SyntacticFilter):
+    stateless = True
+
     def __init__(self, is_useless: Dict[str, Callable]) -> None:
         super().__init__()
         self.is_useless = is_useless
@@ -49,6 +53,8 @@ class FunctionFilter(SyntacticFilter):
 
 
 class SetFilter(SyntacticFilter):
+    stateless = True
+
     def __init__(self, forbidden: Set[Program]) -> None:
         super().__init__()
         self.forbidden = forbidden
@@ -3,12 +3,14 @@ import re
 
 import torch
 from torch import Tensor
+from torch.nn.utils.rnn import pad_sequence
 
 from transformers import BertTokenizer, BertModel
 
 from synth.nn.spec_encoder import SpecificationEncoder
 from synth.specification import NLP
 from synth.task import Task
+from synth.utils.data_storage import EmbeddingCache
 
 __QUOTED_TOKEN_RE__ = re.compile(r"(?P<quote>''|[`'\"])(?P<string>.*?)(?P=quote)")
 """
@@ -19,7 +21,14 @@ __BERT_MODEL__ = "bert-base-uncased"
 
 
 class NLPEncoder(SpecificationEncoder[NLP, Tensor]):
-    def __init__(self, max_var_num: int = 4) -> None:
+    """
+    Encodes intents with a frozen BERT model.
+
+    The encodings are cached by (model name, canonical intent), in the directory cache if given, otherwise in memory,
+    so each intent only goes through BERT once.
+    """
+
+    def __init__(self, max_var_num: int = 4, cache: Optional[str] = None) -> None:
         self.tokenizer = BertTokenizer.from_pretrained(__BERT_MODEL__)
         self.tokenizer.add_tokens(
             [f"var_{i}" for i in range(max_var_num + 1)]
@@ -27,6 +36,8 @@ class NLPEncoder(SpecificationEncoder[NLP, Tensor]):
         )
         self.encoder = BertModel.from_pretrained(__BERT_MODEL__)
         self.encoder.resize_token_embeddings(len(self.tokenizer))
+        self.cache = EmbeddingCache(cache, self.embedding_size)
+        self._canonical: Dict[str, Tuple[Tensor, Dict[str, Dict[str, str]]]] = {}
 
     @property
     def embedding_size(self) -> int:
@@ -34,13 +45,49 @@ class NLPEncoder(SpecificationEncoder[NLP, Tensor]):
         return size
 
     def encode(self, task: Task[NLP], device: Optional[str] = None) -> Tensor:
-        intent_tokens, slot_map = self.canonicalize_intent(task.specification.intent)
-        tensor: Tensor = self.encoder(intent_tokens).last_hidden_state
-        return tensor.to(device)
-        # find the slot map
+        return self.encode_batch([task], device)[0]
+
+    @torch.no_grad()
+    def encode_batch(
+        self, tasks: List[Task[NLP]], device: Optional[str] = None
+    ) -> List[Tensor]:
+        """
+        Returns the (1, number of tokens, embedding_size) encoding of each task.
+        Intents missing from the cache go through BERT together.
+        """
+        keys: List[str] = []
+        missing: Dict[str, Tensor] = {}
+        for task in tasks:
+            intent_tokens, _ = self.canonicalize_intent(task.specification.intent)
+            # The number of tokens tells apart the tokens added for slots
+            key = EmbeddingCache.key(
+                __BERT_MODEL__, len(self.tokenizer), intent_tokens.tolist()
+            )
+            keys.append(key)
+            if key not in self.cache:
+                missing[key] = intent_tokens[0]
+        if missing:
+            tokens = list(missing.values())
+            mask = pad_sequence([torch.ones_like(t) for t in tokens], batch_first=True)
+            states: Tensor = self.encoder(
+                pad_sequence(tokens, batch_first=True), attention_mask=mask
+            ).last_hidden_state
+            for (key, t), state in zip(missing.items(), states):
+                self.cache.put(key, state[: t.shape[0]].cpu().numpy())
+        return [
+            torch.tensor(self.cache.get(key), device=device).unsqueeze(0)
+            for key in keys
+        ]
 
     def canonicalize_intent(
         self, intent: str
+    ) -> Tuple[Tensor, Dict[str, Dict[str, str]]]:
+        if intent not in self._canonical:
+            self._canonical[intent] = self.__canonicalize_intent__(intent)
+        return self._canonical[intent]
+
+    def __canonicalize_intent__(
+        self, intent: str
     ) -> Tuple[Tensor, Dict[str, Dict[str, str]]]:
         # handle the following special case: quote is `''`
         marked_token_matches = __QUOTED_TOKEN_RE__.findall(intent)
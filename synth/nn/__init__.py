@@ -7,7 +7,9 @@ from synth.nn.u_grammar_predictor import UGrammarPredictorLayer
 import synth.nn.abstractions as abstractions
 from synth.nn.utils import (
     AutoPack,
+    BucketBatchSampler,
     Task2Tensor,
     print_model_summary,
     free_pytorch_memory,
+    optimize_for_cpu_inference,
 )
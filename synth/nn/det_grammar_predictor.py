@@ -7,6 +7,7 @@ from typing import (
     Iterable,
     List,
     Literal,
+    Mapping,
     Set,
     Tuple,
     Optional,
@@ -21,7 +22,11 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor
 
-from synth.syntax.grammars.tagged_det_grammar import TaggedDetGrammar, ProbDetGrammar
+from synth.syntax.grammars.tagged_det_grammar import (
+    TaggedDetGrammar,
+    ProbDetGrammar,
+    __rule_segments__,
+)
 from synth.syntax.grammars.det_grammar import DerivableProgram, DetGrammar
 from synth.syntax.program import Constant, Primitive, Program, Variable
 from synth.syntax.type_system import Type
@@ -32,23 +37,97 @@ V = TypeVar("V")
 W = TypeVar("W")
 
 
+def __batch_log_probability__(
+    programs: Iterable[Program],
+    log_pgrammars: Iterable["TensorLogProbDetGrammar"],
+    start: Optional[Tuple[Type, Any]] = None,
+) -> Tensor:
+    """
+    Gathers the log probabilities of the rules used by each program in its grammar then sums them at once.
+    Programs that can not be derived have a log probability of -inf.
+    """
+    programs = list(programs)
+    log_pgrammars = list(log_pgrammars)
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i, log_pgrammar in enumerate(log_pgrammars):
+        groups[id(log_pgrammar)].append(i)
+    # The rule ids of a grammar are shifted by the number of rules of the grammars before it
+    vectors: List[Tensor] = []
+    rules: List[np.ndarray] = []
+    owners: List[np.ndarray] = []
+    valid = np.zeros(len(programs), dtype=bool)
+    offset = 0
+    for indices in groups.values():
+        log_pgrammar = log_pgrammars[indices[0]]
+        ids, owned, derivable = log_pgrammar.encode_derivations_batch(
+            [programs[i] for i in indices], start
+        )
+        rows = np.array(indices, dtype=np.int64)
+        vector = log_pgrammar.log_probability_vector()
+        vectors.append(vector)
+        rules.append(ids + offset)
+        owners.append(rows[owned])
+        valid[rows] = derivable
+        offset += vector.shape[0]
+    if len(vectors) == 0:
+        return torch.full((0,), -np.inf)
+    device = vectors[0].device
+    gathered = torch.cat(vectors).index_select(
+        0, torch.from_numpy(np.concatenate(rules)).to(device)
+    )
+    out = torch.zeros(len(programs), device=device, dtype=gathered.dtype).index_add(
+        0, torch.from_numpy(np.concatenate(owners)).to(device), gathered
+    )
+    return torch.where(
+        torch.from_numpy(valid).to(device),
+        out,
+        torch.tensor(-np.inf, device=device, dtype=out.dtype),
+    )
+
+
 class TensorLogProbDetGrammar(TaggedDetGrammar[Tensor, U, V, W]):
     """
     Special version to compute with Tensors
     """
 
+    def __init__(
+        self,
+        grammar: DetGrammar[U, V, W],
+        tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Tensor]],
+        vector: Optional[Tensor] = None,
+    ):
+        super().__init__(grammar, tags)
+        # The log probabilities of the rules in the order of indexed_rules, see log_probability_vector
+        self._vector = vector
+
+    def log_probability_vector(self) -> Tensor:
+        """
+        Returns the log probabilities of the rules as a vector indexed by rule ids, see indexed_rules.
+        """
+        rules = self.indexed_rules()
+        if self._vector is None or self._vector.shape[0] != len(rules):
+            self._vector = torch.stack([self.tags[S][P] for S, P in rules])
+        return self._vector
+
     def log_probability(
         self,
         program: Program,
         start: Optional[Tuple[Type, U]] = None,
     ) -> Tensor:
-        device = self.tags[self.start][list(self.tags[self.start].keys())[0]].device
-        return self.reduce_derivations(
-            lambda current, S, P, _: current + self.tags[S][P],
-            torch.zeros((1,)).to(device),
-            program,
-            start,
-        )
+        return self.log_probability_batch([program], start)
+
+    def log_probability_batch(
+        self,
+        programs: Iterable[Program],
+        start: Optional[Tuple[Type, U]] = None,
+    ) -> Tensor:
+        """
+        Returns the log probability of each program, -inf for programs that can not be derived.
+
+        Programs are converted to rule ids then all log probabilities are gathered and summed at once.
+        """
+        programs = list(programs)
+        return __batch_log_probability__(programs, [self] * len(programs), start)
 
     def to_prob_det_grammar(self) -> ProbDetGrammar[U, V, W]:
         probabilities = {
@@ -64,61 +143,87 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
     Parameters:
     ------------
     - input_size: int - the input size of the tensor to this layer
-    - grammars: Iterable[DetGrammar[U, V, W]] - the set of all supported grammars
+    - grammars: Iterable[DetGrammar[U, V, W]] - the set of all supported grammars, or a mapping from type requests to them which may build them lazily
     - variable_probability: float = 0.2 - the probability mass of all variable at any given derivation level
+    - index: Optional[Dict[str, Any]] = None - the layout of the outputs as returned by get_extra_state, by default it is computed from grammars
+
+    The index is saved along the weights in the state dict so that a loaded layer only builds the grammars it is queried for.
     """
 
     def __init__(
         self,
         input_size: int,
-        grammars: Iterable[DetGrammar[U, V, W]],
+        grammars: Union[
+            Iterable[DetGrammar[U, V, W]], Mapping[Type, DetGrammar[U, V, W]]
+        ],
         abstraction: Callable[[Tuple[Type, U]], A],
         variable_probability: float = 0.2,
+        index: Optional[Dict[str, Any]] = None,
     ):
         super(DetGrammarPredictorLayer, self).__init__()
 
-        self.grammar_dictionary = {
-            grammar.type_request: grammar for grammar in grammars
-        }
+        self.grammar_dictionary: Mapping[Type, DetGrammar[U, V, W]] = (
+            grammars
+            if isinstance(grammars, Mapping)
+            else {grammar.type_request: grammar for grammar in grammars}
+        )
         self.variable_probability = variable_probability
-
-        # Compute all pairs (A, P) where A is an abstraction of S
-        self.abs2real: Dict[A, Set[Tuple[Type, U]]] = defaultdict(set)
+        self.abstraction = abstraction
+        # Cache of the abstraction of each non-terminal, see __abstract__
         self.real2abs: Dict[Tuple[Type, U], A] = {}
+        if index is None:
+            index = __grammar_index__(self.grammar_dictionary.values(), abstraction)
+        self.__set_index__(index)
+        output_size = self.output_size
 
-        self.all_pairs: Dict[Optional[A], Set[Primitive]] = {}
-        for grammar in grammars:
-            for S in grammar.rules:
-                abstract = abstraction(S)
-                self.abs2real[abstract].add(S)
-                self.real2abs[S] = abstract
-
-                key = abstract
-                if not key in self.all_pairs:
-                    self.all_pairs[key] = set()
-                for P in grammar.rules[S]:
-                    if not isinstance(P, (Variable, Constant)):
-                        self.all_pairs[key].add(P)
-
-        output_size = sum(len(self.all_pairs[S]) for S in self.all_pairs)
-        self.output_size = output_size
+        self.log_probs_predictor = nn.Linear(
+            input_size,
+            output_size,
+        )
+
+    def __set_index__(self, index: Dict[str, Any]) -> None:
+        # abstraction -> (first output column, number of primitives, primitive -> column offset)
         self.abs2index: Dict[
             Optional[A],
             Tuple[int, int, Dict[Primitive, int]],
         ] = {}
         current_index = 0
-        for okey, set_for_key in self.all_pairs.items():
-            self.abs2index[okey] = (
+        for abstract, primitives in index["abstractions"]:
+            self.abs2index[abstract] = (
                 current_index,
-                len(set_for_key),
-                {P: i for i, P in enumerate(self.all_pairs[okey])},
+                len(primitives),
+                {P: i for i, P in enumerate(primitives)},
             )
-            current_index += len(set_for_key)
+            current_index += len(primitives)
+        self.output_size = current_index
+        # Caches of the tensors used to convert outputs into grammars, per device
+        self._layouts: Dict[Tuple[Type, str], Tuple[Tensor, ...]] = {}
+        self._padded_columns: Dict[str, Tensor] = {}
+        # Cache of the sparse encodings of programs, see encode_indices
+        self._encodings: Dict[Tuple[Type, Program], List[int]] = {}
 
-        self.log_probs_predictor = nn.Linear(
-            input_size,
-            output_size,
-        )
+    def get_extra_state(self) -> Dict[str, Any]:
+        """
+        Returns the index of this layer: for each abstraction in the order of the outputs, its primitives in order.
+        """
+        return {
+            "abstractions": [
+                (abstract, list(symbol2index))
+                for abstract, (_, __, symbol2index) in self.abs2index.items()
+            ]
+        }
+
+    def set_extra_state(self, state: Dict[str, Any]) -> None:
+        output_size = self.output_size
+        self.__set_index__(state)
+        assert (
+            self.output_size == output_size
+        ), f"The index has {self.output_size} outputs instead of {output_size}!"
+
+    def __abstract__(self, S: Tuple[Type, U]) -> A:
+        if S not in self.real2abs:
+            self.real2abs[S] = self.abstraction(S)
+        return self.real2abs[S]
 
     def forward(self, x: Tensor) -> Tensor:
         """
@@ -130,6 +235,145 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         y: Tensor = self.log_probs_predictor(x)
         return y
 
+    def __layout__(
+        self, type_request: Type, device: torch.device
+    ) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]:
+        """
+        Returns the layout of the grammar of type_request, for each rule in the order of indexed_rules:
+        - the output column of its primitive, 0 for variables and constants;
+        - the index of its non-terminal;
+        - whether it derives a primitive;
+        - for variables their rank among the variables of their non-terminal, for constants the number of variables of their non-terminal;
+        - the number of variables and constants of its non-terminal.
+        """
+        key = (type_request, str(device))
+        layout = self._layouts.get(key)
+        if layout is None:
+            grammar = self.grammar_dictionary[type_request]
+            columns: List[int] = []
+            owners: List[int] = []
+            primitive: List[bool] = []
+            rank: List[int] = []
+            choices: List[int] = []
+            for i, S in enumerate(grammar.rules):
+                start, _, symbol2index = self.abs2index[self.__abstract__(S)]
+                derivations = list(grammar.rules[S])
+                n_vars = sum(isinstance(P, Variable) for P in derivations)
+                n_choices = sum(
+                    isinstance(P, (Variable, Constant)) for P in derivations
+                )
+                var_rank = 0
+                for P in derivations:
+                    owners.append(i)
+                    choices.append(n_choices)
+                    primitive.append(isinstance(P, Primitive))
+                    columns.append(start + symbol2index[P] if primitive[-1] else 0)
+                    if isinstance(P, Variable):
+                        rank.append(var_rank)
+                        var_rank += 1
+                    else:
+                        rank.append(n_vars if isinstance(P, Constant) else 0)
+            layout = (
+                torch.tensor(columns, dtype=torch.long, device=device),
+                torch.tensor(owners, dtype=torch.long, device=device),
+                torch.tensor(primitive, dtype=torch.bool, device=device),
+                torch.tensor(rank, dtype=torch.float64, device=device),
+                torch.tensor(choices, dtype=torch.float64, device=device),
+            )
+            self._layouts[key] = layout
+        return layout
+
+    def __padded_columns__(self, device: torch.device) -> Tensor:
+        """
+        Returns the position of each output column once every abstraction is padded to the size of the largest one.
+        """
+        key = str(device)
+        if key not in self._padded_columns:
+            width = self.__padded_width__()
+            self._padded_columns[key] = torch.cat(
+                [
+                    torch.arange(length, dtype=torch.long) + i * width
+                    for i, (_, length, __) in enumerate(self.abs2index.values())
+                ]
+            ).to(device)
+        return self._padded_columns[key]
+
+    def __padded_width__(self) -> int:
+        return max([1] + [length for _, length, __ in self.abs2index.values()])
+
+    def __log_softmax__(self, x: Tensor) -> Tensor:
+        """
+        log_softmax of a batch of outputs over each abstraction at once.
+        """
+        columns = self.__padded_columns__(x.device)
+        width = self.__padded_width__()
+        padded = torch.full(
+            (x.shape[0], len(self.abs2index) * width),
+            float("-inf"),
+            device=x.device,
+            dtype=x.dtype,
+        ).index_copy(1, columns, x)
+        log_probs = F.log_softmax(padded.view(x.shape[0], -1, width), dim=-1)
+        return log_probs.view(x.shape[0], -1).index_select(1, columns)
+
+    def tensor2log_prob_weights(
+        self,
+        x: Tensor,
+        type_request: Type,
+        total_variable_order: bool = True,
+    ) -> Tensor:
+        """
+        Converts outputs of this layer into the log probabilities of the rules of the grammar of type_request.
+
+        Parameters:
+        ------------
+        - x: Tensor - one output or a batch of outputs of this layer
+        - type_request: Type - the type request of the PCFG
+        - total_variable_order: bool = True - reduce very slighlty (1e-7) some variable probabilities to ensure they are totally ordered in terms of probablities
+
+        Returns a tensor with one column per rule in the order of indexed_rules, with a batch dimension iff x has one.
+        """
+        batch = x.reshape(-1, self.output_size)
+        columns, owners, primitive, rank, choices = self.__layout__(
+            type_request, x.device
+        )
+        log_probs = self.__log_softmax__(batch)[:, columns]
+        # As for a conversion rule by rule, normalising constants are not differentiated
+        with torch.no_grad():
+            totals = torch.zeros(
+                (batch.shape[0], int(owners[-1]) + 1),
+                device=x.device,
+                dtype=torch.float64,
+            ).index_add(
+                1,
+                owners,
+                torch.where(primitive, log_probs.double().exp(), 0),
+            )[
+                :, owners
+            ]
+            var_probability = torch.where(
+                totals > 0, self.variable_probability, 1.0
+            ).double()
+            # Primitives share the probability mass left by variables and constants
+            shift = torch.where(
+                choices > 0,
+                torch.log((1 - var_probability) / totals),
+                -torch.log(totals),
+            )
+            shift = torch.where(totals > 0, shift, 0)
+            # All variables and constants together have probability mass self.variable_probability
+            # then the probability of selecting one is uniform
+            var_log_probs = torch.log(
+                var_probability / choices.clamp(min=1)
+                - (1e-7 if total_variable_order else 0) * rank
+            )
+        out = torch.where(
+            primitive,
+            log_probs + shift.to(log_probs.dtype),
+            var_log_probs.to(log_probs.dtype),
+        )
+        return out if x.dim() > 1 else out[0]
+
     def tensor2log_prob_grammar(
         self,
         x: Tensor,
@@ -145,68 +389,83 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         - total_variable_order: bool = True - reduce very slighlty (1e-7) some variable probabilities to ensure they are totally ordered in terms of probablities
 
         """
-        device = x.device
-        self.__normalize__(x, x)
         grammar = self.grammar_dictionary[type_request]
-        tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Tensor]] = {}
-        for S in grammar.rules:
-            tags[S] = {}
-            key = self.real2abs[S]
-            start, length, symbol2index = self.abs2index[key]
-            y = x[start : start + length]
-
-            # List of all variables derivable from S
-            variables: List[Variable] = []
-            constants: List[Constant] = []
-            # For each derivation parse probabilities
-            for P in grammar.rules[S]:
-                cpy_P = P
-                if isinstance(P, Primitive):
-                    primitive_index = symbol2index[P]
-                    tags[S][cpy_P] = y[primitive_index]
-                elif isinstance(P, Variable):
-                    V: Variable = P  # ensure typing
-                    variables.append(V)
-                    # All variables together have probability mass self.variable_probability
-                    # then the probability of selecting a variable is uniform
-                elif isinstance(P, Constant):
-                    C: Constant = P  # ensure typing
-                    constants.append(C)
-                else:
-                    continue
-            # If there are variables we need to normalise
-            total = sum(np.exp(tags[S][P].item()) for P in tags[S])
-            if variables or constants:
-                var_probability = self.variable_probability
-                if total > 0:
-                    # Normalise rest
-                    to_add: float = np.log((1 - self.variable_probability) / total)
-                    for O in tags[S]:
-                        tags[S][O] = tags[S][O] + to_add
-                else:
-                    # There are no other choices than variables
-                    var_probability = 1
-                # Normalise variable probability
-                normalised_variable_logprob: float = np.log(
-                    var_probability / (len(variables) + len(constants))
+        vector = self.tensor2log_prob_weights(x, type_request, total_variable_order)
+        values = vector.unbind()
+        index, _ = __rule_segments__(grammar)
+        tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Tensor]] = {
+            S: dict(zip(P_list, values[i:j])) for S, (P_list, i, j) in index.items()
+        }
+        return TensorLogProbDetGrammar(grammar, tags, vector)
+
+    def tensor2prob_grammars(
+        self,
+        x: Tensor,
+        type_requests: Iterable[Type],
+        total_variable_order: bool = True,
+    ) -> List[ProbDetGrammar[U, V, W]]:
+        """
+        Converts a batch of outputs of this layer into PCFGs, outputs with the same type request are converted at once.
+        The PCFGs are built from dense weights, see ProbDetGrammar.from_weights.
+        """
+        type_requests = list(type_requests)
+        groups: Dict[Type, List[int]] = defaultdict(list)
+        for i, type_request in enumerate(type_requests):
+            groups[type_request].append(i)
+        out: List[ProbDetGrammar[U, V, W]] = [None] * len(type_requests)  # type: ignore
+        with torch.no_grad():
+            for type_request, indices in groups.items():
+                weights = (
+                    self.tensor2log_prob_weights(
+                        x[indices], type_request, total_variable_order
+                    )
+                    .double()
+                    .exp()
+                    .cpu()
+                    .numpy()
                 )
-                for P in variables:
-                    tags[S][P] = torch.tensor(normalised_variable_logprob).to(device)
-                    # Trick to allow a total ordering on variables
-                    if total_variable_order:
-                        normalised_variable_logprob = np.log(
-                            np.exp(normalised_variable_logprob) - 1e-7
-                        )
-                for P in constants:
-                    tags[S][P] = torch.tensor(normalised_variable_logprob).to(device)
-            elif total > 0:
-                # We still need to normalise probabilities
-                # Since all derivations aren't possible
-                to_add = np.log(1 / total)
-                for O in tags[S]:
-                    tags[S][O] = tags[S][O] + to_add
-        grammar = TensorLogProbDetGrammar(grammar, tags)
-        return grammar
+                grammar = self.grammar_dictionary[type_request]
+                for i, w in zip(indices, weights):
+                    out[i] = ProbDetGrammar.from_weights(grammar, w)
+        return out
+
+    def encode_indices(self, program: Program, type_request: Type) -> List[int]:
+        """
+        Returns the output columns of the primitives used by program, the sparse form of encode.
+        The result is cached so that each training program is only encoded once.
+        """
+        key = (type_request, program)
+        indices = self._encodings.get(key)
+        if indices is None:
+            grammar = self.grammar_dictionary[type_request]
+            columns: Set[int] = set()
+            grammar.reduce_derivations(__reduce_encoder__, (self, columns), program)
+            indices = sorted(columns)
+            self._encodings[key] = indices
+        return indices
+
+    def encode_batch(
+        self,
+        programs: Iterable[Program],
+        type_requests: Iterable[Type],
+        device: Union[torch.device, str, Literal[None]] = None,
+    ) -> Tensor:
+        """
+        Returns the (batch_size, output_size) tensor of the encodings of programs.
+        """
+        programs = list(programs)
+        rows: List[int] = []
+        columns: List[int] = []
+        for i, (program, type_request) in enumerate(zip(programs, type_requests)):
+            indices = self.encode_indices(program, type_request)
+            rows += [i] * len(indices)
+            columns += indices
+        out: Tensor = torch.zeros((len(programs), self.output_size), device=device)
+        out[
+            torch.tensor(rows, dtype=torch.long, device=device),
+            torch.tensor(columns, dtype=torch.long, device=device),
+        ] = 1
+        return out
 
     def encode(
         self,
@@ -214,10 +473,7 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         type_request: Type,
         device: Union[torch.device, str, Literal[None]] = None,
     ) -> Tensor:
-        out: Tensor = torch.zeros((self.output_size), device=device)
-        grammar = self.grammar_dictionary[type_request]
-        grammar.reduce_derivations(__reduce_encoder__, (self, out), program)
-        return out
+        return self.encode_batch([program], [type_request], device)[0]
 
     def __normalize__(self, src: Tensor, dst: Tensor) -> None:
         # Normalize
@@ -241,21 +497,67 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         reduce: Optional[Callable[[Tensor], Tensor]] = torch.mean,
     ) -> Tensor:
         target = torch.log(
-            1e-5
-            + torch.stack(
-                [
-                    self.encode(prog, tr, device=batch_outputs.device)
-                    for prog, tr in zip(programs, type_requests)
-                ]
-            )
-        ).to(device=batch_outputs.device)
-        dst = torch.zeros_like(batch_outputs)
-        self.__normalize__(batch_outputs, dst)
+            1e-5 + self.encode_batch(programs, type_requests, batch_outputs.device)
+        )
+        dst = self.__log_softmax__(batch_outputs)
         out = F.mse_loss(dst, target)
         if reduce:
             out = reduce(out)
         return out
 
+    def log_probabilities(
+        self,
+        programs: Iterable[Program],
+        log_pgrammars: Iterable[TensorLogProbDetGrammar[U, V, W]],
+    ) -> Tensor:
+        """
+        Computes the log prob of each program in its grammar, -inf if it can not be derived.
+        """
+        return __batch_log_probability__(programs, log_pgrammars)
+
+    def log_probabilities_batch(
+        self,
+        programs: Iterable[Program],
+        type_requests: Iterable[Type],
+        batch_outputs: Tensor,
+        total_variable_order: bool = True,
+    ) -> Tensor:
+        """
+        Computes the log prob of each program in the grammar predicted by its output, -inf if it can not be derived.
+        Same as log_probabilities on the grammars given by tensor2log_prob_grammar without building them:
+        the log probabilities of the rules used are gathered from tensor2log_prob_weights, one type request at a time.
+        """
+        programs = list(programs)
+        groups: Dict[Type, List[int]] = defaultdict(list)
+        for i, type_request in enumerate(type_requests):
+            groups[type_request].append(i)
+        device = batch_outputs.device
+        out = torch.full(
+            (len(programs),), -np.inf, device=device, dtype=batch_outputs.dtype
+        )
+        for type_request, indices in groups.items():
+            rows = torch.tensor(indices, dtype=torch.long, device=device)
+            weights = self.tensor2log_prob_weights(
+                batch_outputs[rows], type_request, total_variable_order
+            )
+            rules, owners, valid = self.grammar_dictionary[
+                type_request
+            ].encode_derivations_batch([programs[i] for i in indices])
+            t_owners = torch.from_numpy(owners).to(device)
+            sums = torch.zeros(
+                len(indices), device=device, dtype=weights.dtype
+            ).index_add(
+                0, t_owners, weights[t_owners, torch.from_numpy(rules).to(device)]
+            )
+            out = out.index_copy(
+                0,
+                rows,
+                torch.where(torch.from_numpy(valid).to(device), sums, out[rows]).to(
+                    out.dtype
+                ),
+            )
+        return out
+
     def loss_negative_log_prob(
         self,
         programs: Iterable[Program],
@@ -267,30 +569,46 @@ class DetGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         Computes the negative log prob of each solution program.
         This works independently of the abstraction used.
         """
+        programs = list(programs)
+        out = -self.log_probabilities(programs, log_pgrammars)
         if length_normed:
-            log_prob_list = [
-                log_pgrammar.log_probability(p) / p.size()
-                for p, log_pgrammar in zip(programs, log_pgrammars)
-            ]
-        else:
-            log_prob_list = [
-                log_pgrammar.log_probability(p)
-                for p, log_pgrammar in zip(programs, log_pgrammars)
-            ]
-        out = -torch.stack(log_prob_list)
+            out = out / torch.tensor(
+                [p.size() for p in programs], device=out.device, dtype=out.dtype
+            )
         if reduce:
             out = reduce(out)
         return out
 
 
+def __grammar_index__(
+    grammars: Iterable[DetGrammar[U, V, W]],
+    abstraction: Callable[[Tuple[Type, U]], A],
+) -> Dict[str, Any]:
+    """
+    Returns all pairs (A, P) where A is an abstraction of a non-terminal S that derives P, grouped by A.
+    """
+    pairs: Dict[A, Dict[Primitive, None]] = {}
+    for grammar in grammars:
+        for S in grammar.rules:
+            primitives = pairs.setdefault(abstraction(S), {})
+            for P in grammar.rules[S]:
+                if not isinstance(P, (Variable, Constant)):
+                    primitives[P] = None  # type: ignore
+    return {
+        "abstractions": [
+            (abstract, list(primitives)) for abstract, primitives in pairs.items()
+        ]
+    }
+
+
 def __reduce_encoder__(
-    t: Tuple[DetGrammarPredictorLayer[A, U, V, W], Tensor],
+    t: Tuple[DetGrammarPredictorLayer[A, U, V, W], Set[int]],
     S: Tuple[Type, U],
     P: DerivableProgram,
     _: V,
-) -> Tuple[DetGrammarPredictorLayer[A, U, V, W], Tensor]:
+) -> Tuple[DetGrammarPredictorLayer[A, U, V, W], Set[int]]:
     if isinstance(P, Primitive):
-        G, tensor = t
-        start, __, symbol2index = G.abs2index[G.real2abs[S]]
-        tensor[start + symbol2index[P]] = 1
+        G, columns = t
+        start, __, symbol2index = G.abs2index[G.__abstract__(S)]
+        columns.add(start + symbol2index[P])
     return t
@@ -1,11 +1,13 @@
 from collections import defaultdict
 from typing import (
+    Any,
     Callable,
     Dict,
     Generic,
     Iterable,
     List,
     Literal,
+    Mapping,
     Set,
     Tuple,
     Optional,
@@ -20,7 +22,11 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor
 
-from synth.syntax.grammars.tagged_u_grammar import TaggedUGrammar, ProbUGrammar
+from synth.syntax.grammars.tagged_u_grammar import (
+    TaggedUGrammar,
+    ProbUGrammar,
+    __derivation_segments__,
+)
 from synth.syntax.grammars.u_grammar import DerivableProgram, UGrammar
 from synth.syntax.program import Constant, Primitive, Program, Variable
 from synth.syntax.type_system import Type
@@ -83,67 +89,90 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
     Parameters:
     ------------
     - input_size: int - the input size of the tensor to this layer
-    - grammars: Iterable[DetGrammar[U, V, W]] - the set of all supported grammars
+    - grammars: Iterable[UGrammar[U, V, W]] - the set of all supported grammars, or a mapping from type requests to them which may build them lazily
     - variable_probability: float = 0.2 - the probability mass of all variable at any given derivation level
+    - index: Optional[Dict[str, Any]] = None - the layout of the outputs as returned by get_extra_state, by default it is computed from grammars
+
+    The index is saved along the weights in the state dict so that a loaded layer only builds the grammars it is queried for.
     """
 
     def __init__(
         self,
         input_size: int,
-        grammars: Iterable[UGrammar[U, V, W]],
+        grammars: Union[Iterable[UGrammar[U, V, W]], Mapping[Type, UGrammar[U, V, W]]],
         abstraction: Callable[[Tuple[Type, U]], A],
         variable_probability: float = 0.2,
+        index: Optional[Dict[str, Any]] = None,
     ):
         super(UGrammarPredictorLayer, self).__init__()
 
-        self.grammar_dictionary = {
-            grammar.type_request: grammar for grammar in grammars
-        }
+        self.grammar_dictionary: Mapping[Type, UGrammar[U, V, W]] = (
+            grammars
+            if isinstance(grammars, Mapping)
+            else {grammar.type_request: grammar for grammar in grammars}
+        )
         self.variable_probability = variable_probability
-
-        # Compute all pairs (A, P) where A is an abstraction of S
-        self.abs2real: Dict[A, Set[Tuple[Type, U]]] = defaultdict(set)
+        self.abstraction = abstraction
+        # Cache of the abstraction of each non-terminal, see __abstract__
         self.real2abs: Dict[Tuple[Type, U], A] = {}
+        if index is None:
+            index = __grammar_index__(self.grammar_dictionary.values(), abstraction)
+        self.__set_index__(index)
+        output_size = self.output_size
 
-        self.all_pairs: Dict[Optional[A], Set[Primitive]] = {}
-        self.all_starts_abs: List[A] = []
-        for grammar in grammars:
-            for S in grammar.rules:
-                abstract = abstraction(S)
-                self.abs2real[abstract].add(S)
-                self.real2abs[S] = abstract
-
-                key = abstract
-                if not key in self.all_pairs:
-                    self.all_pairs[key] = set()
-                for P in grammar.rules[S]:
-                    if not isinstance(P, (Variable, Constant)):
-                        self.all_pairs[key].add(P)
-            for S in grammar.starts:
-                a = abstraction(S)
-                if a not in self.all_starts_abs:
-                    self.all_starts_abs.append(a)
-        output_size = sum(len(self.all_pairs[S]) for S in self.all_pairs) + len(
-            self.all_starts_abs
+        self.log_probs_predictor = nn.Linear(
+            input_size,
+            output_size,
         )
-        self.output_size = output_size
+
+    def __set_index__(self, index: Dict[str, Any]) -> None:
+        # abstraction -> (first output column, number of primitives, primitive -> column offset)
         self.abs2index: Dict[
             Optional[A],
             Tuple[int, int, Dict[Primitive, int]],
         ] = {}
         current_index = 0
-        for okey, set_for_key in self.all_pairs.items():
-            self.abs2index[okey] = (
+        for abstract, primitives in index["abstractions"]:
+            self.abs2index[abstract] = (
                 current_index,
-                len(set_for_key),
-                {P: i for i, P in enumerate(self.all_pairs[okey])},
+                len(primitives),
+                {P: i for i, P in enumerate(primitives)},
             )
-            current_index += len(set_for_key)
+            current_index += len(primitives)
+        # The last outputs are the ones of the abstractions of starts
+        self.all_starts_abs: List[A] = list(index["starts"])
+        self._start2index = {a: i for i, a in enumerate(self.all_starts_abs)}
+        self.output_size = current_index + len(self.all_starts_abs)
+        # Caches of the tensors used to convert outputs into grammars, per device
+        self._layouts: Dict[Tuple[Type, str], Tuple[Tensor, ...]] = {}
+        self._padded_columns: Dict[str, Tensor] = {}
+        # Cache of the sparse encodings of programs, see encode_indices
+        self._encodings: Dict[Tuple[Type, Program], List[int]] = {}
 
-        self.log_probs_predictor = nn.Linear(
-            input_size,
-            output_size,
-        )
+    def get_extra_state(self) -> Dict[str, Any]:
+        """
+        Returns the index of this layer: for each abstraction in the order of the outputs, its primitives in order,
+        and the abstractions of starts in order.
+        """
+        return {
+            "abstractions": [
+                (abstract, list(symbol2index))
+                for abstract, (_, __, symbol2index) in self.abs2index.items()
+            ],
+            "starts": list(self.all_starts_abs),
+        }
+
+    def set_extra_state(self, state: Dict[str, Any]) -> None:
+        output_size = self.output_size
+        self.__set_index__(state)
+        assert (
+            self.output_size == output_size
+        ), f"The index has {self.output_size} outputs instead of {output_size}!"
+
+    def __abstract__(self, S: Tuple[Type, U]) -> A:
+        if S not in self.real2abs:
+            self.real2abs[S] = self.abstraction(S)
+        return self.real2abs[S]
 
     def forward(self, x: Tensor) -> Tensor:
         """
@@ -155,6 +184,173 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         y: Tensor = self.log_probs_predictor(x)
         return y
 
+    def __layout__(
+        self, type_request: Type, device: torch.device
+    ) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor, Tensor]:
+        """
+        Returns the layout of the grammar of type_request, for each derivation S -> P v in the order of ProbUGrammar.weights:
+        - the output column of its primitive, 0 for variables and constants;
+        - the index of its non-terminal;
+        - whether it derives a primitive;
+        - for variables their rank among the variable derivations of their non-terminal, for constants the number of variable derivations of their non-terminal;
+        - the number of variables and constants of its non-terminal;
+        and the output columns of the starts in the order of starts_of.
+        """
+        key = (type_request, str(device))
+        layout = self._layouts.get(key)
+        if layout is None:
+            grammar = self.grammar_dictionary[type_request]
+            index, _ = __derivation_segments__(grammar)
+            columns: List[int] = []
+            owners: List[int] = []
+            primitive: List[bool] = []
+            rank: List[int] = []
+            choices: List[int] = []
+            for i, (S, (derivations, _, _)) in enumerate(index.items()):
+                start, _, symbol2index = self.abs2index[self.__abstract__(S)]
+                n_vars = sum(
+                    len(keys) for P, keys in derivations if isinstance(P, Variable)
+                )
+                n_choices = sum(
+                    isinstance(P, (Variable, Constant)) for P, _ in derivations
+                )
+                var_rank = 0
+                for P, keys in derivations:
+                    for _ in keys:
+                        owners.append(i)
+                        choices.append(n_choices)
+                        primitive.append(isinstance(P, Primitive))
+                        columns.append(start + symbol2index[P] if primitive[-1] else 0)
+                        if isinstance(P, Variable):
+                            rank.append(var_rank)
+                            var_rank += 1
+                        else:
+                            rank.append(n_vars if isinstance(P, Constant) else 0)
+            first_start = self.output_size - len(self.all_starts_abs)
+            start_columns = [
+                first_start + self._start2index[self.__abstract__(S)]
+                for S in self.starts_of(type_request)
+            ]
+            layout = (
+                torch.tensor(columns, dtype=torch.long, device=device),
+                torch.tensor(owners, dtype=torch.long, device=device),
+                torch.tensor(primitive, dtype=torch.bool, device=device),
+                torch.tensor(rank, dtype=torch.float64, device=device),
+                torch.tensor(choices, dtype=torch.float64, device=device),
+                torch.tensor(start_columns, dtype=torch.long, device=device),
+            )
+            self._layouts[key] = layout
+        return layout
+
+    def starts_of(self, type_request: Type) -> List[Tuple[Type, U]]:
+        """
+        Returns the starts of the grammar of type_request in the order used by tensor2log_prob_weights.
+        """
+        grammar = self.grammar_dictionary[type_request]
+        return sorted(
+            grammar.starts, key=lambda S: self._start2index[self.__abstract__(S)]
+        )
+
+    def __padded_columns__(self, device: torch.device) -> Tensor:
+        """
+        Returns the position of each output column once every abstraction is padded to the size of the largest one.
+        """
+        key = str(device)
+        if key not in self._padded_columns:
+            width = self.__padded_width__()
+            self._padded_columns[key] = torch.cat(
+                [
+                    torch.arange(length, dtype=torch.long) + i * width
+                    for i, (_, length, __) in enumerate(self.abs2index.values())
+                ]
+            ).to(device)
+        return self._padded_columns[key]
+
+    def __padded_width__(self) -> int:
+        return max([1] + [length for _, length, __ in self.abs2index.values()])
+
+    def __log_softmax__(self, x: Tensor) -> Tensor:
+        """
+        log_softmax of a batch of outputs over each abstraction at once.
+        """
+        columns = self.__padded_columns__(x.device)
+        width = self.__padded_width__()
+        padded = torch.full(
+            (x.shape[0], len(self.abs2index) * width),
+            float("-inf"),
+            device=x.device,
+            dtype=x.dtype,
+        ).index_copy(1, columns, x)
+        log_probs = F.log_softmax(padded.view(x.shape[0], -1, width), dim=-1)
+        return log_probs.view(x.shape[0], -1).index_select(1, columns)
+
+    def tensor2log_prob_weights(
+        self,
+        x: Tensor,
+        type_request: Type,
+        total_variable_order: bool = True,
+    ) -> Tuple[Tensor, Tensor]:
+        """
+        Converts outputs of this layer into the log probabilities of the derivations of the grammar of type_request.
+
+        Parameters:
+        ------------
+        - x: Tensor - one output or a batch of outputs of this layer
+        - type_request: Type - the type request of the PUCFG
+        - total_variable_order: bool = True - reduce very slighlty (1e-7) some variable probabilities to ensure they are totally ordered in terms of probablities
+
+        Returns the log probabilities of the derivations in the order of ProbUGrammar.weights and those of the starts in the order of starts_of,
+        with a batch dimension iff x has one.
+        """
+        batch = x.reshape(-1, self.output_size)
+        columns, owners, primitive, rank, choices, start_columns = self.__layout__(
+            type_request, x.device
+        )
+        first_start = self.output_size - len(self.all_starts_abs)
+        log_probs = self.__log_softmax__(batch[:, :first_start])[:, columns]
+        start_log_probs = batch[:, start_columns]
+        # As for a conversion rule by rule, normalising constants are not differentiated
+        with torch.no_grad():
+            totals = torch.zeros(
+                (batch.shape[0], int(owners[-1]) + 1),
+                device=x.device,
+                dtype=torch.float64,
+            ).index_add(
+                1,
+                owners,
+                torch.where(primitive, log_probs.double().exp(), 0),
+            )[
+                :, owners
+            ]
+            var_probability = torch.where(
+                totals > 0, self.variable_probability, 1.0
+            ).double()
+            # Primitives share the probability mass left by variables and constants
+            shift = torch.where(
+                choices > 0,
+                torch.log((1 - var_probability) / totals),
+                -torch.log(totals),
+            )
+            shift = torch.where(totals > 0, shift, 0)
+            # All variables and constants together have probability mass self.variable_probability
+            # then the probability of selecting one is uniform
+            var_log_probs = torch.log(
+                var_probability / choices.clamp(min=1)
+                - (1e-7 if total_variable_order else 0) * rank
+            )
+            start_shift = -torch.log(
+                start_log_probs.double().exp().sum(dim=1, keepdim=True)
+            )
+        out = torch.where(
+            primitive,
+            log_probs + shift.to(log_probs.dtype),
+            var_log_probs.to(log_probs.dtype),
+        )
+        start_out = start_log_probs + start_shift.to(start_log_probs.dtype)
+        if x.dim() > 1:
+            return out, start_out
+        return out[0], start_out[0]
+
     def tensor2log_prob_grammar(
         self,
         x: Tensor,
@@ -170,94 +366,89 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         - total_variable_order: bool = True - reduce very slighlty (1e-7) some variable probabilities to ensure they are totally ordered in terms of probablities
 
         """
-        device = x.device
-        self.__normalize__(x, x)
         grammar = self.grammar_dictionary[type_request]
+        weights, start_weights = self.tensor2log_prob_weights(
+            x, type_request, total_variable_order
+        )
+        values = weights.unbind()
+        index, _ = __derivation_segments__(grammar)
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, Tensor]]] = {}
-        for S in grammar.rules:
+        for S, (derivations, i, _) in index.items():
             tags[S] = {}
-            key = self.real2abs[S]
-            start, length, symbol2index = self.abs2index[key]
-            y = x[start : start + length]
-
-            # List of all variables derivable from S
-            variables: List[Variable] = []
-            constants: List[Constant] = []
-            # For each derivation parse probabilities
-            for P in grammar.rules[S]:
-                cpy_P = P
-                tags[S][cpy_P] = {}
-                if isinstance(P, Primitive):
-                    primitive_index = symbol2index[P]
-                    for v in grammar.rules[S][P]:
-                        kv = v
-                        if isinstance(v, List):
-                            kv = tuple(v)  # type: ignore
-                        tags[S][cpy_P][kv] = y[primitive_index]
-                elif isinstance(P, Variable):
-                    V: Variable = P  # ensure typing
-                    variables.append(V)
-                    # All variables together have probability mass self.variable_probability
-                    # then the probability of selecting a variable is uniform
-                elif isinstance(P, Constant):
-                    C: Constant = P  # ensure typing
-                    constants.append(C)
-                else:
-                    continue
-            # If there are variables we need to normalise
-            total = sum(
-                sum(np.exp(t_prob.item()) for t_prob in dico.values())
-                for P, dico in tags[S].items()
-            )
-            if variables or constants:
-                var_probability = self.variable_probability
-                if total > 0:
-                    # Normalise rest
-                    to_add: float = np.log((1 - self.variable_probability) / total)
-                    for P in tags[S]:
-                        tags[S][P] = {
-                            z: prob + to_add for z, prob in tags[S][P].items()
-                        }
-                else:
-                    # There are no other choices than variables
-                    var_probability = 1
-                # Normalise variable probability
-                normalised_variable_logprob: float = np.log(
-                    var_probability / (len(variables) + len(constants))
+            for P, keys in derivations:
+                tags[S][P] = dict(zip(keys, values[i : i + len(keys)]))
+                i += len(keys)
+        start_tags = dict(zip(self.starts_of(type_request), start_weights.unbind()))
+        return TensorLogProbUGrammar(grammar, tags, start_tags)
+
+    def tensor2prob_grammars(
+        self,
+        x: Tensor,
+        type_requests: Iterable[Type],
+        total_variable_order: bool = True,
+    ) -> List[ProbUGrammar[U, V, W]]:
+        """
+        Converts a batch of outputs of this layer into normalised PUCFGs, outputs with the same type request are converted at once.
+        The PUCFGs are built from dense weights, see ProbUGrammar.from_weights.
+        """
+        type_requests = list(type_requests)
+        groups: Dict[Type, List[int]] = defaultdict(list)
+        for i, type_request in enumerate(type_requests):
+            groups[type_request].append(i)
+        out: List[ProbUGrammar[U, V, W]] = [None] * len(type_requests)  # type: ignore
+        with torch.no_grad():
+            for type_request, indices in groups.items():
+                weights, start_weights = self.tensor2log_prob_weights(
+                    x[indices], type_request, total_variable_order
                 )
-                for P in variables:
-                    for v in grammar.rules[S][P]:
-                        tags[S][P][tuple(v)] = torch.tensor(  # type: ignore
-                            normalised_variable_logprob
-                        ).to(device)
-                        # Trick to allow a total ordering on variables
-                        if total_variable_order:
-                            normalised_variable_logprob = np.log(
-                                np.exp(normalised_variable_logprob) - 1e-7
-                            )
-                for P in constants:
-                    for v in grammar.rules[S][P]:
-                        tags[S][P][tuple(v)] = torch.tensor(  # type: ignore
-                            normalised_variable_logprob
-                        ).to(device)
-            else:
-                # We still need to normalise probabilities
-                # Since all derivations aren't possible
-                to_add = np.log(1 / total)
-                for P in tags[S]:
-                    tags[S][P] = {z: prob + to_add for z, prob in tags[S][P].items()}
-        start_tags: Dict[Tuple[Type, U], Tensor] = {}
-        z = x[self.output_size - len(self.all_starts_abs) :]
-        for i, abs in enumerate(self.all_starts_abs):
-            all_S = self.abs2real[abs]
-            for S in all_S:
-                if S in grammar.starts:
-                    start_tags[S] = z[i]
-        total = sum(np.exp(t_prob.item()) for t_prob in start_tags.values())
-        to_add = np.log(1 / total)
-        start_tags = {S: t_prob + to_add for S, t_prob in start_tags.items()}
-        grammar = TensorLogProbUGrammar(grammar, tags, start_tags)
-        return grammar
+                weights = weights.double().exp().cpu().numpy()
+                start_weights = start_weights.double().exp().cpu().numpy()
+                grammar = self.grammar_dictionary[type_request]
+                starts = self.starts_of(type_request)
+                for i, w, sw in zip(indices, weights, start_weights):
+                    out[i] = ProbUGrammar.from_weights(
+                        grammar, w, dict(zip(starts, sw.tolist()))
+                    )
+                    out[i].normalise()
+        return out
+
+    def encode_indices(self, program: Program, type_request: Type) -> List[int]:
+        """
+        Returns the output columns of the primitives used by program, the sparse form of encode.
+        The result is cached so that each training program is only encoded once.
+        """
+        key = (type_request, program)
+        indices = self._encodings.get(key)
+        if indices is None:
+            grammar = self.grammar_dictionary[type_request]
+            columns: Set[int] = set()
+            grammar.reduce_derivations(__reduce_encoder__, (self, columns), program)
+            indices = sorted(columns)
+            self._encodings[key] = indices
+        return indices
+
+    def encode_batch(
+        self,
+        programs: Iterable[Program],
+        type_requests: Iterable[Type],
+        device: Union[torch.device, str, Literal[None]] = None,
+    ) -> Tensor:
+        """
+        Returns the (batch_size, output_size) tensor of the encodings of programs.
+        """
+        programs = list(programs)
+        rows: List[int] = []
+        columns: List[int] = []
+        for i, (program, type_request) in enumerate(zip(programs, type_requests)):
+            indices = self.encode_indices(program, type_request)
+            rows += [i] * len(indices)
+            columns += indices
+        out: Tensor = torch.zeros((len(programs), self.output_size), device=device)
+        out[
+            torch.tensor(rows, dtype=torch.long, device=device),
+            torch.tensor(columns, dtype=torch.long, device=device),
+        ] = 1
+        return out
 
     def encode(
         self,
@@ -265,10 +456,7 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         type_request: Type,
         device: Union[torch.device, str, Literal[None]] = None,
     ) -> Tensor:
-        out: Tensor = torch.zeros((self.output_size), device=device)
-        grammar = self.grammar_dictionary[type_request]
-        grammar.reduce_derivations(__reduce_encoder__, (self, out), program)
-        return out
+        return self.encode_batch([program], [type_request], device)[0]
 
     def __normalize__(self, src: Tensor, dst: Tensor) -> None:
         # Normalize
@@ -292,21 +480,62 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         reduce: Optional[Callable[[Tensor], Tensor]] = torch.mean,
     ) -> Tensor:
         target = torch.log(
-            1e-5
-            + torch.stack(
-                [
-                    self.encode(prog, tr, device=batch_outputs.device)
-                    for prog, tr in zip(programs, type_requests)
-                ]
-            )
-        ).to(device=batch_outputs.device)
-        dst = torch.zeros_like(batch_outputs)
-        self.__normalize__(batch_outputs, dst)
+            1e-5 + self.encode_batch(programs, type_requests, batch_outputs.device)
+        )
+        # Start columns are left at 0
+        n = self.output_size - len(self.all_starts_abs)
+        dst = F.pad(
+            self.__log_softmax__(batch_outputs[:, :n]), (0, len(self.all_starts_abs))
+        )
         out = F.mse_loss(dst, target)
         if reduce:
             out = reduce(out)
         return out
 
+    def log_probabilities_batch(
+        self,
+        programs: Iterable[Program],
+        type_requests: Iterable[Type],
+        batch_outputs: Tensor,
+        total_variable_order: bool = True,
+    ) -> Tensor:
+        """
+        Computes the log prob of each program in the grammar predicted by its output, -inf if it can not be derived.
+        As TensorLogProbUGrammar.log_probability, the first derivation of a program is used and starts are not counted.
+        The log probabilities of the derivations used are gathered from tensor2log_prob_weights without building grammars,
+        one type request at a time.
+        """
+        programs = list(programs)
+        groups: Dict[Type, List[int]] = defaultdict(list)
+        for i, type_request in enumerate(type_requests):
+            groups[type_request].append(i)
+        device = batch_outputs.device
+        out = torch.full(
+            (len(programs),), -np.inf, device=device, dtype=batch_outputs.dtype
+        )
+        for type_request, indices in groups.items():
+            rows = torch.tensor(indices, dtype=torch.long, device=device)
+            weights, _ = self.tensor2log_prob_weights(
+                batch_outputs[rows], type_request, total_variable_order
+            )
+            rules, owners, valid = __encode_derivations_batch__(
+                self.grammar_dictionary[type_request], [programs[i] for i in indices]
+            )
+            t_owners = torch.from_numpy(owners).to(device)
+            sums = torch.zeros(
+                len(indices), device=device, dtype=weights.dtype
+            ).index_add(
+                0, t_owners, weights[t_owners, torch.from_numpy(rules).to(device)]
+            )
+            out = out.index_copy(
+                0,
+                rows,
+                torch.where(torch.from_numpy(valid).to(device), sums, out[rows]).to(
+                    out.dtype
+                ),
+            )
+        return out
+
     def loss_negative_log_prob(
         self,
         programs: Iterable[Program],
@@ -334,14 +563,81 @@ class UGrammarPredictorLayer(nn.Module, Generic[A, U, V, W]):
         return out
 
 
+def __encode_derivations_batch__(
+    grammar: UGrammar[U, V, W], programs: List[Program]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns (derivations, owners, valid) where derivations is the concatenation of the indices of the derivations of all programs
+    in the order of ProbUGrammar.weights, owners[i] is the index of the program using derivations[i]
+    and valid[j] is False iff the j-th program can not be derived.
+    """
+    ids = grammar.__dict__.get("_derivation_ids")
+    if ids is None:
+        index, _ = __derivation_segments__(grammar)
+        ids = {}
+        for S, (derivations, start, _) in index.items():
+            for P, keys in derivations:
+                for key in keys:
+                    ids[(S, P, key)] = start
+                    start += 1
+        grammar.__dict__["_derivation_ids"] = ids
+    derivations: List[int] = []
+    owners: List[int] = []
+    valid: List[bool] = []
+    for j, program in enumerate(programs):
+        try:
+            alternatives = grammar.reduce_derivations(
+                lambda out, S, P, v: out + [ids[(S, P, tuple(v) if isinstance(v, List) else v)]],  # type: ignore
+                [],
+                program,
+            )
+        except KeyError:
+            alternatives = []
+        valid.append(len(alternatives) > 0)
+        if alternatives:
+            derivations += alternatives[0]
+            owners += [j] * len(alternatives[0])
+    return (
+        np.array(derivations, dtype=np.int64),
+        np.array(owners, dtype=np.int64),
+        np.array(valid, dtype=bool),
+    )
+
+
+def __grammar_index__(
+    grammars: Iterable[UGrammar[U, V, W]],
+    abstraction: Callable[[Tuple[Type, U]], A],
+) -> Dict[str, Any]:
+    """
+    Returns all pairs (A, P) where A is an abstraction of a non-terminal S that derives P, grouped by A,
+    and all abstractions of starts.
+    """
+    pairs: Dict[A, Dict[Primitive, None]] = {}
+    starts: Dict[A, None] = {}
+    for grammar in grammars:
+        for S in grammar.rules:
+            primitives = pairs.setdefault(abstraction(S), {})
+            for P in grammar.rules[S]:
+                if not isinstance(P, (Variable, Constant)):
+                    primitives[P] = None  # type: ignore
+        for S in grammar.starts:
+            starts[abstraction(S)] = None
+    return {
+        "abstractions": [
+            (abstract, list(primitives)) for abstract, primitives in pairs.items()
+        ],
+        "starts": list(starts),
+    }
+
+
 def __reduce_encoder__(
-    t: Tuple[UGrammarPredictorLayer[A, U, V, W], Tensor],
+    t: Tuple[UGrammarPredictorLayer[A, U, V, W], Set[int]],
     S: Tuple[Type, U],
     P: DerivableProgram,
     _: V,
-) -> Tuple[UGrammarPredictorLayer[A, U, V, W], Tensor]:
+) -> Tuple[UGrammarPredictorLayer[A, U, V, W], Set[int]]:
     if isinstance(P, Primitive):
-        G, tensor = t
-        start, __, symbol2index = G.abs2index[G.real2abs[S]]
-        tensor[start + symbol2index[P]] = 1
+        G, columns = t
+        start, __, symbol2index = G.abs2index[G.__abstract__(S)]
+        columns.add(start + symbol2index[P])
     return t
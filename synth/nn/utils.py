@@ -1,10 +1,12 @@
-from typing import Dict, Generic, List, Optional, TypeVar
+from typing import Dict, Generic, Iterator, List, Optional, TypeVar, Union
+import copy
 import gc
 
 import torch
 from torch import Tensor
 import torch.nn as nn
 from torch.nn.utils.rnn import PackedSequence
+from torch.utils.data import Sampler
 from synth.nn.spec_encoder import SpecificationEncoder
 
 from synth.specification import TaskSpecification
@@ -14,7 +16,8 @@ from synth.task import Task
 
 class AutoPack(nn.Module):
     """
-    Automatically pad tensors then pack them into a PackedSequence object.
+    Automatically pack tensors into a PackedSequence object.
+    The PackedSequence is built directly from the concatenation of the tensors and their lengths, without padding them.
     """
 
     def __init__(
@@ -27,33 +30,80 @@ class AutoPack(nn.Module):
         self.max_sequence_length = max_sequence_length
 
     def forward(self, x: List[Tensor]) -> PackedSequence:
-        max_seq_len: int = (
-            self.max_sequence_length
-            if self.max_sequence_length > 0
-            else max(t.shape[0] for t in x)
-        )
-        padded_tensors = []
-        lengths = torch.zeros((len(x)))
         device = x[0].device
-        for i, t in enumerate(x):
-            missing: int = max_seq_len - t.shape[0]
-            if missing == 0:
-                padded_tensors.append(t)
-            else:
-                padded_tensors.append(
-                    torch.concat(
-                        [
-                            t,
-                            torch.fill_(
-                                torch.zeros((missing, t.shape[1])), self.pad_symbol
-                            ).to(device),
-                        ]
-                    )
-                )
-            lengths[i] = t.shape[0]
-        inputs = torch.stack(padded_tensors)
-        return torch.nn.utils.rnn.pack_padded_sequence(
-            inputs, lengths, batch_first=True, enforce_sorted=False
+        lengths = torch.tensor([t.shape[0] for t in x], dtype=torch.long)
+        max_seq_len = int(lengths.max().item())
+        assert (
+            self.max_sequence_length <= 0 or max_seq_len <= self.max_sequence_length
+        ), f"AutoPack: sequence too long: {max_seq_len} > {self.max_sequence_length}"
+        sorted_lengths, sorted_indices = torch.sort(lengths, descending=True)
+        offsets = torch.cumsum(lengths, 0) - lengths
+        # Row t holds the index of the t-th element of each sequence still running at t, longest first
+        steps = torch.arange(max_seq_len).unsqueeze(1)
+        running = steps < sorted_lengths.unsqueeze(0)
+        index = (offsets[sorted_indices].unsqueeze(0) + steps)[running]
+        batch_sizes = running.sum(1)
+        data = torch.cat(x).index_select(0, index.to(device))
+        unsorted_indices = torch.empty_like(sorted_indices)
+        unsorted_indices[sorted_indices] = torch.arange(len(x))
+        return PackedSequence(
+            data,
+            batch_sizes,
+            sorted_indices.to(device),
+            unsorted_indices.to(device),
+        )
+
+
+class BucketBatchSampler(Sampler[List[int]]):
+    """
+    Batch sampler that groups items of similar lengths to reduce the work spent on the shortest sequences of each batch.
+    Items are shuffled, then sorted by length inside buckets of bucket_factor * batch_size items, then cut into batches whose order is shuffled.
+    """
+
+    def __init__(
+        self,
+        lengths: List[int],
+        batch_size: int,
+        bucket_factor: int = 50,
+        shuffle: bool = True,
+        drop_last: bool = False,
+    ) -> None:
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_factor
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self) -> Iterator[List[int]]:
+        indices = (
+            torch.randperm(len(self.lengths)).tolist()
+            if self.shuffle
+            else list(range(len(self.lengths)))
+        )
+        batches: List[List[int]] = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(
+                indices[start : start + self.bucket_size],
+                key=lambda i: self.lengths[i],
+            )
+            for i in range(0, len(bucket), self.batch_size):
+                batches.append(bucket[i : i + self.batch_size])
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return iter(batches)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return sum(
+                min(self.bucket_size, len(self.lengths) - start) // self.batch_size
+                for start in range(0, len(self.lengths), self.bucket_size)
+            )
+        return sum(
+            (min(self.bucket_size, len(self.lengths) - start) + self.batch_size - 1)
+            // self.batch_size
+            for start in range(0, len(self.lengths), self.bucket_size)
         )
 
 
@@ -67,6 +117,7 @@ class Task2Tensor(nn.Module, Generic[T]):
     - Embedder batch on (Tensor -> Tensor)
     - AutoPack (List[Tensor] -> PackedSequence)
     which means this maps (List[Task[T]] -> PackedSequence).
+    Tasks already encoded, for example by a DataLoader, skip the encoder.
     """
 
     def __init__(
@@ -86,15 +137,47 @@ class Task2Tensor(nn.Module, Generic[T]):
         self.packer = AutoPack(pad_symbol)
         self.embed_size = embed_size
 
-    def forward(self, tasks: List[Task[T]]) -> PackedSequence:
+    def forward(self, tasks: Union[List[Task[T]], List[Tensor]]) -> PackedSequence:
         packed: PackedSequence = self.packer(self.embed(self.encode(tasks)))
         return packed
 
-    def encode(self, tasks: List[Task[T]]) -> List[Tensor]:
-        return [self.encoder.encode(task).to(self.device) for task in tasks]
+    def encode(self, tasks: Union[List[Task[T]], List[Tensor]]) -> List[Tensor]:
+        return [
+            (task if isinstance(task, Tensor) else self.encoder.encode(task)).to(
+                self.device, non_blocking=True
+            )
+            for task in tasks
+        ]
 
     def embed(self, batch_inputs: List[Tensor]) -> List[Tensor]:
-        return [self.embedder(x).reshape((-1, self.embed_size)) for x in batch_inputs]
+        if any(x.shape[1:] != batch_inputs[0].shape[1:] for x in batch_inputs):
+            return [
+                self.embedder(x).reshape((-1, self.embed_size)) for x in batch_inputs
+            ]
+        # Embed the whole batch at once then split it back per task
+        embedded: Tensor = self.embedder(torch.cat(batch_inputs))
+        return [
+            x.reshape((-1, self.embed_size))
+            for x in embedded.split([x.shape[0] for x in batch_inputs])
+        ]
+
+
+def optimize_for_cpu_inference(
+    module: nn.Module, quantize: bool = True, script: bool = True
+) -> nn.Module:
+    """
+    Returns a copy of module in eval mode for CPU inference.
+    - quantize: dynamically quantize its linear and LSTM layers to int8
+    - script: compile it with TorchScript, module must then be scriptable
+    """
+    out = copy.deepcopy(module).eval()
+    if quantize:
+        out = torch.ao.quantization.quantize_dynamic(
+            out, {nn.Linear, nn.LSTM}, dtype=torch.qint8
+        )
+    if script:
+        out = torch.jit.script(out)
+    return out
 
 
 def one_hot_encode_primitives(
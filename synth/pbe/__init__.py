@@ -2,7 +2,7 @@
 Module that contains anything relevant to the Programming By Example (PBE) framework
 """
 
-from synth.pbe.io_encoder import IOEncoder
+from synth.pbe.io_encoder import IOEncoder, EncodedIODataset
 from synth.pbe.task_generator import (
     TaskGenerator,
     basic_output_validator,
@@ -1,7 +1,12 @@
-from typing import Any, List, Optional, Tuple
+import os
+from hashlib import blake2b
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 import torch
 from torch import Tensor
+from torch.utils.data import Dataset as TorchDataset
 
 from synth.nn.spec_encoder import SpecificationEncoder
 from synth.specification import PBE
@@ -46,14 +51,7 @@ class IOEncoder(SpecificationEncoder[PBE, Tensor]):
         else:
             encoding.append(self.symbol2index.get(x, self._default))  # type: ignore
 
-    def encode_IO(self, IO: Tuple[List, Any], device: Optional[str] = None) -> Tensor:
-        """
-        embed a list of inputs and its associated output
-        IO is of the form [[I1, I2, ..., Ik], O]
-        where I1, I2, ..., Ik are inputs and O is an output
-
-        outputs a tensor of dimension self.output_dimension
-        """
+    def __encode_IO__(self, IO: Tuple[List, Any]) -> List[int]:
         e = [self.starting_index]
         inputs, output = IO
         for x in inputs:
@@ -70,13 +68,128 @@ class IOEncoder(SpecificationEncoder[PBE, Tensor]):
         else:
             for _ in range(self.output_dimension - size):
                 e.append(self.ending_index)
-        res = torch.LongTensor(e).to(device)
-        return res
+        return e
+
+    def encode_IO(self, IO: Tuple[List, Any], device: Optional[str] = None) -> Tensor:
+        """
+        embed a list of inputs and its associated output
+        IO is of the form [[I1, I2, ..., Ik], O]
+        where I1, I2, ..., Ik are inputs and O is an output
+
+        outputs a tensor of dimension self.output_dimension
+        """
+        return torch.tensor(self.__encode_IO__(IO), dtype=torch.long, device=device)
 
     def encode(self, task: Task[PBE], device: Optional[str] = None) -> Tensor:
-        return torch.stack(
+        return torch.tensor(
             [
-                self.encode_IO((ex.inputs, ex.output), device)
+                self.__encode_IO__((ex.inputs, ex.output))
                 for ex in task.specification.examples
-            ]
+            ],
+            dtype=torch.long,
+            device=device,
+        ).reshape((-1, self.output_dimension))
+
+
+def __fingerprint__(encoder: IOEncoder, tasks: List[Task[PBE]]) -> str:
+    """
+    Digest of everything the encoded IOs depend on: the lexicon, the output dimension and the examples.
+    """
+    h = blake2b(digest_size=16)
+    h.update(repr((encoder.lexicon, encoder.output_dimension)).encode())
+    for task in tasks:
+        h.update(
+            repr(
+                [(ex.inputs, ex.output) for ex in task.specification.examples]
+            ).encode()
         )
+    return h.hexdigest()
+
+
+class EncodedIODataset(TorchDataset):
+    """
+    The IOs of a list of tasks encoded once by an IOEncoder and stored in memory-mapped files at path.
+    The i-th item is (i, encoder.encode(tasks[i])), see collate to batch them with a DataLoader.
+    The files are opened lazily so that each DataLoader worker maps them on its own.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offsets: np.ndarray = np.load(path + ".offsets.npy")
+        self._ios: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(
+        cls, encoder: IOEncoder, tasks: Iterable[Task[PBE]], path: str
+    ) -> "EncodedIODataset":
+        """
+        Encodes the IOs of tasks into the files at path.
+        """
+        tasks = list(tasks)
+        if os.path.exists(path + ".fingerprint"):
+            os.remove(path + ".fingerprint")
+        offsets = np.zeros(len(tasks) + 1, dtype=np.int64)
+        for i, task in enumerate(tasks):
+            offsets[i + 1] = offsets[i] + len(task.specification.examples)
+        dtype = np.int16 if len(encoder.lexicon) <= np.iinfo(np.int16).max else np.int32
+        ios = np.lib.format.open_memmap(
+            path + ".ios.npy",
+            mode="w+",
+            dtype=dtype,
+            shape=(int(offsets[-1]), encoder.output_dimension),
+        )
+        for i, task in enumerate(tasks):
+            if offsets[i] < offsets[i + 1]:
+                ios[offsets[i] : offsets[i + 1]] = [
+                    encoder.__encode_IO__((ex.inputs, ex.output))
+                    for ex in task.specification.examples
+                ]
+        ios.flush()
+        del ios
+        np.save(path + ".offsets.npy", offsets)
+        # Written last so that an interrupted build is never reused
+        with open(path + ".fingerprint", "w") as fd:
+            fd.write(__fingerprint__(encoder, tasks))
+        return cls(path)
+
+    @classmethod
+    def cache(
+        cls, encoder: IOEncoder, tasks: Iterable[Task[PBE]], path: str
+    ) -> "EncodedIODataset":
+        """
+        Loads the encoded IOs at path if they were built from the same examples and encoder, otherwise encodes them again.
+        """
+        tasks = list(tasks)
+        if all(
+            os.path.exists(path + ext)
+            for ext in [".offsets.npy", ".ios.npy", ".fingerprint"]
+        ):
+            with open(path + ".fingerprint") as fd:
+                if fd.read() == __fingerprint__(encoder, tasks):
+                    return cls(path)
+        return cls.build(encoder, tasks, path)
+
+    @property
+    def ios(self) -> np.ndarray:
+        if self._ios is None:
+            self._ios = np.load(self.path + ".ios.npy", mmap_mode="r")
+        return self._ios
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Tuple[int, Tensor]:
+        ios = self.ios[self.offsets[i] : self.offsets[i + 1]]
+        return i, torch.from_numpy(ios.astype(np.int64))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_ios"] = None
+        return state
+
+    @staticmethod
+    def collate(batch: List[Tuple[int, Tensor]]) -> Tuple[List[int], List[Tensor]]:
+        """
+        collate_fn of a DataLoader: returns the indices of the tasks and their encoded IOs.
+        """
+        return [i for i, _ in batch], [ios for _, ios in batch]
@@ -67,7 +67,9 @@ class PBESolver(ABC):
         last_program: Program,
     ) -> None:
         self._stats["time"] += time_used
-        self._stats["program_probability"] = enumerator.probability(last_program)
+        self._stats["program_probability"] = enumerator.probability_batch(
+            [last_program]
+        )[0]
         self._stats["programs"] += self._programs
 
     def solve(
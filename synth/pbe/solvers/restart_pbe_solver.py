@@ -1,12 +1,14 @@
-from typing import Any, Callable, Generator, List, Tuple
+from typing import Any, Callable, Generator, List, Optional, Tuple
+
+import numpy as np
+
 from synth.semantic.evaluator import DSLEvaluator
 
 
 from synth.specification import PBE
 from synth.syntax.grammars.enumeration.program_enumerator import ProgramEnumerator
-from synth.syntax.grammars.grammar import DerivableProgram
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
 from synth.syntax.program import Program
-from synth.syntax.type_system import Type
 from synth.task import Task
 from synth.utils import chrono
 from synth.pbe.solvers.pbe_solver import MetaPBESolver, NaivePBESolver, PBESolver
@@ -45,6 +47,8 @@ class RestartPBESolver(MetaPBESolver):
         self._restarts = 0
         self._data: List[Tuple[Program, float]] = []
         self._last_size = 0
+        # Sum of the scores of the saved programs using each rule, indexed by rule ids
+        self._scores: Optional[np.ndarray] = None
 
     def _close_task_solving_(
         self,
@@ -97,19 +101,23 @@ class RestartPBESolver(MetaPBESolver):
         return self.restart_criterion(self)
 
     def _restart_(self, enumerator: ProgramEnumerator[None]) -> ProgramEnumerator[None]:
-        pcfg = enumerator.G * 0  # type: ignore
+        G: ProbDetGrammar = enumerator.G  # type: ignore
+        if self._scores is None:
+            self._scores = np.zeros(len(G.indexed_rules()))
+        # Only the programs saved since the last restart need to be counted
+        new_data = self._data[self._last_size :]
         self._last_size = len(self._data)
-
-        def reduce(
-            score: float, S: Tuple[Type, Any], P: DerivableProgram, prob: float
-        ) -> float:
-            pcfg.probabilities[S][P] += score
-            return score
-
-        for program, score in self._data:
-            pcfg.reduce_derivations(reduce, score, program)
+        rules, owners, _ = G.encode_derivations_batch(
+            [program for program, _ in new_data]
+        )
+        scores = np.array([score for _, score in new_data], dtype=float)
+        counts = np.bincount(rules, weights=scores[owners], minlength=len(self._scores))
+        # Lazy grammars get new rule ids as they are expanded
+        self._scores = np.pad(self._scores, (0, len(counts) - len(self._scores)))
+        self._scores += counts
+        pcfg = ProbDetGrammar.from_weights(G.grammar, self._scores.copy())
         if self.uniform_prior > 0:
-            pcfg = pcfg + (pcfg.uniform(pcfg.grammar) * self.uniform_prior)
+            pcfg = pcfg + G.uniform(G.grammar) * self.uniform_prior
         pcfg.normalise()
         new_enumerator = enumerator.clone(pcfg)
         return new_enumerator
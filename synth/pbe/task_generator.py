@@ -49,6 +49,7 @@ class TaskGenerator:
         uniques: bool = False,
         skip_exceptions: Optional[Set[PythonType]] = None,
         verbose: bool = False,
+        sampling_batch_size: int = 256,
     ) -> None:
         self.input_generator = input_generator
         self.evaluator = evaluator
@@ -61,6 +62,9 @@ class TaskGenerator:
         self.uniques = uniques
         self.seen: Set[Program] = set()
         self.verbose = verbose
+        self.sampling_batch_size = sampling_batch_size
+        # Programs are sampled by batches, these are the programs not used yet
+        self._program_buffers: Dict[Tuple[Type, bool, bool], TList[Program]] = {}
 
         self._failed_types: Set[Type] = set()
         # For statistics
@@ -72,29 +76,36 @@ class TaskGenerator:
     def generate_program(self, type_request: Type) -> Tuple[Program, bool]:
         """
         Returns (program, is_unique)
+        Programs already seen and programs that do not use all variables are rejected while sampling,
+        when none is found using all variables is not required anymore then being unique.
         """
-        nargs: int = len(type_request.arguments())
-        solution: Program = self.type2pgrammar[type_request].sample_program()
-        tries: int = 0
-        unique_tries: int = 0
-        while solution in self.seen and unique_tries < self.max_tries:
-            solution = self.type2pgrammar[type_request].sample_program()
-            unique_tries += 1
-
-        var_used = len(solution.used_variables())
-        best = solution
-        tries = 0
-        while var_used < nargs and tries < self.max_tries:
-            solution = self.type2pgrammar[type_request].sample_program()
-            while solution in self.seen and unique_tries < self.max_tries:
-                solution = self.type2pgrammar[type_request].sample_program()
-                unique_tries += 1
-            tries += 1
-            n = len(solution.used_variables())
-            if n > var_used:
-                var_used = n
-                best = solution
-        return best, unique_tries < self.max_tries
+        for use_all_variables in [True, False]:
+            solution = self.__sample_program__(type_request, True, use_all_variables)
+            if solution is not None:
+                return solution, True
+        solution = self.__sample_program__(type_request, False, False)
+        assert solution is not None, f"No program can be sampled for {type_request}"
+        return solution, False
+
+    def __sample_program__(
+        self, type_request: Type, unique: bool, use_all_variables: bool
+    ) -> Optional[Program]:
+        key = (type_request, unique, use_all_variables)
+        buffer = self._program_buffers.get(key)
+        # Buffered programs may have been seen since they were sampled
+        while buffer and unique and buffer[-1] in self.seen:
+            buffer.pop()
+        if not buffer:
+            # About max_tries programs are drawn as when sampling one program at a time
+            buffer = self.type2pgrammar[type_request].sample_programs(
+                self.sampling_batch_size,
+                unique=unique,
+                use_all_variables=use_all_variables,
+                max_tries=max(1, self.max_tries // self.sampling_batch_size),
+                exclude=self.seen if unique else None,
+            )
+            self._program_buffers[key] = buffer
+        return buffer.pop() if buffer else None
 
     def generate_type_request(self) -> Type:
         type_request = self.gen_random_type_request.sample()
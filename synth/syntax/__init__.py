@@ -40,12 +40,14 @@ from synth.syntax.grammars import (
     UGrammar,
     ProbDetGrammar,
     ProbUGrammar,
+    CompiledProbDetGrammar,
     TaggedDetGrammar,
     TaggedUGrammar,
     ProgramEnumerator,
     bs_enumerate_prob_grammar,
     bps_enumerate_prob_grammar,
     hs_enumerate_prob_grammar,
+    chs_enumerate_prob_grammar,
     hs_enumerate_prob_u_grammar,
     hs_enumerate_bucket_prob_grammar,
     hs_enumerate_bucket_prob_u_grammar,
@@ -1,4 +1,3 @@
-import copy
 from typing import Any, Callable, Dict, Mapping, Optional, List as TList, Set, Tuple
 from synth.syntax.type_helper import FunctionType
 
@@ -76,11 +75,12 @@ class DSL:
                             or type_.size() > upper_bound_type_size
                         ):
                             continue
+                        # unify does not modify the type, no copy is needed
+                        unifier = {str(poly_type): type_}
                         for instantiated_type in set_instantiated_types:
-                            unifier = {str(poly_type): type_}
-                            intermediate_type = copy.deepcopy(instantiated_type)
-                            new_type = intermediate_type.unify(unifier)
-                            new_set_instantiated_types.add(new_type)
+                            new_set_instantiated_types.add(
+                                instantiated_type.unify(unifier)
+                            )
                     set_instantiated_types = new_set_instantiated_types
                 for type_ in set_instantiated_types:
                     instantiated_P = Primitive(P.primitive, type=type_)
@@ -3,11 +3,13 @@ from synth.syntax.grammars.ttcfg import TTCFG
 from synth.syntax.grammars.grammar import Grammar
 from synth.syntax.grammars.det_grammar import DetGrammar
 from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar, TaggedDetGrammar
+from synth.syntax.grammars.compiled_grammar import CompiledProbDetGrammar
 from synth.syntax.grammars.enumeration import (
     ProgramEnumerator,
     bs_enumerate_prob_grammar,
     bps_enumerate_prob_grammar,
     hs_enumerate_prob_grammar,
+    chs_enumerate_prob_grammar,
     hs_enumerate_prob_u_grammar,
     hs_enumerate_bucket_prob_grammar,
     hs_enumerate_bucket_prob_u_grammar,
@@ -17,3 +19,4 @@ from synth.syntax.grammars.enumeration import (
 from synth.syntax.grammars.u_grammar import UGrammar
 from synth.syntax.grammars.u_cfg import UCFG
 from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar, TaggedUGrammar
+from synth.syntax.grammars.lazy_rules import LazyRules
@@ -1,11 +1,11 @@
 from collections import deque
 from functools import lru_cache
-from typing import Deque, Dict, Literal, Set, Tuple, List
+from typing import Deque, Dict, Literal, Optional, Set, Tuple, List
 
 from synth.syntax.dsl import DSL
 from synth.syntax.grammars.det_grammar import DerivableProgram
 from synth.syntax.grammars.ttcfg import TTCFG, NGram
-from synth.syntax.program import Constant, Primitive, Variable
+from synth.syntax.program import Constant, Function, Primitive, Program, Variable
 from synth.syntax.type_system import Type
 
 
@@ -30,6 +30,44 @@ class CFG(TTCFG[CFGState, NoneType]):
     def __hash__(self) -> int:
         return hash((self.start, str(self.rules)))
 
+    def arguments_non_terminals(
+        self,
+        S: CFGNonTerminal,
+        P: DerivableProgram,
+        arguments: Optional[List[Program]] = None,
+    ) -> List[CFGNonTerminal]:
+        """
+        Returns the non-terminals from which the arguments of P are derived from S.
+        They do not depend on the arguments so they are cached, the returned list must not be modified.
+        """
+        # Not built in __init__ so that previously pickled grammars still work
+        table = self.__dict__.setdefault("_arguments_table", {})
+        out = table.get((S, P))
+        if out is None:
+            out = [(arg[0], (arg[1], None)) for arg in self.rules[S][P][0]]
+            table[(S, P)] = out
+        return out
+
+    def encode_derivations(
+        self, program: Program, start: Optional[CFGNonTerminal] = None
+    ) -> Optional[List[int]]:
+        ids = self.rule_ids()
+        out: List[int] = []
+        stack = [(program, start or self.start)]
+        while stack:
+            program, S = stack.pop()
+            P = program.function if isinstance(program, Function) else program
+            rule = ids.get((S, P))  # type: ignore
+            if rule is None:
+                return None
+            out.append(rule)
+            if isinstance(program, Function):
+                args_S = self.arguments_non_terminals(S, P)  # type: ignore
+                if len(args_S) != len(program.arguments):
+                    return None
+                stack += zip(reversed(program.arguments), reversed(args_S))
+        return out
+
     def clean(self) -> None:
         self._remove_non_productive_()
         self._remove_non_reachable_()
@@ -173,103 +211,97 @@ class CFG(TTCFG[CFGState, NoneType]):
             Dict[DerivableProgram, Tuple[List[Tuple[Type, CFGState]], NoneType]],
         ] = {}
 
+        # For each type, the programs that can be derived from it with the types of their arguments,
+        # computed only once per type since the DSL is the same for all non-terminals
+        Matches = Tuple[
+            List[DerivableProgram],
+            List[Tuple[DerivableProgram, List[Type]]],
+            List[Tuple[DerivableProgram, List[Type]]],
+            List[Tuple[DerivableProgram, List[Type]]],
+        ]
+        matches: Dict[Type, Matches] = {}
+
+        def matches_of(current_type: Type) -> Matches:
+            if current_type not in matches:
+                leaves: List[DerivableProgram] = [
+                    Variable(i, current_type)
+                    for i in range(len(args))
+                    if current_type == args[i]
+                ]
+                if current_type in constant_types:
+                    leaves.append(Constant(current_type))
+                primitives: List[Tuple[DerivableProgram, List[Type]]] = []
+                for P in dsl.list_primitives:
+                    arguments_P = P.type.ends_with(current_type)
+                    if arguments_P is not None:
+                        primitives.append((P, arguments_P))
+                variables: List[Tuple[DerivableProgram, List[Type]]] = []
+                for vi, varg in enumerate(args):
+                    arguments_V = varg.ends_with(current_type)
+                    if arguments_V is not None and len(varg.arguments()) > 0:
+                        variables.append((Variable(vi, varg), arguments_V))
+                calls_self: List[Tuple[DerivableProgram, List[Type]]] = []
+                if recursive:
+                    arguments_self = type_request.ends_with(current_type)
+                    if arguments_self is not None:
+                        calls_self.append(
+                            (Primitive("@self", type_request), arguments_self)
+                        )
+                matches[current_type] = (leaves, primitives, variables, calls_self)
+            return matches[current_type]
+
         list_to_be_treated: Deque[CFGNonTerminal] = deque()
         initital_ctx = (return_type, ((NGram(n_gram), 0), None))
         list_to_be_treated.append(initital_ctx)
+        visited: Set[CFGNonTerminal] = {initital_ctx}
 
         while len(list_to_be_treated) > 0:
             non_terminal = list_to_be_treated.pop()
             depth = non_terminal[1][0][1]
             current_type = non_terminal[0]
-            # Create rule if non existent
-            if non_terminal not in rules:
-                rules[non_terminal] = {}
-
-            if depth < max_depth:
-                # Try to add variables rules
-                if depth >= min_variable_depth:
-                    for i in range(len(args)):
-                        if current_type == args[i]:
-                            var = Variable(i, current_type)
-                            rules[non_terminal][var] = ([], None)
-                    if current_type in constant_types:
-                        cst = Constant(current_type)
-                        rules[non_terminal][cst] = ([], None)
-                # Try to add constants from the DSL
-                for P in dsl.list_primitives:
-                    type_P = P.type
-                    if type_P == current_type:
-                        rules[non_terminal][P] = ([], None)
-                # Function call
-                if depth < max_depth - 1:
-                    predecessors = non_terminal[1][0][0]
-                    last_pred = predecessors.last() if len(predecessors) > 0 else None
-                    forbidden = forbidden_sets.get(
-                        (last_pred[0].primitive, last_pred[1])
-                        if last_pred and isinstance(last_pred[0], Primitive)
-                        else ("", 0),
-                        set(),
-                    )
-                    # DSL Primitives
-                    for P in dsl.list_primitives:
-                        if P.primitive in forbidden:
-                            continue
-                        type_P = P.type
-                        arguments_P = type_P.ends_with(current_type)
-                        if arguments_P is not None:
-                            decorated_arguments_P = []
-                            for i, arg in enumerate(arguments_P):
-                                new_predecessors = predecessors.successor((P, i))
-                                new_context = (
-                                    arg,
-                                    ((new_predecessors, depth + 1), None),
-                                )
-                                decorated_arguments_P.append(
-                                    (arg, (new_predecessors, depth + 1))
-                                )
-                                if new_context not in list_to_be_treated:
-                                    list_to_be_treated.appendleft(new_context)
-
-                            rules[non_terminal][P] = (decorated_arguments_P, None)
-                    # Try to use variable as if there were functions
-                    if depth >= min_variable_depth:
-                        for vi, varg in enumerate(args):
-                            arguments_V = varg.ends_with(current_type)
-                            if arguments_V is not None and len(varg.arguments()) > 0:
-                                V = Variable(vi, varg)
-                                decorated_arguments_V = []
-                                for i, arg in enumerate(arguments_V):
-                                    new_predecessors = predecessors.successor((V, i))
-                                    new_context = (
-                                        arg,
-                                        ((new_predecessors, depth + 1), None),
-                                    )
-                                    decorated_arguments_V.append(
-                                        (arg, (new_predecessors, depth + 1))
-                                    )
-                                    if new_context not in list_to_be_treated:
-                                        list_to_be_treated.appendleft(new_context)
-
-                                rules[non_terminal][V] = (decorated_arguments_V, None)
-                    # Try to call self
-                    if recursive:
-                        arguments_self = type_request.ends_with(current_type)
-                        if arguments_self is not None:
-                            P = Primitive("@self", type_request)
-                            decorated_arguments_self = []
-                            for i, arg in enumerate(arguments_self):
-                                new_predecessors = predecessors.successor((P, i))
-                                new_context = (
-                                    arg,
-                                    ((new_predecessors, depth + 1), None),
-                                )
-                                decorated_arguments_self.append(
-                                    (arg, (new_predecessors, depth + 1))
-                                )
-                                if new_context not in list_to_be_treated:
-                                    list_to_be_treated.appendleft(new_context)
-
-                            rules[non_terminal][P] = (decorated_arguments_self, None)
+            derivations = rules.setdefault(non_terminal, {})
+            if depth >= max_depth:
+                continue
+            leaves, primitives, variables, calls_self = matches_of(current_type)
+            # Try to add variables rules
+            if depth >= min_variable_depth:
+                for leaf in leaves:
+                    derivations[leaf] = ([], None)
+            # Try to add constants from the DSL
+            for P, arguments_P in primitives:
+                if not arguments_P:
+                    derivations[P] = ([], None)
+            if depth >= max_depth - 1:
+                continue
+            # Function call
+            predecessors = non_terminal[1][0][0]
+            last_pred = predecessors.last() if len(predecessors) > 0 else None
+            forbidden = forbidden_sets.get(
+                (last_pred[0].primitive, last_pred[1])
+                if last_pred and isinstance(last_pred[0], Primitive)
+                else ("", 0),
+                set(),
+            )
+            candidates = [
+                (P, arguments_P)
+                for P, arguments_P in primitives
+                if P.primitive not in forbidden  # type: ignore
+            ]
+            # Try to use variable as if there were functions
+            if depth >= min_variable_depth:
+                candidates += variables
+            # Try to call self
+            candidates += calls_self
+            for P, arguments_P in candidates:
+                decorated_arguments_P = []
+                for i, arg in enumerate(arguments_P):
+                    new_predecessors = predecessors.successor((P, i))
+                    new_context = (arg, ((new_predecessors, depth + 1), None))
+                    decorated_arguments_P.append((arg, (new_predecessors, depth + 1)))
+                    if new_context not in visited:
+                        visited.add(new_context)
+                        list_to_be_treated.appendleft(new_context)
+                derivations[P] = (decorated_arguments_P, None)
 
         cfg = CFG(
             start=initital_ctx,
@@ -0,0 +1,181 @@
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.grammars.grammar import DerivableProgram
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
+from synth.syntax.program import Function, Program
+from synth.syntax.type_system import Type
+
+U = TypeVar("U")
+V = TypeVar("V")
+W = TypeVar("W")
+
+
+class CompiledProbDetGrammar(Generic[U, V, W]):
+    """
+    Frozen compiled form of a probabilistic CFG where non-terminals, letters and rules are dense integers.
+
+    Rules of the non-terminal S are the rules rule_offsets[S]:rule_offsets[S + 1].
+    For a rule r:
+    - rule_non_terminal[r] is the non-terminal it derives from;
+    - rule_letter[r] is the index of its derivable program in letters;
+    - probabilities[r] and log_probabilities[r] are its probability and log probability;
+    - nargs[r] is its number of arguments;
+    - arguments[r, i] is the non-terminal of its i-th argument, -1 is used as padding.
+    rule_of[S, l] is the rule deriving the letter l from S or -1 if there is none.
+
+    The grammar is not updated when the original grammar is modified.
+    """
+
+    non_terminals: List[Tuple[Type, U]]
+    non_terminal_id: Dict[Tuple[Type, U], int]
+    start: int
+    letters: List[DerivableProgram]
+    letter_id: Dict[DerivableProgram, int]
+    rule_offsets: np.ndarray
+    rule_non_terminal: np.ndarray
+    rule_letter: np.ndarray
+    nargs: np.ndarray
+    arguments: np.ndarray
+    rule_of: np.ndarray
+    rules_list: List[List[int]]
+    arguments_list: List[Tuple[int, ...]]
+    rule_letter_list: List[int]
+    rule_of_list: List[Dict[int, int]]
+
+    def __init__(self, grammar: ProbDetGrammar[U, V, W]) -> None:
+        assert isinstance(
+            grammar.grammar, CFG
+        ), f"Only probabilistic CFGs can be compiled, not {grammar.grammar.name()}"
+        self.grammar = grammar
+        # Only the probabilities depend on grammar, the tables are shared by all PCFGs of the same CFG
+        self.__dict__.update(__compiled_tables__(grammar.grammar))
+        # Rules are in the same order as the weights
+        self.probabilities_list: List[float] = grammar.weights().tolist()
+        self.probabilities = np.array(self.probabilities_list, dtype=np.float64)
+        with np.errstate(divide="ignore"):
+            self.log_probabilities = np.log(self.probabilities)
+        self.probabilities.setflags(write=False)
+        self.log_probabilities.setflags(write=False)
+
+    def __str__(self) -> str:
+        return f"compiled {self.grammar.name()} with {len(self.non_terminals)} non-terminals and {len(self.rule_letter)} rules"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def rules_for(self, S: int) -> np.ndarray:
+        """
+        Returns the rule ids of the non-terminal S.
+        """
+        return np.arange(self.rule_offsets[S], self.rule_offsets[S + 1])
+
+    def rule_program(self, rule: int) -> DerivableProgram:
+        return self.letters[self.rule_letter_list[rule]]
+
+    def derivations(
+        self, program: Program, start: Optional[int] = None
+    ) -> Optional[List[int]]:
+        """
+        Returns the rule ids used to derive program in prefix order or None if program is not in the grammar.
+        """
+        out: List[int] = []
+        stack: List[Tuple[Program, int]] = [
+            (program, self.start if start is None else start)
+        ]
+        while stack:
+            program, S = stack.pop()
+            P = program.function if isinstance(program, Function) else program
+            letter = self.letter_id.get(P, -1)  # type: ignore
+            if letter < 0:
+                return None
+            rule = self.rule_of_list[S].get(letter, -1)
+            if rule < 0:
+                return None
+            out.append(rule)
+            if isinstance(program, Function):
+                args = self.arguments_list[rule]
+                if len(args) != len(program.arguments):
+                    return None
+                stack += list(zip(program.arguments, args))[::-1]
+        return out
+
+    def probability(self, program: Program, start: Optional[int] = None) -> float:
+        rules = self.derivations(program, start)
+        if rules is None:
+            return 0
+        return float(np.prod(self.probabilities[rules]))
+
+    def log_probability(self, program: Program, start: Optional[int] = None) -> float:
+        rules = self.derivations(program, start)
+        if rules is None:
+            return -np.inf
+        return float(np.sum(self.log_probabilities[rules]))
+
+
+def __compiled_tables__(cfg: CFG) -> Dict[str, Any]:
+    """
+    Returns the tables of the compiled form of cfg that do not depend on probabilities, cached on cfg.
+    """
+    tables = cfg.__dict__.get("_compiled_tables")
+    if tables is not None:
+        return tables  # type: ignore
+    non_terminals = list(cfg.rules.keys())
+    non_terminal_id = {S: i for i, S in enumerate(non_terminals)}
+    letters: List[DerivableProgram] = []
+    letter_id: Dict[DerivableProgram, int] = {}
+    for S in non_terminals:
+        for P in cfg.rules[S]:
+            if P not in letter_id:
+                letter_id[P] = len(letters)
+                letters.append(P)
+
+    rule_non_terminal: List[int] = []
+    rule_letter: List[int] = []
+    rule_arguments: List[List[int]] = []
+    offsets = [0]
+    for i, S in enumerate(non_terminals):
+        for P, (args, _) in cfg.rules[S].items():
+            rule_non_terminal.append(i)
+            rule_letter.append(letter_id[P])
+            rule_arguments.append(
+                [non_terminal_id[(arg[0], (arg[1], None))] for arg in args]  # type: ignore
+            )
+        offsets.append(len(rule_letter))
+    max_nargs = max((len(args) for args in rule_arguments), default=0)
+
+    arguments = np.full((len(rule_arguments), max_nargs), -1, dtype=np.int64)
+    for r, args in enumerate(rule_arguments):
+        arguments[r, : len(args)] = args
+    rule_of = np.full((len(non_terminals), len(letters)), -1, dtype=np.int64)
+    rule_of[rule_non_terminal, rule_letter] = np.arange(len(rule_letter))
+    tables = {
+        "non_terminals": non_terminals,
+        "non_terminal_id": non_terminal_id,
+        "start": non_terminal_id[cfg.start],
+        "letters": letters,
+        "letter_id": letter_id,
+        "rule_offsets": np.array(offsets, dtype=np.int64),
+        "rule_non_terminal": np.array(rule_non_terminal, dtype=np.int64),
+        "rule_letter": np.array(rule_letter, dtype=np.int64),
+        "nargs": np.array([len(args) for args in rule_arguments], dtype=np.int64),
+        "arguments": arguments,
+        "rule_of": rule_of,
+        # Plain python copies for the innermost loops of enumerators, indexing numpy arrays element by element is slow
+        "rules_list": [
+            list(range(offsets[i], offsets[i + 1])) for i in range(len(non_terminals))
+        ],
+        "arguments_list": [tuple(args) for args in rule_arguments],
+        "rule_letter_list": rule_letter,
+        "rule_of_list": [
+            {rule_letter[r]: r for r in range(offsets[i], offsets[i + 1])}
+            for i in range(len(non_terminals))
+        ],
+    }
+    for value in tables.values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+    cfg.__dict__["_compiled_tables"] = tables
+    return tables
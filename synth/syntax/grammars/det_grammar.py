@@ -9,11 +9,15 @@ from typing import (
     Tuple,
     TypeVar,
     Generic,
+    Iterable,
 )
 from functools import lru_cache
 import copy
 
+import numpy as np
+
 from synth.syntax.grammars.grammar import DerivableProgram, Grammar
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.program import Constant, Function, Primitive, Program, Variable
 from synth.syntax.type_system import Arrow, Type
 
@@ -59,7 +63,11 @@ class DetGrammar(Grammar, ABC, Generic[U, V, W]):
     def primitives_used(self) -> Set[Primitive]:
         """
         Returns the set of primitives used by this grammar.
+        Lazy grammars are not supported since only their expanded non-terminals are known.
         """
+        assert not isinstance(
+            self.rules, LazyRules
+        ), "primitives_used() does not support lazy grammars!"
         out: Set[Primitive] = set()
         for S in self.rules:
             for P in self.rules[S]:
@@ -68,6 +76,9 @@ class DetGrammar(Grammar, ABC, Generic[U, V, W]):
         return out
 
     def __hash__(self) -> int:
+        # The rules of lazy grammars grow as they are expanded, hence are not hashed
+        if isinstance(self.rules, LazyRules):
+            return hash((self.start, self.type_request))
         return hash((self.start, str(self.rules)))
 
     def __rule_to_str__(self, P: DerivableProgram, out: V) -> str:
@@ -179,6 +190,92 @@ class DetGrammar(Grammar, ABC, Generic[U, V, W]):
             return (information, current)
         assert False
 
+    def arguments_non_terminals(
+        self,
+        S: Tuple[Type, U],
+        P: DerivableProgram,
+        arguments: Optional[List[Program]] = None,
+    ) -> List[Tuple[Type, U]]:
+        """
+        Returns the non-terminals from which the arguments of P are derived when deriving P(*arguments) from S.
+
+        Since the non-terminal of an argument may depend on the derivation of the previous arguments,
+        only the non-terminals of the first len(arguments) + 1 arguments are guaranteed to be returned.
+        """
+        nargs = self.arguments_length_for(S, P)
+        if nargs == 0:
+            return []
+        information, current = self.derive(self.start_information(), S, P)
+        out = [current]
+        for arg in (arguments or [])[: nargs - 1]:
+            information, lst = self.derive_all(information, current, arg)
+            current = lst[-1]
+            out.append(current)
+        return out
+
+    def indexed_rules(self) -> List[Tuple[Tuple[Type, U], DerivableProgram]]:
+        """
+        Returns the list of derivation rules (S, P), the index of a rule in this list is its id.
+        """
+        rules = self.__dict__.get("_indexed_rules")
+        # Lazy rules can grow, new non-terminals are appended so that ids are kept
+        if rules is None or self.__dict__["_indexed_size"] != len(self.rules):
+            rules = [(S, P) for S in self.rules for P in self.rules[S]]
+            self.__dict__["_indexed_rules"] = rules
+            self.__dict__["_indexed_size"] = len(self.rules)
+            self.__dict__["_rule_ids"] = {rule: i for i, rule in enumerate(rules)}
+        return rules
+
+    def rule_ids(self) -> Dict[Tuple[Tuple[Type, U], DerivableProgram], int]:
+        """
+        Returns the mapping from derivation rules (S, P) to their ids.
+        """
+        self.indexed_rules()
+        return self.__dict__["_rule_ids"]  # type: ignore
+
+    def encode_derivations(
+        self, program: Program, start: Optional[Tuple[Type, U]] = None
+    ) -> Optional[List[int]]:
+        """
+        Returns the ids of the rules used to derive program in prefix order or None if program can not be derived.
+        """
+        try:
+            rules = self.reduce_derivations(
+                lambda out, S, P, _: out.append((S, P)) or out,  # type: ignore
+                [],
+                program,
+                start,
+            )
+            # Rules are indexed once derived since deriving may expand lazy rules
+            ids = self.rule_ids()
+            return [ids[rule] for rule in rules]
+        except KeyError:
+            return None
+
+    def encode_derivations_batch(
+        self, programs: Iterable[Program], start: Optional[Tuple[Type, U]] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Encode all programs at once.
+        Returns (rules, owners, valid) where rules is the concatenation of the rule ids of all programs,
+        owners[i] is the index of the program using rules[i]
+        and valid[j] is False iff the j-th program can not be derived.
+        """
+        rules: List[int] = []
+        owners: List[int] = []
+        valid: List[bool] = []
+        for i, program in enumerate(programs):
+            ids = self.encode_derivations(program, start)
+            valid.append(ids is not None)
+            if ids is not None:
+                rules += ids
+                owners += [i] * len(ids)
+        return (
+            np.array(rules, dtype=np.int64),
+            np.array(owners, dtype=np.int64),
+            np.array(valid, dtype=bool),
+        )
+
     @abstractmethod
     def arguments_length_for(self, S: Tuple[Type, U], P: DerivableProgram) -> int:
         """
@@ -2,11 +2,17 @@ from synth.syntax.grammars.enumeration.heap_search import (
     enumerate_prob_grammar as hs_enumerate_prob_grammar,
     enumerate_bucket_prob_grammar as hs_enumerate_bucket_prob_grammar,
 )
+from synth.syntax.grammars.enumeration.compiled_heap_search import (
+    enumerate_prob_grammar as chs_enumerate_prob_grammar,
+)
 from synth.syntax.grammars.enumeration.u_heap_search import (
     enumerate_prob_u_grammar as hs_enumerate_prob_u_grammar,
     enumerate_bucket_prob_u_grammar as hs_enumerate_bucket_prob_u_grammar,
 )
-from synth.syntax.grammars.enumeration.grammar_splitter import split
+from synth.syntax.grammars.enumeration.grammar_splitter import split, threshold_cost
+from synth.syntax.grammars.enumeration.parallel_enumeration import (
+    enumerate_in_parallel,
+)
 from synth.syntax.grammars.enumeration.program_enumerator import ProgramEnumerator
 
 from synth.syntax.grammars.enumeration.bee_search import (
@@ -1,10 +1,11 @@
 from collections import defaultdict
-from itertools import product
+from itertools import islice, product
 from heapq import heappush, heappop
 from typing import (
     Dict,
     Generator,
     Generic,
+    Iterable,
     List,
     Optional,
     Set,
@@ -29,6 +30,9 @@ U = TypeVar("U")
 V = TypeVar("V")
 W = TypeVar("W")
 
+# Number of programs built from a heap element that are filtered at once
+__FILTER_CHUNK__ = 1024
+
 
 @dataclass(order=True, frozen=True)
 class HeapElement:
@@ -123,11 +127,11 @@ class BeeSearch(
         return True, len(cost_list) - 1
 
     def _add_program_(
-        self, S: Tuple[Type, U], new_program: Program, cost_index: int
+        self, S: Tuple[Type, U], new_program: Program, cost_index: int, keep: bool
     ) -> bool:
         if new_program in self._deleted:
             return False
-        if not self._should_keep_subprogram(new_program):
+        if not keep:
             self._deleted.add(new_program)
             return False
         local_bank = self._bank[S]
@@ -227,16 +231,23 @@ class BeeSearch(
                 if len(args_possibles) != nargs:
                     # print("failed")
                     continue
-                for new_args in product(*args_possibles):
-                    if len(args_possibles) == 0:
-                        new_program: Program = element.P
-                    else:
-                        new_program = Function(element.P, list(new_args))
-                    if (
-                        self._add_program_(S, new_program, cost_index)
-                        and S == self.G.start
-                    ):
-                        yield new_program
+                # Filter the combinations by chunks so that they are streamed
+                combinations = product(*args_possibles)
+                while True:
+                    candidates: List[Program] = [
+                        Function(element.P, list(new_args)) if nargs > 0 else element.P
+                        for new_args in islice(combinations, __FILTER_CHUNK__)
+                    ]
+                    if not candidates:
+                        break
+                    candidates = [p for p in candidates if p not in self._deleted]
+                    accepted = self._should_keep_subprograms(candidates)
+                    for new_program, keep in zip(candidates, accepted):
+                        if (
+                            self._add_program_(S, new_program, cost_index, keep)
+                            and S == self.G.start
+                        ):
+                            yield new_program
             self._max_index[S] = maxi
 
     def merge_program(self, representative: Program, other: Program) -> None:
@@ -253,6 +264,9 @@ class BeeSearch(
     def probability(self, program: Program) -> float:
         return self.G.probability(program)
 
+    def probability_batch(self, programs: Iterable[Program]) -> List[float]:
+        return self.G.probability_batch(programs).tolist()
+
     def programs_in_banks(self) -> int:
         return sum(sum(len(x) for x in val.values()) for val in self._bank.values())
 
@@ -0,0 +1,279 @@
+from heapq import heappush, heappop
+from typing import (
+    Dict,
+    Generator,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from synth.filter.filter import Filter
+from synth.syntax.grammars.compiled_grammar import CompiledProbDetGrammar
+from synth.syntax.grammars.enumeration.program_enumerator import ProgramEnumerator
+from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
+from synth.syntax.program import Function, Program
+
+U = TypeVar("U")
+V = TypeVar("V")
+W = TypeVar("W")
+
+__START__ = -1
+
+
+class CompiledHeapSearch(ProgramEnumerator[None], Generic[U, V, W]):
+    """
+    Heap search running on the compiled form of a probabilistic CFG.
+
+    Non-terminals and rules are integers and programs are represented by integer ids:
+    a program id stands for a letter and the ids of its arguments.
+    Programs are only built when they are output.
+    """
+
+    def __init__(
+        self,
+        G: ProbDetGrammar[U, V, W],
+        threshold: float = 0,
+        filter: Optional[Filter[Program]] = None,
+    ) -> None:
+        super().__init__(filter)
+        self.G = G
+        self.compiled = CompiledProbDetGrammar(G)
+        self.threshold = threshold
+        self.current: int = __START__
+
+        n = len(self.compiled.non_terminals)
+        # program id -> (letter, argument ids)
+        self._keys: List[Tuple[int, Tuple[int, ...]]] = []
+        self._key2id: Dict[Tuple[int, Tuple[int, ...]], int] = {}
+        self._programs: List[Optional[Program]] = []
+
+        self.deleted: Set[int] = set()
+        # self.heaps[S] is a heap of (-probability, program id) generated from S
+        self.heaps: List[List[Tuple[float, int]]] = [[] for _ in range(n)]
+        # self.probabilities[S][p] is the probability of the program p from S
+        self.probabilities: List[Dict[int, float]] = [{} for _ in range(n)]
+        # self.succ[S][p] is the successor of p from S
+        self.succ: List[Dict[int, int]] = [{} for _ in range(n)]
+        # self.pred[S][p] is the predecessor of p from S
+        self.pred: List[Dict[int, int]] = [{} for _ in range(n)]
+        # self.seen[S] is the set of programs ever added to the heap for S
+        self.seen: List[Set[int]] = [set() for _ in range(n)]
+
+    def probability(self, program: Program) -> float:
+        return self.G.probability(program)
+
+    def probability_batch(self, programs: Iterable[Program]) -> List[float]:
+        return self.G.probability_batch(programs).tolist()
+
+    @classmethod
+    def name(cls) -> str:
+        return "compiled-heap-search"
+
+    def __intern__(self, letter: int, args: Tuple[int, ...]) -> int:
+        key = (letter, args)
+        pid = self._key2id.get(key)
+        if pid is None:
+            pid = len(self._keys)
+            self._key2id[key] = pid
+            self._keys.append(key)
+            self._programs.append(None)
+        return pid
+
+    def __id_of__(self, program: Program) -> Optional[int]:
+        P = program.function if isinstance(program, Function) else program
+        letter = self.compiled.letter_id.get(P)  # type: ignore
+        if letter is None:
+            return None
+        args = []
+        if isinstance(program, Function):
+            for arg in program.arguments:
+                pid = self.__id_of__(arg)
+                if pid is None:
+                    return None
+                args.append(pid)
+        return self.__intern__(letter, tuple(args))
+
+    def __program__(self, pid: int) -> Program:
+        program = self._programs[pid]
+        if program is None:
+            letter, args = self._keys[pid]
+            program = self.compiled.letters[letter]
+            if args:
+                program = Function(program, [self.__program__(arg) for arg in args])
+            self._programs[pid] = program
+        return program
+
+    def __init_heaps__(self) -> None:
+        C = self.compiled
+        n = len(C.non_terminals)
+        # Compute the most probable program of each non-terminal, Bellman-Ford like
+        value = [0.0] * n
+        best = [-1] * n
+        changed = True
+        while changed:
+            changed = False
+            for r, (S, p, args) in enumerate(
+                zip(
+                    C.rule_non_terminal.tolist(), C.probabilities_list, C.arguments_list
+                )
+            ):
+                if any(best[arg] < 0 for arg in args):
+                    continue
+                for arg in args:
+                    p *= value[arg]
+                if best[S] < 0 or p > value[S]:
+                    value[S] = p
+                    best[S] = r
+                    changed = True
+        best_id = [-1] * n
+
+        def build(S: int) -> int:
+            if best_id[S] < 0:
+                r = best[S]
+                args = tuple(build(arg) for arg in C.arguments_list[r])
+                best_id[S] = self.__intern__(C.rule_letter_list[r], args)
+                self.probabilities[S][best_id[S]] = value[S]
+            return best_id[S]
+
+        for S in range(n):
+            if best[S] >= 0:
+                build(S)
+            for r in C.rules_list[S]:
+                args = C.arguments_list[r]
+                if any(best[arg] < 0 for arg in args):
+                    continue
+                pid = self.__intern__(
+                    C.rule_letter_list[r], tuple(build(arg) for arg in args)
+                )
+                probability = C.probabilities_list[r]
+                for arg in args:
+                    probability *= value[arg]
+                self.seen[S].add(pid)
+                self.probabilities[S][pid] = probability
+                if pid != best_id[S] and (
+                    not self.threshold or probability > self.threshold
+                ):
+                    heappush(self.heaps[S], (-probability, pid))
+        # The most probable programs are the first ones so that they can be used as arguments
+        for S in range(n):
+            if best_id[S] >= 0:
+                self.succ[S][__START__] = best_id[S]
+                self.pred[S][best_id[S]] = __START__
+        for S in range(n):
+            if best_id[S] >= 0:
+                self.__add_successors__(best_id[S], S)
+
+    def generator(self) -> Generator[Program, None, None]:
+        """
+        A generator which outputs the next most probable program
+        """
+        self.__init_heaps__()
+        while True:
+            pid = self.query(self.compiled.start, self.current)
+            if pid is None:
+                return
+            # The first program is not checked against the threshold in the heaps
+            if (
+                self.threshold
+                and self.probabilities[self.compiled.start][pid] <= self.threshold
+            ):
+                return
+            self.current = pid
+            program = self.__program__(pid)
+            if not self._should_keep_subprogram(program):
+                self.deleted.add(pid)
+                continue
+            yield program
+
+    def merge_program(self, representative: Program, other: Program) -> None:
+        """
+        Merge other into representative.
+        In other words, other will no longer be generated through heap search
+        """
+        pid = self.__id_of__(other)
+        if pid is None:
+            return
+        self.deleted.add(pid)
+        for pred, succ in zip(self.pred, self.succ):
+            if pid in pred and pid in succ:
+                pred_id = pred[pid]
+                nxt = succ[pid]
+                succ[pred_id] = nxt
+                pred[nxt] = pred_id
+
+    def __add_successors__(self, pid: int, S: int) -> None:
+        letter, args = self._keys[pid]
+        if not args:
+            return
+        C = self.compiled
+        r = C.rule_of_list[S][letter]
+        args_nt = C.arguments_list[r]
+        seen = self.seen[S]
+        for i, arg in enumerate(args):
+            succ = self.query(args_nt[i], arg)
+            if succ is None:
+                continue
+            new_args = args[:i] + (succ,) + args[i + 1 :]
+            new_pid = self.__intern__(letter, new_args)
+            if new_pid in seen or new_pid in self.deleted:
+                continue
+            seen.add(new_pid)
+            probability = C.probabilities_list[r]
+            for arg_nt, new_arg in zip(args_nt, new_args):
+                probability *= self.probabilities[arg_nt][new_arg]
+            self.probabilities[S][new_pid] = probability
+            if not self.threshold or probability > self.threshold:
+                heappush(self.heaps[S], (-probability, new_pid))
+
+    def query(self, S: int, pid: int) -> Optional[int]:
+        """
+        computing the successor of the program pid from S
+        """
+        # if we have already computed the successor of program from S, we return its stored value
+        succ = self.succ[S].get(pid)
+        if succ is not None:
+            return succ
+        # otherwise the successor is the next element in the heap
+        heap = self.heaps[S]
+        if not heap:
+            return None
+        succ = heappop(heap)[1]
+        while succ in self.deleted:
+            self.__add_successors__(succ, S)
+            if not heap:
+                return None
+            succ = heappop(heap)[1]
+        self.succ[S][pid] = succ
+        self.pred[S][succ] = pid
+        # now we need to add all potential successors of succ in heaps[S]
+        self.__add_successors__(succ, S)
+        return succ
+
+    def programs_in_banks(self) -> int:
+        return sum(len(val) for val in self.succ)
+
+    def programs_in_queues(self) -> int:
+        return sum(len(val) for val in self.heaps)
+
+    def clone(
+        self, G: Union[ProbDetGrammar, ProbUGrammar]
+    ) -> "CompiledHeapSearch[U, V, W]":
+        assert isinstance(G, ProbDetGrammar)
+        enum = self.__class__(G, self.threshold)
+        for pid in self.deleted:
+            new_pid = enum.__id_of__(self.__program__(pid))
+            if new_pid is not None:
+                enum.deleted.add(new_pid)
+        return enum
+
+
+def enumerate_prob_grammar(
+    G: ProbDetGrammar[U, V, W], threshold: float = 0
+) -> CompiledHeapSearch[U, V, W]:
+    return CompiledHeapSearch(G, threshold)
@@ -4,6 +4,7 @@ from typing import (
     Dict,
     Generator,
     Generic,
+    Iterable,
     List,
     Optional,
     Set,
@@ -428,6 +429,9 @@ class CDSearch(
     def probability(self, program: Program) -> float:
         return self.G.probability(program)
 
+    def probability_batch(self, programs: Iterable[Program]) -> List[float]:
+        return self.G.probability_batch(programs).tolist()
+
     @classmethod
     def name(cls) -> str:
         return "cd-search"
@@ -8,17 +8,14 @@ from typing import (
     Tuple,
     TypeVar,
 )
-import bisect
 from dataclasses import dataclass, field
-import copy
-
-import numpy as np
+from heapq import heapify, heappop, heappush
 
 from synth.syntax.grammars.tagged_det_grammar import DerivableProgram
 from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
 from synth.syntax.grammars.u_cfg import UCFG
-from synth.syntax.program import Constant, Primitive, Program, Variable
-from synth.syntax.type_system import Type, UnknownType
+from synth.syntax.program import Program
+from synth.syntax.type_system import Type
 
 U = TypeVar("U")
 
@@ -69,218 +66,97 @@ def __node_split__(
 
 
 def __split_nodes_until_quantity_reached__(
-    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]], quantity: int
+    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
+    quantity: int,
+    cost: Callable[[float], float],
+    nodes: Optional[List[_Node[U]]] = None,
 ) -> List[_Node[U]]:
     """
-    Start from the root node and split most probable node until the threshold number of nodes is reached.
+    Start from the given nodes, by default the root nodes, and split the most costly node until the threshold number of nodes is reached.
+    Fewer nodes are returned if no node can be split anymore.
     """
-    nodes: List[_Node[U]] = []
-    for key, prob in pcfg.start_tags.items():
-        nodes.append(_Node(prob, (pcfg.start_information(), key), [], [], []))
-    while len(nodes) < quantity:
-        i = 1
-        success, new_nodes = __node_split__(pcfg, nodes.pop())
-        while not success:
-            i += 1
-            nodes.append(new_nodes[0])
-            success, new_nodes = __node_split__(pcfg, nodes.pop(-i))
+    if nodes is None:
+        nodes = [
+            _Node(prob, (pcfg.start_information(), key), [], [], [])
+            for key, prob in pcfg.start_tags.items()
+        ]
+    # Max heap of (-cost, tie breaker, node)
+    heap = [(-cost(node.probability), i, node) for i, node in enumerate(nodes)]
+    heapify(heap)
+    counter = len(heap)
+    leaves: List[_Node[U]] = []
+    while heap and len(heap) + len(leaves) < quantity:
+        node = heappop(heap)[2]
+        success, new_nodes = __node_split__(pcfg, node)
+        if not success:
+            leaves.append(node)
+            continue
         for new_node in new_nodes:
-            insertion_index: int = bisect.bisect(nodes, new_node)
-            nodes.insert(insertion_index, new_node)
-
-    return nodes
-
-
-def __all_compatible__(
-    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
-    node: _Node[U],
-    group: List[_Node[U]],
-) -> bool:
-    return True  # all(__are_compatible__(pcfg, node, node2) for node2 in group)
-
-
-def __try_split_node_in_group__(
-    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
-    prob_groups: List[List],
-    group_index: int,
-) -> bool:
-    group_a: List[_Node[U]] = prob_groups[group_index][1]
-    # Sort group by ascending probability
-    group_a_bis = sorted(group_a, key=lambda x: x.probability)
-    # Try splitting a node until success
-    i = 1
-    success, new_nodes = __node_split__(pcfg, group_a_bis[-i])
-    while not success and i < len(group_a):
-        i += 1
-        success, new_nodes = __node_split__(pcfg, group_a_bis[-i])
-    if i >= len(group_a):
-        return False
-    # Success, remove old node
-    group_a.pop(-i)
-    # Add new nodes
-    for new_node in new_nodes:
-        group_a.append(new_node)
-    return True
-
-
-def __find_swap_for_group__(
-    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
-    prob_groups: List[List],
-    group_index: int,
-) -> Optional[Tuple[int, Optional[int], int]]:
-    max_prob: float = prob_groups[-1][1]
-    min_prob: float = prob_groups[0][1]
-    group_a, prob = prob_groups[group_index]
-    best_swap: Optional[Tuple[int, Optional[int], int]] = None
-    current_score: float = max_prob / prob
-
-    candidates = (
-        list(range(len(prob_groups) - 1, group_index, -1))
-        if group_index == 0
-        else [len(prob_groups) - 1]
-    )
-
-    for i in candidates:
-        group_b, prob_b = prob_groups[i]
-        for j, node_a in enumerate(group_a):
-            pa: float = node_a.probability
-            reduced_prob: float = prob - pa
-            # Try all swaps
-            for k, node_b in enumerate(group_b):
-                pb: float = node_b.probability
-                if (
-                    pb < pa
-                    or not __all_compatible__(pcfg, node_a, group_b)
-                    or not __all_compatible__(pcfg, node_b, group_a)
-                ):
-                    continue
-                new_mass_b: float = prob_b - pb + pa
-                mini = min_prob if group_index > 0 else reduced_prob + pb
-                maxi = (
-                    max(new_mass_b, prob_groups[-2][1])
-                    if j == len(prob_groups) - 1
-                    else max_prob
-                )
-                new_score = maxi / mini
-                if new_score < current_score:
-                    best_swap = (i, j, k)
-                    current_score = new_score
-        # Consider taking something from b
-        for k, node_b in enumerate(group_b):
-            if not __all_compatible__(pcfg, node_b, group_a):
-                continue
-            pb = node_b.probability
-            if prob + pb > max_prob:
-                new_score = (prob + pb) / min_prob
-            else:
-                new_score = max_prob / (prob + pb)
-            if new_score < current_score:
-                best_swap = (i, None, k)
-                current_score = new_score
-    return best_swap
-
-
-def __percolate_down__(prob_groups: List[List], group_index: int) -> None:
-    index = group_index
-    p = prob_groups[group_index][1]
-    while index > 0 and prob_groups[index - 1][1] > p:
-        prob_groups[index - 1], prob_groups[index] = (
-            prob_groups[index],
-            prob_groups[index - 1],
-        )
-        index -= 1
+            heappush(heap, (-cost(new_node.probability), counter, new_node))
+            counter += 1
+    return leaves + [node for _, _, node in heap]
 
 
-def __percolate_up__(prob_groups: List[List], group_index: int) -> None:
-    index = group_index
-    p = prob_groups[group_index][1]
-    while index < len(prob_groups) - 2 and prob_groups[index + 1][1] < p:
-        prob_groups[index + 1], prob_groups[index] = (
-            prob_groups[index],
-            prob_groups[index + 1],
-        )
-        index += 1
-
-
-def __apply_swap__(
-    prob_groups: List[List], group_index: int, swap: Tuple[int, Optional[int], int]
-) -> None:
-    j, k, l = swap
-    # App
-    if k:
-        node_a = prob_groups[group_index][0].pop(k)
-        prob_groups[group_index][1] -= node_a.probability
-        prob_groups[j][0].append(node_a)
-        prob_groups[j][1] += node_a.probability
+def __assign_to_groups__(
+    nodes: List[_Node[U]], splits: int, cost: Callable[[float], float]
+) -> Tuple[List[List[_Node[U]]], List[float]]:
+    """
+    Longest processing time first: each node, from the most to the least costly, is added to the least costly group.
+    """
+    groups: List[List[_Node[U]]] = [[] for _ in range(splits)]
+    costs = [0.0] * splits
+    # Min heap of (cost, group index)
+    heap = [(0.0, i) for i in range(splits)]
+    for node in sorted(nodes, key=lambda x: cost(x.probability), reverse=True):
+        c, i = heappop(heap)
+        groups[i].append(node)
+        costs[i] = c + cost(node.probability)
+        heappush(heap, (costs[i], i))
+    return groups, costs
 
-    node_b = prob_groups[j][0].pop(l)
-    prob_groups[j][1] -= node_b.probability
-    prob_groups[group_index][0].append(node_b)
-    prob_groups[group_index][1] += node_b.probability
 
-    __percolate_down__(prob_groups, -1)
-    __percolate_up__(prob_groups, group_index)
+def __imbalance__(costs: List[float]) -> float:
+    lowest = min(costs)
+    return max(costs) / lowest if lowest > 0 else float("inf")
 
 
 def __split_into_nodes__(
     pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
     splits: int,
     threshold: float,
+    cost: Callable[[float], float],
+    max_nodes_per_split: int,
 ) -> Tuple[List[List[_Node[U]]], float]:
-    nodes = __split_nodes_until_quantity_reached__(pcfg, splits)
-    # Create groups
-    groups: List[List[_Node[U]]] = []
-    for node in nodes[:splits]:
-        groups.append([node])
-    for node in nodes[splits:]:
-        # Add to first compatible group
-        added = False
-        for group in groups:
-            if __all_compatible__(pcfg, node, group):
-                group.append(node)
-                added = True
-                break
-        assert added
-    masses: List[float] = [np.sum([x.probability for x in group]) for group in groups]
-    prob_groups = sorted([[g, p] for g, p in zip(groups, masses)], key=lambda x: x[1])  # type: ignore
-    ratio: float = prob_groups[-1][1] / prob_groups[0][1]  # type: ignore
-    made_progress = True
-    while ratio > threshold and made_progress:
-        made_progress = False
-        for i in range(splits - 1):
-            swap = __find_swap_for_group__(pcfg, prob_groups, i)
-            if swap:
-                made_progress = True
-                __apply_swap__(prob_groups, i, swap)
-                break
-        if not made_progress:
-            for i in range(splits - 1, 0, -1):
-                made_progress = __try_split_node_in_group__(pcfg, prob_groups, i)
-                if made_progress:
-                    break
-        ratio = prob_groups[-1][1] / prob_groups[0][1]  # type: ignore
-    return [g for g, _ in prob_groups], ratio  # type: ignore
-
-
-def __common_prefix__(
-    a: List[Tuple[Type, U]], b: List[Tuple[Type, U]]
-) -> List[Tuple[Type, U]]:
-    if a == b:
-        return a
-    candidates = []
-    if len(a) > 1:
-        candidates.append(__common_prefix__(a[1:], b))
-        if len(b) >= 1 and a[0] == b[0]:
-            candidates.append([a[0]] + __common_prefix__(a[1:], b[1:]))
-    if len(b) > 1:
-        candidates.append(__common_prefix__(a, b[1:]))
-    # Take longest common prefix
-    lentghs = [len(x) for x in candidates]
-    if len(lentghs) == 0:
-        return []
-    if max(lentghs) == lentghs[0]:
-        return candidates[0]
-    return candidates[1]
+    quantity = splits
+    nodes = __split_nodes_until_quantity_reached__(pcfg, quantity, cost)
+    groups, costs = __assign_to_groups__(nodes, splits, cost)
+    ratio = __imbalance__(costs)
+    # Nodes are split further until the groups are balanced enough or no node can be split
+    while (
+        ratio > threshold
+        and len(nodes) >= quantity
+        and quantity < splits * max_nodes_per_split
+    ):
+        quantity = min(2 * quantity, splits * max_nodes_per_split)
+        nodes = __split_nodes_until_quantity_reached__(pcfg, quantity, cost, nodes)
+        groups, costs = __assign_to_groups__(nodes, splits, cost)
+        ratio = __imbalance__(costs)
+    return groups, ratio
+
+
+def threshold_cost(threshold: float, exponent: float = 1.0) -> Callable[[float], float]:
+    """
+    Cost model estimating the number of programs enumerated from a node of probability p before reaching the probability threshold
+    as (p / threshold) ** exponent, nodes less probable than threshold cost nothing.
+    An exponent greater than 1 models grammars where the number of programs grows faster than their probability decreases.
+    """
+
+    def cost(probability: float) -> float:
+        if probability < threshold:
+            return 0
+        return (probability / threshold) ** exponent
+
+    return cost
 
 
 def __create_path__(
@@ -293,121 +169,70 @@ def __create_path__(
         Dict[DerivableProgram, Dict[List[Tuple[Type, Tuple[U, int]]], float]],
     ],
     original_pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
-    Slist: List[Tuple[Type, U]],
-    Plist: List[Program],
-    Vlist: List[List[Tuple[Type, U]]],
+    node: _Node[U],
     map_state: Callable[[Tuple[Type, U]], Tuple[Type, Tuple[U, int]]],
-    original_start: Tuple[Type, U],
+    new_state: Callable[[Tuple[Type, U]], Tuple[Type, Tuple[U, int]]],
     to_normalise: List[
-        Tuple[List[Tuple[Type, U]], Tuple[Type, U], Program, List[Tuple[Type, U]]]
+        Tuple[
+            Tuple[Type, Tuple[U, int]],
+            DerivableProgram,
+            Tuple[Tuple[Type, Tuple[U, int]], ...],
+            float,
+            Optional[Tuple[Type, Tuple[U, int]]],
+        ]
     ],
 ) -> List[Tuple[Type, U]]:
-    # print("\tCREATING A PATH:", Plist)
-    info = original_pcfg.start_information()
-    for i, (S, P, v) in enumerate(zip(Slist, Plist, Vlist)):
-        if i == 0:
-            S = original_start
-        # print(f"\t\tpath:{S} -> {P} : {v}")
-        to_normalise.append((info, S, P, v))
-        if i > 0:
-            info.pop(0)
-        derivation = original_pcfg.derive_specific(info, S, P, v)  # type: ignore
-        assert derivation
-        next_derivation, current = derivation
-        # Update derivations
-        assert isinstance(P, (Primitive, Variable, Constant))
-        # print(f"\t\tpath current:{current} next:{next_derivation}")
-        Sp = map_state(S)
-        mapped_v = [map_state(x) for x in v]
+    """
+    Create the path from the start non terminal to the node.
+    The non terminals derived along the path get their own copy so that the restricted derivations of different nodes of a group are never mixed,
+    the other non terminals are shared and returned to be filled.
+    """
+    # Follow the leftmost derivation with one id per occurrence of a non terminal
+    occurrences: List[Tuple[Type, U]] = []
+    steps: List[Tuple[Optional[int], List[int]]] = []
+    info: List[int] = []
+    current: Optional[int] = None
+    for v in node.choices:
+        ids = list(range(len(occurrences), len(occurrences) + len(v)))
+        occurrences += v
+        steps.append((current, ids))
+        if ids:
+            current, info = ids[0], ids[1:] + info
+        elif info:
+            current, info = info[0], info[1:]
+        else:
+            current = None
+    remaining = [] if current is None else [current] + info
+    derived = {S for S, _ in steps}
+    mapped = [
+        new_state(S) if i in derived else map_state(S)
+        for i, S in enumerate(occurrences)
+    ]
+    for i, ((occurrence, ids), S, P, v) in enumerate(
+        zip(steps, node.derivation_history, node.program, node.choices)
+    ):
+        Sp = map_state(S) if occurrence is None else mapped[occurrence]
+        mapped_v = [mapped[j] for j in ids]
         if Sp not in rules:
-            rules[Sp] = {P: []}
-            probabilities[Sp] = {P: {}}
+            rules[Sp] = {}
+            probabilities[Sp] = {}
         if P not in rules[Sp]:
             rules[Sp][P] = []
             probabilities[Sp][P] = {}
         rules[Sp][P].append(mapped_v)
-        probabilities[Sp][P][tuple(mapped_v)] = original_pcfg.probabilities[S][P][  # type: ignore
-            tuple(v)  # type: ignore
-        ]
-        info = [current] + next_derivation
-    return info
-
-
-def __create_starts__(
-    min_prefix: List[Tuple[Type, U]],
-    map_state: Callable[[Tuple[Type, U]], Tuple[Type, Tuple[U, int]]],
-    rules: Dict[
-        Tuple[Type, Tuple[U, int]],
-        Dict[DerivableProgram, List[List[Tuple[Type, Tuple[U, int]]]]],
-    ],
-    probabilities: Dict[
-        Tuple[Type, Tuple[U, int]],
-        Dict[DerivableProgram, Dict[List[Tuple[Type, Tuple[U, int]]], float]],
-    ],
-    to_normalise: List[
-        Tuple[List[Tuple[Type, U]], Tuple[Type, U], Program, List[Tuple[Type, U]]]
-    ],
-    group: List[_Node[U]],
-    original_pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
-) -> List[Tuple[Type, U]]:
-    """
-    For each node in the group, create the starting path from the start non terminal to each node
-    """
-    # Extract the start symbol
-    original_start = min_prefix.pop()
-
-    # We also need to mark all contexts that should be filled
-    to_fill: List[Tuple[Type, U]] = []
-    if len(min_prefix) > 0:
-        Slist = group[0].derivation_history[: len(min_prefix) + 1]
-        Plist = group[0].program[: len(min_prefix) + 1]
-        Vlist = group[0].choices[: len(min_prefix) + 1]
-        rem = __create_path__(
-            rules,
-            probabilities,
-            original_pcfg,
-            Slist,
-            Plist,
-            Vlist,
-            map_state,
-            Slist[0],
-            to_normalise,
-        )
-        if rem and not isinstance(rem[0][0], UnknownType):
-            to_fill += rem
-        original_start = Slist[-1]
-
-    # Now we need to make a path from the common prefix to each node's prefix
-
-    for node in group:
-        program, prefix = (
-            node.program,
-            node.derivation_history,
-        )
-        # Create rules to follow the path
-        i = prefix.index(original_start)
-        if len(min_prefix) > 0:
-            i += 1
-        ctx_path = prefix[i:]
-        program_path = program[i:]
-        v_path = node.choices[i:]
-        # print(prefix, "START:", original_start)
-        if len(ctx_path) > 0:
-            ctx_path[0] = original_start
-            rem = __create_path__(
-                rules,
-                probabilities,
-                original_pcfg,
-                ctx_path,
-                program_path,
-                v_path,
-                map_state,
-                original_start,
-                to_normalise,
+        w = original_pcfg.probabilities[S][P][tuple(v)]  # type: ignore
+        probabilities[Sp][P][tuple(mapped_v)] = w  # type: ignore
+        next_occurrence = steps[i + 1][0] if i + 1 < len(steps) else current
+        to_normalise.append(
+            (
+                Sp,
+                P,
+                tuple(mapped_v),
+                w,
+                None if next_occurrence is None else mapped[next_occurrence],
             )
-            if rem and not isinstance(rem[0][0], UnknownType):
-                to_fill += rem
-    return to_fill
+        )
+    return [occurrences[i] for i in remaining]
 
 
 def __fill_grammar__(
@@ -455,62 +280,36 @@ def __fill_grammar__(
 
 
 def __fix_probabilities__(
-    map_state: Callable[[Tuple[Type, U]], Tuple[Type, Tuple[U, int]]],
     probabilities: Dict[
         Tuple[Type, Tuple[U, int]],
         Dict[DerivableProgram, Dict[List[Tuple[Type, Tuple[U, int]]], float]],
     ],
-    original_pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
     computed: Dict[
         Tuple[Type, Tuple[U, int]],
         Dict[DerivableProgram, Dict[Tuple[Tuple[Type, Tuple[U, int]], ...], float]],
     ],
     to_normalise: List[
-        Tuple[List[Tuple[Type, U]], Tuple[Type, U], Program, List[Tuple[Type, U]]]
+        Tuple[
+            Tuple[Type, Tuple[U, int]],
+            DerivableProgram,
+            Tuple[Tuple[Type, Tuple[U, int]], ...],
+            float,
+            Optional[Tuple[Type, Tuple[U, int]]],
+        ]
     ],
 ) -> None:
-    while to_normalise:
-        for el in list(to_normalise):
-            info, S, cP, v = el
-            assert isinstance(cP, (Primitive, Variable, Constant))
-            Sp = map_state(S)
-            if Sp not in probabilities:
-                probabilities[Sp] = {}
-            if cP not in probabilities[Sp]:
-                probabilities[Sp][cP] = {}
-            # print("\t", Sp, "->", P)
-            derivation = original_pcfg.derive_specific(info, S, cP, v)
-            assert derivation
-            _, current = derivation
-            # Compute the updated probabilities
-            new_prob = 0.0
-            old_w = original_pcfg.probabilities[S][cP][tuple(v)]  # type: ignore
-            if isinstance(current[0], UnknownType):
-                new_prob = 1
-            else:
-                missed = False
-                currentP = map_state(current)
-                count = 0
-                for Pp, v_dict in computed[currentP].items():
-                    if Pp not in computed[currentP]:
-                        missed = True
-                        break
-                    for cv, p in v_dict.items():
-                        if cv not in v_dict:
-                            missed = True
-                            break
-                        new_prob += p
-                        count += 1
-                if missed or count == 0:
-                    continue
-                # print("for", S, "=>", P, "@", v)
-                # print("\tprob:", new_prob, "count:", count, "missed:", missed)
-            # Update according to Equation (1)
-            tmapped_v = tuple(map_state(x) for x in v)
-            # print("\t\t", Sp, "->", P)
-            probabilities[Sp][cP][tmapped_v] = old_w * new_prob  # type: ignore
-            computed[Sp][cP][tmapped_v] = old_w * new_prob
-            to_normalise.remove(el)
+    # Each derivation of a path depends on the next one, so paths are fixed from their ends
+    for Sp, P, mapped_v, old_w, current in reversed(to_normalise):
+        # Compute the updated probabilities
+        new_prob = 1.0
+        if current is not None:
+            assert computed[current]
+            new_prob = sum(
+                p for v_dict in computed[current].values() for p in v_dict.values()
+            )
+        # Update according to Equation (1)
+        probabilities[Sp][P][mapped_v] = old_w * new_prob  # type: ignore
+        computed[Sp][P][mapped_v] = old_w * new_prob
 
 
 def __pcfg_from__(
@@ -519,17 +318,6 @@ def __pcfg_from__(
 ) -> ProbUGrammar[
     Tuple[U, int], List[Tuple[Type, Tuple[U, int]]], List[Tuple[Type, Tuple[U, int]]]
 ]:
-    # print()
-    # print("=" * 60)
-    # print("NODE")
-    # for node in group:
-    #     print("\t", node.program)
-    # Find the common prefix to all
-    min_prefix = copy.deepcopy(group[0].derivation_history)
-    for node in group[1:]:
-        min_prefix = __common_prefix__(min_prefix, node.derivation_history)
-    # print("MIN PREFIX:", min_prefix)
-
     # Function to map states automatically
     rule_nos = [0]
     mapping: Dict[Tuple[Type, U], Tuple[Type, Tuple[U, int]]] = {}
@@ -544,6 +332,10 @@ def __pcfg_from__(
         rule_nos[0] += 1
         return mapping[s]
 
+    def new_state(s: Tuple[Type, U]) -> Tuple[Type, Tuple[U, int]]:
+        rule_nos[0] += 1
+        return (s[0], (s[1], rule_nos[0] - 1))
+
     # New start states
     starts = {map_state(s) for s in original_pcfg.grammar.starts}
 
@@ -556,18 +348,29 @@ def __pcfg_from__(
         Dict[DerivableProgram, Dict[List[Tuple[Type, Tuple[U, int]]], float]],
     ] = {}
     start_probs: Dict[Tuple[Type, Tuple[U, int]], float] = {}
-    # List of non-terminals + info we need to normalise weirdly
+    # List of derivations whose probabilities we need to normalise weirdly
     to_normalise: List[
-        Tuple[List[Tuple[Type, U]], Tuple[Type, U], Program, List[Tuple[Type, U]]]
+        Tuple[
+            Tuple[Type, Tuple[U, int]],
+            DerivableProgram,
+            Tuple[Tuple[Type, Tuple[U, int]], ...],
+            float,
+            Optional[Tuple[Type, Tuple[U, int]]],
+        ]
     ] = []
-    # Our min_prefix may be something like (int, 1, (+, 1))
-    # which means we already chose +
-    # But it is not in the PCFG
-    # Thus we need to add it
-    # In the general case we may as well have + -> + -> + as prefix this whole prefix needs to be added
-    to_fill = __create_starts__(
-        min_prefix, map_state, rules, probabilities, to_normalise, group, original_pcfg
-    )
+    # Each node, for instance (+, 1) which means we already chose + then 1, is not in the PCFG
+    # Thus we need to add the path to it
+    to_fill: List[Tuple[Type, U]] = []
+    for node in group:
+        to_fill += __create_path__(
+            rules,
+            probabilities,
+            original_pcfg,
+            node,
+            map_state,
+            new_state,
+            to_normalise,
+        )
     # print("BEFORE FILLING")
     # print("to_fill:", to_fill)
     # print(UCFG(starts, rules, clean=False))
@@ -579,9 +382,7 @@ def __pcfg_from__(
     new_grammar.clean()
     # At this point we have all the needed rules
     # However, the probabilites are incorrect
-    __fix_probabilities__(
-        map_state, probabilities, original_pcfg, computed, to_normalise
-    )
+    __fix_probabilities__(probabilities, computed, to_normalise)
     for start in original_pcfg.start_tags:
         Sp = map_state(start)
         if Sp in new_grammar.starts:
@@ -629,6 +430,8 @@ def split(
     pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
     splits: int,
     desired_ratio: float = 1.1,
+    cost: Optional[Callable[[float], float]] = None,
+    max_nodes_per_split: int = 16,
 ) -> Tuple[
     List[
         ProbUGrammar[
@@ -640,17 +443,22 @@ def split(
     float,
 ]:
     """
-    Currently use exchange split.
+    The most costly partial programs are split until there are enough of them, they are then distributed among groups, the most costly first to the least costly group.
+    Partial programs are split further while the groups are not balanced enough.
     Parameters:
     splits: the number of splits (must be > 1, otherwise the pcfg returned does not match the type signature since the input one is returned)
-    desired_ratio: the max ratio authorized between the most probable group and the least probable pcfg
+    desired_ratio: the max ratio authorized between the most costly group and the least costly group
+    cost: the cost of a partial program given its probability, by default its probability, see threshold_cost
+    max_nodes_per_split: the maximum number of partial programs per split
 
     Return:
     a list of probabilistic grammars
-    the reached threshold
+    the predicted imbalance, that is the ratio between the costs of the most costly group and the least costly group
     """
     if splits == 1:
         return [pcfg], 1  # type: ignore
     assert desired_ratio > 1, "The desired ratio must be > 1!"
-    groups, ratio = __split_into_nodes__(pcfg, splits, desired_ratio)
+    groups, ratio = __split_into_nodes__(
+        pcfg, splits, desired_ratio, cost or (lambda p: p), max_nodes_per_split
+    )
     return [__pcfg_from__(pcfg, group) for group in groups if len(group) > 0], ratio
@@ -5,6 +5,7 @@ from typing import (
     Dict,
     Generator,
     Generic,
+    Iterable,
     List,
     Optional,
     Set,
@@ -32,11 +33,26 @@ W = TypeVar("W")
 class HeapElement:
     priority: Ordered
     program: Program = field(compare=False)
+    tiebreak: Tuple[int, int] = field(default=(0, 0))
 
     def __repr__(self) -> str:
         return f"({self.priority}, {self.program})"
 
 
+# Key in succ of the successor of no program, that is of the first program
+__FIRST__ = 123891
+
+# Key of the bound of a rule with arguments, it is lower than the key of all its programs
+__RULE_TIEBREAK__ = (1, -(2**64))
+
+
+def __tiebreak__(program: Program) -> Tuple[int, int]:
+    """
+    Orders programs of equal priority the same way in all non-terminals, terminals first.
+    """
+    return (int(isinstance(program, Function)), hash(program))
+
+
 class HSEnumerator(
     ProgramEnumerator[None],
     ABC,
@@ -57,26 +73,34 @@ class HSEnumerator(
         self.G = G
         self.start = G.start
         self.rules = G.rules
-        symbols = [S for S in self.rules]
+        # Non-terminals of lazy grammars are only known once queried, hence the defaultdicts
 
         # self.heaps[S] is a heap containing programs generated from the non-terminal S
-        self.heaps: Dict[Tuple[Type, U], List[HeapElement]] = {S: [] for S in symbols}
+        self.heaps: Dict[Tuple[Type, U], List[HeapElement]] = defaultdict(list)
 
         # the same program can be pushed in different heaps, with different probabilities
         # however, the same program cannot be pushed twice in the same heap
 
         # self.succ[S][P] is the successor of P from S
-        self.succ: Dict[Tuple[Type, U], Dict[int, Program]] = {S: {} for S in symbols}
+        self.succ: Dict[Tuple[Type, U], Dict[int, Program]] = defaultdict(dict)
         # self.pred[S][P] is the hash of the predecessor of P from S
-        self.pred: Dict[Tuple[Type, U], Dict[int, int]] = {S: {} for S in symbols}
+        self.pred: Dict[Tuple[Type, U], Dict[int, int]] = defaultdict(dict)
 
         # self.hash_table_program[S] is the set of hashes of programs
         # ever added to the heap for S
-        self.hash_table_program: Dict[Tuple[Type, U], Set[int]] = {
-            S: set() for S in symbols
-        }
+        self.hash_table_program: Dict[Tuple[Type, U], Set[int]] = defaultdict(set)
 
+        # Non-terminals whose most probable program is being computed
         self._init: Set[Tuple[Type, U]] = set()
+        # Non-terminals whose most probable program is known or that have none
+        self._done: Set[Tuple[Type, U]] = set()
+        # Non-terminals visited by the current computation of most probable programs
+        self._touched: List[Tuple[Type, U]] = []
+        self._cycle = False
+        # self._pending[S] are the rules of S whose heap element is still a bound, see __init_heap__
+        self._pending: Dict[Tuple[Type, U], Set[Program]] = {}
+        # self._last[S] is the last program of the chain of successors of S
+        self._last: Dict[Tuple[Type, U], Program] = {}
 
         self.max_priority: Dict[
             Union[Tuple[Type, U], Tuple[Tuple[Type, U], Program]], Program
@@ -85,6 +109,9 @@ class HSEnumerator(
     def probability(self, program: Program) -> float:
         return self.G.probability(program)
 
+    def probability_batch(self, programs: Iterable[Program]) -> List[float]:
+        return self.G.probability_batch(programs).tolist()
+
     @classmethod
     def name(cls) -> str:
         return "heap-search"
@@ -93,15 +120,6 @@ class HSEnumerator(
         """
         A generator which outputs the next most probable program
         """
-        self.__init_non_terminal__(self.G.start)
-        self._reevaluate_()
-        # Now we can init the heaps
-        for S in self.G.rules:
-            self.__init_heap__(S)
-        # And now that ALL heaps have been init
-        # Query(S, None) for all
-        for S in self.G.rules:
-            self.query(S, None)
         while True:
             program = self.query(self.start, self.current)
             if program is None:
@@ -118,77 +136,136 @@ class HSEnumerator(
         best_program: Optional[Program] = None,
         best_priority: Optional[Ordered] = None,
     ) -> Tuple[Optional[Program], Optional[Ordered]]:
-        for P in self.rules[S]:
-            nargs = self.G.arguments_length_for(S, P)
-            P_unique: Program = P
-            if nargs > 0:
-                arguments = []
-                information, current = self.G.derive(self.G.start_information(), S, P)
-                for _ in range(nargs):
-                    self.__init_non_terminal__(current)
-                    if current not in self.max_priority:
-                        break
-                    # Try to init sub Tuple[Type, U] in case they were not initialised
-                    arguments.append(self.max_priority[current])
+        # Rules are tried from the best bound, once a rule can not beat the best program
+        # the following ones are skipped and their non-terminals are not initialised
+        # Ties are broken as in the heaps so that all non-terminals agree on the order of programs
+        best_key = None
+        if best_program is not None:
+            best_key = (best_priority, __tiebreak__(best_program))
+        keys = {
+            P: (
+                self.bound_priority(S, P),
+                (
+                    __tiebreak__(P)
+                    if self.G.arguments_length_for(S, P) == 0
+                    else __RULE_TIEBREAK__
+                ),
+            )
+            for P in self.rules[S]
+        }
+        for P in sorted(keys, key=keys.__getitem__):
+            if best_key is not None and not keys[P] < best_key:
+                break
+            program = self.__rule_max__(S, P)
+            if program is None:
+                continue
+            priority = self.compute_priority(S, program)
+            program_key = (priority, __tiebreak__(program))
+            if best_key is None or program_key < best_key:
+                best_program = program
+                best_priority = priority
+                best_key = program_key
+        return best_program, best_priority
+
+    def __rule_max__(self, S: Tuple[Type, U], P: Program) -> Optional[Program]:
+        """
+        Returns the most probable program derived from S with rule P or None if there is none yet.
+        """
+        nargs = self.G.arguments_length_for(S, P)
+        program: Program = P
+        if nargs > 0:
+            arguments: List[Program] = []
+            # The non-terminal of an argument may depend on the previous arguments
+            information, current = self.G.derive(self.G.start_information(), S, P)
+            for i in range(nargs):
+                if i > 0:
                     information, lst = self.G.derive_all(
                         information, current, arguments[-1]
                     )
                     current = lst[-1]
-                if len(arguments) != nargs:
-                    continue
-                new_program = Function(
-                    function=P_unique,
-                    arguments=arguments,
-                )
-                P_unique = new_program
-            priority = self.compute_priority(S, P_unique)
-            self.max_priority[(S, P)] = P_unique
-            if best_priority is None or priority < best_priority:
-                best_program = P_unique
-                best_priority = priority
-        return best_program, best_priority
+                self.__init_non_terminal__(current)
+                if current not in self.max_priority:
+                    return None
+                arguments.append(self.max_priority[current])
+            program = Function(function=P, arguments=arguments)
+        self.max_priority[(S, P)] = program
+        return program
 
     def __init_non_terminal__(self, S: Tuple[Type, U]) -> None:
+        """
+        Computes the most probable program of S, initialising the non-terminals it needs.
+        """
         if S in self._init:
+            # S is part of a cycle, it is computed again by _reevaluate_
+            self._cycle = True
             return
-        if all((S, P) in self.max_priority for P in self.rules[S]):
+        if S in self._done or S not in self.rules:
             return
+        top = len(self._init) == 0
         self._init.add(S)
-        # 1) Compute max probablities
+        self._touched.append(S)
         best_program, _ = self.__compute_max_prio__(S)
-
         self._init.remove(S)
+        self._done.add(S)
         if best_program is not None:
             self.max_priority[S] = best_program
+        if top:
+            if self._cycle:
+                self._reevaluate_()
+            self._touched = []
+            self._cycle = False
 
     def _reevaluate_(self) -> None:
+        """
+        Computes again the most probable programs of the non-terminals visited until none changes,
+        programs found through a cycle were missing the first time.
+        """
         changed = True
         while changed:
             changed = False
-            for S in list(self.G.rules.keys()):
+            i = 0
+            # Computing a non-terminal may visit new ones
+            while i < len(self._touched):
+                S = self._touched[i]
+                i += 1
                 old = self.max_priority.get(S, None)
-                self.__init_non_terminal__(S)
-
-                if S not in self.max_priority or old != self.max_priority[S]:
+                self._init.add(S)
+                best_program, _ = self.__compute_max_prio__(
+                    S, old, None if old is None else self.compute_priority(S, old)
+                )
+                self._init.remove(S)
+                # Non productive non-terminals, only found in lazy grammars, never get a max
+                if best_program is not None and best_program != old:
+                    self.max_priority[S] = best_program
                     changed = True
 
     def __init_heap__(self, S: Tuple[Type, U]) -> None:
-        # 2) add P(max(S1),max(S2), ...) to self.heaps[S]
+        """
+        Pushes in self.heaps[S] the terminal rules of S and, for the other rules, their bound.
+        When a bound is popped it is replaced by the most probable program of its rule,
+        so that non-terminals are only initialised when programs may be derived from them.
+        """
+        self._pending[S] = set()
         for P in self.rules[S]:
-            program = self.max_priority[(S, P)]
-            hash_program = hash(program)
-            # Remark: the program cannot already be in self.heaps[S]
-            assert hash_program not in self.hash_table_program[S]
-            # Init heap all others so that query will work
-            self.hash_table_program[S].add(hash_program)
-            # we assume that the programs from max_probability
-            # are represented by the same object
-            priority = self.compute_priority(S, program)
-            if not self.threshold or priority < self.threshold:
-                heappush(
-                    self.heaps[S],
-                    HeapElement(priority, program),
-                )
+            if self.G.arguments_length_for(S, P) == 0:
+                self.__push__(S, P)
+                continue
+            bound = self.bound_priority(S, P)
+            if not self.threshold or bound < self.threshold:
+                self._pending[S].add(P)
+                heappush(self.heaps[S], HeapElement(bound, P, __RULE_TIEBREAK__))
+
+    def __push__(self, S: Tuple[Type, U], program: Program) -> None:
+        hash_program = hash(program)
+        # The program was already pushed or was the first program of S
+        if hash_program in self.hash_table_program[S]:
+            return
+        self.hash_table_program[S].add(hash_program)
+        priority = self.compute_priority(S, program)
+        if not self.threshold or priority < self.threshold:
+            heappush(
+                self.heaps[S], HeapElement(priority, program, __tiebreak__(program))
+            )
 
     def merge_program(self, representative: Program, other: Program) -> None:
         """
@@ -207,10 +284,8 @@ class HSEnumerator(
     def __add_successors__(self, succ: Program, S: Tuple[Type, U]) -> None:
         if isinstance(succ, Function):
             F = succ.function
-            information, lst = self.G.derive_all(self.G.start_information(), S, F)
-            S2 = lst[-1]
-            args_len = self.G.arguments_length_for(S, F)  # type: ignore
-            for i in range(args_len):
+            args_S = self.G.arguments_non_terminals(S, F, succ.arguments)  # type: ignore
+            for i, S2 in enumerate(args_S):
                 # S2 is non-terminal symbol used to derive the i-th argument
                 succ_sub_program = self.query(S2, succ.arguments[i])
                 if succ_sub_program:
@@ -227,15 +302,15 @@ class HSEnumerator(
                             priority: Ordered = self.compute_priority(S, new_program)
                             if not self.threshold or priority < self.threshold:
                                 heappush(
-                                    self.heaps[S], HeapElement(priority, new_program)
+                                    self.heaps[S],
+                                    HeapElement(
+                                        priority,
+                                        new_program,
+                                        __tiebreak__(new_program),
+                                    ),
                                 )
                         except KeyError:
                             pass
-                if i + 1 < args_len:
-                    information, lst = self.G.derive_all(
-                        information, S2, succ.arguments[i]
-                    )
-                    S2 = lst[-1]
 
     def query(self, S: Tuple[Type, U], program: Optional[Program]) -> Optional[Program]:
         """
@@ -244,25 +319,81 @@ class HSEnumerator(
         if program:
             hash_program = hash(program)
         else:
-            hash_program = 123891
+            hash_program = __FIRST__
 
         # if we have already computed the successor of program from S, we return its stored value
         if hash_program in self.succ[S]:
             return self.succ[S][hash_program]
 
+        if S not in self._pending:
+            self.__init_heap__(S)
+        if program:
+            if __FIRST__ not in self.succ[S]:
+                # Successors are chained from the first program
+                self.query(S, None)
+            # The program may come from another non-terminal where it was reached earlier
+            self.__reach__(S, program)
+            if hash_program in self.succ[S]:
+                return self.succ[S][hash_program]
+            if S in self._last and hash(self._last[S]) != hash_program:
+                # The program is not in the chain of S, its successor is the next program of S
+                succ = self.query(S, self._last[S])
+                if succ is not None:
+                    self.succ[S][hash_program] = succ
+                return succ
+        else:
+            # The first program is the most probable one, as the most probable program of each rule
+            # is made of the first programs of its non-terminals, their successors are then all reached
+            self.__init_non_terminal__(S)
+            first = self.max_priority.get(S, None)
+            if first is not None:
+                self.hash_table_program[S].add(hash(first))
+                priority = self.compute_priority(S, first)
+                if not self.threshold or priority < self.threshold:
+                    if first not in self.deleted:
+                        return self.__chain__(S, hash_program, first)
+                    self.__add_successors__(first, S)
+
         # otherwise the successor is the next element in the heap
-        try:
-            element = heappop(self.heaps[S])
-            succ = element.program
-            while succ in self.deleted:
+        while True:
+            if not self.heaps[S]:
+                return None  # the heap is empty: there are no successors from S
+            succ = heappop(self.heaps[S]).program
+            if not isinstance(succ, Function) and succ in self._pending[S]:
+                # A bound: its rule is now the most promising one
+                self._pending[S].remove(succ)
+                rule_max = self.__rule_max__(S, succ)
+                if rule_max is not None:
+                    self.__push__(S, rule_max)
+            elif hash(succ) in self.pred[S]:
+                # The first program of S, it is already chained
+                continue
+            elif succ in self.deleted:
                 self.__add_successors__(succ, S)
-                element = heappop(self.heaps[S])
-                succ = element.program
-        except:
-            return None  # the heap is empty: there are no successors from S
+            else:
+                break
+
+        return self.__chain__(S, hash_program, succ)
+
+    def __reach__(self, S: Tuple[Type, U], program: Program) -> None:
+        """
+        Extends the chain of S until program, if it comes before the next program of the heap.
+        """
+        key = (self.compute_priority(S, program), __tiebreak__(program))
+        hash_program = hash(program)
+        while (
+            S in self._last
+            and hash(self._last[S]) != hash_program
+            and self.heaps[S]
+            and not key < (self.heaps[S][0].priority, self.heaps[S][0].tiebreak)
+        ):
+            if self.query(S, self._last[S]) is None:
+                return
 
+    def __chain__(self, S: Tuple[Type, U], hash_program: int, succ: Program) -> Program:
         self.succ[S][hash_program] = succ  # we store the successor
         self.pred[S][hash(succ)] = hash_program  # we store the predecessor
+        self._last[S] = succ
 
         # now we need to add all potential successors of succ in heaps[S]
         self.__add_successors__(succ, S)
@@ -272,6 +403,13 @@ class HSEnumerator(
     def compute_priority(self, S: Tuple[Type, U], new_program: Program) -> Ordered:
         pass
 
+    @abstractmethod
+    def bound_priority(self, S: Tuple[Type, U], P: Program) -> Ordered:
+        """
+        Returns a priority that is at most the priority of any program derived from S with rule P.
+        """
+        pass
+
     def programs_in_banks(self) -> int:
         return sum(len(val) for val in self.succ.values())
 
@@ -300,20 +438,20 @@ class HeapSearch(HSEnumerator[U, V, W]):
             # We guarantee that F is a Primitive
             new_arguments = new_program.arguments
             probability = self.G.probabilities[S][F]  # type: ignore
-            information, lst = self.G.derive_all(self.G.start_information(), S, F)
-            S2 = lst[-1]
-            args_len = self.G.arguments_length_for(S, F)  # type: ignore
-            for i in range(args_len):
-                arg = new_arguments[i]
+            args_S = self.G.arguments_non_terminals(S, F, new_arguments)  # type: ignore
+            for arg, S2 in zip(new_arguments, args_S):
+                # The argument may come from a non-terminal that was not initialised yet
+                if S2 not in self.probabilities[arg]:
+                    self.compute_priority(S2, arg)
                 probability *= self.probabilities[arg][S2]
-                if i + 1 < args_len:
-                    information, lst = self.G.derive_all(information, S2, arg)
-                    S2 = lst[-1]
         else:
             probability = self.G.probabilities[S][new_program]  # type: ignore
         self.probabilities[new_program][S] = probability
         return -probability
 
+    def bound_priority(self, S: Tuple[Type, U], P: Program) -> float:
+        return -self.G.probabilities[S][P]  # type: ignore
+
 
 def enumerate_prob_grammar(
     G: ProbDetGrammar[U, V, W], threshold: float = 0
@@ -408,20 +546,24 @@ class BucketSearch(HSEnumerator[U, V, W]):
             F = new_program.function
             new_arguments = new_program.arguments
             new_bucket.add_prob_uniform(self.G.probabilities[S][F])  # type: ignore
-
-            information, lst = self.G.derive_all(self.G.start_information(), S, F)
-            S2 = lst[-1]
-            for i in range(self.G.arguments_length_for(S, F)):  # type: ignore
-                arg = new_arguments[i]
+            args_S = self.G.arguments_non_terminals(S, F, new_arguments)  # type: ignore
+            for arg, S2 in zip(new_arguments, args_S):
+                # The argument may come from a non-terminal that was not initialised yet
+                if S2 not in self.bucket_tuples[arg]:
+                    self.compute_priority(S2, arg)
                 new_bucket += self.bucket_tuples[arg][S2]
-                information, lst = self.G.derive_all(information, S2, arg)
-                S2 = lst[-1]
         else:
             probability = self.G.probabilities[S][new_program]  # type: ignore
             new_bucket.add_prob_uniform(probability)
         self.bucket_tuples[new_program][S] = new_bucket
         return new_bucket
 
+    def bound_priority(self, S: Tuple[Type, U], P: Program) -> Bucket:
+        # Buckets of the arguments can only be added
+        return Bucket(self.bucket_size).add_prob_uniform(
+            self.G.probabilities[S][P]  # type: ignore
+        )
+
 
 def enumerate_bucket_prob_grammar(
     G: ProbDetGrammar[U, V, W], bucket_size: int
@@ -0,0 +1,319 @@
+import multiprocessing as mp
+import queue
+import time
+from heapq import heapify, heappop, heappush
+from math import isclose
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from synth.syntax.grammars.enumeration.grammar_splitter import (
+    _Node,
+    __node_split__,
+    __pcfg_from__,
+    __split_nodes_until_quantity_reached__,
+)
+from synth.syntax.grammars.enumeration.program_enumerator import ProgramEnumerator
+from synth.syntax.grammars.enumeration.u_heap_search import enumerate_prob_u_grammar
+from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
+from synth.syntax.program import Program
+from synth.syntax.type_system import Type
+
+U = TypeVar("U")
+
+# Number of programs enumerated between two checks of the stop conditions
+__CHECK_EVERY__ = 64
+
+
+# Work handed to a worker: a partial program and its floor, see __worker__
+_Work = Tuple[_Node[U], Optional[Tuple[float, FrozenSet[Program]]]]
+
+
+class _WorkPool:
+    """
+    Coordinator side pool of the partial programs that no worker has enumerated yet.
+    The heaviest partial program is split when it is too costly to be handed over to a single worker.
+    Partial programs stolen from a worker come with a floor and are never split.
+    """
+
+    def __init__(
+        self,
+        pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
+        workers: int,
+        cost: Callable[[float], float],
+        granularity: int,
+    ) -> None:
+        self.pcfg = pcfg
+        self.cost = cost
+        self.granularity = granularity
+        nodes = __split_nodes_until_quantity_reached__(
+            pcfg, workers * granularity, cost
+        )
+        # Max heap of (-cost, tie breaker, node, floor)
+        self.heap = [
+            (-cost(node.probability), i, node, None) for i, node in enumerate(nodes)
+        ]
+        heapify(self.heap)
+        self.counter = len(self.heap)
+        self.remaining = sum(cost(node.probability) for node in nodes)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(
+        self,
+        node: _Node[U],
+        floor: Optional[Tuple[float, FrozenSet[Program]]] = None,
+    ) -> None:
+        c = self.cost(node.probability)
+        heappush(self.heap, (-c, self.counter, node, floor))
+        self.counter += 1
+        self.remaining += c
+
+    def pop(self, busy: int) -> Optional[_Work[U]]:
+        """
+        Return the heaviest partial program once split to at most a fair share of the remaining work, with its floor.
+        busy is the number of workers that will share the remaining work.
+        """
+        while self.heap:
+            c, _, node, floor = heappop(self.heap)
+            share = self.remaining / max(1, busy * self.granularity)
+            self.remaining += c
+            if floor is None and -c > share:
+                success, children = __node_split__(self.pcfg, node)
+                if success and children:
+                    for child in children:
+                        self.push(child)
+                    continue
+            return node, floor
+        return None
+
+
+def __give_away__(
+    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
+    nodes: List[_Node[U]],
+    cost: Callable[[float], float],
+) -> Tuple[List[_Node[U]], List[_Node[U]]]:
+    """
+    Split the frontier of a worker until it has at least two partial programs.
+    Return (kept, given) where given holds about half of the cost of the frontier, given is empty if the frontier cannot be split.
+    """
+    nodes = sorted(nodes, key=lambda node: cost(node.probability), reverse=True)
+    while len(nodes) == 1:
+        success, children = __node_split__(pcfg, nodes[0])
+        if not success or not children:
+            return nodes, []
+        nodes = sorted(children, key=lambda node: cost(node.probability), reverse=True)
+    return nodes[::2], nodes[1::2]
+
+
+def __worker__(
+    wid: int,
+    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
+    evaluate: Callable[[Program, float], Any],
+    enumerator: Callable[[ProbUGrammar], ProgramEnumerator],
+    threshold: float,
+    deadline: Optional[float],
+    cost: Callable[[float], float],
+    tasks: "mp.Queue[Optional[_Work[U]]]",
+    results: "mp.Queue[Tuple[str, int, Any]]",
+    stop: Any,
+    steal: Any,
+) -> None:
+    """
+    Enumerate the partial programs received from tasks until None is received.
+
+    The frontier of a worker is the list of partial programs it still owns, when steal is set it gives about half of them away.
+    It keeps its enumerator and skips the programs derived from the partial programs given away.
+    Since enumerators are best-first, every program given away more probable than the last program enumerated has already been evaluated,
+    so partial programs are given away with the floor (probability of the last program, programs enumerated with that probability):
+    programs above the floor are skipped by the receiving worker.
+    Probabilities are compared up to rounding errors since sub grammars multiply them in another order.
+    """
+    while True:
+        work = tasks.get()
+        if work is None:
+            return
+        node, floor = work
+        frontier = [node]
+        given: List[ProbUGrammar] = []
+        # Probability of the last program enumerated and the programs enumerated with it
+        last = 2.0
+        ties: Set[Program] = set()
+        programs = 0
+        for program in enumerator(__pcfg_from__(pcfg, [node])):
+            programs += 1
+            if programs % __CHECK_EVERY__ == 0:
+                if stop.is_set() or (deadline is not None and time.time() > deadline):
+                    break
+                if steal.is_set():
+                    steal.clear()
+                    frontier, away = __give_away__(pcfg, frontier, cost)
+                    if away:
+                        given.append(__pcfg_from__(pcfg, away))
+                    handled = (last, frozenset(ties))
+                    # Programs above our own floor may not have been reached yet
+                    if floor is not None and isclose(last, floor[0]):
+                        handled = (floor[0], floor[1] | handled[1])
+                    elif floor is not None and last > floor[0]:
+                        handled = floor
+                    results.put(("work", wid, [(n, handled) for n in away]))
+            probability = pcfg.probability(program)
+            if probability < threshold:
+                break
+            if not isclose(probability, last):
+                last, ties = probability, set()
+            ties.add(program)
+            if floor is not None and (
+                program in floor[1]
+                if isclose(probability, floor[0])
+                else probability > floor[0]
+            ):
+                continue
+            if any(program in g for g in given):
+                continue
+            out = evaluate(program, probability)
+            if out is not None:
+                results.put(("result", wid, (program, probability, out)))
+        results.put(("done", wid, programs))
+
+
+def enumerate_in_parallel(
+    pcfg: ProbUGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]],
+    evaluate: Callable[[Program, float], Any],
+    workers: int = mp.cpu_count(),
+    threshold: float = 0,
+    timeout: Optional[float] = None,
+    enumerator: Callable[[ProbUGrammar], ProgramEnumerator] = enumerate_prob_u_grammar,
+    cost: Optional[Callable[[float], float]] = None,
+    granularity: int = 4,
+) -> Generator[Tuple[Program, float, Any], None, None]:
+    """
+    Enumerate the programs of pcfg with several local processes and work stealing.
+
+    The coordinator keeps a pool of partial programs from the derivation tree of the grammar splitter.
+    Each worker enumerates the sub grammar of one partial program and asks for more work when it is drained,
+    it is then given the heaviest remaining partial program, split beforehand when it exceeds a fair share of the remaining work.
+    When the pool is empty, the coordinator asks the busy worker that started first to give up about half of its frontier to the idle workers.
+
+    Parameters:
+    evaluate: called by workers on each program and its probability, it must be picklable; non None outputs are yielded
+    workers: the number of processes
+    threshold: programs less probable than threshold are not enumerated
+    timeout: the maximum time in seconds
+    enumerator: builds the enumerator of a sub grammar, it must be picklable and enumerate programs by non increasing probability
+    cost: the cost of a partial program given its probability, by default its probability, see threshold_cost
+    granularity: the number of partial programs per worker
+
+    Yields:
+    (program, probability, output) as soon as a worker finds one.
+    The remaining work is cancelled when the generator is closed.
+    """
+    assert workers >= 1, "There must be at least one worker!"
+    cost = cost or (lambda p: p)
+    deadline = None if timeout is None else time.time() + timeout
+    pool = _WorkPool(pcfg, workers, cost, granularity)
+    ctx = mp.get_context()
+    results: "mp.Queue[Tuple[str, int, Any]]" = ctx.Queue()
+    tasks: List["mp.Queue[Optional[_Work[U]]]"] = [ctx.Queue() for _ in range(workers)]
+    stop = ctx.Event()
+    steal = [ctx.Event() for _ in range(workers)]
+    processes = [
+        ctx.Process(
+            target=__worker__,
+            args=(
+                wid,
+                pcfg,
+                evaluate,
+                enumerator,
+                threshold,
+                deadline,
+                cost,
+                tasks[wid],
+                results,
+                stop,
+                steal[wid],
+            ),
+            daemon=True,
+        )
+        for wid in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        idle = list(range(workers))
+        # Time at which each busy worker started its work
+        started: Dict[int, float] = {}
+        # Busy workers asked to give up part of their frontier
+        asked: Set[int] = set()
+        # Busy workers whose frontier cannot be split
+        unsplittable: Set[int] = set()
+
+        def dispatch() -> None:
+            while idle:
+                work = pool.pop(workers - len(idle) + 1)
+                if work is None:
+                    break
+                wid = idle.pop()
+                started[wid] = time.time()
+                tasks[wid].put(work)
+            victims = sorted(
+                (
+                    wid
+                    for wid in started
+                    if wid not in asked and wid not in unsplittable
+                ),
+                key=started.__getitem__,
+            )
+            for wid in victims[: max(0, len(idle) - len(asked))]:
+                asked.add(wid)
+                steal[wid].set()
+
+        dispatch()
+        while started:
+            wait = None if deadline is None else max(0, deadline - time.time())
+            try:
+                kind, wid, data = results.get(timeout=wait)
+            except queue.Empty:
+                break
+            if kind == "result":
+                yield data
+                continue
+            asked.discard(wid)
+            if kind == "work":
+                if not data:
+                    unsplittable.add(wid)
+                for node, floor in data:
+                    pool.push(node, floor)
+            else:
+                steal[wid].clear()
+                unsplittable.discard(wid)
+                del started[wid]
+                idle.append(wid)
+            if deadline is not None and time.time() > deadline:
+                continue
+            dispatch()
+    finally:
+        stop.set()
+        for task in tasks:
+            task.put(None)
+        # Workers can only exit once their results have been read
+        end = time.time() + 1
+        while any(process.is_alive() for process in processes) and time.time() < end:
+            try:
+                results.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
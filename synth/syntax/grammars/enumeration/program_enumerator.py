@@ -1,6 +1,8 @@
 from typing import (
     Generator,
     Generic,
+    Iterable,
+    List,
     Optional,
     TypeVar,
     Union,
@@ -54,6 +56,12 @@ class ProgramEnumerator(ABC, Generic[U]):
         """
         pass
 
+    def probability_batch(self, programs: Iterable[Program]) -> List[float]:
+        """
+        Return the probability of generating each of the given programs, see probability.
+        """
+        return [self.probability(program) for program in programs]
+
     def merge_program(self, representative: Program, other: Program) -> None:
         """
         Merge other into representative.
@@ -65,6 +73,11 @@ class ProgramEnumerator(ABC, Generic[U]):
     def _should_keep_subprogram(self, program: Program) -> bool:
         return self.filter is None or self.filter.accept(program)
 
+    def _should_keep_subprograms(self, programs: List[Program]) -> List[bool]:
+        if self.filter is None:
+            return [True] * len(programs)
+        return self.filter.accept_batch(programs)
+
     @abstractmethod
     def clone(
         self, grammar: Union[ProbDetGrammar, ProbUGrammar]
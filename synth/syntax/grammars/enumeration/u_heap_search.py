@@ -54,12 +54,12 @@ class UHSEnumerator(ProgramEnumerator[None], ABC, Generic[U, V, W]):
     ) -> None:
         super().__init__(filter)
         self.G = G
-        symbols = [S for S in self.G.rules]
         self.threshold = threshold
         self.deleted: Set[Program] = set()
+        # Non-terminals of lazy grammars are only known once queried, hence the defaultdicts
 
         # self.heaps[S] is a heap containing programs generated from the non-terminal S
-        self.heaps: Dict[Tuple[Type, U], List[HeapElement]] = {S: [] for S in symbols}
+        self.heaps: Dict[Tuple[Type, U], List[HeapElement]] = defaultdict(list)
 
         self._start_heap: List[StartHeapElement[U]] = []
 
@@ -67,15 +67,13 @@ class UHSEnumerator(ProgramEnumerator[None], ABC, Generic[U, V, W]):
         # however, the same program cannot be pushed twice in the same heap
 
         # self.succ[S][P] is the successor of P from S
-        self.succ: Dict[Tuple[Type, U], Dict[int, Program]] = {S: {} for S in symbols}
+        self.succ: Dict[Tuple[Type, U], Dict[int, Program]] = defaultdict(dict)
         # self.pred[S][P] is the hash of the predecessor of P from S
-        self.pred: Dict[Tuple[Type, U], Dict[int, int]] = {S: {} for S in symbols}
+        self.pred: Dict[Tuple[Type, U], Dict[int, int]] = defaultdict(dict)
 
         # self.hash_table_program[S] is the set of hashes of programs
         # ever added to the heap for S
-        self.hash_table_program: Dict[Tuple[Type, U], Set[int]] = {
-            S: set() for S in symbols
-        }
+        self.hash_table_program: Dict[Tuple[Type, U], Set[int]] = defaultdict(set)
 
         self._keys: Dict[Tuple[Type, U], Dict[Program, V]] = defaultdict(dict)
 
@@ -302,7 +300,7 @@ class UHSEnumerator(ProgramEnumerator[None], ABC, Generic[U, V, W]):
         """
         our_hash = hash(other)
         self.deleted.add(other)
-        for S in self.G.rules:
+        for S in list(self.G.rules):
             if our_hash in self.pred[S] and our_hash in self.succ[S]:
                 pred_hash = self.pred[S][our_hash]
                 nxt = self.succ[S][our_hash]
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Callable, Container, Dict, List, Optional, Set, Tuple, Union
 
 from synth.syntax.program import Constant, Primitive, Program, Variable
 from synth.syntax.type_system import Type
@@ -35,7 +35,27 @@ class NGram:
         return self.predecessors[0]
 
 
+# Attributes caching data derived from the rules, they are built on first use
+__CACHES__ = frozenset(
+    [
+        "_arguments_table",
+        "_compiled_tables",
+        "_constant_types",
+        "_derivation_ids",
+        "_derivation_segments",
+        "_indexed_rules",
+        "_indexed_size",
+        "_rule_ids",
+        "_rule_segments",
+    ]
+)
+
+
 class Grammar(ABC):
+    def __getstate__(self) -> Dict[str, Any]:
+        # Caches are not saved along the grammar, they are rebuilt after loading
+        return {k: v for k, v in self.__dict__.items() if k not in __CACHES__}
+
     @abstractmethod
     def __contains__(self, program: Program) -> bool:
         pass
@@ -67,3 +87,57 @@ class Grammar(ABC):
         Replace all occurences of non instantiated constants with all possible values of instantiated ones.
         """
         pass
+
+
+def sample_with_rejection(
+    sample_batch: Callable[[int], List[Program]],
+    n: int,
+    nvars: int = 0,
+    unique: bool = False,
+    use_all_variables: bool = False,
+    max_tries: int = 100,
+    exclude: Optional[Container[Program]] = None,
+) -> List[Program]:
+    """
+    Draws programs with sample_batch(k) until n programs are accepted or n * max_tries programs have been drawn.
+    If unique, duplicates and programs in exclude are rejected.
+    If use_all_variables, programs that do not use all of the nvars variables are rejected.
+    """
+    out: List[Program] = []
+    seen: Set[Program] = set()
+    budget = n * max_tries
+    while len(out) < n and budget > 0:
+        batch = sample_batch(min(budget, 2 * (n - len(out))))
+        budget -= len(batch)
+        for program in batch:
+            if unique and (
+                program in seen or (exclude is not None and program in exclude)
+            ):
+                continue
+            if use_all_variables and len(program.used_variables()) < nvars:
+                continue
+            seen.add(program)
+            out.append(program)
+            if len(out) >= n:
+                break
+    return out
+
+
+def __constant_non_terminals__(
+    grammar: Any, constants: Dict[Type, List[Any]]
+) -> Set[Tuple[Type, Any]]:
+    """
+    Returns the non-terminals of grammar deriving a constant of one of the given types.
+    """
+    constant_types = grammar.__dict__.get("_constant_types")
+    if constant_types is None:
+        constant_types = {}
+        for S in grammar.rules:
+            for P in grammar.rules[S]:
+                if isinstance(P, Constant):
+                    constant_types.setdefault(P.type, set()).add(S)
+        grammar.__dict__["_constant_types"] = constant_types
+    out: Set[Tuple[Type, Any]] = set()
+    for t in constants:
+        out |= constant_types.get(t, set())
+    return out
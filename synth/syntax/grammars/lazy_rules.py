@@ -0,0 +1,51 @@
+from typing import Callable, Dict, Optional, Set, TypeVar, Union
+
+K = TypeVar("K")
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+class LazyRules(Dict[K, V]):
+    """
+    Derivation rules whose non-terminals are only created when they are first queried.
+
+    expand(S) returns the rules of S or None if S is not a non-terminal,
+    it is called at most once per non-terminal and its result is cached.
+    Iterating over the rules or taking their length only sees the non-terminals expanded so far.
+    """
+
+    def __init__(self, expand: Callable[[K], Optional[V]]) -> None:
+        super().__init__()
+        self.expand = expand
+        self._absent: Set[K] = set()
+
+    def __expand__(self, key: K) -> Optional[V]:
+        if key in self._absent:
+            return None
+        value = self.expand(key)
+        if value is None:
+            self._absent.add(key)
+        else:
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __missing__(self, key: K) -> V:
+        value = self.__expand__(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return dict.__contains__(self, key) or self.__expand__(key) is not None  # type: ignore
+
+    def get(self, key: K, default: Optional[Union[V, T]] = None) -> Optional[Union[V, T]]:  # type: ignore
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        value = self.__expand__(key)
+        return default if value is None else value
+
+    def map(self, f: Callable[[K, V], T]) -> "LazyRules[K, T]":
+        """
+        Returns the lazy rules S -> f(S, self[S]) over the same non-terminals.
+        """
+        return LazyRules(lambda S: f(S, self[S]) if S in self else None)
@@ -1,6 +1,7 @@
 from typing import (
     Any,
     Callable,
+    Container,
     Dict,
     Generator,
     Generic,
@@ -13,13 +14,20 @@ from typing import (
     TYPE_CHECKING,
 )
 
+from itertools import islice
+
 import numpy as np
 from synth.utils.vose_polyfill import Sampler as VoseSampler
 
 if TYPE_CHECKING:
     from synth.syntax.grammars.cfg import CFG
-from synth.syntax.grammars.grammar import NGram
+from synth.syntax.grammars.grammar import (
+    NGram,
+    __constant_non_terminals__,
+    sample_with_rejection,
+)
 from synth.syntax.grammars.det_grammar import DerivableProgram, DetGrammar
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.program import Constant, Function, Program
 from synth.syntax.type_system import Type
 
@@ -33,20 +41,71 @@ CFGState = Tuple[NGram, int]
 CFGNonTerminal = Tuple[Type, Tuple[CFGState, NoneType]]
 
 
+def __rule_segments__(
+    grammar: DetGrammar[U, V, W]
+) -> Tuple[Dict[Tuple[Type, U], Tuple[List[DerivableProgram], int, int]], np.ndarray]:
+    """
+    Returns the dense layout of the rules of grammar, cached on the grammar:
+    - for each non-terminal S, (P_list, i, j) where rules i to j excluded are the rules S -> P for P in P_list in the order of rule ids;
+    - the index of the non-terminal of each rule.
+    """
+    segments = grammar.__dict__.get("_rule_segments")
+    # Lazy rules can grow, new non-terminals are appended to the layout as they are to the rule ids
+    if segments is None or len(segments[0]) != len(grammar.rules):
+        index: Dict[Tuple[Type, U], Tuple[List[DerivableProgram], int, int]] = {}
+        n = 0
+        if segments is not None and len(segments[0]) < len(grammar.rules):
+            index = dict(segments[0])
+            n = len(segments[1])
+        for S in islice(grammar.rules, len(index), None):
+            P_list = list(grammar.rules[S])
+            index[S] = (P_list, n, n + len(P_list))
+            n += len(P_list)
+        owners = np.repeat(
+            np.arange(len(index)), [len(P_list) for P_list, _, _ in index.values()]
+        )
+        segments = (index, owners)
+        grammar.__dict__["_rule_segments"] = segments
+    return segments  # type: ignore
+
+
+def __normalised__(
+    tags: Dict[Tuple[Type, U], Dict[DerivableProgram, float]]
+) -> Callable[[Tuple[Type, U], Any], Dict[DerivableProgram, float]]:
+    """
+    Returns the function mapping a non-terminal to its normalised probabilities in tags, to be used with LazyRules.map.
+    """
+
+    def normalised(S: Tuple[Type, U], _: Any) -> Dict[DerivableProgram, float]:
+        probs = tags.get(S, {})
+        total = sum(probs.values())
+        return {P: p / total for P, p in probs.items()} if total > 0 else dict(probs)
+
+    return normalised
+
+
 class TaggedDetGrammar(DetGrammar[U, V, W], Generic[T, U, V, W]):
     def __init__(
         self,
         grammar: DetGrammar[U, V, W],
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, T]],
     ):
-        super().__init__(grammar.start, grammar.rules, clean=False)
         self.grammar = grammar
+        super().__init__(grammar.start, grammar.rules, clean=False)
         self.tags = tags
 
+    def _guess_type_request_(self) -> Type:
+        # Same rules as the underlying grammar which already guessed it
+        self._variables = self.grammar.variables()
+        return self.grammar.type_request
+
     def programs(self) -> int:
         return self.grammar.programs()
 
     def __hash__(self) -> int:
+        # The tags of lazy grammars grow as they are expanded, hence are not hashed
+        if isinstance(self.tags, LazyRules):
+            return hash((self.start, self.grammar))
         return hash((self.start, self.grammar, str(self.tags)))
 
     def __eq__(self, o: object) -> bool:
@@ -79,6 +138,25 @@ class TaggedDetGrammar(DetGrammar[U, V, W], Generic[T, U, V, W]):
     ) -> Tuple[W, Tuple[Type, U]]:
         return self.grammar.derive(information, S, P)
 
+    def arguments_non_terminals(
+        self,
+        S: Tuple[Type, U],
+        P: DerivableProgram,
+        arguments: Optional[List[Program]] = None,
+    ) -> List[Tuple[Type, U]]:
+        return self.grammar.arguments_non_terminals(S, P, arguments)
+
+    def indexed_rules(self) -> List[Tuple[Tuple[Type, U], DerivableProgram]]:
+        return self.grammar.indexed_rules()
+
+    def rule_ids(self) -> Dict[Tuple[Tuple[Type, U], DerivableProgram], int]:
+        return self.grammar.rule_ids()
+
+    def encode_derivations(
+        self, program: Program, start: Optional[Tuple[Type, U]] = None
+    ) -> Optional[List[int]]:
+        return self.grammar.encode_derivations(program, start)
+
     def start_information(self) -> W:
         return self.grammar.start_information()
 
@@ -100,8 +178,11 @@ class TaggedDetGrammar(DetGrammar[U, V, W], Generic[T, U, V, W]):
         self, constants: Dict[Type, List[Any]]
     ) -> "TaggedDetGrammar[T, U, V, W]":
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, T]] = {}
-
+        instantiated = __constant_non_terminals__(self.grammar, constants)
         for S in self.tags:
+            if S not in instantiated:
+                tags[S] = dict(self.tags[S])
+                continue
             tags[S] = {}
             for P in self.tags[S]:
                 if isinstance(P, Constant) and P.type in constants:
@@ -113,6 +194,13 @@ class TaggedDetGrammar(DetGrammar[U, V, W], Generic[T, U, V, W]):
 
 
 class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
+    # Number of rules drawn at once for a non-terminal by sample_programs
+    sampling_block_size: int = 1024
+
+    # Probabilities are stored either as tags or as dense weights, see from_weights
+    _tags: Optional[Dict[Tuple[Type, U], Dict[DerivableProgram, float]]]
+    _weights: Optional[np.ndarray]
+
     def __init__(
         self,
         grammar: DetGrammar[U, V, W],
@@ -128,15 +216,112 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
     def probabilities(self) -> Dict[Tuple[Type, U], Dict[DerivableProgram, float]]:
         return self.tags
 
+    @property
+    def tags(self) -> Dict[Tuple[Type, U], Dict[DerivableProgram, float]]:
+        # Grammars built from weights only materialise their probabilities when they are first needed
+        if self._tags is None:
+            index, _ = __rule_segments__(self.grammar)
+            values = self._weights.tolist()  # type: ignore
+            self._tags = {
+                S: dict(zip(P_list, values[i:j])) for S, (P_list, i, j) in index.items()
+            }
+            self._weights = None
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags: Dict[Tuple[Type, U], Dict[DerivableProgram, float]]) -> None:
+        self._tags = tags
+        self._weights = None
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Grammars pickled before tags became a property
+        if "tags" in state:
+            state["_tags"] = state.pop("tags")
+            state.setdefault("_weights", None)
+        self.__dict__.update(state)
+
     def name(self) -> str:
         return "P" + self.grammar.name()
 
-    def __mul__(self, other: float) -> "ProbDetGrammar[U, V, W]":
-        return ProbDetGrammar(
-            self.grammar,
-            {S: {P: other * p for P, p in v.items()} for S, v in self.tags.items()},
+    def weights(self) -> np.ndarray:
+        """
+        Returns the probabilities of the rules as a dense vector indexed by rule ids, see indexed_rules.
+        Missing rules have probability 0.
+        """
+        if self._weights is not None:
+            return self._weights.copy()
+        index, _ = __rule_segments__(self.grammar)
+        out: List[float] = []
+        for S, (P_list, _, _) in index.items():
+            probs = self.tags.get(S)
+            if probs is None:
+                out += [0.0] * len(P_list)
+            elif list(probs) == P_list:
+                out += probs.values()
+            else:
+                out += [probs.get(P, 0) for P in P_list]
+        return np.array(out, dtype=float)
+
+    @classmethod
+    def from_weights(
+        cls, grammar: DetGrammar[U, V, W], weights: np.ndarray
+    ) -> "ProbDetGrammar[U, V, W]":
+        """
+        Inverse of weights: builds the probabilistic grammar whose rule probabilities are given by a dense vector indexed by rule ids.
+        Probabilities are kept dense until they are accessed so that chaining arithmetic operations and normalise is cheap.
+        For lazy grammars, rules that had no id when weights was computed have probability 0.
+        """
+        pg = ProbDetGrammar(grammar, {})
+        if isinstance(grammar.rules, LazyRules):
+            values = np.asarray(weights, dtype=float).tolist()
+
+            def __from_weights__(
+                S: Tuple[Type, U], _: Any
+            ) -> Dict[DerivableProgram, float]:
+                P_list, i, _ = __rule_segments__(grammar)[0][S]
+                return {
+                    P: values[k] if k < len(values) else 0.0
+                    for k, P in enumerate(P_list, i)
+                }
+
+            pg.tags = grammar.rules.map(__from_weights__)
+            return pg
+        pg._tags = None
+        pg._weights = np.asarray(weights, dtype=float)
+        return pg
+
+    def __add__(
+        self, other: "TaggedDetGrammar[float, U, V, W]"
+    ) -> "ProbDetGrammar[U, V, W]":
+        if not isinstance(other, ProbDetGrammar) or other.grammar is not self.grammar:
+            return super().__add__(other)  # type: ignore
+        if isinstance(self.grammar.rules, LazyRules):
+            # Dense weights only cover the non-terminals expanded so far
+            tags, other_tags = self.tags, other.tags
+            return ProbDetGrammar(
+                self.grammar,
+                self.grammar.rules.map(
+                    lambda S, rules: {
+                        P: tags.get(S, {}).get(P, 0) + other_tags.get(S, {}).get(P, 0)
+                        for P in rules
+                    }
+                ),
+            )
+        return ProbDetGrammar.from_weights(
+            self.grammar, self.weights() + other.weights()
         )
 
+    def __mul__(self, other: float) -> "ProbDetGrammar[U, V, W]":
+        if isinstance(self.grammar.rules, LazyRules):
+            tags = self.tags
+            return ProbDetGrammar(
+                self.grammar,
+                self.grammar.rules.map(
+                    lambda S, _: {P: p * other for P, p in tags.get(S, {}).items()}
+                ),
+            )
+        return ProbDetGrammar.from_weights(self.grammar, self.weights() * other)
+
     def __rmul__(self, other: float) -> "ProbDetGrammar[U, V, W]":
         return self.__mul__(other)
 
@@ -145,19 +330,48 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
         program: Program,
         start: Optional[Tuple[Type, U]] = None,
     ) -> float:
-        try:
-            return self.reduce_derivations(
-                lambda current, S, P, _: current * self.tags[S][P],
-                1.0,
-                program,
-                start,
-            )
-        except:
+        ids = self.encode_derivations(program, start)
+        if ids is None:
             return 0
+        rules = self.indexed_rules()
+        probability = 1.0
+        for i in ids:
+            S, P = rules[i]
+            probability *= self.tags.get(S, {}).get(P, 0)
+        return probability
+
+    def log_probability_batch(
+        self,
+        programs: Iterable[Program],
+        start: Optional[Tuple[Type, U]] = None,
+    ) -> np.ndarray:
+        """
+        Returns the log probability of each program, -inf for programs that can not be derived.
+
+        Programs are converted to rule ids then all log probabilities are gathered and summed at once.
+        """
+        with np.errstate(divide="ignore"):
+            log_probs = np.log(
+                np.array(
+                    [self.tags.get(S, {}).get(P, 0) for S, P in self.indexed_rules()],
+                    dtype=float,
+                )
+            )
+        rules, owners, valid = self.encode_derivations_batch(programs, start)
+        out = np.bincount(owners, weights=log_probs[rules], minlength=len(valid))
+        out[~valid] = -np.inf
+        return out
+
+    def probability_batch(
+        self,
+        programs: Iterable[Program],
+        start: Optional[Tuple[Type, U]] = None,
+    ) -> np.ndarray:
+        return np.exp(self.log_probability_batch(programs, start))
 
     def init_sampling(self, seed: Optional[int] = None) -> None:
         """
-        seed = 0 <=> No Seeding
+        seed = 0 <=> No Seeding of sample_program, batch sampling is seeded by any seed but None
         """
         self.ready_for_sampling = True
         self.vose_samplers = {}
@@ -173,13 +387,41 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
                 seed=seed + i if seed else None,
             )
             self.sampling_map[S] = P_list
+        self._rng = np.random.default_rng(seed)
+        # Tables for batch sampling indexed by non-terminal ids, built on first use
+        self._batch_tables: Optional[
+            List[Tuple[np.ndarray, List[Tuple[DerivableProgram, int]], List[List[int]]]]
+        ] = None
+        self._batch_buffers: List[List[int]] = []
+        self._batch_start = 0
 
     def normalise(self) -> None:
+        """
+        Normalise in place the probabilities of the rules of each non-terminal so that they sum to 1.
+        Non-terminals whose probabilities sum to 0 are left unchanged.
+        """
+        if isinstance(self.grammar.rules, LazyRules):
+            # Non-terminals are normalised as they are expanded
+            self.tags = self.grammar.rules.map(__normalised__(self.tags))
+            return
+        index, owners = __rule_segments__(self.grammar)
+        weights = self.weights()
+        sums = np.bincount(owners, weights=weights, minlength=len(index))[owners]
+        np.divide(weights, sums, out=weights, where=sums > 0)
+        if self._weights is not None:
+            self._weights = weights
+            return
+        values = weights.tolist()
         for S in self.tags:
-            s = sum(self.tags[S][P] for P in self.tags[S])
-            for P in list(self.tags[S].keys()):
-                w = self.tags[S][P]
-                self.tags[S][P] = w / s
+            probs = self.tags[S]
+            P_list, i, j = index.get(S, (None, 0, 0))
+            if list(probs) == P_list:
+                probs.update(zip(P_list, values[i:j]))
+                continue
+            s = sum(probs[P] for P in probs)
+            if s > 0:
+                for P in list(probs.keys()):
+                    probs[P] /= s
 
     def sampling(self) -> Generator[Program, None, None]:
         """
@@ -209,12 +451,102 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
             current = lst[-1]
         return Function(P, arguments)
 
+    def sample_programs(
+        self,
+        n: int,
+        unique: bool = False,
+        use_all_variables: bool = False,
+        max_tries: int = 100,
+        exclude: Optional[Container[Program]] = None,
+    ) -> List[Program]:
+        """
+        Samples n programs from the start non-terminal at once.
+        If unique, duplicates and programs in exclude are rejected.
+        If use_all_variables, programs that do not use all variables of the type request are rejected.
+        At most n * max_tries programs are drawn so that fewer than n programs may be returned.
+        """
+        assert self.ready_for_sampling
+        return sample_with_rejection(
+            self.__sample_batch__,
+            n,
+            len(self.type_request.arguments()),
+            unique,
+            use_all_variables,
+            max_tries,
+            exclude,
+        )
+
+    def __sample_batch__(self, k: int) -> List[Program]:
+        from synth.syntax.grammars.cfg import CFG
+
+        # The non-terminals of the arguments of a TTCFG depend on the previous arguments
+        if not isinstance(self.grammar, CFG):
+            return [self.sample_program() for _ in range(k)]
+        if self._batch_tables is None:
+            # Non-terminals are replaced by their index, hashing them is costly
+            ids = {S: i for i, S in enumerate(self.tags)}
+            self._batch_tables = []
+            for S in self.tags:
+                P_list = self.sampling_map[S]
+                cumulative = np.cumsum([self.tags[S][P] for P in P_list], dtype=float)
+                if cumulative[-1] > 0:
+                    cumulative /= cumulative[-1]
+                self._batch_tables.append(
+                    (
+                        cumulative,
+                        [(P, self.arguments_length_for(S, P)) for P in P_list],
+                        [
+                            [
+                                ids[arg]
+                                for arg in self.grammar.arguments_non_terminals(S, P)
+                            ][::-1]
+                            for P in P_list
+                        ],
+                    )
+                )
+            self._batch_start = ids[self.start]
+            self._batch_buffers = [[] for _ in self.tags]
+        tables = self._batch_tables
+        buffers = self._batch_buffers
+        rng = self._rng
+        block = self.sampling_block_size
+        out: List[Program] = []
+        for _ in range(k):
+            # Draw the derivation in prefix order
+            prefix: List[Tuple[DerivableProgram, int]] = []
+            stack = [self._batch_start]
+            while stack:
+                S = stack.pop()
+                buffer = buffers[S]
+                if not buffer:
+                    # Rules are drawn by blocks and consumed from the end of the buffer
+                    cumulative = tables[S][0]
+                    buffer += np.minimum(
+                        np.searchsorted(cumulative, rng.random(block), side="right"),
+                        len(cumulative) - 1,
+                    ).tolist()
+                i = buffer.pop()
+                prefix.append(tables[S][1][i])
+                stack += tables[S][2][i]
+            # Build the program bottom-up
+            built: List[Program] = []
+            for P, nargs in reversed(prefix):
+                if nargs == 0:
+                    built.append(P)
+                else:
+                    built.append(Function(P, [built.pop() for _ in range(nargs)]))
+            out.append(built[0])
+        return out
+
     def instantiate_constants(
         self, constants: Dict[Type, List[Any]]
     ) -> "ProbDetGrammar[U, V, W]":
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, float]] = {}
-
+        instantiated = __constant_non_terminals__(self.grammar, constants)
         for S in self.tags:
+            if S not in instantiated:
+                tags[S] = dict(self.tags[S])
+                continue
             tags[S] = {}
             for P in self.tags[S]:
                 if isinstance(P, Constant) and P.type in constants:
@@ -228,13 +560,15 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
 
     @classmethod
     def uniform(cls, grammar: DetGrammar[U, V, W]) -> "ProbDetGrammar[U, V, W]":
-        return ProbDetGrammar(
-            grammar,
-            {
-                S: {_: 1 / len(grammar.rules[S]) for _ in grammar.rules[S]}
-                for S in grammar.rules
-            },
-        )
+        if isinstance(grammar.rules, LazyRules):
+            # Probabilities are computed along with the non-terminals
+            return ProbDetGrammar(
+                grammar,
+                grammar.rules.map(lambda _, rules: {P: 1 / len(rules) for P in rules}),
+            )
+        index, owners = __rule_segments__(grammar)
+        counts = np.bincount(owners, minlength=len(index))
+        return ProbDetGrammar.from_weights(grammar, 1 / counts[owners])
 
     @classmethod
     def random(
@@ -244,10 +578,13 @@ class ProbDetGrammar(TaggedDetGrammar[float, U, V, W]):
         gen: Callable[[np.random.Generator], float] = lambda prng: prng.uniform(),
     ) -> "ProbDetGrammar[U, V, W]":
         prng = np.random.default_rng(seed)
-        pg = ProbDetGrammar(
-            grammar,
-            {S: {_: gen(prng) for _ in grammar.rules[S]} for S in grammar.rules},
-        )
+        tags: Dict[Tuple[Type, U], Dict[DerivableProgram, float]]
+        if isinstance(grammar.rules, LazyRules):
+            # Probabilities are drawn along with the non-terminals, so they depend on the order of expansion
+            tags = grammar.rules.map(lambda _, rules: {P: gen(prng) for P in rules})
+        else:
+            tags = {S: {_: gen(prng) for _ in grammar.rules[S]} for S in grammar.rules}
+        pg = ProbDetGrammar(grammar, tags)
         pg.normalise()
         return pg
 
@@ -1,6 +1,7 @@
 from typing import (
     Any,
     Callable,
+    Container,
     Dict,
     Generator,
     Generic,
@@ -10,10 +11,17 @@ from typing import (
     TypeVar,
 )
 
+from itertools import islice
+
 import numpy as np
 from synth.utils.vose_polyfill import Sampler as VoseSampler
 
 from synth.syntax.grammars.det_grammar import DerivableProgram
+from synth.syntax.grammars.grammar import (
+    __constant_non_terminals__,
+    sample_with_rejection,
+)
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.grammars.u_grammar import UGrammar
 from synth.syntax.program import Constant, Function, Program
 from synth.syntax.type_system import Type
@@ -24,6 +32,60 @@ V = TypeVar("V")
 W = TypeVar("W")
 
 
+def __derivation_segments__(grammar: UGrammar[U, V, W]) -> Tuple[
+    Dict[Tuple[Type, U], Tuple[List[Tuple[DerivableProgram, List[V]]], int, int]],
+    np.ndarray,
+]:
+    """
+    Returns the dense layout of the derivations of grammar, cached on the grammar:
+    - for each non-terminal S, (derivations, i, j) where derivations is the list of (P, [v...]) for the derivations S -> P v
+    and indices i to j excluded are the indices of these derivations in this order;
+    - the index of the non-terminal of each derivation.
+    """
+    segments = grammar.__dict__.get("_derivation_segments")
+    # Lazy rules can grow, new non-terminals are appended to the layout
+    if segments is None or len(segments[0]) != len(grammar.rules):
+        index: Dict[
+            Tuple[Type, U], Tuple[List[Tuple[DerivableProgram, List[V]]], int, int]
+        ] = {}
+        n = 0
+        if segments is not None and len(segments[0]) < len(grammar.rules):
+            index = dict(segments[0])
+            n = len(segments[1])
+        for S in islice(grammar.rules, len(index), None):
+            derivations = [
+                (P, [tuple(v) if isinstance(v, List) else v for v in lst])  # type: ignore
+                for P, lst in grammar.rules[S].items()
+            ]
+            size = sum(len(keys) for _, keys in derivations)
+            index[S] = (derivations, n, n + size)
+            n += size
+        owners = np.repeat(np.arange(len(index)), [j - i for _, i, j in index.values()])
+        segments = (index, owners)
+        grammar.__dict__["_derivation_segments"] = segments
+    return segments  # type: ignore
+
+
+def __normalised__(
+    tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]]
+) -> Callable[[Tuple[Type, U], Any], Dict[DerivableProgram, Dict[V, float]]]:
+    """
+    Returns the function mapping a non-terminal to its normalised probabilities in tags, to be used with LazyRules.map.
+    """
+
+    def normalised(S: Tuple[Type, U], _: Any) -> Dict[DerivableProgram, Dict[V, float]]:
+        probs = tags.get(S, {})
+        total = sum(sum(v_probs.values()) for v_probs in probs.values())
+        if total <= 0:
+            total = 1
+        return {
+            P: {v: p / total for v, p in v_probs.items()}
+            for P, v_probs in probs.items()
+        }
+
+    return normalised
+
+
 class TaggedUGrammar(UGrammar[U, V, W], Generic[T, U, V, W]):
     def __init__(
         self,
@@ -31,15 +93,22 @@ class TaggedUGrammar(UGrammar[U, V, W], Generic[T, U, V, W]):
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, T]]],
         start_tags: Dict[Tuple[Type, U], T],
     ):
-        super().__init__(grammar.starts, grammar.rules, clean=False)
         self.grammar = grammar
+        super().__init__(grammar.starts, grammar.rules, clean=False)
         self.tags = tags
         self.start_tags = start_tags
 
+    def _guess_type_request_(self) -> Type:
+        # Same rules as the underlying grammar which already guessed it
+        return self.grammar.type_request
+
     def programs(self) -> int:
         return self.grammar.programs()
 
     def __hash__(self) -> int:
+        # The tags of lazy grammars grow as they are expanded, hence are not hashed
+        if isinstance(self.tags, LazyRules):
+            return hash((str(self.start_tags), self.grammar))
         return hash((str(self.start_tags), self.grammar, str(self.tags)))
 
     def __eq__(self, o: object) -> bool:
@@ -90,8 +159,14 @@ class TaggedUGrammar(UGrammar[U, V, W], Generic[T, U, V, W]):
         for S in set(self.tags.keys()).union(other.tags.keys()):
             new_probs[S] = {}
             for P in set(self.tags.get(S, {})).union(other.tags.get(S, {})):
-                for key in self.tags[S][P]:
-                    new_probs[S][P][key] = self.tags[S][P][key] + other.tags[S][P][key]  # type: ignore
+                mine = self.tags.get(S, {}).get(P, {})
+                theirs = other.tags.get(S, {}).get(P, {})
+                new_probs[S][P] = {}
+                for key in set(mine).union(theirs):
+                    if key in mine and key in theirs:
+                        new_probs[S][P][key] = mine[key] + theirs[key]  # type: ignore
+                    else:
+                        new_probs[S][P][key] = mine.get(key, theirs.get(key))  # type: ignore
         new_start_tags: Dict[Tuple[Type, U], T] = {
             key: value + other.start_tags[key]  # type: ignore
             for key, value in self.start_tags.items()
@@ -102,8 +177,11 @@ class TaggedUGrammar(UGrammar[U, V, W], Generic[T, U, V, W]):
         self, constants: Dict[Type, List[Any]]
     ) -> "TaggedUGrammar[T, U, V, W]":
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, T]]] = {}
-
+        instantiated = __constant_non_terminals__(self.grammar, constants)
         for S in self.tags:
+            if S not in instantiated:
+                tags[S] = dict(self.tags[S])
+                continue
             tags[S] = {}
             for P in self.tags[S]:
                 if isinstance(P, Constant) and P.type in constants:
@@ -117,6 +195,10 @@ class TaggedUGrammar(UGrammar[U, V, W], Generic[T, U, V, W]):
 
 
 class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
+    # Probabilities are stored either as tags or as dense weights, see from_weights
+    _tags: Optional[Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]]]
+    _weights: Optional[np.ndarray]
+
     def __init__(
         self,
         grammar: UGrammar[U, V, W],
@@ -144,13 +226,140 @@ class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
     def name(self) -> str:
         return "P" + self.grammar.name()
 
+    @property
+    def tags(self) -> Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]]:
+        # Grammars built from weights only materialise their probabilities when they are first needed
+        if self._tags is None:
+            index, _ = __derivation_segments__(self.grammar)
+            values = self._weights.tolist()  # type: ignore
+            self._tags = {}
+            for S, (derivations, i, _) in index.items():
+                self._tags[S] = {}
+                for P, keys in derivations:
+                    self._tags[S][P] = dict(zip(keys, values[i : i + len(keys)]))
+                    i += len(keys)
+            self._weights = None
+        return self._tags
+
+    @tags.setter
+    def tags(
+        self, tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]]
+    ) -> None:
+        self._tags = tags
+        self._weights = None
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Grammars pickled before tags became a property
+        if "tags" in state:
+            state["_tags"] = state.pop("tags")
+            state.setdefault("_weights", None)
+        self.__dict__.update(state)
+
+    def weights(self) -> np.ndarray:
+        """
+        Returns the probabilities of the derivations as a dense vector, see from_weights.
+        Missing derivations have probability 0.
+        """
+        if self._weights is not None:
+            return self._weights.copy()
+        index, _ = __derivation_segments__(self.grammar)
+        out: List[float] = []
+        for S, (derivations, _, _) in index.items():
+            probs = self.tags.get(S, {})
+            for P, keys in derivations:
+                v_probs = probs.get(P)
+                if v_probs is None:
+                    out += [0.0] * len(keys)
+                elif list(v_probs) == keys:
+                    out += v_probs.values()
+                else:
+                    out += [v_probs.get(key, 0) for key in keys]
+        return np.array(out, dtype=float)
+
+    @classmethod
+    def from_weights(
+        cls,
+        grammar: UGrammar[U, V, W],
+        weights: np.ndarray,
+        start_probs: Dict[Tuple[Type, U], float],
+    ) -> "ProbUGrammar[U, V, W]":
+        """
+        Inverse of weights: builds the probabilistic grammar whose derivation probabilities are given by a dense vector
+        where derivations are ordered by non-terminal, program and then as in the rules of grammar.
+        Probabilities are kept dense until they are accessed so that chaining arithmetic operations and normalise is cheap.
+        For lazy grammars, derivations that were not expanded when weights was computed have probability 0.
+        """
+        pg = ProbUGrammar(grammar, {}, start_probs)
+        if isinstance(grammar.rules, LazyRules):
+            values = np.asarray(weights, dtype=float).tolist()
+
+            def __from_weights__(
+                S: Tuple[Type, U], _: Any
+            ) -> Dict[DerivableProgram, Dict[V, float]]:
+                derivations, i, _ = __derivation_segments__(grammar)[0][S]
+                out = {}
+                for P, keys in derivations:
+                    out[P] = {
+                        key: values[k] if k < len(values) else 0.0
+                        for k, key in enumerate(keys, i)
+                    }
+                    i += len(keys)
+                return out
+
+            pg.tags = grammar.rules.map(__from_weights__)
+            return pg
+        pg._tags = None
+        pg._weights = np.asarray(weights, dtype=float)
+        return pg
+
+    def __add__(
+        self, other: "TaggedUGrammar[float, U, V, W]"
+    ) -> "ProbUGrammar[U, V, W]":
+        if not isinstance(other, ProbUGrammar) or other.grammar is not self.grammar:
+            return super().__add__(other)  # type: ignore
+        if isinstance(self.grammar.rules, LazyRules):
+            # Dense weights only cover the non-terminals expanded so far
+            tags, other_tags = self.tags, other.tags
+
+            def __add__(
+                S: Tuple[Type, U], _: Any
+            ) -> Dict[DerivableProgram, Dict[V, float]]:
+                probs, other_probs = tags.get(S, {}), other_tags.get(S, {})
+                return {
+                    P: {
+                        v: probs.get(P, {}).get(v, 0) + other_probs.get(P, {}).get(v, 0)
+                        for v in {**probs.get(P, {}), **other_probs.get(P, {})}
+                    }
+                    for P in {**probs, **other_probs}
+                }
+
+            return ProbUGrammar(
+                self.grammar,
+                self.grammar.rules.map(__add__),
+                {S: p + other.start_tags.get(S, 0) for S, p in self.start_tags.items()},
+            )
+        return ProbUGrammar.from_weights(
+            self.grammar,
+            self.weights() + other.weights(),
+            {S: p + other.start_tags.get(S, 0) for S, p in self.start_tags.items()},
+        )
+
     def __mul__(self, other: float) -> "ProbUGrammar[U, V, W]":
-        return ProbUGrammar(
+        if isinstance(self.grammar.rules, LazyRules):
+            tags = self.tags
+            return ProbUGrammar(
+                self.grammar,
+                self.grammar.rules.map(
+                    lambda S, _: {
+                        P: {v: p * other for v, p in v_probs.items()}
+                        for P, v_probs in tags.get(S, {}).items()
+                    }
+                ),
+                {S: v * other for S, v in self.start_tags.items()},
+            )
+        return ProbUGrammar.from_weights(
             self.grammar,
-            {
-                S: {P: {v: p * other for v, p in lst.items()} for P, lst in v.items()}
-                for S, v in self.tags.items()
-            },
+            self.weights() * other,
             {S: v * other for S, v in self.start_tags.items()},
         )
 
@@ -211,13 +420,39 @@ class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
         )
 
     def normalise(self) -> None:
-        for S in self.tags:
-            s = sum(
-                sum(self.tags[S][P][V] for V in self.tags[S][P]) for P in self.tags[S]
-            )
-            for P in list(self.tags[S].keys()):
-                w = self.tags[S][P]
-                self.tags[S][P] = {v: p / s for v, p in w.items()}
+        """
+        Normalise in place the probabilities of the derivations of each non-terminal and of the starts so that they sum to 1.
+        Non-terminals whose probabilities sum to 0 are left unchanged.
+        """
+        if isinstance(self.grammar.rules, LazyRules):
+            # Non-terminals are normalised as they are expanded
+            self.tags = self.grammar.rules.map(__normalised__(self.tags))
+        else:
+            index, owners = __derivation_segments__(self.grammar)
+            weights = self.weights()
+            sums = np.bincount(owners, weights=weights, minlength=len(index))[owners]
+            np.divide(weights, sums, out=weights, where=sums > 0)
+            if self._weights is not None:
+                self._weights = weights
+            else:
+                values = weights.tolist()
+                for S in self.tags:
+                    derivations, i, _ = index.get(S, ([], 0, 0))
+                    if list(self.tags[S]) == [P for P, _ in derivations] and all(
+                        list(self.tags[S][P]) == keys for P, keys in derivations
+                    ):
+                        for P, keys in derivations:
+                            self.tags[S][P] = dict(zip(keys, values[i : i + len(keys)]))
+                            i += len(keys)
+                        continue
+                    s = sum(
+                        sum(self.tags[S][P][V] for V in self.tags[S][P])
+                        for P in self.tags[S]
+                    )
+                    if s > 0:
+                        for P in list(self.tags[S].keys()):
+                            w = self.tags[S][P]
+                            self.tags[S][P] = {v: p / s for v, p in w.items()}
 
         s = sum(v for v in self.start_tags.values())
         for S in self.start_tags:
@@ -253,12 +488,37 @@ class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
             current = lst[-1][0]
         return Function(P, arguments)
 
+    def sample_programs(
+        self,
+        n: int,
+        unique: bool = False,
+        use_all_variables: bool = False,
+        max_tries: int = 100,
+        exclude: Optional[Container[Program]] = None,
+    ) -> List[Program]:
+        """
+        Samples n programs at once, see ProbDetGrammar.sample_programs.
+        """
+        assert self.ready_for_sampling
+        return sample_with_rejection(
+            lambda k: [self.sample_program() for _ in range(k)],
+            n,
+            len(self.type_request.arguments()),
+            unique,
+            use_all_variables,
+            max_tries,
+            exclude,
+        )
+
     def instantiate_constants(
         self, constants: Dict[Type, List[Any]]
     ) -> "ProbUGrammar[U, V, W]":
         tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]] = {}
-
+        instantiated = __constant_non_terminals__(self.grammar, constants)
         for S in self.tags:
+            if S not in instantiated:
+                tags[S] = dict(self.tags[S])
+                continue
             tags[S] = {}
             for P in self.tags[S]:
                 if isinstance(P, Constant) and P.type in constants:
@@ -275,19 +535,20 @@ class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
 
     @classmethod
     def uniform(cls, grammar: UGrammar[U, V, W]) -> "ProbUGrammar[U, V, W]":
-        probs: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]] = {}
-        for S in grammar.rules:
-            probs[S] = {}
-            n = sum(len(grammar.rules[S][P]) for P in grammar.rules[S])
-            for P in grammar.rules[S]:
-                lst = grammar.rules[S][P]
-                if isinstance(lst[0], List):
-                    probs[S][P] = {tuple(v): 1 / n for v in lst}  # type: ignore
-                else:
-                    probs[S][P] = {v: 1 / n for v in lst}
-
         start_probs = {start: 1 / len(grammar.starts) for start in grammar.starts}
-        return ProbUGrammar(grammar, probs, start_probs)
+        if isinstance(grammar.rules, LazyRules):
+            # Probabilities are computed along with the non-terminals
+            def __uniform__(_: Any, rules: Dict[DerivableProgram, List[V]]) -> Dict:
+                n = sum(len(derivations) for derivations in rules.values())
+                return {
+                    P: {tuple(v) if isinstance(v, List) else v: 1 / n for v in derivations}  # type: ignore
+                    for P, derivations in rules.items()
+                }
+
+            return ProbUGrammar(grammar, grammar.rules.map(__uniform__), start_probs)
+        index, owners = __derivation_segments__(grammar)
+        counts = np.bincount(owners, minlength=len(index))
+        return ProbUGrammar.from_weights(grammar, 1 / counts[owners], start_probs)
 
     @classmethod
     def random(
@@ -297,16 +558,23 @@ class ProbUGrammar(TaggedUGrammar[float, U, V, W]):
         gen: Callable[[np.random.Generator], float] = lambda prng: prng.uniform(),
     ) -> "ProbUGrammar[U, V, W]":
         prng = np.random.default_rng(seed)
-        pg = ProbUGrammar(
-            grammar,
-            {
+        tags: Dict[Tuple[Type, U], Dict[DerivableProgram, Dict[V, float]]]
+        if isinstance(grammar.rules, LazyRules):
+            # Probabilities are drawn along with the non-terminals, so they depend on the order of expansion
+            tags = grammar.rules.map(
+                lambda _, rules: {
+                    P: {tuple(x) if isinstance(x, List) else x: gen(prng) for x in der}  # type: ignore
+                    for P, der in rules.items()
+                }
+            )
+        else:
+            tags = {
                 S: {
                     P: {tuple(x) if isinstance(x, List) else x: gen(prng) for x in der}  # type: ignore
                     for P, der in grammar.rules[S].items()
                 }
                 for S in grammar.rules
-            },
-            {S: gen(prng) for S in grammar.starts},
-        )
+            }
+        pg = ProbUGrammar(grammar, tags, {S: gen(prng) for S in grammar.starts})
         pg.normalise()
         return pg
@@ -18,6 +18,7 @@ from typing import (
 from synth.syntax.dsl import DSL
 from synth.syntax.automata.dfa import DFA
 from synth.syntax.grammars.grammar import DerivableProgram, NGram
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
 from synth.syntax.program import Constant, Primitive, Variable
 from synth.syntax.type_system import Arrow, Type, UnknownType
@@ -86,26 +87,50 @@ class TTCFG(
             DFA[U, Tuple[Tuple[Type, Tuple[S, T]], DerivableProgram]],
         ],
     ) -> Union["TTCFG[S, Tuple[T, U]]", "TTCFG[Tuple[S, U], Tuple[T, V]]"]:
+        return self.product(other)
+
+    def product(
+        self,
+        other: Union[
+            "TTCFG[U, V]",
+            DFA[U, DerivableProgram],
+            DFA[U, Tuple[Tuple[Type, Tuple[S, T]], DerivableProgram]],
+        ],
+        lazy: bool = False,
+    ) -> Union["TTCFG[S, Tuple[T, U]]", "TTCFG[Tuple[S, U], Tuple[T, V]]"]:
+        """
+        Product of this grammar with a TTCFG or a DFA, same as self * other.
+
+        If lazy, the non-terminals of the product are only built when they are first queried, for instance by an enumerator,
+        instead of building and cleaning the whole product;
+        the product is then not cleaned and iterating over its rules only sees the non-terminals built so far.
+        """
         if isinstance(other, TTCFG):
-            return self.__mul_ttcfg__(other)
+            return self.__mul_ttcfg__(other, lazy)
         elif isinstance(other, DFA):
             if isinstance(list(other.rules[other.start].keys())[0], tuple):
-                return self.__mul_dfa__(other)  # type: ignore
+                return self.__mul_dfa__(other, lazy)  # type: ignore
             else:
-                return self.__mul_dfa_simple__(other)  # type: ignore
+                return self.__mul_dfa_simple__(other, lazy)  # type: ignore
         assert False, f"Cannot multiply TTCFG with {other}"
 
-    def __mul_ttcfg__(self, other: "TTCFG[U, V]") -> "TTCFG[Tuple[S, U], Tuple[T, V]]":
+    def __lazy_product__(
+        self,
+        start: Tuple[Type, Tuple[Any, Any]],
+        expand: Callable[[Tuple[Type, Tuple[Any, Any]]], Optional[Dict]],
+    ) -> "TTCFG":
+        product: TTCFG = TTCFG(start, LazyRules(expand), clean=False)
+        # The product has the variables of this grammar but none of them has been built yet
+        product.type_request = self.type_request
+        product._variables = self.variables()
+        return product
+
+    def __mul_ttcfg__(
+        self, other: "TTCFG[U, V]", lazy: bool = False
+    ) -> "TTCFG[Tuple[S, U], Tuple[T, V]]":
         assert (
             self.type_request == other.type_request
         ), "Both TTCFGs do not have the same type request!"
-        rules: Dict[
-            Tuple[Type, Tuple[Tuple[S, U], Tuple[T, V]]],
-            Dict[
-                Union[Primitive, Variable, Constant],
-                Tuple[List[Tuple[Type, Tuple[S, U]]], Tuple[T, V]],
-            ],
-        ] = {}
         start: Tuple[Type, Tuple[Tuple[S, U], Tuple[T, V]]] = (
             self.start[0],
             (
@@ -113,40 +138,58 @@ class TTCFG(
                 (self.start[1][1], other.start[1][1]),
             ),
         )
+
+        def __product_rules__(
+            nT1: Tuple[Type, Tuple[S, T]], nT2: Tuple[Type, Tuple[U, V]]
+        ) -> Dict[
+            Union[Primitive, Variable, Constant],
+            Tuple[List[Tuple[Type, Tuple[S, U]]], Tuple[T, V]],
+        ]:
+            out = {}
+            rules2 = other.rules[nT2]
+            for P1, (args1, state1) in self.rules[nT1].items():
+                if P1 not in rules2:
+                    continue
+                args2, state2 = rules2[P1]
+                new_deriv = [
+                    (el1[0], (el1[1], el2[1])) for el1, el2 in zip(args1, args2)
+                ]
+                out[P1] = (new_deriv, (state1, state2))
+            return out  # type: ignore
+
+        if lazy:
+
+            def expand(
+                rule: Tuple[Type, Tuple[Tuple[S, U], Tuple[T, V]]]
+            ) -> Optional[Dict]:
+                t, ((s1, s2), (t1, t2)) = rule
+                nT1, nT2 = (t, (s1, t1)), (t, (s2, t2))
+                if nT1 not in self.rules or nT2 not in other.rules:
+                    return None
+                return __product_rules__(nT1, nT2) or None
+
+            return self.__lazy_product__(start, expand)
+
+        rules: Dict[
+            Tuple[Type, Tuple[Tuple[S, U], Tuple[T, V]]],
+            Dict[
+                Union[Primitive, Variable, Constant],
+                Tuple[List[Tuple[Type, Tuple[S, U]]], Tuple[T, V]],
+            ],
+        ] = {}
         for nT1 in self.rules:
             for nT2 in other.rules:
                 # check type equality
                 if nT1[0] != nT2[0]:
                     continue
                 rule = (nT1[0], ((nT1[1][0], nT2[1][0]), (nT1[1][1], nT2[1][1])))
-                rules[rule] = {}
-                for P1 in self.rules[nT1]:
-                    for P2 in other.rules[nT2]:
-                        if P1 != P2:
-                            continue
-                        new_deriv = [
-                            (el1[0], (el1[1], el2[1]))
-                            for el1, el2 in zip(
-                                self.rules[nT1][P1][0], other.rules[nT2][P1][0]
-                            )
-                        ]
-                        rules[rule][P1] = (
-                            new_deriv,
-                            (self.rules[nT1][P1][1], other.rules[nT2][P1][1]),
-                        )
+                rules[rule] = __product_rules__(nT1, nT2)
 
         return TTCFG(start, rules, clean=True)
 
     def __mul_dfa_simple__(
-        self, other: DFA[U, DerivableProgram]
+        self, other: DFA[U, DerivableProgram], lazy: bool = False
     ) -> "TTCFG[S, Tuple[T, U]]":
-        rules: Dict[
-            Tuple[Type, Tuple[S, Tuple[T, U]]],
-            Dict[
-                Union[Primitive, Variable, Constant],
-                Tuple[List[Tuple[Type, S]], Tuple[T, U]],
-            ],
-        ] = {}
         start: Tuple[Type, Tuple[S, Tuple[T, U]]] = (
             self.start[0],
             (
@@ -154,24 +197,30 @@ class TTCFG(
                 (self.start[1][1], other.start),
             ),
         )
-        for nT1 in self.rules:
-            for nT2 in other.rules:
-                rule = (nT1[0], (nT1[1][0], (nT1[1][1], nT2)))
-                rules[rule] = {}
-                for P1 in self.rules[nT1]:
-                    for P2 in other.rules[nT2]:
-                        if P1 != P2:
-                            continue
-                        new_deriv = self.rules[nT1][P1][0][:]
-                        rules[rule][P1] = (
-                            new_deriv,
-                            (self.rules[nT1][P1][1], other.rules[nT2][P2]),
-                        )
-        return TTCFG(start, rules, clean=True)
 
-    def __mul_dfa__(
-        self, other: DFA[U, Tuple[Tuple[Type, Tuple[S, T]], DerivableProgram]]
-    ) -> "TTCFG[S, Tuple[T, U]]":
+        def __product_rules__(nT1: Tuple[Type, Tuple[S, T]], nT2: U) -> Dict[
+            Union[Primitive, Variable, Constant],
+            Tuple[List[Tuple[Type, S]], Tuple[T, U]],
+        ]:
+            out = {}
+            rules2 = other.rules[nT2]
+            for P1, (args1, state1) in self.rules[nT1].items():
+                if P1 not in rules2:
+                    continue
+                out[P1] = (args1[:], (state1, rules2[P1]))
+            return out  # type: ignore
+
+        if lazy:
+
+            def expand(rule: Tuple[Type, Tuple[S, Tuple[T, U]]]) -> Optional[Dict]:
+                t, (s1, (t1, nT2)) = rule
+                nT1 = (t, (s1, t1))
+                if nT1 not in self.rules or nT2 not in other.rules:
+                    return None
+                return __product_rules__(nT1, nT2) or None
+
+            return self.__lazy_product__(start, expand)
+
         rules: Dict[
             Tuple[Type, Tuple[S, Tuple[T, U]]],
             Dict[
@@ -179,6 +228,17 @@ class TTCFG(
                 Tuple[List[Tuple[Type, S]], Tuple[T, U]],
             ],
         ] = {}
+        for nT1 in self.rules:
+            for nT2 in other.rules:
+                rule = (nT1[0], (nT1[1][0], (nT1[1][1], nT2)))
+                rules[rule] = __product_rules__(nT1, nT2)
+        return TTCFG(start, rules, clean=True)
+
+    def __mul_dfa__(
+        self,
+        other: DFA[U, Tuple[Tuple[Type, Tuple[S, T]], DerivableProgram]],
+        lazy: bool = False,
+    ) -> "TTCFG[S, Tuple[T, U]]":
         start: Tuple[Type, Tuple[S, Tuple[T, U]]] = (
             self.start[0],
             (
@@ -186,21 +246,42 @@ class TTCFG(
                 (self.start[1][1], other.start),
             ),
         )
+
+        def __product_rules__(nT1: Tuple[Type, Tuple[S, T]], nT2: U) -> Dict[
+            Union[Primitive, Variable, Constant],
+            Tuple[List[Tuple[Type, S]], Tuple[T, U]],
+        ]:
+            out = {}
+            rules1 = self.rules[nT1]
+            for (S2, P2), dst in other.rules[nT2].items():
+                if S2 != nT1 or P2 not in rules1:
+                    continue
+                args1, state1 = rules1[P2]
+                out[P2] = (args1[:], (state1, dst))
+            return out  # type: ignore
+
+        if lazy:
+
+            def expand(rule: Tuple[Type, Tuple[S, Tuple[T, U]]]) -> Optional[Dict]:
+                t, (s1, (t1, nT2)) = rule
+                nT1 = (t, (s1, t1))
+                if nT1 not in self.rules or nT2 not in other.rules:
+                    return None
+                return __product_rules__(nT1, nT2) or None
+
+            return self.__lazy_product__(start, expand)
+
+        rules: Dict[
+            Tuple[Type, Tuple[S, Tuple[T, U]]],
+            Dict[
+                Union[Primitive, Variable, Constant],
+                Tuple[List[Tuple[Type, S]], Tuple[T, U]],
+            ],
+        ] = {}
         for nT1 in self.rules:
             for nT2 in other.rules:
                 rule = (nT1[0], (nT1[1][0], (nT1[1][1], nT2)))
-                rules[rule] = {}
-                for S2, P2 in other.rules[nT2]:
-                    if S2 != nT1:
-                        continue
-                    for P1 in self.rules[nT1]:
-                        if P1 != P2:
-                            continue
-                        new_deriv = self.rules[nT1][P1][0][:]
-                        rules[rule][P1] = (
-                            new_deriv,
-                            (self.rules[nT1][P1][1], other.rules[nT2][(S2, P2)]),
-                        )
+                rules[rule] = __product_rules__(nT1, nT2)
         return TTCFG(start, rules, clean=True)
 
     def clean(self) -> None:
@@ -17,9 +17,10 @@ from synth.syntax.automata.tree_automaton import DFTA
 from synth.syntax.dsl import DSL
 from synth.syntax.grammars.cfg import CFG, CFGState
 from synth.syntax.grammars.grammar import DerivableProgram, NGram
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.grammars.u_grammar import UGrammar
-from synth.syntax.program import Constant
-from synth.syntax.type_system import Type, UnknownType
+from synth.syntax.program import Constant, Variable
+from synth.syntax.type_system import Arrow, Type, UnknownType
 
 U = TypeVar("U")
 V = TypeVar("V")
@@ -321,10 +322,13 @@ class UCFG(UGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]], Generic[U]):
         ],
         ngram: int,
         clean: bool = False,
+        lazy: bool = False,
     ) -> "Union[UCFG[Tuple[NGram, U]], UCFG[Tuple[NGram, Tuple[U, ...]]]]":
         """
         Convert a DFTA into a UCFG representing the same language and adds contextual information with ngrams.
         If the DFTA is reduced then the UCFG is, therefore in that case clean should be set to False since cleaning can be expensive.
+        If lazy, the non-terminals are only built when they are first queried, for instance by an enumerator,
+        the DFTA should then be reduced since the UCFG is not cleaned.
         """
 
         def local_d2state(
@@ -338,6 +342,47 @@ class UCFG(UGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]], Generic[U]):
 
         starts = {local_d2state(q, None) for q in dfta.finals}
 
+        # Index the transitions by their destination
+        by_dst: Dict[
+            Tuple[Type, U], List[Tuple[DerivableProgram, Tuple[Tuple[Type, U], ...]]]
+        ] = defaultdict(list)
+        for (P, args), dst in dfta.rules.items():
+            by_dst[__d2state__(dst)].append((P, args))  # type: ignore
+
+        def __rules_of__(
+            tgt: Tuple[Type, Tuple[NGram, U]]
+        ) -> Dict[DerivableProgram, List[List[Tuple[Type, Tuple[NGram, U]]]]]:
+            out: Dict[DerivableProgram, List[List[Tuple[Type, Tuple[NGram, U]]]]] = (
+                defaultdict(list)
+            )
+            last: NGram = tgt[1][0]
+            for P, args in by_dst.get((tgt[0], tgt[1][1]), []):
+                out[P].append(
+                    [
+                        local_d2state(arg, last.successor((P, i)))  # type: ignore
+                        for i, arg in enumerate(args)
+                    ]
+                )
+            return out
+
+        if lazy:
+
+            def expand(
+                tgt: Tuple[Type, Tuple[NGram, U]]
+            ) -> Optional[
+                Dict[DerivableProgram, List[List[Tuple[Type, Tuple[NGram, U]]]]]
+            ]:
+                if (tgt[0], tgt[1][1]) not in by_dst:
+                    return None
+                return __rules_of__(tgt)
+
+            ucfg = UCFG(starts, LazyRules(expand), clean=False)
+            # No rule has been built yet, the variables are read from the DFTA
+            variables = {P for P, _ in dfta.rules if isinstance(P, Variable)}
+            for var in sorted(variables, key=lambda var: -var.variable):  # type: ignore
+                ucfg.type_request = Arrow(var.type, ucfg.type_request)
+            return ucfg
+
         new_rules: Dict[
             Tuple[Type, Tuple[NGram, U]],
             Dict[DerivableProgram, List[List[Tuple[Type, Tuple[NGram, U]]]]],
@@ -348,18 +393,11 @@ class UCFG(UGrammar[U, List[Tuple[Type, U]], List[Tuple[Type, U]]], Generic[U]):
             tgt = stack.pop()
             if tgt in new_rules:
                 continue
-            new_rules[tgt] = defaultdict(list)
-            last: NGram = tgt[1][0]
-            for (P, args), dst in dfta.rules.items():
-                if not match(local_d2state(dst, None), tgt):
-                    continue
-                new_args = [
-                    local_d2state(arg, last.successor((P, i)))  # type: ignore
-                    for i, arg in enumerate(args)
-                ]
-                new_rules[tgt][P].append(new_args)
-                for new_state in new_args:
-                    if new_state not in new_rules:
-                        stack.append(new_state)
+            new_rules[tgt] = __rules_of__(tgt)
+            for derivations in new_rules[tgt].values():
+                for new_args in derivations:
+                    for new_state in new_args:
+                        if new_state not in new_rules:
+                            stack.append(new_state)
 
         return UCFG(starts, new_rules, clean)
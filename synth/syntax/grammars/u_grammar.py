@@ -13,6 +13,7 @@ from typing import (
 from functools import lru_cache
 
 from synth.syntax.grammars.grammar import DerivableProgram, Grammar
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.program import Constant, Function, Primitive, Program, Variable
 from synth.syntax.type_system import Arrow, Type
 
@@ -59,7 +60,11 @@ class UGrammar(Grammar, ABC, Generic[U, V, W]):
     def primitives_used(self) -> Set[Primitive]:
         """
         Returns the set of primitives used by this grammar.
+        Lazy grammars are not supported since only their expanded non-terminals are known.
         """
+        assert not isinstance(
+            self.rules, LazyRules
+        ), "primitives_used() does not support lazy grammars!"
         out: Set[Primitive] = set()
         for S in self.rules:
             for P in self.rules[S]:
@@ -68,6 +73,9 @@ class UGrammar(Grammar, ABC, Generic[U, V, W]):
         return out
 
     def __hash__(self) -> int:
+        # The rules of lazy grammars grow as they are expanded, hence are not hashed
+        if isinstance(self.rules, LazyRules):
+            return hash((tuple(self.starts), self.type_request))
         return hash((tuple(self.starts), str(self.rules)))
 
     def __rule_to_str__(self, P: DerivableProgram, out: V) -> str:
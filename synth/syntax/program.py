@@ -3,11 +3,11 @@ from typing import Dict, Generator, List as TList, Any, Optional, Set, Tuple
 import itertools
 
 from synth.syntax.type_system import (
+    Arrow,
     PrimitiveType,
     Type,
     UnknownType,
 )
-from synth.syntax.type_helper import FunctionType
 
 
 class Program(ABC):
@@ -240,10 +240,12 @@ class Function(Program):
     __hash__ = Program.__hash__
 
     def __init__(self, function: Program, arguments: TList[Program]):
-        # Build automatically the type of the function
-        type = function.type
-        args = type.arguments()[len(arguments) :]
-        my_type = FunctionType(*args, type.returns())
+        # Build automatically the type of the function: drop one arrow per argument
+        my_type = function.type
+        for _ in arguments:
+            if not isinstance(my_type, Arrow):
+                break
+            my_type = my_type.type_out
 
         super().__init__(my_type)
         self.function = function
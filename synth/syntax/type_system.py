@@ -3,9 +3,11 @@ Objective: define a type system.
 A type can be either PolymorphicType, FixedPolymorphicType, PrimitiveType, Generic, Arrow, Sum or List
 """
 
+from functools import wraps
 from itertools import product
-from typing import Dict, List as TList, Optional, Set, Tuple, Union
-from abc import ABC, abstractmethod
+from weakref import WeakValueDictionary
+from typing import Any, Callable, Dict, List as TList, Optional, Set, Tuple, Union
+from abc import ABC, ABCMeta, abstractmethod
 
 
 class TypeFunctor(ABC):
@@ -18,9 +20,64 @@ class TypeFunctor(ABC):
         pass
 
 
-class Type(ABC):
+# (class, arguments) -> type, an entry lives as long as its type which holds its arguments so that their ids are not reused
+__INTERNED__: "WeakValueDictionary[Tuple, Type]" = WeakValueDictionary()
+# Maximum number of unifiers memoised per type, the cache is cleared when it is full
+__UNIFY_CACHE_SIZE__ = 256
+
+
+class TypeMeta(ABCMeta):
+    """
+    Interns types: building a type with the same arguments as an existing one returns the existing object.
+    Types are immutable, so equal types are most of the time the same object and comparisons are pointer comparisons.
+    """
+
+    def __call__(cls, *args: Any, **kwargs: Any) -> Any:
+        # Keyword arguments are completed with their default values so that they do not change the key
+        kwargs = {**getattr(cls, "__type_defaults__", {}), **kwargs}
+        # Type arguments are already interned so they are identified by their id,
+        # structural equality would mix up types that are equal but not identical such as polymorphic types with the same name
+        try:
+            key = (
+                cls,
+                tuple(id(x) if isinstance(x, Type) else x for x in args),
+                tuple(sorted(kwargs.items())),
+            )
+            out = __INTERNED__.get(key)
+        except TypeError:
+            # Unhashable arguments
+            return super().__call__(*args, **kwargs)
+        if out is None:
+            out = super().__call__(*args, **kwargs)
+            __INTERNED__[key] = out
+        return out
+
+
+def __memoized_unify__(
+    unify: Callable[["Type", Dict[str, "Type"]], "Type"]
+) -> Callable[["Type", Dict[str, "Type"]], "Type"]:
+    @wraps(unify)
+    def cached_unify(self: "Type", unifier: Dict[str, "Type"]) -> "Type":
+        if not self.is_polymorphic():
+            return self
+        key = tuple(sorted((name, id(t)) for name, t in unifier.items()))
+        cache = self.__dict__.setdefault("_unify_cache", {})
+        entry = cache.get(key)
+        if entry is None:
+            if len(cache) >= __UNIFY_CACHE_SIZE__:
+                cache.clear()
+            # The unifier is kept alive so that the ids of the key are not reused
+            entry = (unify(self, unifier), tuple(unifier.values()))
+            cache[key] = entry
+        return entry[0]
+
+    return cached_unify
+
+
+class Type(ABC, metaclass=TypeMeta):
     """
     Object that represents a type.
+    Types are interned and must not be modified.
     """
 
     def __init__(self) -> None:
@@ -143,7 +200,11 @@ class Type(ABC):
         other = INT
         ends_with(self, other) = [Arrow(INT, INT), INT]
         """
-        return self.ends_with_rec(other, [])
+        cache = self.__dict__.setdefault("_ends_with_cache", {})
+        if other not in cache:
+            cache[other] = self.ends_with_rec(other, [])
+        out = cache[other]
+        return None if out is None else out[:]
 
     def ends_with_rec(
         self, other: "Type", arguments_list: TList["Type"]
@@ -184,7 +245,7 @@ class PolymorphicType(Type):
         return format(self.name)
 
     def __eq__(self, o: object) -> bool:
-        return isinstance(o, PolymorphicType) and o.name == self.name
+        return self is o or (isinstance(o, PolymorphicType) and o.name == self.name)
 
     def is_polymorphic(self) -> bool:
         return True
@@ -241,7 +302,7 @@ class FixedPolymorphicType(PolymorphicType):
         return any(other.is_instance(x) for x in self.types)
 
     def __eq__(self, o: object) -> bool:
-        return (
+        return self is o or (
             isinstance(o, FixedPolymorphicType)
             and len(set(o.types).symmetric_difference(self.types)) == 0
         )
@@ -270,7 +331,9 @@ class PrimitiveType(Type):
         return format(self.type_name)
 
     def __eq__(self, o: object) -> bool:
-        return isinstance(o, PrimitiveType) and o.type_name == self.type_name
+        return self is o or (
+            isinstance(o, PrimitiveType) and o.type_name == self.type_name
+        )
 
     def __decompose_type_rec__(
         self,
@@ -294,6 +357,7 @@ class Sum(Type):
     def __init__(self, *types: Type):
         self.types = types
         self.hash = hash(types)
+        self._polymorphic = any(t.is_polymorphic() for t in self.types)
 
     def all_versions(self) -> TList["Type"]:
         v = []
@@ -326,7 +390,7 @@ class Sum(Type):
         return Sum(other, *self.types)
 
     def __eq__(self, o: object) -> bool:
-        return (
+        return self is o or (
             isinstance(o, Sum)
             and len(set(o.types).symmetric_difference(self.types)) == 0
         )
@@ -340,8 +404,9 @@ class Sum(Type):
             t.__decompose_type_rec__(set_basic_types, set_polymorphic_types)
 
     def is_polymorphic(self) -> bool:
-        return any(t.is_polymorphic() for t in self.types)
+        return self._polymorphic
 
+    @__memoized_unify__
     def unify(self, unifier: Dict[str, "Type"]) -> "Type":
         return Sum(*[x.unify(unifier) for x in self.types])
 
@@ -368,6 +433,9 @@ class Arrow(Type):
         self.type_in = type_in
         self.type_out = type_out
         self.hash = hash((self.type_in, self.type_out))
+        self._polymorphic = type_in.is_polymorphic() or type_out.is_polymorphic()
+        self._returns = type_out.returns()
+        self._arguments = [type_in] + type_out.arguments()
 
     def __pickle__(o: Type) -> Tuple:
         return Arrow, (o.type_in, o.type_out)  # type: ignore
@@ -396,7 +464,7 @@ class Arrow(Type):
         return super().__contains__(t) or t in self.type_in or t in self.type_out
 
     def __eq__(self, o: object) -> bool:
-        return (
+        return self is o or (
             isinstance(o, Arrow)
             and o.type_in == self.type_in
             and o.type_out == self.type_out
@@ -414,17 +482,13 @@ class Arrow(Type):
         """
         Get the return type of this arrow.
         """
-        if isinstance(self.type_out, Arrow):
-            return self.type_out.returns()
-        return self.type_out
+        return self._returns
 
     def arguments(self) -> TList[Type]:
         """
         Get the list of arguments in the correct order of this arrow.
         """
-        if isinstance(self.type_out, Arrow):
-            return [self.type_in] + self.type_out.arguments()
-        return [self.type_in]
+        return self._arguments[:]
 
     def without_unit_arguments(self) -> "Type":
         if self.type_in == UNIT:
@@ -434,8 +498,9 @@ class Arrow(Type):
         return self
 
     def is_polymorphic(self) -> bool:
-        return self.type_in.is_polymorphic() or self.type_out.is_polymorphic()
+        return self._polymorphic
 
+    @__memoized_unify__
     def unify(self, unifier: Dict[str, "Type"]) -> "Type":
         return Arrow(self.type_in.unify(unifier), self.type_out.unify(unifier))
 
@@ -459,6 +524,7 @@ class Generic(Type):
     """
 
     __hash__ = Type.__hash__
+    __type_defaults__ = {"infix": False}
 
     def __init__(
         self,
@@ -470,6 +536,7 @@ class Generic(Type):
         self.infix = infix
         self.name = name
         self.hash = hash((self.name, self.types))
+        self._polymorphic = any(t.is_polymorphic() for t in self.types)
 
     def all_versions(self) -> TList["Type"]:
         v = []
@@ -477,7 +544,7 @@ class Generic(Type):
             v.append(t.all_versions())
         out: TList[Type] = []
         for cand in product(*v):
-            out.append(Generic(self.name, *cand))
+            out.append(Generic(self.name, *cand, infix=self.infix))
         return out
 
     def is_under_specified(self) -> bool:
@@ -490,12 +557,15 @@ class Generic(Type):
             and all(any(tt.is_instance(t) for t in self.types) for tt in other.types)
         )
 
+    def __pickle__(o: Type) -> Tuple:  # type: ignore[misc]
+        return __generic__, (o.name, o.infix, *o.types)  # type: ignore
+
+    # Used to load generic types pickled before they were interned
     def __getstate__(self) -> Dict:
-        return {k: v for k, v in self.__dict__.items() if k != "hash"}
+        return {k: v for k, v in self.__dict__.items() if k != "hash" and k[0] != "_"}
 
     def __setstate__(self, state: Dict) -> None:
-        self.__dict__ = state
-        self.hash = hash((self.name, self.types))
+        self.__init__(state["name"], *state["types"], infix=state.get("infix", False))  # type: ignore
 
     def __str__(self) -> str:
         base = " " if not self.infix else f" {self.name} "
@@ -508,7 +578,7 @@ class Generic(Type):
         return super().__contains__(t) or any(t in tt for tt in self.types)
 
     def __eq__(self, o: object) -> bool:
-        return (
+        return self is o or (
             isinstance(o, Generic)
             and o.name == self.name
             and all(x == y for x, y in zip(self.types, o.types))
@@ -523,10 +593,13 @@ class Generic(Type):
             t.__decompose_type_rec__(set_basic_types, set_polymorphic_types)
 
     def is_polymorphic(self) -> bool:
-        return any(t.is_polymorphic() for t in self.types)
+        return self._polymorphic
 
+    @__memoized_unify__
     def unify(self, unifier: Dict[str, "Type"]) -> "Type":
-        return Generic(self.name, *[x.unify(unifier) for x in self.types])
+        return Generic(
+            self.name, *[x.unify(unifier) for x in self.types], infix=self.infix
+        )
 
     def depth(self) -> int:
         return max(t.depth() for t in self.types)
@@ -535,6 +608,10 @@ class Generic(Type):
         return 1 + sum(t.size() for t in self.types)
 
 
+def __generic__(name: str, infix: bool, *types: Type) -> Generic:
+    return Generic(name, *types, infix=infix)
+
+
 class GenericFunctor(TypeFunctor):
     """
     Produces an instanciator for the specific generic type.
@@ -623,15 +700,13 @@ def match(a: Type, b: Type) -> bool:
     if type(a) == type(b):
         if isinstance(a, Generic):
             return a.name == b.name and all(  # type: ignore
-                match(x, y)
-                for x, y in zip(a.types, b.types)  # type: ignore
+                match(x, y) for x, y in zip(a.types, b.types)  # type: ignore
             )
         elif a.is_instance(Arrow):
             return match(a.type_in, b.type_in) and match(a.type_out, b.type_out)  # type: ignore
         elif isinstance(a, Sum):
             return all(any(match(x, y) for y in b.types) for x in a.types) and all(  # type: ignore
-                any(match(x, y) for y in a.types)
-                for x in b.types  # type: ignore
+                any(match(x, y) for y in a.types) for x in b.types  # type: ignore
             )
         elif isinstance(a, UnknownType):
             return False
@@ -651,7 +726,7 @@ for cls in [
     PrimitiveType,
     PolymorphicType,
     FixedPolymorphicType,
-    # Generic,
+    Generic,
     Arrow,
     Sum,
     UnknownType,
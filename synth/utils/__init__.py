@@ -4,4 +4,9 @@ Utility objects and functions that do not fit elsewhere.
 
 import synth.utils.chrono as chrono
 from synth.utils.generator_utils import gen_take
-from synth.utils.data_storage import load_object, save_object
+from synth.utils.data_storage import (
+    load_object,
+    save_object,
+    ObjectStore,
+    EmbeddingCache,
+)
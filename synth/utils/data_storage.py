@@ -1,8 +1,14 @@
 import bz2
+import hashlib
+import io
+import os
 import pickle
-from typing import Any, Callable, Optional
+import struct
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import pickletools
 
+import numpy as np
+
 
 def load_object(
     path: str, unpickler: Optional[Callable[[bz2.BZ2File], pickle.Unpickler]] = None
@@ -29,3 +35,231 @@ def save_object(
         if optimize:
             content = pickletools.optimize(content)
         fd.write(content)
+
+
+class ObjectStore:
+    """
+    Append-only file of objects that can be read back by index without loading the others.
+
+    Each object is stored as a compressed pickle in its own record, objects appended are immediately written to the file.
+    The shared objects, for example the grammars of many probabilistic grammars, are stored once in their own record the first time a record contains them
+    then they are referenced by the records that contain them and loaded only once when reading.
+    An incomplete last record, left by a crash while writing, is discarded when the store is opened in write mode.
+    A store opened for reading can follow another process appending to the same file with refresh.
+    """
+
+    __MAGIC__ = b"SYNTHOS1"
+    __HEADER__ = struct.Struct("<BQ")
+    __ITEM__ = 0
+    __SHARED__ = 1
+
+    def __init__(
+        self,
+        path: str,
+        write: bool = False,
+        shared: Iterable[Any] = (),
+        compress_level: int = 9,
+    ) -> None:
+        self.path = path
+        self.compress_level = compress_level
+        # Offsets in the file of the records of the items
+        self.offsets: List[int] = []
+        # id of a shared object -> (object, offset of its record)
+        self._shared: Dict[int, Tuple[Any, int]] = {
+            id(obj): (obj, -1) for obj in shared
+        }
+        # offset of a shared record -> object
+        self._loaded: Dict[int, Any] = {}
+        if write and not os.path.exists(path):
+            with open(path, "wb") as fd:
+                fd.write(ObjectStore.__MAGIC__)
+        self._fd = open(path, "r+b" if write else "rb")
+        assert (
+            self._fd.read(len(ObjectStore.__MAGIC__)) == ObjectStore.__MAGIC__
+        ), f"{path} is not an object store!"
+        self._end = len(ObjectStore.__MAGIC__)
+        self.__scan__(write)
+
+    def __scan__(self, write: bool) -> None:
+        size = os.fstat(self._fd.fileno()).st_size
+        offset = self._end
+        header_size = ObjectStore.__HEADER__.size
+        while offset + header_size <= size:
+            self._fd.seek(offset)
+            kind, length = ObjectStore.__HEADER__.unpack(self._fd.read(header_size))
+            if offset + header_size + length > size:
+                break
+            if kind == ObjectStore.__ITEM__:
+                self.offsets.append(offset)
+            offset += header_size + length
+        if write and offset < size:
+            self._fd.truncate(offset)
+        self._end = offset
+
+    def refresh(self) -> None:
+        """
+        Reads the records appended to the file since it was opened or last refreshed, for example by another process writing to it.
+        """
+        self.__scan__(False)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> Any:
+        return self.__load__(self.offsets[index])
+
+    def __iter__(self) -> Iterator[Any]:
+        for offset in self.offsets:
+            yield self.__load__(offset)
+
+    def __load__(self, offset: int) -> Any:
+        self._fd.seek(offset)
+        _, length = ObjectStore.__HEADER__.unpack(
+            self._fd.read(ObjectStore.__HEADER__.size)
+        )
+        content = bz2.decompress(self._fd.read(length))
+        unpickler = pickle.Unpickler(io.BytesIO(content))
+        unpickler.persistent_load = self.__load_shared__  # type: ignore
+        return unpickler.load()
+
+    def __load_shared__(self, offset: int) -> Any:
+        if offset not in self._loaded:
+            self._loaded[offset] = self.__load__(offset)
+        return self._loaded[offset]
+
+    def append(self, obj: Any) -> None:
+        """
+        Write obj at the end of the store.
+        """
+        self.__write__(obj, ObjectStore.__ITEM__)
+        self._fd.flush()
+
+    def __write__(self, obj: Any, kind: int) -> int:
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+
+        def persistent_id(o: Any) -> Optional[int]:
+            if o is obj or id(o) not in self._shared:
+                return None
+            shared, offset = self._shared[id(o)]
+            if offset < 0:
+                offset = self.__write__(shared, ObjectStore.__SHARED__)
+                self._shared[id(o)] = (shared, offset)
+            return offset
+
+        pickler.persistent_id = persistent_id  # type: ignore
+        pickler.dump(obj)
+        content = bz2.compress(buffer.getvalue(), self.compress_level)
+        offset = self._end
+        self._fd.seek(offset)
+        self._fd.write(ObjectStore.__HEADER__.pack(kind, len(content)))
+        self._fd.write(content)
+        self._end = offset + ObjectStore.__HEADER__.size + len(content)
+        if kind == ObjectStore.__ITEM__:
+            self.offsets.append(offset)
+        return offset
+
+    def close(self) -> None:
+        self._fd.close()
+
+    def __enter__(self) -> "ObjectStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of float arrays of shape (n, dimension), where n may differ between entries, addressed by the content they are computed from.
+
+    The rows of all arrays are appended to a memory-mapped float32 file in the directory path and an index file maps each key to its rows.
+    A partially written entry, left by a crash, is ignored when the cache is opened.
+    If path is None the cache only lives in memory.
+    """
+
+    def __init__(self, path: Optional[str], dimension: int) -> None:
+        self.path = path
+        self.dimension = dimension
+        # key -> (first row, number of rows) in the file
+        self._index: Dict[str, Tuple[int, int]] = {}
+        # key -> array when the cache only lives in memory
+        self._memory: Dict[str, np.ndarray] = {}
+        self._rows = 0
+        self._mapped: Optional[np.ndarray] = None
+        if path is None:
+            return
+        os.makedirs(path, exist_ok=True)
+        self._data_file = os.path.join(path, "embeddings.f32")
+        self._index_file = os.path.join(path, "index.tsv")
+        complete_rows = (
+            os.path.getsize(self._data_file) // (4 * dimension)
+            if os.path.exists(self._data_file)
+            else 0
+        )
+        if os.path.exists(self._index_file):
+            with open(self._index_file, "r+") as fd:
+                content = fd.read()
+                # Drop a line left incomplete by an interrupted write
+                complete = content[: content.rfind("\n") + 1]
+                if len(complete) < len(content):
+                    fd.truncate(len(complete.encode()))
+            for line in complete.splitlines():
+                key, start, rows = line.split("\t")
+                if int(start) + int(rows) <= complete_rows:
+                    self._index[key] = (int(start), int(rows))
+                    self._rows = max(self._rows, int(start) + int(rows))
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """
+        Returns the key of the content described by parts.
+        """
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._index) + len(self._memory)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index or key in self._memory
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Returns the array of key, read-only, or None if it is not in the cache.
+        """
+        if key in self._memory:
+            return self._memory[key]
+        if key not in self._index:
+            return None
+        start, rows = self._index[key]
+        if rows == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if self._mapped is None or self._mapped.shape[0] < start + rows:
+            self._mapped = np.memmap(
+                self._data_file,
+                dtype=np.float32,
+                mode="r",
+                shape=(self._rows, self.dimension),
+            )
+        return self._mapped[start : start + rows]
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """
+        Adds the array of key to the cache, the array is written to disk immediately.
+        """
+        array = np.ascontiguousarray(array, dtype=np.float32).reshape(
+            (-1, self.dimension)
+        )
+        if self.path is None:
+            self._memory[key] = array
+            return
+        if key in self._index:
+            return
+        # Rows left by an interrupted write are overwritten
+        with open(self._data_file, "ab") as fd:
+            fd.truncate(self._rows * 4 * self.dimension)
+            fd.write(array.tobytes())
+        with open(self._index_file, "a") as fd:
+            fd.write(f"{key}\t{self._rows}\t{array.shape[0]}\n")
+        self._index[key] = (self._rows, array.shape[0])
+        self._rows += array.shape[0]
@@ -0,0 +1,190 @@
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.grammars.u_cfg import UCFG
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import (
+    INT,
+    STRING,
+    List,
+    PolymorphicType,
+    PrimitiveType,
+)
+from synth.syntax.type_helper import FunctionType
+from synth.filter.constraints.grammar_constraints import add_ucfg_constraints
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "-": FunctionType(INT, INT, INT),
+    "head": FunctionType(List(PolymorphicType("a")), PolymorphicType("a")),
+    "non_reachable": PrimitiveType("non_reachable"),
+    "1": INT,
+    "0": INT,
+    "non_productive": FunctionType(INT, STRING),
+}
+dsl = DSL(syntax)
+cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), 4)
+
+
+def test_restriction() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(+ 1 _)", progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (+ 1 1) 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ 1 1)))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(+ 1 _)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (+ 1 1) 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ 1 1)))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) in new_cfg
+
+
+def test_multi_level_easy() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(+ 1 (- _ 1))", progress=False)
+    # print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (- 1 (+ 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (- (+ 1 1) 1))", cfg.type_request) in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(+ 1 (- _ 1))"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (- (- 1 1) 1))", cfg.type_request) in new_cfg
+
+
+def test_multi_level_hard() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(+ 1 (+ _ 1))", progress=False)
+    # print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (+ 1 1) 1))", cfg.type_request) in new_cfg
+
+    # Every + would need another + below it, hence no program can use +
+    new_cfg = add_ucfg_constraints(cfg, ["(+ 1 (+ _ 1))"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(+ 1 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (- 1 1) 1))", cfg.type_request) not in new_cfg
+
+
+def test_only_reachable() -> None:
+    new_cfg = add_ucfg_constraints(cfg, ["(- #(1)<=1 _)"], progress=False)
+    base = UCFG.from_CFG(cfg)
+    assert new_cfg.programs() < base.programs()
+    for S in new_cfg.rules:
+        assert (S[0], (S[1][0], None)) in cfg.rules
+        for P in new_cfg.rules[S]:
+            assert P in cfg.rules[(S[0], (S[1][0], None))]
+
+
+def test_unsatisfiable() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "#(1)>=100", progress=False)
+    assert new_cfg.programs() == 0
+
+
+def test_at_most() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(- #(1)<=1 _)", progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- (- 1 1) 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (- 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (+ 1 1) 1))", cfg.type_request) not in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(- #(1)<=1 _)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- (- 1 1) 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (- 1 1)))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ (+ 1 1) 1))", cfg.type_request) in new_cfg
+
+
+def test_at_least() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(- _ #(1)>=2)", progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- (- 1 1) 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (- 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- (+ 1 1) 1))", cfg.type_request) in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(- _ #(1)>=2)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- (- 1 1) 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (- 1 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 (+ 1 1)))", cfg.type_request) in new_cfg
+
+
+def test_forbid_subtree() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(+ >^(var0) _)", progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ var0 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ var0 1)))", cfg.type_request) in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(+ >^(var0) _)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ var0 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ var0 1)))", cfg.type_request) not in new_cfg
+
+
+def test_force_subtree() -> None:
+    new_cfg = add_ucfg_constraints(cfg, [], "(+ >(var0) _)", progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ var0 1)", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ var0 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ (+ 1 (+ var0 1)) 1)", cfg.type_request) in new_cfg
+
+    new_cfg = add_ucfg_constraints(cfg, ["(+ >(var0) _)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ var0 1)", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ var0 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ (+ (+ var0 1) 1) 1)", cfg.type_request) in new_cfg
+
+
+def test_multi_constraints() -> None:
+    new_cfg = add_ucfg_constraints(cfg, ["(+ 1 ^0)", "(- _ ^0)"], progress=False)
+    print(new_cfg)
+    assert dsl.parse_program("(- 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(- 1 (- 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 1))", cfg.type_request) in new_cfg
+    assert dsl.parse_program("(+ (+ 1 1) 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ var0 1)", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ var0 1)))", cfg.type_request) not in new_cfg
+    assert dsl.parse_program("(+ 1 (+ 1 (+ 1 var0)))", cfg.type_request) in new_cfg
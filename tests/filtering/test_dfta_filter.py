@@ -0,0 +1,57 @@
+from synth.filter.dfta_filter import DFTAFilter
+from synth.filter.constraints.dfta_constraints import add_dfta_constraints
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.grammars.enumeration.heap_search import enumerate_prob_grammar
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import INT
+from synth.syntax.type_helper import FunctionType
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "-": FunctionType(INT, INT, INT),
+    "1": INT,
+    "0": INT,
+}
+dsl = DSL(syntax)
+cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), 3)
+dfta = add_dfta_constraints(cfg, ["(+ ^0 _)", "(- _ ^0)"], progress=False)
+programs = list(enumerate_prob_grammar(ProbDetGrammar.uniform(cfg)))
+
+
+def test_batch_matches_single() -> None:
+    single = DFTAFilter(dfta)
+    expected = [single.accept(p) for p in programs]
+    batch = DFTAFilter(dfta)
+    assert batch.accept_batch(programs) == expected
+    # Cached states must give the same answers
+    assert batch.accept_batch(programs[::-1]) == expected[::-1]
+    assert any(expected) and not all(expected)
+
+
+def test_negated_dfta() -> None:
+    positive = DFTAFilter(dfta)
+    negative = DFTAFilter(dfta, accepting_dfta=False)
+    assert negative.accept_batch(programs) == [
+        not x for x in positive.accept_batch(programs)
+    ]
+
+
+def test_counters() -> None:
+    filter = DFTAFilter(dfta)
+    out = filter.accept_batch(programs)
+    assert filter.accepted == sum(out)
+    assert filter.rejected == len(out) - sum(out)
+    assert 0 < filter.rejection_rate < 1
+    filter.reset_stats()
+    assert filter.accepted == filter.rejected == 0
+
+
+def test_bounded_cache() -> None:
+    reference = DFTAFilter(dfta)
+    filter = DFTAFilter(dfta, cache_size=10)
+    for p in programs:
+        assert filter.accept(p) == reference.accept(p)
+        assert len(filter._cache) <= 10 and len(filter._old_cache) <= 10
+    assert filter.accept_batch(programs) == reference.accept_batch(programs)
@@ -0,0 +1,78 @@
+from synth.filter.equivalence_filter import EquivalenceFilter
+from synth.filter.dfta_filter import DFTAFilter
+from synth.filter.constraints.dfta_constraints import add_dfta_constraints
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.grammars.enumeration.heap_search import enumerate_prob_grammar
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
+from synth.syntax.program import Function
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import INT
+from synth.syntax.type_helper import FunctionType
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "-": FunctionType(INT, INT, INT),
+    "1": INT,
+    "0": INT,
+}
+dsl = DSL(syntax)
+type_request = FunctionType(INT, INT, INT)
+
+
+def parse(program: str):
+    return dsl.parse_program(program, type_request)
+
+
+commutatives = [parse("(+ var1 var0)")]
+eq_classes = [
+    [parse("(+ var0 0)"), parse("var0")],
+    [parse("(- var0 var0)"), parse("0")],
+    [parse("(- (+ var0 var1) var1)"), parse("var0")],
+    # Not sound: var1 does not occur in (- var0 1)
+    [parse("(- var0 1)"), parse("(+ var0 var1)")],
+]
+cfg = CFG.depth_constraint(dsl, type_request, 3)
+programs = list(enumerate_prob_grammar(ProbDetGrammar.uniform(cfg)))
+
+
+def test_from_equivalence_classes() -> None:
+    filter = EquivalenceFilter.from_equivalence_classes(commutatives, eq_classes)
+    assert filter.stats["constraints.total"] == 5
+    assert filter.stats["constraints.successes"] == 4
+    assert len(filter.forbidden) == 3
+
+
+def test_accept() -> None:
+    filter = EquivalenceFilter.from_equivalence_classes(commutatives, eq_classes)
+    for program in ["(+ var0 0)", "(- 1 1)", "(- (+ 1 var0) var0)"]:
+        assert not filter.accept(parse(program))
+    for program in ["(- 1 0)", "(- (+ 1 var0) var1)", "(- var0 1)", "var0", "1"]:
+        assert filter.accept(parse(program))
+    a, b = parse("(+ var0 1)"), parse("var1")
+    # Exactly one order is kept, whatever the hash seed
+    assert filter.accept(Function(a.function, [a, b]))
+    assert not filter.accept(Function(a.function, [b, a]))
+
+
+def test_shared_shapes() -> None:
+    filter = EquivalenceFilter()
+    for program in ["(- (+ var0 0) var1)", "(- (+ var0 1) 1)", "(- (+ 1 var0) var0)"]:
+        filter.forbid_program(parse(program))
+    for program in ["(- (+ var1 0) 1)", "(- (+ var0 1) 1)", "(- (+ 1 1) 1)"]:
+        assert not filter.accept(parse(program))
+    for program in ["(- (+ var0 1) 0)", "(- (+ 1 var0) var1)", "(- (- 1 0) var1)"]:
+        assert filter.accept(parse(program))
+
+
+def test_to_constraints() -> None:
+    filter = EquivalenceFilter.from_equivalence_classes(commutatives, eq_classes)
+    constraints = filter.to_constraints()
+    assert constraints == ["(+ _ ^0)"]
+    dfta_filter = DFTAFilter(add_dfta_constraints(cfg, constraints, progress=False))
+    local = EquivalenceFilter()
+    local.forbid_program(parse("(+ var0 0)"))
+    for program in programs:
+        assert dfta_filter.accept(program) == all(
+            local.accept(p) for p in program.depth_first_iter()
+        )
@@ -0,0 +1,116 @@
+import time
+
+from synth.filter.filter import Filter, FilterStats, IntersectionFilter, UnionFilter
+from synth.filter.dfta_filter import DFTAFilter
+from synth.filter.obs_eq_filter import ObsEqFilter
+from synth.filter.constraints.dfta_constraints import add_dfta_constraints
+from synth.semantic.evaluator import DSLEvaluator
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import INT
+from synth.syntax.type_helper import FunctionType
+
+
+class SlowFilter(Filter[int]):
+    stateless = True
+
+    def accept(self, obj: int) -> bool:
+        time.sleep(1e-4)
+        return True
+
+
+class EvenFilter(Filter[int]):
+    stateless = True
+
+    def accept(self, obj: int) -> bool:
+        return obj % 2 == 0
+
+
+class PositiveFilter(Filter[int]):
+    stateless = True
+
+    def accept(self, obj: int) -> bool:
+        return obj > 0
+
+
+def test_intersection() -> None:
+    filter = IntersectionFilter(PositiveFilter(), EvenFilter())
+    for i in range(-10, 10):
+        assert filter.accept(i) == (i > 0 and i % 2 == 0)
+    objs = list(range(-10, 10))
+    assert filter.accept_batch(objs) == [i > 0 and i % 2 == 0 for i in objs]
+
+
+def test_union() -> None:
+    filter = UnionFilter(PositiveFilter(), EvenFilter())
+    for i in range(-10, 10):
+        assert filter.accept(i) == (i > 0 or i % 2 == 0)
+    objs = list(range(-10, 10))
+    assert filter.accept_batch(objs) == [i > 0 or i % 2 == 0 for i in objs]
+
+
+def test_adaptive_order() -> None:
+    slow, even = SlowFilter(), EvenFilter()
+    filter = IntersectionFilter(slow, even, reorder_every=20)
+    for i in range(100):
+        assert filter.accept(i) == (i % 2 == 0)
+    assert filter.filters[0] is even
+    stats = dict((id(f), s) for f, s in filter.get_stats())
+    assert stats[id(slow)].decisions == 0
+    assert stats[id(even)].decision_rate > 0.4
+    filter.reset_stats()
+    assert all(s.calls == 0 for _, s in filter.get_stats())
+
+
+def test_not_adaptive() -> None:
+    slow, even = SlowFilter(), EvenFilter()
+    filter = IntersectionFilter(slow, even, adaptive=False, reorder_every=20)
+    for i in range(100):
+        filter.accept(i)
+    assert filter.filters[0] is slow
+
+
+def test_settings_kept() -> None:
+    filter = IntersectionFilter(PositiveFilter(), adaptive=False, reorder_every=20)
+    for composite in [filter & EvenFilter(), EvenFilter() & filter, filter & filter]:
+        assert isinstance(composite, IntersectionFilter)
+        assert not composite.adaptive and composite.reorder_every == 20
+    union = UnionFilter(PositiveFilter(), reorder_every=20) | EvenFilter()
+    assert union.adaptive and union.reorder_every == 20
+    assert len(union.filters) == 2
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "1": INT,
+    "0": INT,
+}
+semantics = {
+    "+": lambda x: lambda y: x + y,
+    "1": 1,
+    "0": 0,
+}
+dsl = DSL(syntax)
+evaluator = DSLEvaluator(dsl.instantiate_semantics(semantics))
+type_request = FunctionType(INT, INT)
+cfg = CFG.depth_constraint(dsl, type_request, 3)
+dfta = add_dfta_constraints(cfg, ["(+ ^0 _)"], progress=False)
+
+
+def test_stateful_filters_stay_last() -> None:
+    # (+ 0 var0) is rejected by the DFTA, var0 has the same outputs and must be accepted
+    programs = [dsl.parse_program(p, type_request) for p in ["(+ 0 var0)", "var0"]]
+    for batch in [False, True]:
+        obs_eq = ObsEqFilter(evaluator, [[i] for i in range(5)])
+        dfta_filter = DFTAFilter(dfta)
+        filter = IntersectionFilter(obs_eq, dfta_filter)
+        assert filter.filters == [dfta_filter, obs_eq]
+        assert not filter.stateless
+        # Observational equivalence looks much cheaper but must not run first
+        filter._stats = [FilterStats(10, 1, 10.0), FilterStats(10, 10, 1e-3)]
+        filter.reorder()
+        assert filter.filters == [dfta_filter, obs_eq]
+        if batch:
+            assert filter.accept_batch(programs) == [False, True]
+        else:
+            assert [filter.accept(p) for p in programs] == [False, True]
@@ -0,0 +1,78 @@
+from synth.filter.obs_eq_filter import ObsEqFilter, __canonical__
+from synth.semantic.evaluator import DSLEvaluator
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import INT, List
+from synth.syntax.type_helper import FunctionType
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "*": FunctionType(INT, INT, INT),
+    "repeat": FunctionType(INT, List(INT)),
+    "1": INT,
+    "0": INT,
+}
+
+semantics = {
+    "+": lambda x: lambda y: x + y,
+    "*": lambda x: lambda y: x * y,
+    "repeat": lambda x: [x, x],
+    "1": 1,
+    "0": 0,
+}
+dsl = DSL(syntax)
+evaluator = DSLEvaluator(dsl.instantiate_semantics(semantics))
+type_request = FunctionType(INT, INT)
+inputs = [[i] for i in range(5)]
+programs = [
+    dsl.parse_program(p, type_request)
+    for p in [
+        "(+ var0 1)",
+        "(+ 1 var0)",
+        "(* var0 1)",
+        "var0",
+        "(repeat (+ var0 0))",
+        "(repeat var0)",
+        "(repeat 1)",
+    ]
+]
+expected = [True, False, True, False, True, False, True]
+
+
+def test_accept() -> None:
+    filter = ObsEqFilter(evaluator, inputs)
+    assert [filter.accept(p) for p in programs] == expected
+    # Programs already seen are still accepted
+    assert filter.accept(programs[0])
+
+
+def test_accept_batch() -> None:
+    filter = ObsEqFilter(evaluator, inputs, confirm_collisions=True)
+    assert filter.accept_batch(programs) == expected
+
+
+def test_max_size() -> None:
+    filter = ObsEqFilter(evaluator, inputs, max_size=1)
+    assert filter.accept(programs[0])
+    assert not filter.accept(programs[1])
+    assert filter.accept(programs[2])
+    # The first program was forgotten
+    assert filter.accept(programs[1])
+    assert len(filter._cache) == 1
+
+
+def test_canonical() -> None:
+    equal = [
+        ([1, 2], (1.0, True + 1)),
+        ({"a", "b", "c"}, {"c", "b", "a"}),
+        ({1: [2], 3: "x"}, {3: "x", 1.0: (2,)}),
+        (
+            frozenset({frozenset({1}), frozenset({2, 3})}),
+            {frozenset({3, 2}), frozenset({1})},
+        ),
+    ]
+    for a, b in equal:
+        assert __canonical__(a) == __canonical__(b)
+    different = [([1, 2], [12]), (["ab"], ["a", "b"]), (1, "1"), (1.5, 1), (None, [])]
+    for a, b in different:
+        assert __canonical__(a) != __canonical__(b)
@@ -6,6 +6,7 @@ from synth.nn.det_grammar_predictor import DetGrammarPredictorLayer
 from synth.nn.abstractions import cfg_bigram_without_depth
 from synth.syntax.grammars.cfg import CFG
 from synth.syntax.dsl import DSL
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.program import Function, Primitive, Variable
 from synth.syntax.type_system import (
     INT,
@@ -197,3 +198,130 @@ def test_learning_mse() -> None:
         assert mean_prob[i - 1] < mean_prob[i], f"{mean_prob}"
 
     assert mean_prob[-1] > 0.12
+
+
+def test_tensor2prob_grammars() -> None:
+    layer = DetGrammarPredictorLayer(50, {cfg2, cfg}, cfg_bigram_without_depth)
+    generator = torch.manual_seed(0)
+    x = torch.randn((6, 50), generator=generator)
+    y = layer(x)
+    type_requests = [cfg.type_request, cfg2.type_request] * 3
+    pcfgs = layer.tensor2prob_grammars(y, type_requests)
+    for i, (pcfg, type_request) in enumerate(zip(pcfgs, type_requests)):
+        log_pcfg = layer.tensor2log_prob_grammar(y[i], type_request)
+        assert pcfg.grammar == log_pcfg.grammar
+        for S in log_pcfg.rules:
+            for P in log_pcfg.rules[S]:
+                target = np.exp(log_pcfg.tags[S][P].item())
+                assert np.isclose(pcfg.probabilities[S][P], target)
+        weights = layer.tensor2log_prob_weights(y, type_request)
+        assert weights.shape == (6, len(log_pcfg.indexed_rules()))
+
+
+def test_encode_batch() -> None:
+    layer = DetGrammarPredictorLayer(10, {cfg2, cfg}, cfg_bigram_without_depth)
+    programs = [
+        Function(
+            Primitive("+", FunctionType(INT, INT, INT)),
+            [Variable(0, INT), Primitive("1", INT)],
+        ),
+        Function(
+            Primitive("-", FunctionType(INT, INT, INT)),
+            [Variable(1, INT), Variable(1, INT)],
+        ),
+    ]
+    type_requests = [cfg.type_request, cfg2.type_request]
+    target = layer.encode_batch(programs, type_requests)
+    assert target.shape == (2, layer.output_size)
+    for i, (program, type_request) in enumerate(zip(programs, type_requests)):
+        assert torch.equal(target[i], layer.encode(program, type_request))
+        primitives = [P for P in program.depth_first_iter() if isinstance(P, Primitive)]
+        assert target[i].sum().item() == len(primitives)
+        assert (
+            layer.encode_indices(program, type_request)
+            == target[i].nonzero(as_tuple=True)[0].tolist()
+        )
+
+
+def test_lazy_grammars_from_index(tmp_path) -> None:
+    layer = DetGrammarPredictorLayer(50, {cfg2, cfg}, cfg_bigram_without_depth)
+    torch.save(layer.state_dict(), tmp_path / "layer.pt")
+    state = torch.load(tmp_path / "layer.pt", mmap=True, weights_only=False)
+    built = []
+    grammars = LazyRules(
+        lambda t: built.append(t) or {c.type_request: c for c in [cfg, cfg2]}.get(t)
+    )
+    loaded = DetGrammarPredictorLayer(
+        50, grammars, cfg_bigram_without_depth, index=state["_extra_state"]
+    )
+    loaded.load_state_dict(state)
+    assert built == []
+    assert loaded.output_size == layer.output_size
+    x = torch.randn((3, 50), generator=torch.manual_seed(0))
+    assert torch.equal(loaded(x), layer(x))
+    out = loaded.tensor2log_prob_weights(loaded(x), cfg.type_request)
+    assert torch.equal(out, layer.tensor2log_prob_weights(layer(x), cfg.type_request))
+    assert built == [cfg.type_request]
+
+
+def test_log_probabilities_batch() -> None:
+    layer = DetGrammarPredictorLayer(50, {cfg2, cfg}, cfg_bigram_without_depth)
+    programs = [
+        Function(
+            Primitive("+", FunctionType(INT, INT, INT)),
+            [Variable(0, INT), Primitive("1", INT)],
+        ),
+        Function(
+            Primitive("-", FunctionType(INT, INT, INT)),
+            [Variable(1, INT), Variable(1, INT)],
+        ),
+        Variable(1, INT),
+    ]
+    type_requests = [cfg.type_request, cfg2.type_request, cfg.type_request]
+    x = torch.randn((3, 50), generator=torch.manual_seed(0), requires_grad=True)
+    y = layer(x)
+    out = layer.log_probabilities_batch(programs, type_requests, y)
+    assert out[2].item() == -np.inf
+    target = torch.stack(
+        [
+            layer.tensor2log_prob_grammar(y[i], type_requests[i])
+            .log_probability(programs[i])
+            .reshape(())
+            for i in range(2)
+        ]
+    )
+    assert torch.allclose(out[:2], target)
+    (grad,) = torch.autograd.grad(out[:2].sum(), x, retain_graph=True)
+    (target_grad,) = torch.autograd.grad(target.sum(), x)
+    assert torch.allclose(grad, target_grad, atol=1e-6)
+
+
+def test_log_probabilities() -> None:
+    layer = DetGrammarPredictorLayer(50, {cfg2, cfg}, cfg_bigram_without_depth)
+    programs = [
+        Function(
+            Primitive("+", FunctionType(INT, INT, INT)),
+            [Variable(0, INT), Primitive("1", INT)],
+        ),
+        Function(
+            Primitive("-", FunctionType(INT, INT, INT)),
+            [Variable(1, INT), Variable(1, INT)],
+        ),
+        Variable(1, INT),
+        Primitive("1", INT),
+    ]
+    type_requests = [cfg.type_request, cfg2.type_request, cfg.type_request] * 2
+    x = torch.randn((3, 50), generator=torch.manual_seed(0), requires_grad=True)
+    y = layer(x)
+    log_pgrammars = [
+        layer.tensor2log_prob_grammar(y[i], type_requests[i]) for i in range(3)
+    ]
+    # The first grammar is used twice
+    log_pgrammars.append(log_pgrammars[0])
+    out = layer.log_probabilities(programs, log_pgrammars)
+    assert out[2].item() == -np.inf
+    target = layer.log_probabilities_batch(programs, type_requests[:4], y[[0, 1, 2, 0]])
+    assert torch.allclose(out[[0, 1, 3]], target[[0, 1, 3]])
+    (grad,) = torch.autograd.grad(out[[0, 1, 3]].sum(), x, retain_graph=True)
+    (target_grad,) = torch.autograd.grad(target[[0, 1, 3]].sum(), x)
+    assert torch.allclose(grad, target_grad, atol=1e-6)
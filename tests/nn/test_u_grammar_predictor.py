@@ -6,6 +6,7 @@ from synth.nn.abstractions import ucfg_bigram
 from synth.nn.u_grammar_predictor import UGrammarPredictorLayer
 from synth.syntax.grammars.u_cfg import UCFG
 from synth.syntax.dsl import DSL
+from synth.syntax.grammars.lazy_rules import LazyRules
 from synth.syntax.program import Function, Primitive, Variable
 from synth.syntax.type_system import (
     INT,
@@ -201,3 +202,101 @@ def test_learning_mse() -> None:
         assert mean_prob[i - 1] < mean_prob[i], f"{mean_prob}"
 
     assert mean_prob[-1] > 0.12
+
+
+def test_tensor2prob_grammars() -> None:
+    layer = UGrammarPredictorLayer(50, {cfg2, cfg}, ucfg_bigram)
+    generator = torch.manual_seed(0)
+    x = torch.randn((6, 50), generator=generator)
+    y = layer(x)
+    type_requests = [cfg.type_request, cfg2.type_request] * 3
+    pcfgs = layer.tensor2prob_grammars(y, type_requests)
+    for i, (pcfg, type_request) in enumerate(zip(pcfgs, type_requests)):
+        target = layer.tensor2log_prob_grammar(y[i], type_request).to_prob_u_grammar()
+        assert pcfg.grammar == target.grammar
+        for S in target.rules:
+            for P in target.rules[S]:
+                for v, p in target.probabilities[S][P].items():
+                    assert np.isclose(pcfg.probabilities[S][P][v], p)
+        for S, p in target.start_probabilities.items():
+            assert np.isclose(pcfg.start_probabilities[S], p)
+
+
+def test_encode_batch() -> None:
+    layer = UGrammarPredictorLayer(10, {cfg2, cfg}, ucfg_bigram)
+    programs = [
+        Function(
+            Primitive("+", FunctionType(INT, INT, INT)),
+            [Variable(0, INT), Primitive("1", INT)],
+        ),
+        Function(
+            Primitive("-", FunctionType(INT, INT, INT)),
+            [Variable(1, INT), Variable(1, INT)],
+        ),
+    ]
+    type_requests = [cfg.type_request, cfg2.type_request]
+    target = layer.encode_batch(programs, type_requests)
+    assert target.shape == (2, layer.output_size)
+    for i, (program, type_request) in enumerate(zip(programs, type_requests)):
+        assert torch.equal(target[i], layer.encode(program, type_request))
+        primitives = [P for P in program.depth_first_iter() if isinstance(P, Primitive)]
+        assert target[i].sum().item() == len(primitives)
+        assert (
+            layer.encode_indices(program, type_request)
+            == target[i].nonzero(as_tuple=True)[0].tolist()
+        )
+
+
+def test_lazy_grammars_from_index(tmp_path) -> None:
+    layer = UGrammarPredictorLayer(50, {cfg2, cfg}, ucfg_bigram)
+    torch.save(layer.state_dict(), tmp_path / "layer.pt")
+    state = torch.load(tmp_path / "layer.pt", mmap=True, weights_only=False)
+    built = []
+    grammars = LazyRules(
+        lambda t: built.append(t) or {c.type_request: c for c in [cfg, cfg2]}.get(t)
+    )
+    loaded = UGrammarPredictorLayer(
+        50, grammars, ucfg_bigram, index=state["_extra_state"]
+    )
+    loaded.load_state_dict(state)
+    assert built == []
+    assert loaded.output_size == layer.output_size
+    x = torch.randn((3, 50), generator=torch.manual_seed(0))
+    assert torch.equal(loaded(x), layer(x))
+    out = loaded.tensor2log_prob_weights(loaded(x), cfg.type_request)
+    target = layer.tensor2log_prob_weights(layer(x), cfg.type_request)
+    for a, b in zip(out, target):
+        assert torch.equal(a, b)
+    assert built == [cfg.type_request]
+
+
+def test_log_probabilities_batch() -> None:
+    layer = UGrammarPredictorLayer(50, {cfg2, cfg}, ucfg_bigram)
+    programs = [
+        Function(
+            Primitive("+", FunctionType(INT, INT, INT)),
+            [Variable(0, INT), Primitive("1", INT)],
+        ),
+        Function(
+            Primitive("-", FunctionType(INT, INT, INT)),
+            [Variable(1, INT), Variable(1, INT)],
+        ),
+        Variable(1, INT),
+    ]
+    type_requests = [cfg.type_request, cfg2.type_request, cfg.type_request]
+    x = torch.randn((3, 50), generator=torch.manual_seed(0), requires_grad=True)
+    y = layer(x)
+    out = layer.log_probabilities_batch(programs, type_requests, y)
+    assert out[2].item() == -np.inf
+    target = torch.stack(
+        [
+            layer.tensor2log_prob_grammar(y[i], type_requests[i])
+            .log_probability(programs[i])
+            .reshape(())
+            for i in range(2)
+        ]
+    )
+    assert torch.allclose(out[:2], target)
+    (grad,) = torch.autograd.grad(out[:2].sum(), x, retain_graph=True)
+    (target_grad,) = torch.autograd.grad(target.sum(), x)
+    assert torch.allclose(grad, target_grad, atol=1e-6)
@@ -0,0 +1,66 @@
+import torch
+import torch.nn as nn
+from torch import Tensor
+from torch.nn.utils.rnn import PackedSequence, pack_sequence
+
+from synth.nn.utils import AutoPack, BucketBatchSampler, optimize_for_cpu_inference
+
+
+def test_autopack() -> None:
+    generator = torch.manual_seed(0)
+    packer = AutoPack()
+    for _ in range(20):
+        x = [
+            torch.randn((int(length), 5), generator=generator)
+            for length in torch.randint(1, 30, (10,), generator=generator)
+        ]
+        packed = packer(x)
+        target = pack_sequence(x, enforce_sorted=False)
+        assert torch.equal(packed.data, target.data)
+        assert torch.equal(packed.batch_sizes, target.batch_sizes)
+        assert torch.equal(packed.sorted_indices, target.sorted_indices)
+        assert torch.equal(packed.unsorted_indices, target.unsorted_indices)
+
+
+def test_bucket_batch_sampler() -> None:
+    torch.manual_seed(0)
+    lengths = torch.randint(1, 100, (1037,)).tolist()
+    sampler = BucketBatchSampler(lengths, 16, bucket_factor=4)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 16
+        assert [lengths[i] for i in batch] == sorted(lengths[i] for i in batch)
+    sampler = BucketBatchSampler(lengths, 16, bucket_factor=4, drop_last=True)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert all(len(batch) == 16 for batch in batches)
+
+
+class _Model(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.rnn = nn.LSTM(8, 16, 1)
+        self.output = nn.Linear(16, 4)
+
+    def forward(self, seq: PackedSequence) -> Tensor:
+        _, (y, _) = self.rnn(seq)
+        return self.output(y.squeeze(0))
+
+
+def test_optimize_for_cpu_inference() -> None:
+    generator = torch.manual_seed(0)
+    model = _Model().eval()
+    x = pack_sequence(
+        [torch.randn((length, 8), generator=generator) for length in [3, 7, 5]],
+        enforce_sorted=False,
+    )
+    with torch.no_grad():
+        target = model(x)
+        scripted = optimize_for_cpu_inference(model, quantize=False)
+        assert torch.allclose(scripted(x), target, atol=1e-6)
+        quantized = optimize_for_cpu_inference(model)
+        assert torch.allclose(quantized(x), target, atol=5e-2)
+        # The model itself is left untouched
+        assert torch.equal(model(x), target)
@@ -1,8 +1,9 @@
 import random
 
 import torch
+from torch.utils.data import DataLoader
 
-from synth.pbe.io_encoder import IOEncoder
+from synth.pbe.io_encoder import IOEncoder, EncodedIODataset
 
 from synth.task import Task, Dataset
 from synth.specification import PBE, Example
@@ -13,9 +14,9 @@ from synth.syntax.type_system import (
 from synth.syntax.type_helper import FunctionType
 
 
-def test_encoding() -> None:
+def __random_dataset__() -> Dataset[PBE]:
     random.seed(0)
-    dataset = Dataset(
+    return Dataset(
         [
             Task(
                 FunctionType(INT, List(INT), INT),
@@ -34,6 +35,10 @@ def test_encoding() -> None:
         ],
         metadata={"something": False, "else": "is", "coming": 42},
     )
+
+
+def test_encoding() -> None:
+    dataset = __random_dataset__()
     for output_dim in [32, 64, 512]:
         encoder = IOEncoder(output_dim, list(range(100 + 1)))
         for task in dataset:
@@ -43,3 +48,55 @@ def test_encoding() -> None:
             )
             assert torch.min(encoded).item() >= 0
             assert torch.max(encoded).item() < len(encoder.lexicon)
+
+
+def test_encoded_dataset(tmp_path) -> None:
+    dataset = __random_dataset__()
+    encoder = IOEncoder(32, list(range(100 + 1)))
+    path = str(tmp_path / "ios")
+    encoded = EncodedIODataset.cache(encoder, dataset, path)
+    assert len(encoded) == len(dataset)
+    for i, task in enumerate(dataset):
+        j, ios = encoded[i]
+        assert j == i
+        assert torch.equal(ios, encoder.encode(task))
+    # Same tasks: the files are reused
+    assert EncodedIODataset.cache(encoder, dataset, path).ios.shape[1] == 32
+    # Other dimension: the files are rebuilt
+    encoder = IOEncoder(64, list(range(100 + 1)))
+    encoded = EncodedIODataset.cache(encoder, dataset, path)
+    assert encoded.ios.shape[1] == 64
+    # Same number of examples but other contents or lexicon: the files are rebuilt
+    other = Dataset(
+        [
+            Task(
+                task.type_request,
+                PBE(
+                    [
+                        Example(ex.inputs, (ex.output + 1) % 101)
+                        for ex in task.specification.examples
+                    ]
+                ),
+            )
+            for task in dataset
+        ]
+    )
+    for other_encoder, tasks in [
+        (encoder, other),
+        (IOEncoder(64, list(range(-10, 100 + 1))), dataset),
+    ]:
+        encoded = EncodedIODataset.cache(other_encoder, tasks, path)
+        assert all(
+            torch.equal(encoded[i][1], other_encoder.encode(task))
+            for i, task in enumerate(tasks)
+        )
+    encoded = EncodedIODataset.cache(encoder, dataset, path)
+    loader = DataLoader(
+        encoded, batch_size=16, shuffle=True, collate_fn=EncodedIODataset.collate
+    )
+    seen = 0
+    for indices, batch in loader:
+        for i, ios in zip(indices, batch):
+            assert torch.equal(ios, encoder.encode(dataset[i]))
+        seen += len(indices)
+    assert seen == len(dataset)
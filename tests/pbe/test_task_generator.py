@@ -81,4 +81,21 @@ def test_seed() -> None:
         assert g1.generate_task() == g2.generate_task()
 
 
+def test_uniques() -> None:
+    pcfg = ProbDetGrammar.uniform(CFG.depth_constraint(dsl, type_req, max_depth))
+    pcfg.init_sampling(10)
+    g = TaskGenerator(
+        LexiconSampler(int_lexicon, seed=10),
+        DSLEvaluator(dsl.instantiate_semantics(semantics)),
+        LexiconSampler([type_req], seed=10),
+        LexiconSampler([2, 3, 4], [0.25, 0.5, 0.25], seed=10),
+        {pcfg},
+        validator,
+        uniques=True,
+    )
+    solutions = [g.generate_task().solution for _ in range(50)]
+    assert len(set(solutions)) == len(solutions)
+    assert all(solution.used_variables() == {0} for solution in solutions)
+
+
 test_gen()
@@ -52,3 +52,19 @@ def test_none_missing(splits: int) -> None:
         new_seen |= a
     assert len(new_seen.difference(seen)) == 0, new_seen.difference(seen)
     assert len(seen.difference(new_seen)) == 0, seen.difference(new_seen)
+
+
+def test_conditional_probabilities() -> None:
+    pcfg = ProbUGrammar.random(pucfg.grammar, seed=1)
+    fragments, _ = split(pcfg, 8, desired_ratio=1.05)
+    new_seen = set()
+    for sub_pcfg in fragments:
+        ratios = set()
+        for program in enumerate_prob_u_grammar(sub_pcfg):
+            assert program not in new_seen
+            new_seen.add(program)
+            ratios.add(
+                round(sub_pcfg.probability(program) / pcfg.probability(program), 6)
+            )
+        assert len(ratios) == 1
+    assert new_seen == seen
@@ -134,3 +134,19 @@ def test_infinite() -> None:
         if count < 0:
             break
     assert count == -1
+
+
+def test_lazy_initialisation() -> None:
+    cfg1 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), 10)
+    cfg2 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), 5)
+    eager = cfg1 * cfg2
+    lazy = cfg1.product(cfg2, lazy=True)
+    programs = enumerate_prob_grammar(ProbDetGrammar.uniform(lazy)).generator()
+    seen = {next(programs)}
+    # The first program is a terminal, only the start non-terminal is expanded
+    assert len(lazy.rules) == 1
+    for _ in range(4):
+        seen.add(next(programs))
+    assert len(lazy.rules) < len(eager.rules)
+    seen.update(programs)
+    assert len(seen) == eager.programs()
@@ -0,0 +1,117 @@
+import time
+from typing import Optional
+
+import pytest
+
+from synth.syntax.grammars.enumeration.u_heap_search import enumerate_prob_u_grammar
+from synth.syntax.grammars.enumeration.grammar_splitter import (
+    __pcfg_from__,
+    __split_nodes_until_quantity_reached__,
+)
+from synth.syntax.grammars.enumeration.parallel_enumeration import (
+    __give_away__,
+    enumerate_in_parallel,
+)
+from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
+from synth.syntax.grammars.u_cfg import UCFG
+from synth.syntax.dsl import DSL
+from synth.syntax.program import Program
+from synth.syntax.type_system import (
+    INT,
+    STRING,
+    List,
+    PolymorphicType,
+    PrimitiveType,
+)
+from synth.syntax.type_helper import FunctionType
+
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "-": FunctionType(INT, INT, INT),
+    "head": FunctionType(List(PolymorphicType("a")), PolymorphicType("a")),
+    "non_reachable": PrimitiveType("non_reachable"),
+    "1": INT,
+    "non_productive": FunctionType(INT, STRING),
+}
+dsl = DSL(syntax)
+pucfg = ProbUGrammar.random(
+    UCFG.depth_constraint(dsl, FunctionType(INT, INT), 3), seed=1
+)
+seen = set()
+for program in enumerate_prob_u_grammar(pucfg):
+    seen.add(program)
+
+
+def keep_all(program: Program, probability: float) -> Optional[str]:
+    return str(program)
+
+
+def keep_plus(program: Program, probability: float) -> Optional[str]:
+    return "found" if str(program).startswith("(+") else None
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_unicity_and_none_missing(workers: int) -> None:
+    new_seen = set()
+    for program, probability, out in enumerate_in_parallel(
+        pucfg, keep_all, workers=workers
+    ):
+        assert program not in new_seen
+        assert out == str(program)
+        assert probability == pucfg.probability(program)
+        new_seen.add(program)
+    assert new_seen == seen
+
+
+def test_threshold() -> None:
+    threshold = 1e-3
+    found = {
+        program
+        for program, _, _ in enumerate_in_parallel(
+            pucfg, keep_all, workers=2, threshold=threshold
+        )
+    }
+    assert found == {p for p in seen if pucfg.probability(p) >= threshold}
+
+
+def test_early_stop() -> None:
+    gen = enumerate_in_parallel(pucfg, keep_plus, workers=2)
+    program, _, out = next(gen)
+    gen.close()
+    assert out == "found"
+    assert str(program).startswith("(+")
+
+
+def test_give_away() -> None:
+    node = max(
+        __split_nodes_until_quantity_reached__(pucfg, 2, lambda p: 1.0),
+        key=lambda node: len(
+            list(enumerate_prob_u_grammar(__pcfg_from__(pucfg, [node])))
+        ),
+    )
+    programs = set(enumerate_prob_u_grammar(__pcfg_from__(pucfg, [node])))
+    kept, given = __give_away__(pucfg, [node], lambda p: p)
+    assert kept and given
+    kept_programs = set(enumerate_prob_u_grammar(__pcfg_from__(pucfg, kept)))
+    given_programs = set(enumerate_prob_u_grammar(__pcfg_from__(pucfg, given)))
+    assert not kept_programs & given_programs
+    assert kept_programs | given_programs == programs
+
+
+def slow_keep_all(program: Program, probability: float) -> Optional[str]:
+    time.sleep(1e-3)
+    return str(program)
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_work_stealing(workers: int) -> None:
+    # All partial programs look as costly so the split is skewed and idle workers steal
+    found = [
+        program
+        for program, _, _ in enumerate_in_parallel(
+            pucfg, slow_keep_all, workers=workers, cost=lambda p: 1.0, granularity=1
+        )
+    ]
+    assert len(found) == len(set(found))
+    assert set(found) == seen
@@ -1,3 +1,5 @@
+import pickle
+
 from synth.syntax.grammars.cfg import CFG
 from synth.syntax.dsl import DSL
 from synth.syntax.program import Primitive
@@ -67,3 +69,28 @@ def test_infinite() -> None:
             res in cfg
         ), f"Program depth:{res.depth()} should be in the infinite TTCFG"
         res = dsl.parse_program(f"(+ {res} var0)", FunctionType(INT, INT))
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_arguments_non_terminals(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    program = dsl.parse_program("1", FunctionType(INT, INT))
+    for S in cfg.rules:
+        for P in cfg.rules[S]:
+            expected = [(arg[0], (arg[1], None)) for arg in cfg.rules[S][P][0]]
+            assert cfg.arguments_non_terminals(S, P) == expected
+            # Generic implementation
+            assert super(CFG, cfg).arguments_non_terminals(S, P, [program]) == expected
+
+
+def test_pickle_without_caches() -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), 5)
+    size = len(pickle.dumps(cfg))
+    for S in cfg.rules:
+        for P in cfg.rules[S]:
+            cfg.arguments_non_terminals(S, P)
+    rules = cfg.indexed_rules()
+    assert len(pickle.dumps(cfg)) == size
+    loaded = pickle.loads(pickle.dumps(cfg))
+    assert loaded == cfg
+    assert loaded.indexed_rules() == rules
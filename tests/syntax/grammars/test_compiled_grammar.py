@@ -0,0 +1,77 @@
+import numpy as np
+
+from synth.syntax.grammars.compiled_grammar import CompiledProbDetGrammar
+from synth.syntax.grammars.enumeration.heap_search import enumerate_prob_grammar
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
+from synth.syntax.grammars.cfg import CFG
+from synth.syntax.dsl import DSL
+from synth.syntax.type_system import (
+    INT,
+    STRING,
+    List,
+    PolymorphicType,
+    PrimitiveType,
+)
+from synth.syntax.type_helper import FunctionType
+
+import pytest
+
+syntax = {
+    "+": FunctionType(INT, INT, INT),
+    "-": FunctionType(INT, INT, INT),
+    "head": FunctionType(List(PolymorphicType("a")), PolymorphicType("a")),
+    "non_reachable": PrimitiveType("non_reachable"),
+    "1": INT,
+    "2": INT,
+    "non_productive": FunctionType(INT, STRING),
+}
+dsl = DSL(syntax)
+max_depths = [2, 3]
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_tables(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    pcfg = ProbDetGrammar.random(cfg, 1)
+    compiled = CompiledProbDetGrammar(pcfg)
+    assert compiled.non_terminals[compiled.start] == cfg.start
+    for i, S in enumerate(compiled.non_terminals):
+        rules = compiled.rules_for(i)
+        assert len(rules) == len(cfg.rules[S])
+        for r in rules:
+            assert compiled.rule_non_terminal[r] == i
+            P = compiled.rule_program(r)
+            assert compiled.rule_of[i, compiled.letter_id[P]] == r
+            assert np.isclose(compiled.probabilities[r], pcfg.probabilities[S][P])
+            args = cfg.rules[S][P][0]
+            assert compiled.nargs[r] == len(args)
+            for j, arg in enumerate(args):
+                assert compiled.non_terminals[compiled.arguments[r, j]] == (
+                    arg[0],
+                    (arg[1], None),
+                )
+    with pytest.raises(ValueError):
+        compiled.probabilities[0] = 0
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_probability(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    pcfg = ProbDetGrammar.random(cfg, 1)
+    compiled = CompiledProbDetGrammar(pcfg)
+    for program in enumerate_prob_grammar(pcfg):
+        p = pcfg.probability(program)
+        assert np.isclose(compiled.probability(program), p)
+        assert np.isclose(compiled.log_probability(program), np.log(p))
+    too_deep = "(+ 1 " * max_depth + "1" + ")" * max_depth
+    assert compiled.derivations(dsl.parse_program(too_deep, INT)) is None
+
+
+def test_from_weights() -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), 3)
+    pcfg = ProbDetGrammar.random(cfg, 1)
+    compiled = CompiledProbDetGrammar(pcfg)
+    other = CompiledProbDetGrammar(ProbDetGrammar.from_weights(cfg, pcfg.weights()))
+    assert np.allclose(compiled.probabilities, other.probabilities)
+    # Tables that do not depend on probabilities are shared
+    assert compiled.arguments is other.arguments
@@ -0,0 +1,33 @@
+from synth.syntax.grammars.lazy_rules import LazyRules
+
+
+def test_expand_once() -> None:
+    calls = []
+
+    def expand(n: int) -> dict:
+        calls.append(n)
+        return {n + 1: n} if n < 3 else None
+
+    rules = LazyRules(expand)
+    assert len(rules) == 0
+    assert 0 in rules
+    assert rules[0] == {1: 0}
+    assert rules.get(1) == {2: 1}
+    assert 3 not in rules
+    assert rules.get(3, "absent") == "absent"
+    assert 3 not in rules
+    assert list(rules) == [0, 1]
+    assert calls == [0, 1, 3]
+    try:
+        rules[4]
+        assert False
+    except KeyError:
+        pass
+
+
+def test_map() -> None:
+    rules = LazyRules(lambda n: {n + 1: n} if n < 3 else None)
+    doubled = rules.map(lambda n, r: {P: 2 * v for P, v in r.items()})
+    assert doubled[2] == {3: 4}
+    assert 5 not in doubled
+    assert list(rules) == [2]
@@ -1,3 +1,5 @@
+import pickle
+
 import numpy as np
 
 from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
@@ -83,3 +85,91 @@ def test_depth(max_depth: int) -> None:
     g = pcfg.sampling()
     for _ in range(200):
         assert next(g).depth() <= max_depth
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_log_probability_batch(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    pcfg = ProbDetGrammar.random(cfg, seed=0)
+    pcfg.init_sampling(0)
+    g = pcfg.sampling()
+    programs = [next(g) for _ in range(50)]
+    programs.append(
+        dsl.parse_program("(+ 1 (+ 1 (+ 1 (+ 1 (+ 1 (+ 1 1))))))", cfg.type_request)
+    )
+    log_probs = pcfg.log_probability_batch(programs)
+    for program, log_prob in zip(programs, log_probs):
+        assert np.isclose(np.exp(log_prob), pcfg.probability(program))
+    assert np.isclose(
+        np.exp(log_probs[:-1]), pcfg.probability_batch(programs[:-1])
+    ).all()
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_sample_programs(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT, INT), max_depth)
+    pcfg = ProbDetGrammar.random(cfg, seed=1)
+    pcfg.init_sampling(0)
+    programs = pcfg.sample_programs(200)
+    assert len(programs) == 200
+    for program in programs:
+        assert program in cfg
+        assert program.depth() <= max_depth
+    programs = pcfg.sample_programs(50, unique=True, use_all_variables=True)
+    assert len(set(programs)) == len(programs)
+    for program in programs:
+        assert program.used_variables() == {0, 1}
+    excluded = pcfg.sample_programs(50, unique=True, exclude=set(programs))
+    assert not set(excluded) & set(programs)
+    # A seed of 0 still seeds batch sampling
+    other = ProbDetGrammar.random(cfg, seed=1)
+    other.init_sampling(0)
+    pcfg.init_sampling(0)
+    assert other.sample_programs(50) == pcfg.sample_programs(50)
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_dense_operations(max_depth: int) -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    pcfg = ProbDetGrammar.random(cfg, seed=1)
+    other = ProbDetGrammar.random(cfg, seed=2)
+    weights = pcfg.weights()
+    for i, (S, P) in enumerate(pcfg.indexed_rules()):
+        assert weights[i] == pcfg.probabilities[S][P]
+    assert ProbDetGrammar.from_weights(cfg, weights) == pcfg
+    mixed = pcfg * 3 + other
+    for S in cfg.rules:
+        for P in cfg.rules[S]:
+            assert np.isclose(
+                mixed.probabilities[S][P],
+                3 * pcfg.probabilities[S][P] + other.probabilities[S][P],
+            )
+    mixed = pcfg * 3 + other
+    mixed.normalise()
+    expected = pcfg * 3 + other
+    # Normalise the materialised probabilities
+    expected.probabilities
+    expected.normalise()
+    uniform = ProbDetGrammar.uniform(cfg)
+    for S in cfg.rules:
+        assert np.isclose(sum(mixed.probabilities[S].values()), 1)
+        for P in cfg.rules[S]:
+            assert np.isclose(mixed.probabilities[S][P], expected.probabilities[S][P])
+            assert uniform.probabilities[S][P] == 1 / len(cfg.rules[S])
+
+
+def test_lazy_tags() -> None:
+    cfg = CFG.depth_constraint(dsl, FunctionType(INT, INT), 3)
+    pcfg = ProbDetGrammar.random(cfg, seed=1)
+    lazy = ProbDetGrammar.from_weights(cfg, pcfg.weights())
+    assert pickle.loads(pickle.dumps(lazy)) == pcfg
+    assert lazy.tags == pcfg.tags
+    assert np.array_equal(lazy.weights(), pcfg.weights())
+    # Grammars pickled when tags was an attribute
+    state = dict(pcfg.__getstate__())
+    state["tags"] = state.pop("_tags")
+    del state["_weights"]
+    old = ProbDetGrammar.__new__(ProbDetGrammar)
+    old.__setstate__(state)
+    assert old == pcfg
+    assert np.array_equal(old.weights(), pcfg.weights())
@@ -1,3 +1,5 @@
+import pickle
+
 import numpy as np
 
 from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
@@ -85,3 +87,49 @@ def test_depth(max_depth: int) -> None:
     g = pcfg.sampling()
     for _ in range(200):
         assert next(g).depth() <= max_depth
+
+
+@pytest.mark.parametrize("max_depth", max_depths)
+def test_dense_operations(max_depth: int) -> None:
+    cfg = UCFG.depth_constraint(dsl, FunctionType(INT, INT), max_depth)
+    pcfg = ProbUGrammar.random(cfg, seed=1)
+    other = ProbUGrammar.random(cfg, seed=2)
+    assert ProbUGrammar.from_weights(cfg, pcfg.weights(), pcfg.start_tags) == pcfg
+    mixed = pcfg * 3 + other
+    for S in cfg.rules:
+        for P in cfg.rules[S]:
+            for v, p in pcfg.probabilities[S][P].items():
+                assert np.isclose(
+                    mixed.probabilities[S][P][v], 3 * p + other.probabilities[S][P][v]
+                )
+    mixed = pcfg * 3 + other
+    mixed.normalise()
+    expected = pcfg * 3 + other
+    # Normalise the materialised probabilities
+    expected.probabilities
+    expected.normalise()
+    for S in cfg.rules:
+        total = 0
+        for P in cfg.rules[S]:
+            for v, p in expected.probabilities[S][P].items():
+                assert np.isclose(mixed.probabilities[S][P][v], p)
+                total += p
+        assert np.isclose(total, 1)
+    assert np.isclose(sum(mixed.start_probabilities.values()), 1)
+
+
+def test_lazy_tags() -> None:
+    cfg = UCFG.depth_constraint(dsl, FunctionType(INT, INT), 3)
+    pcfg = ProbUGrammar.random(cfg, seed=1)
+    lazy = ProbUGrammar.from_weights(cfg, pcfg.weights(), pcfg.start_tags)
+    assert pickle.loads(pickle.dumps(lazy)).tags == pcfg.tags
+    assert lazy.tags == pcfg.tags
+    assert np.array_equal(lazy.weights(), pcfg.weights())
+    # Grammars pickled when tags was an attribute
+    state = dict(pcfg.__getstate__())
+    state["tags"] = state.pop("_tags")
+    del state["_weights"]
+    old = ProbUGrammar.__new__(ProbUGrammar)
+    old.__setstate__(state)
+    assert old == pcfg
+    assert np.array_equal(old.weights(), pcfg.weights())
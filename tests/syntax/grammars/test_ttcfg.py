@@ -1,3 +1,5 @@
+from synth.syntax.grammars.enumeration.heap_search import enumerate_prob_grammar
+from synth.syntax.grammars.tagged_det_grammar import ProbDetGrammar
 from synth.syntax.grammars.ttcfg import TTCFG
 from synth.syntax.dsl import DSL
 from synth.syntax.program import Primitive
@@ -105,3 +107,69 @@ def test_product() -> None:
     assert (
         res not in cfg
     ), f"Program size:{res.size()} should NOT be in the TTCFG max_size:{max_size}"
+
+
+@pytest.mark.parametrize("max_size", max_sizes)
+def test_arguments_non_terminals(max_size: int) -> None:
+    cfg = TTCFG.size_constraint(dsl, FunctionType(INT, INT), max_size)
+    program = dsl.parse_program("(+ 1 var0)", FunctionType(INT, INT))
+    plus = program.function
+    for S in cfg.rules:
+        if plus not in cfg.rules[S]:
+            continue
+        args = [dsl.parse_program("1", INT), dsl.parse_program("var0", INT)]
+        try:
+            _, derivation = cfg.derive_all(cfg.start_information(), S, program)
+        except KeyError:
+            # The program is too large for this non-terminal
+            continue
+        # derivation is S followed by the non-terminals after each derivation
+        assert cfg.arguments_non_terminals(S, plus, args) == derivation[1:3]
+        assert cfg.arguments_non_terminals(S, plus) == derivation[1:2]
+
+
+def test_lazy_product() -> None:
+    max_size = 5
+    cfg1 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), max_size * 2)
+    cfg2 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), max_size)
+    eager = cfg1 * cfg2
+    lazy = cfg1.product(cfg2, lazy=True)
+    assert len(lazy.rules) == 0
+    assert lazy.type_request == eager.type_request
+    peager = ProbDetGrammar.uniform(eager)
+    plazy = ProbDetGrammar.uniform(lazy)
+    for program in enumerate_prob_grammar(plazy):
+        assert program in eager
+        assert plazy.probability(program) == pytest.approx(peager.probability(program))
+    assert 0 < len(lazy.rules) <= len(eager.rules)
+    for S in lazy.rules:
+        assert lazy.rules[S] == eager.rules[S]
+
+
+def test_lazy_operations() -> None:
+    cfg1 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), 10)
+    cfg2 = TTCFG.size_constraint(dsl, FunctionType(INT, INT), 5)
+    lazy = cfg1.product(cfg2, lazy=True)
+    plazy = ProbDetGrammar.uniform(lazy)
+    h = hash(lazy)
+    random = ProbDetGrammar.random(lazy, seed=1)
+    programs = list(enumerate_prob_grammar(plazy))
+    # Expanding the grammar changes neither its hash nor the layout of its weights
+    assert hash(lazy) == h
+    assert len(plazy.weights()) == len(lazy.indexed_rules())
+    doubled = plazy * 2.0
+    summed = plazy + doubled
+    doubled.normalise()
+    summed.normalise()
+    dense = ProbDetGrammar.from_weights(lazy, plazy.weights())
+    for program in programs:
+        probability = plazy.probability(program)
+        assert probability > 0
+        assert doubled.probability(program) == pytest.approx(probability)
+        assert summed.probability(program) == pytest.approx(probability)
+        assert dense.probability(program) == pytest.approx(probability)
+        assert random.probability(program) > 0
+    for S in lazy.rules:
+        assert sum(random.probabilities[S].values()) == pytest.approx(1)
+    with pytest.raises(AssertionError):
+        lazy.primitives_used()
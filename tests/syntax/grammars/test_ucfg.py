@@ -1,4 +1,7 @@
+from synth.filter.constraints import add_dfta_constraints
 from synth.syntax.grammars.cfg import CFG
+from synth.syntax.grammars.enumeration.u_heap_search import enumerate_prob_u_grammar
+from synth.syntax.grammars.tagged_u_grammar import ProbUGrammar
 from synth.syntax.grammars.u_cfg import UCFG
 from synth.syntax.dsl import DSL
 from synth.syntax.program import Primitive
@@ -66,3 +69,52 @@ def test_depth_constraint(max_depth: int) -> None:
     assert (
         res not in cfg
     ), f"Program depth:{res.depth()} should NOT be in the TTCFG max_depth:{max_depth}"
+
+
+def test_lazy_from_DFTA_with_ngrams() -> None:
+    dfta = add_dfta_constraints(
+        CFG.depth_constraint(dsl, FunctionType(INT, INT), 4),
+        ["(+ 1 ^1)", "(+ _ ^+)"],
+        progress=False,
+    )
+    eager = UCFG.from_DFTA_with_ngrams(dfta, 2)
+    lazy = UCFG.from_DFTA_with_ngrams(dfta, 2, lazy=True)
+    assert len(lazy.rules) == 0
+    assert lazy.type_request == eager.type_request
+    enumerated = list(enumerate_prob_u_grammar(ProbUGrammar.uniform(lazy)))
+    assert enumerated == list(enumerate_prob_u_grammar(ProbUGrammar.uniform(eager)))
+    assert len(enumerated) == eager.programs()
+    for S in lazy.rules:
+        assert lazy.rules[S] == eager.rules[S]
+
+
+def test_lazy_operations() -> None:
+    dfta = add_dfta_constraints(
+        CFG.depth_constraint(dsl, FunctionType(INT, INT), 4),
+        ["(+ 1 ^1)", "(+ _ ^+)"],
+        progress=False,
+    )
+    lazy = UCFG.from_DFTA_with_ngrams(dfta, 2, lazy=True)
+    plazy = ProbUGrammar.uniform(lazy)
+    h = hash(lazy)
+    random = ProbUGrammar.random(lazy, seed=1)
+    programs = list(enumerate_prob_u_grammar(plazy))
+    # Expanding the grammar changes neither its hash nor the layout of its weights
+    assert hash(lazy) == h
+    assert len(plazy.weights()) == sum(
+        len(v) for S in lazy.rules for v in lazy.rules[S].values()
+    )
+    doubled = plazy * 2.0
+    summed = plazy + doubled
+    doubled.normalise()
+    summed.normalise()
+    dense = ProbUGrammar.from_weights(lazy, plazy.weights(), plazy.start_tags)
+    for program in programs:
+        probability = plazy.probability(program)
+        assert probability > 0
+        assert doubled.probability(program) == pytest.approx(probability)
+        assert summed.probability(program) == pytest.approx(probability)
+        assert dense.probability(program) == pytest.approx(probability)
+        assert random.probability(program) > 0
+    with pytest.raises(AssertionError):
+        lazy.primitives_used()
@@ -1,4 +1,6 @@
 import copy
+import gc
+import weakref
 from synth.syntax.type_system import (
     STRING,
     INT,
@@ -11,6 +13,7 @@ from synth.syntax.type_system import (
     Type,
     match,
     EmptyList,
+    __UNIFY_CACHE_SIZE__,
 )
 from typing import List as TList, Set, Tuple
 
@@ -150,3 +153,35 @@ def test_pickle() -> None:
     for t in types:
         tprime = copy.deepcopy(t)
         assert tprime == t
+
+
+def test_interning() -> None:
+    t = Arrow(List(PolymorphicType("a")), Arrow(INT, PolymorphicType("a")))
+    assert t is Arrow(List(PolymorphicType("a")), Arrow(INT, PolymorphicType("a")))
+    assert copy.deepcopy(t) is t
+    assert List(INT) is copy.deepcopy(List(INT))
+    assert FixedPolymorphicType("a", INT) is not PolymorphicType("a")
+    unified = t.unify({"a": BOOL})
+    assert unified is Arrow(List(BOOL), Arrow(INT, BOOL))
+    assert t.unify({"a": BOOL}) is unified
+    assert t.unify({"a": STRING}) is Arrow(List(STRING), Arrow(INT, STRING))
+    assert unified.unify({"a": STRING}) is unified
+    args = unified.ends_with(BOOL)
+    assert args == [List(BOOL), INT]
+    args.append(INT)
+    assert unified.ends_with(BOOL) == [List(BOOL), INT]
+    assert unified.arguments() == [List(BOOL), INT]
+    assert unified.returns() is BOOL
+
+
+def test_interning_memory() -> None:
+    t = Arrow(PrimitiveType("transient"), INT)
+    ref = weakref.ref(t)
+    del t
+    gc.collect()
+    assert ref() is None
+    poly = List(PolymorphicType("a"))
+    for i in range(2 * __UNIFY_CACHE_SIZE__):
+        poly.unify({"a": PrimitiveType(f"t{i}")})
+    assert len(poly.__dict__["_unify_cache"]) <= __UNIFY_CACHE_SIZE__
+    assert poly.unify({"a": INT}) is List(INT)
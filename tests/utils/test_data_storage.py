@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+from synth.utils.data_storage import (
+    EmbeddingCache,
+    ObjectStore,
+    load_object,
+    save_object,
+)
+
+
+def test_save_load(tmp_path) -> None:
+    path = str(tmp_path / "object.pickle")
+    obj = {"a": [1, 2, 3], "b": (4, "5")}
+    save_object(path, obj)
+    assert load_object(path) == obj
+
+
+def test_object_store(tmp_path) -> None:
+    path = str(tmp_path / "objects.store")
+    shared = {"big": list(range(1000))}
+    objects = [(i, shared) for i in range(10)]
+    with ObjectStore(path, write=True, shared=[shared]) as store:
+        for obj in objects:
+            store.append(obj)
+        assert len(store) == len(objects)
+    with ObjectStore(path) as store:
+        assert len(store) == len(objects)
+        assert store[3] == objects[3]
+        assert list(store) == objects
+        # Shared objects are loaded once
+        assert store[0][1] is store[9][1]
+
+
+def test_object_store_resume(tmp_path) -> None:
+    path = str(tmp_path / "objects.store")
+    with ObjectStore(path, write=True) as store:
+        for i in range(5):
+            store.append(i)
+    # A crash in the middle of a record
+    with open(path, "ab") as fd:
+        fd.write(b"\x00\x10\x00\x00\x00\x00\x00\x00\x00incomplete")
+    with ObjectStore(path, write=True) as store:
+        assert len(store) == 5
+        for i in range(5, 10):
+            store.append(i)
+    with ObjectStore(path) as store:
+        assert list(store) == list(range(10))
+
+
+def test_object_store_refresh(tmp_path) -> None:
+    path = str(tmp_path / "objects.store")
+    shared = {"big": list(range(1000))}
+    with ObjectStore(path, write=True, shared=[shared]) as writer:
+        writer.append((0, shared))
+        with ObjectStore(path) as reader:
+            assert len(reader) == 1
+            for i in range(1, 4):
+                writer.append((i, shared))
+            assert len(reader) == 1
+            reader.refresh()
+            assert list(reader) == [(i, shared) for i in range(4)]
+
+
+def test_embedding_cache(tmp_path) -> None:
+    path = str(tmp_path / "cache")
+    rng = np.random.default_rng(0)
+    arrays = {
+        EmbeddingCache.key("model", i): rng.random((i + 1, 8), dtype=np.float32)
+        for i in range(10)
+    }
+    cache = EmbeddingCache(path, 8)
+    for key, array in arrays.items():
+        assert key not in cache
+        cache.put(key, array)
+        assert np.array_equal(cache.get(key), array)
+    # A crash while writing an entry
+    with open(os.path.join(path, "embeddings.f32"), "ab") as fd:
+        fd.write(b"\x00" * 20)
+    with open(os.path.join(path, "index.tsv"), "a") as fd:
+        fd.write("partial\t55")
+    cache = EmbeddingCache(path, 8)
+    assert len(cache) == len(arrays)
+    for key, array in arrays.items():
+        assert np.array_equal(cache.get(key), array)
+    cache.put("other", np.ones((3, 8)))
+    assert np.array_equal(EmbeddingCache(path, 8).get("other"), np.ones((3, 8)))
+    assert EmbeddingCache(None, 8).get("other") is None